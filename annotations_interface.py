@@ -1,10 +1,26 @@
-from app import create_app, db
+import click
+import os
+import time
+from datetime import datetime
+from flask import current_app
+from app import create_app, db, write_queue
+from app.admin import archive
+from app.admin.delete import CHUNK_SIZE, delete_dataset as delete_dataset_rows
+from app.export import exporters
+from app.upload import bulk
+from app.upload.compress import compress_dataset
+from app.annotate.utils import rebuild_annotation_progress
+from app.upload.parsers import compute_dataset_stats
+from app.search.utils import rebuild_search_index
+from app import shards
+from app.utils import Speaker, DatasetType
 from app.models import (
     User,
     SMAnnotation,
     SMPost,
     SMReply,
     Dataset,
+    LabelVocabulary,
     Role,
     Permission,
     PSDialogTurn,
@@ -35,7 +51,322 @@ def make_shell_context():
 
 @app.cli.command()
 def clear_db():
-    """Clear database and insert roles"""
+    """Clear database and insert roles and label codes"""
+    if shards.sharding_enabled():
+        for shard in current_app.extensions["shards"].files():
+            current_app.extensions["shards"].remove(shard)
     db.drop_all()
     db.create_all()
     Role.insert_roles()
+    LabelVocabulary.insert_labels()
+
+
+@app.cli.command()
+def update_vocabulary():
+    """Insert the codes of the labels added to LABEL_CODES (see app/vocabulary.py)"""
+    LabelVocabulary.insert_labels()
+
+
+@app.cli.command()
+def update_progress():
+    """Compute the annotation progress of all the psychotherapy datasets"""
+    time_interval = current_app.config["PS_MINS_PER_PAGE"] * 60
+    dataset_ids = db.session.scalars(
+        db.select(Dataset.id).where(Dataset.type == DatasetType.psychotherapy)
+    ).all()
+    db.session.rollback()
+    for id_dataset in dataset_ids:
+        shards.use_dataset_shard(id_dataset)
+        rebuild_annotation_progress(db.session.get(Dataset, id_dataset), time_interval)
+        db.session.commit()
+
+
+@app.cli.command()
+@click.option(
+    "--all", "update_all", is_flag=True, help="Also recompute existing stats."
+)
+def update_stats(update_all):
+    """Compute the statistics of the datasets uploaded without them"""
+    query = db.select(Dataset.id)
+    if not update_all:
+        query = query.where(~Dataset.stats.has())
+    dataset_ids = db.session.scalars(query).all()
+    db.session.rollback()
+    for id_dataset in dataset_ids:
+        shards.use_dataset_shard(id_dataset)
+        compute_dataset_stats(db.session.get(Dataset, id_dataset))
+        db.session.commit()
+
+
+@app.cli.command()
+def rebuild_search():
+    """Rebuild the full-text search index of the dialog events (SQLite only)"""
+    for shard in shards.all_shards():
+        shards.use_shard(shard)
+        rebuild_search_index()
+        db.session.commit()
+
+
+def database_files(dataset_ids: list) -> list:
+    """
+    The shards of datasets (None for the main database), or the main database
+    and all the shards if no dataset ids are given
+    """
+    if db.engine.dialect.name != "sqlite":
+        raise click.UsageError("only SQLite database files can be vacuumed or copied")
+    if not dataset_ids:
+        return shards.all_shards()
+    for id_dataset in dataset_ids:
+        if db.session.get(Dataset, id_dataset) is None:
+            raise click.BadParameter("unknown dataset: {}".format(id_dataset))
+    return list(dict.fromkeys(shards.dataset_shard(id) for id in dataset_ids))
+
+
+@app.cli.command()
+@click.argument("dataset_ids", type=int, nargs=-1)
+def vacuum(dataset_ids):
+    """
+    Rebuild the database files of datasets to reclaim the space of their deleted rows
+    (the main database file and all the shards if no DATASET_IDS are given).
+    SQLite only.
+    """
+    for shard in database_files(dataset_ids):
+        db.session.rollback()
+        path = shards.shard_path(shard)
+        size = os.path.getsize(path)
+        shards.vacuum_shard(shard)
+        click.echo(
+            "{}: {} bytes vacuumed to {}".format(path, size, os.path.getsize(path))
+        )
+
+
+@app.cli.command()
+@click.argument("directory", type=click.Path(file_okay=False))
+@click.argument("dataset_ids", type=int, nargs=-1)
+def backup(directory, dataset_ids):
+    """
+    Copy the database files of datasets to a directory, while the app is running
+    (the main database file and all the shards if no DATASET_IDS are given).
+    SQLite only.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for shard in database_files(dataset_ids):
+        db.session.rollback()
+        path = shards.shard_path(shard)
+        copy = os.path.join(directory, os.path.basename(path))
+        shards.backup_shard(shard, copy)
+        click.echo("{}: copied to {}".format(path, copy))
+
+
+@app.cli.command()
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@click.option("--author", required=True, help="Username of the author of the datasets")
+@click.option(
+    "--annotator",
+    "annotators",
+    multiple=True,
+    help="Username of an annotator of all the datasets (can be repeated)",
+)
+@click.option(
+    "--manifest",
+    type=click.Path(exists=True, dir_okay=False),
+    help="CSV file with the name, description and annotators (usernames separated "
+    "by spaces) of each file, in the columns file, name, description and annotators",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    help="Number of worker processes reading the files (default: number of CPUs)",
+)
+def import_datasets(directory, author, annotators, manifest, workers):
+    """
+    Import all the dataset files (pickle or Parquet) of a directory.
+    The files are read in parallel, and each file is imported as a new dataset,
+    named after the file unless a name is given in the manifest.
+    """
+    users = {user.username: user.id for user in User.query}
+
+    def user_ids(usernames):
+        unknown = [username for username in usernames if username not in users]
+        if unknown:
+            raise click.BadParameter("unknown user: " + ", ".join(unknown))
+        return [users[username] for username in usernames]
+
+    id_author = user_ids([author])[0]
+    manifest = bulk.read_manifest(manifest) if manifest else {}
+    files = {}
+    for path in bulk.find_dataset_files(directory):
+        row = manifest.get(os.path.basename(path), {})
+        files[path] = {
+            "name": row.get("name") or os.path.splitext(os.path.basename(path))[0],
+            "description": row.get("description")
+            or "Imported from " + os.path.basename(path),
+            "annotators": user_ids(
+                dict.fromkeys(list(annotators) + (row.get("annotators") or "").split())
+            ),
+        }
+    if not files:
+        raise click.UsageError("no pickle or Parquet files in " + directory)
+
+    start = time.perf_counter()
+    failures = []
+    for i, (path, id_dataset, stats, error) in enumerate(
+        bulk.import_datasets(files, id_author, workers), start=1
+    ):
+        progress = "[{}/{}] {}:".format(i, len(files), os.path.basename(path))
+        if error is None:
+            click.echo(
+                "{} dataset {} ({})".format(
+                    progress, id_dataset, bulk.format_stats(stats)
+                )
+            )
+        else:
+            failures.append((path, error))
+            click.echo("{} FAILED: {}".format(progress, error), err=True)
+    click.echo(
+        "Imported {} of {} files in {:.1f} s".format(
+            len(files) - len(failures), len(files), time.perf_counter() - start
+        )
+    )
+    if failures:
+        click.echo("Failed:", err=True)
+        for path, error in failures:
+            click.echo("  {}: {!r}".format(os.path.basename(path), error), err=True)
+        raise SystemExit(1)
+
+
+@app.cli.command()
+@click.argument("dataset_id", type=int)
+@click.option(
+    "--archive",
+    "with_archive",
+    is_flag=True,
+    help="Write the dataset and its annotations to an archive file first",
+)
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    default=CHUNK_SIZE,
+    show_default=True,
+    help="Number of rows deleted in each transaction",
+)
+def delete_dataset(dataset_id, with_archive, chunk_size):
+    """
+    Delete a dataset with its annotations, a chunk of rows at a time.
+    An interrupted deletion can be run again.
+    """
+    if db.session.get(Dataset, dataset_id) is None:
+        raise click.BadParameter("unknown dataset: {}".format(dataset_id))
+    if with_archive:
+        path = archive.archive_dataset(dataset_id, chunk_size)
+        click.echo("Archived to {}".format(path))
+    else:
+        n_rows = delete_dataset_rows(dataset_id, chunk_size)
+        click.echo("Deleted {} rows".format(sum(n_rows.values())))
+    click.echo("Deleted dataset {}".format(dataset_id))
+
+
+@app.cli.command()
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+def restore_dataset(path):
+    """Restore a dataset and its annotations from an archive file, as a new dataset"""
+    try:
+        id_dataset = write_queue.submit(archive.restore_dataset, path)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    click.echo("Restored dataset {}".format(id_dataset))
+
+
+@app.cli.command()
+@click.argument("dataset_ids", type=int, nargs=-1)
+def compress_datasets(dataset_ids):
+    """
+    Compress the texts of datasets uploaded before COMPRESS_TEXT was enabled
+    (all the datasets if no DATASET_IDS are given). SQLite only.
+    """
+    if db.engine.dialect.name != "sqlite":
+        raise click.UsageError("the texts are only compressed on SQLite")
+    if not dataset_ids:
+        dataset_ids = db.session.scalars(
+            db.select(Dataset.id)
+            .where(Dataset.id_content.is_(None), Dataset.text_dictionary.is_(None))
+            .order_by(Dataset.id)
+        ).all()
+    db.session.rollback()  # end the read transaction before the writes
+    for id_dataset in dataset_ids:
+        if db.session.get(Dataset, id_dataset) is None:
+            raise click.BadParameter("unknown dataset: {}".format(id_dataset))
+        db.session.rollback()
+        shards.use_dataset_shard(id_dataset)
+        size_before, size_after = write_queue.submit(compress_dataset, id_dataset)
+        click.echo(
+            "Dataset {}: {} bytes of text compressed to {}".format(
+                id_dataset, size_before, size_after
+            )
+        )
+
+
+def parse_watermark(ctx, param, value):
+    """Parse a date and time in ISO format (click option callback)"""
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise click.BadParameter("invalid date, use the ISO format")
+
+
+@app.cli.command()
+@click.argument("dataset_id", type=int, required=False)
+@click.option(
+    "--format",
+    "export_format",
+    type=click.Choice(list(exporters.EXPORT_FORMATS)),
+    default="csv",
+    help="File format",
+)
+@click.option(
+    "--speaker",
+    "speakers",
+    type=click.Choice([speaker.value for speaker in Speaker]),
+    multiple=True,
+    help="Only export the annotations of this speaker (can be repeated)",
+)
+@click.option(
+    "--since",
+    callback=parse_watermark,
+    help="Only export the annotations written at or after this time (ISO format, UTC)",
+)
+@click.option(
+    "--watermark-file",
+    type=click.Path(dir_okay=False),
+    help="File with the watermark of the previous export, used as --since and "
+    "updated after the export",
+)
+@click.option("--output", "-o", type=click.File("wb"), default="-", help="Output file")
+def export_annotations(
+    dataset_id, export_format, speakers, since, watermark_file, output
+):
+    """
+    Export the annotations of a dataset (or of all the datasets).
+    For incremental exports (--since or --watermark-file), the watermark
+    for the next export is printed at the end.
+    """
+    if dataset_id is not None and db.session.get(Dataset, dataset_id) is None:
+        raise click.BadParameter("dataset not found", param_hint="DATASET_ID")
+    if watermark_file and since is None and os.path.exists(watermark_file):
+        with open(watermark_file) as f:
+            since = parse_watermark(None, None, f.read().strip())
+    until = None
+    if since is not None or watermark_file:  # incremental export
+        until = exporters.export_watermark(current_app.config["EXPORT_WATERMARK_LAG"])
+    speakers = [Speaker(speaker) for speaker in speakers]
+    for data in exporters.export_annotations(
+        dataset_id, export_format, speakers, since, until
+    ):
+        output.write(data)
+    if until is not None:
+        if watermark_file:
+            with open(watermark_file, "w") as f:
+                f.write(until.isoformat())
+        click.echo("Next watermark: " + until.isoformat(), err=True)
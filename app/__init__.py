@@ -5,6 +5,11 @@ from flask_migrate import Migrate
 from flask_login import LoginManager
 from sqlalchemy import MetaData
 from flask_bootstrap import Bootstrap
+from app.database import configure_engines, set_engine_options, get_backend_name
+from app.shards import ShardSession
+from app import shards
+from app.writer import WriteQueue
+from app.jinja import set_bytecode_cache
 
 # custom metadata naming convention
 # this is required for dealing with alembic migrations
@@ -19,11 +24,14 @@ naming_convention = {
 metadata = MetaData(naming_convention=naming_convention)
 
 # extension instances (global) not bound to application
-db = SQLAlchemy(metadata=metadata)  # database instance
+db = SQLAlchemy(
+    metadata=metadata, session_options={"class_": ShardSession}
+)  # database instance (see SHARD_DATASETS for the sessions)
 migrate = Migrate()  # migration engine instance
 login = LoginManager()  # login manager instance
 login.login_view = "auth.login"  # login view function (endpoint) name
 bootstrap = Bootstrap()  # bootstrap instance
+write_queue = WriteQueue()  # database writes (see SINGLE_WRITER in config.py)
 
 
 def create_app(config_class=BaseConfig):
@@ -37,12 +45,20 @@ def create_app(config_class=BaseConfig):
     """
     app = Flask(__name__)  # create application instance
     app.config.from_object(config_class)
+    set_bytecode_cache(app)
 
     # bind extensions to application
+    set_engine_options(app)
     db.init_app(app)
+    with app.app_context():
+        configure_engines(app, db)
+        shards.init_app(app, db)
+    # batch mode is only needed for SQLite, which has limited ALTER TABLE support
     # see: https://blog.miguelgrinberg.com/post/fixing-alter-table-errors-with-flask-migrate-and-sqlite
-    migrate.init_app(app, db, render_as_batch=True)
+    is_sqlite = get_backend_name(app.config["SQLALCHEMY_DATABASE_URI"]) == "sqlite"
+    migrate.init_app(app, db, render_as_batch=is_sqlite)
     login.init_app(app)
+    write_queue.init_app(app, db)
 
     # bootstrap
     bootstrap.init_app(app)
@@ -80,5 +96,17 @@ def register_blueprints(app):
 
     app.register_blueprint(annotate_bp, url_prefix="/annotate")
 
+    from app.admin import bp as admin_bp
+
+    app.register_blueprint(admin_bp, url_prefix="/admin")
+
+    from app.export import bp as export_bp
+
+    app.register_blueprint(export_bp, url_prefix="/export")
+
+    from app.search import bp as search_bp
+
+    app.register_blueprint(search_bp, url_prefix="/search")
+
 
 from app import models
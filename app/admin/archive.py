@@ -0,0 +1,318 @@
+"""
+Archives of datasets: a dataset and its annotations are written to a compressed file
+(gzip, one JSON object per line) before the dataset is deleted (see app/admin/delete.py),
+to keep the database small, and the dataset can be restored from the file later.
+The rows are read and written a chunk at a time. A restored dataset is a new dataset:
+its rows get new ids, and the references between them are remapped.
+"""
+import datetime
+import enum
+import gzip
+import json
+import os
+import tempfile
+from flask import current_app
+from app import db, write_queue
+from app.admin.delete import CHUNK_SIZE, delete_dataset, mark_deleting
+from app.models import (
+    Dataset,
+    DatasetStats,
+    EvidenceClient,
+    EvidenceDyad,
+    EvidenceTherapist,
+    PSAnnotatedSegment,
+    PSAnnotationClient,
+    PSAnnotationDyad,
+    PSAnnotationProgress,
+    PSAnnotationTherapist,
+    PSDialogEvent,
+    PSDialogTurn,
+    SMAnnotation,
+    SMPost,
+    SMReply,
+    SMTimeline,
+    User,
+    touch_annotations,
+)
+from app.search.utils import index_dataset_events
+from app.shards import use_dataset_shard, use_new_shard
+from app.upload.parsers import append_rows, insert_rows
+
+ARCHIVE_FORMAT = "annotations-interface-archive"
+ARCHIVE_VERSION = 2  # 2: annotations reference their segment (id_first_dialog_turn)
+
+# the tables archived, in the order they are restored: the table, whether its rows are
+# the contents of the dataset (see Dataset.content_id) or belong to the dataset itself,
+# or which table (and column) their rows belong to, and the columns referencing the rows
+# of other tables archived before (column -> table name), remapped when they are restored
+ARCHIVED_TABLES = [
+    (DatasetStats.__table__, "dataset", {}),
+    (SMTimeline.__table__, "content", {}),
+    (SMPost.__table__, "content", {}),
+    (SMReply.__table__, "content", {"id_sm_post": "sm_post"}),
+    (SMAnnotation.__table__, "dataset", {"id_sm_post": "sm_post"}),
+    (PSDialogTurn.__table__, "content", {}),
+    (PSDialogEvent.__table__, "content", {"id_ps_dialog_turn": "ps_dialog_turn"}),
+    (
+        PSAnnotationClient.__table__,
+        "dataset",
+        {"id_first_dialog_turn": "ps_dialog_turn"},
+    ),
+    (
+        PSAnnotationTherapist.__table__,
+        "dataset",
+        {"id_first_dialog_turn": "ps_dialog_turn"},
+    ),
+    (
+        PSAnnotationDyad.__table__,
+        "dataset",
+        {"id_first_dialog_turn": "ps_dialog_turn"},
+    ),
+    (
+        EvidenceClient.__table__,
+        ("ps_annotation_client", "id_ps_annotation_client"),
+        {
+            "id_ps_dialog_event": "ps_dialog_event",
+            "id_ps_annotation_client": "ps_annotation_client",
+        },
+    ),
+    (
+        EvidenceTherapist.__table__,
+        ("ps_annotation_therapist", "id_ps_annotation_therapist"),
+        {
+            "id_ps_dialog_event": "ps_dialog_event",
+            "id_ps_annotation_therapist": "ps_annotation_therapist",
+        },
+    ),
+    (
+        EvidenceDyad.__table__,
+        ("ps_annotation_dyad", "id_ps_annotation_dyad"),
+        {
+            "id_ps_dialog_event": "ps_dialog_event",
+            "id_ps_annotation_dyad": "ps_annotation_dyad",
+        },
+    ),
+    (PSAnnotationProgress.__table__, "dataset", {}),
+    (PSAnnotatedSegment.__table__, "dataset", {}),
+]
+
+# the columns not archived: the time the annotations were written (see modified in
+# the annotation models) is the time they are restored
+UNARCHIVED_COLUMNS = {"modified"}
+
+# the columns of the dataset archived, and restored
+DATASET_COLUMNS = [
+    "name",
+    "description",
+    "timestamp",
+    "type",
+    "n_segments",
+    "id_author",
+    "file_sha256",
+    "version",
+]
+
+
+def encode_value(value):
+    """A value of a row, as a JSON value"""
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.name
+    return value
+
+
+def decode_value(column: db.Column, value):
+    """A JSON value of a row (see encode_value), as a value to insert in a column"""
+    if value is None:
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type in (datetime.datetime, datetime.date, datetime.time):
+        return python_type.fromisoformat(value)
+    if issubclass(python_type, enum.Enum):
+        # the archives have the names of the members, not what the database stores
+        # (the integer codes of the label columns, see LabelCode in app/vocabulary.py),
+        # so that they do not depend on the codes of the database they were written from
+        return python_type[value]
+    return value
+
+
+def archived_columns(table: db.Table) -> list:
+    """The columns of a table archived, in the order of the values of the archived rows"""
+    return [column for column in table.c if column.name not in UNARCHIVED_COLUMNS]
+
+
+def archived_rows(table: db.Table, scope, dataset: Dataset):
+    """The query of the rows of a table archived with a dataset (see ARCHIVED_TABLES)"""
+    if scope == "content":
+        where = table.c.id_dataset == dataset.content_id
+    elif scope == "dataset":
+        where = table.c.id_dataset == dataset.id
+    else:
+        parent, column = db.metadata.tables[scope[0]], scope[1]
+        where = table.c[column].in_(
+            db.select(parent.c.id).where(parent.c.id_dataset == dataset.id)
+        )
+    query = db.select(*archived_columns(table)).where(where)
+    if "id" in table.c:
+        query = query.order_by(table.c.id)
+    return query
+
+
+def write_archive(id_dataset: int, path: str, chunk_size: int = CHUNK_SIZE) -> dict:
+    """
+    Write a dataset and its annotations to an archive file (see ARCHIVED_TABLES).
+    The first line describes the dataset, and each other line has a chunk of rows
+    of a table. The file is written to a temporary file first, which is then renamed.
+
+    Returns
+    -------
+    n_rows : dict
+        The number of rows archived from each table, by table name
+    """
+    use_dataset_shard(id_dataset)
+    dataset = db.session.get(Dataset, id_dataset)
+    header = {
+        "format": ARCHIVE_FORMAT,
+        "version": ARCHIVE_VERSION,
+        "dataset": {
+            column: encode_value(getattr(dataset, column)) for column in DATASET_COLUMNS
+        },
+        "annotators": [user.id for user in dataset.annotators],
+    }
+    n_rows = {}
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.open(
+            raw, "wt", encoding="utf-8"
+        ) as handle:
+            handle.write(json.dumps(header) + "\n")
+            for table, scope, _ in ARCHIVED_TABLES:
+                n_rows[table.name] = 0
+                result = db.session.execute(
+                    archived_rows(table, scope, dataset),
+                    execution_options={"yield_per": chunk_size},
+                )
+                for rows in result.partitions():
+                    line = {
+                        "table": table.name,
+                        "rows": [
+                            [encode_value(value) for value in row] for row in rows
+                        ],
+                    }
+                    handle.write(json.dumps(line) + "\n")
+                    n_rows[table.name] += len(rows)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return n_rows
+
+
+def archive_path(dataset: Dataset) -> str:
+    """The path of the archive of a dataset, in the ARCHIVE_FOLDER from the app config"""
+    return os.path.join(
+        current_app.config["ARCHIVE_FOLDER"],
+        "dataset-{}-{}.jsonl.gz".format(
+            dataset.id, datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S")
+        ),
+    )
+
+
+def archive_dataset(
+    id_dataset: int, chunk_size: int = CHUNK_SIZE, path: str = None
+) -> str:
+    """
+    Write a dataset and its annotations to an archive file (by default in the
+    ARCHIVE_FOLDER, see archive_path), then delete the dataset (see delete_dataset).
+    The dataset is marked as being deleted first (see mark_deleting), so that
+    no annotation is added after it is archived. Returns the path of the archive.
+    """
+    if path is None:
+        path = archive_path(db.session.get(Dataset, id_dataset))
+    db.session.rollback()  # the mark is written by another transaction
+    write_queue.submit(mark_deleting, id_dataset)
+    write_archive(id_dataset, path, chunk_size)
+    db.session.rollback()  # end the read transaction before the deletion
+    delete_dataset(id_dataset, chunk_size)
+    return path
+
+
+def read_archive(path: str):
+    """The header of an archive file, and an iterator over its chunks of rows"""
+    handle = gzip.open(path, "rt", encoding="utf-8")
+    header = json.loads(handle.readline())
+    if header.get("format") != ARCHIVE_FORMAT:
+        handle.close()
+        raise ValueError("not a dataset archive: " + path)
+    if header.get("version") != ARCHIVE_VERSION:
+        handle.close()
+        raise ValueError("unsupported archive version: {}".format(header["version"]))
+
+    def chunks():
+        with handle:
+            for line in handle:
+                yield json.loads(line)
+
+    return header, chunks()
+
+
+def restore_dataset(path: str) -> int:
+    """
+    Write job for the write queue (see app/writer.py): restore a dataset and its
+    annotations from an archive file (see write_archive), as a new dataset.
+    The rows get new ids, and their references to the rows restored before them
+    (see ARCHIVED_TABLES) are remapped. The restored annotations keep their order
+    (their ids) and their timestamps, and are stamped as modified at the end of the
+    restore (see touch_annotations), so that the incremental exports export them.
+    Returns the id of the new dataset.
+    """
+    header, chunks = read_archive(path)
+    shard = use_new_shard()  # in sharding mode, before anything is written
+    columns = {
+        column: decode_value(Dataset.__table__.c[column], value)
+        for column, value in header["dataset"].items()
+    }
+    user_ids = set(db.session.scalars(db.select(User.id)))
+    if columns["id_author"] not in user_ids:
+        columns["id_author"] = None
+    dataset = Dataset(shard=shard, **columns)
+    db.session.add(dataset)
+    for id_annotator in header["annotators"]:
+        if id_annotator in user_ids:
+            dataset.annotators.append(db.session.get(User, id_annotator))
+    db.session.flush()
+    tables = {table.name: references for table, _, references in ARCHIVED_TABLES}
+    new_ids = {}  # table name -> {archived id: new id}
+    for chunk in chunks:
+        table = db.metadata.tables[chunk["table"]]
+        references = tables[table.name]
+        rows = []
+        for values in chunk["rows"]:
+            row = {
+                column.name: decode_value(column, value)
+                for column, value in zip(archived_columns(table), values)
+            }
+            if "id_dataset" in row:
+                row["id_dataset"] = dataset.id
+            for column, referenced in references.items():
+                row[column] = new_ids[referenced].get(row[column])
+            rows.append(row)
+        if "id" in table.c:
+            archived_ids = [row.pop("id") for row in rows]
+            new_ids.setdefault(table.name, {}).update(
+                zip(archived_ids, insert_rows(table, rows))
+            )
+        else:
+            append_rows(table, rows)
+    index_dataset_events(dataset.id)  # full-text search of the restored dialog events
+    # last, shortly before the restore is committed: the rows written at its start
+    # are not behind the watermark of an export by then
+    touch_annotations(dataset.id)
+    return dataset.id
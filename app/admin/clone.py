@@ -0,0 +1,216 @@
+"""
+Cloning of psychotherapy datasets, e.g. for a new annotation round on the same
+transcripts with another group of annotators.
+The dialog turns and events, and optionally the annotations (as pre-annotations, with
+their annotation progress), are copied with INSERT ... SELECT statements: the rows
+do not go through Python. The ids of the copies are the ids of the originals plus
+an offset (one per table), so that the references between the copied rows
+(dialog turn of an event, segment and evidence of an annotation) are remapped
+inside the database too. The copied annotations keep their order (their ids) and their
+timestamps, and are marked as modified at the end of the clone (see touch_annotations).
+"""
+from app import db
+from app.models import (
+    ANNOTATION_TABLES,
+    Dataset,
+    DatasetStats,
+    PSAnnotatedSegment,
+    PSAnnotationProgress,
+    PSDialogEvent,
+    PSDialogTurn,
+    User,
+    touch_annotations,
+)
+from app.search.utils import index_dataset_events
+from app.shards import use_shard
+
+
+def is_postgresql() -> bool:
+    """Check if the database of the current session is PostgreSQL"""
+    return db.session.get_bind().dialect.name == "postgresql"
+
+
+def id_offset(table: db.Table, where) -> int:
+    """
+    The offset added to the ids of the rows of a table which are copied (where),
+    so that the ids of the copies are above the largest id of the table.
+    Returns None if there are no rows to copy.
+    """
+    last_id = db.func.coalesce(db.func.max(table.c.id), 0)
+    if is_postgresql():
+        # the ids taken from the sequence may not be in the table yet
+        sequence = db.func.pg_get_serial_sequence(table.name, "id")
+        last_id = db.func.greatest(last_id, db.func.currval(sequence))
+        db.session.execute(db.select(db.func.nextval(sequence)))
+    return db.session.scalar(
+        db.select(db.select(last_id).scalar_subquery() + 1 - db.func.min(table.c.id))
+        .select_from(table)
+        .where(where)
+    )
+
+
+def copy_rows(table: db.Table, where, values: dict, skip: tuple = ()):
+    """
+    Copy rows of a table (where) with one INSERT ... SELECT statement.
+    values gives the SQL expressions of the columns which change (e.g. the dataset id),
+    and the columns in skip are not copied (e.g. ids assigned by the database).
+    """
+    columns = [column for column in table.c if column.name not in skip]
+    query = db.select(*[values.get(column.name, column) for column in columns]).where(
+        where
+    )
+    db.session.execute(
+        db.insert(table).from_select([column.name for column in columns], query)
+    )
+
+
+def reset_sequences(tables: list):
+    """
+    Move the PostgreSQL sequences of the ids of tables after their largest id,
+    once rows were inserted with their ids
+    """
+    if not is_postgresql():
+        return
+    for table in tables:
+        db.session.execute(
+            db.text(
+                "SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+                f"(SELECT max(id) FROM {table.name}))"
+            ),
+            {"table": table.name},
+        )
+
+
+def clone_dataset(
+    id_source: int,
+    name: str,
+    description: str,
+    id_author: int,
+    id_annotators: list,
+    with_annotations: bool = False,
+) -> int:
+    """
+    Write job for the write queue (see app/writer.py): clone a psychotherapy dataset.
+
+    Parameters
+    ----------
+    id_source : int
+        The id of the dataset to clone
+    name : str
+        The name of the new dataset
+    description : str
+        The description of the new dataset
+    id_author : int
+        The id of the author of the new dataset
+    id_annotators : list
+        The ids of the annotators of the new dataset
+    with_annotations : bool
+        Copy the annotations of the dataset (with their evidence and the annotation
+        progress of the annotators) as pre-annotations of the new dataset
+
+    Returns
+    -------
+    id_dataset : int
+        The id of the new dataset
+    """
+    source = db.session.get(Dataset, id_source)
+    use_shard(source.shard)  # the copies are in the shard of the dataset
+    dataset = Dataset(
+        name=name,
+        description=description,
+        author=db.session.get(User, id_author),
+        type=source.type,
+        n_segments=source.n_segments,
+        file_sha256=source.file_sha256,
+        text_dictionary=source.text_dictionary,  # the texts are copied as they are
+        shard=source.shard,
+    )
+    db.session.add(dataset)
+    for id_annotator in id_annotators:
+        dataset.annotators.append(db.session.get(User, id_annotator))
+    # the new dataset is written first: on SQLite, the transaction then holds the write
+    # lock, so no other connection adds rows (and ids) until the clone is committed
+    db.session.flush()
+    turns = PSDialogTurn.__table__
+    events = PSDialogEvent.__table__
+    tables = [turns, events] + [
+        model.__table__ for model, *_ in ANNOTATION_TABLES.values()
+    ]
+    if is_postgresql():
+        # other writers wait until the clone is committed (readers do not)
+        db.session.execute(
+            db.text(
+                "LOCK TABLE {} IN EXCLUSIVE MODE".format(
+                    ", ".join(table.name for table in tables)
+                )
+            )
+        )
+    copy_rows(
+        DatasetStats.__table__,
+        DatasetStats.id_dataset == source.id,
+        {"id_dataset": db.literal(dataset.id)},
+    )
+    # the dialog turns and events (shared with another dataset or not) are copied
+    id_content = source.content_id
+    turn_offset = id_offset(turns, turns.c.id_dataset == id_content) or 0
+    event_offset = id_offset(events, events.c.id_dataset == id_content) or 0
+    copy_rows(
+        turns,
+        turns.c.id_dataset == id_content,
+        {"id": turns.c.id + turn_offset, "id_dataset": db.literal(dataset.id)},
+    )
+    copy_rows(
+        events,
+        events.c.id_dataset == id_content,
+        {
+            "id": events.c.id + event_offset,
+            "id_ps_dialog_turn": events.c.id_ps_dialog_turn + turn_offset,
+            "id_dataset": db.literal(dataset.id),
+        },
+    )
+    if with_annotations:
+        for model, evidence, evidence_column in ANNOTATION_TABLES.values():
+            annotations = model.__table__
+            source_annotations = db.select(annotations.c.id).where(
+                annotations.c.id_dataset == source.id
+            )
+            offset = id_offset(annotations, annotations.c.id_dataset == source.id)
+            if offset is None:
+                continue  # no annotations
+            copy_rows(
+                annotations,
+                annotations.c.id_dataset == source.id,
+                {
+                    "id": annotations.c.id + offset,
+                    "id_dataset": db.literal(dataset.id),
+                    "id_first_dialog_turn": annotations.c.id_first_dialog_turn
+                    + turn_offset,
+                },
+            )
+            evidence = evidence.__table__
+            copy_rows(
+                evidence,
+                evidence.c[evidence_column].in_(source_annotations),
+                {
+                    evidence_column: evidence.c[evidence_column] + offset,
+                    "id_ps_dialog_event": evidence.c.id_ps_dialog_event + event_offset,
+                },
+                skip=("id",),
+            )
+        # the segments are the same, so is the annotation progress
+        for model, skip in [(PSAnnotationProgress, ("id",)), (PSAnnotatedSegment, ())]:
+            table = model.__table__
+            copy_rows(
+                table,
+                table.c.id_dataset == source.id,
+                {"id_dataset": db.literal(dataset.id)},
+                skip=skip,
+            )
+    reset_sequences(tables)
+    index_dataset_events(dataset.id)  # full-text search of the new dialog events
+    if with_annotations:
+        # the copies are new annotations of the new dataset: they are marked as modified
+        # last, shortly before the clone is committed, so that the incremental exports
+        # (see app/export/exporters.py) export them, even after a long clone
+        touch_annotations(dataset.id)
+    return dataset.id
@@ -0,0 +1,218 @@
+"""
+Bulk deletion of datasets.
+Deleting a dataset through the ORM would load all its rows (the relationships are
+dynamic), so the rows are deleted with set-based DELETE statements instead, in the order
+of their dependencies, a chunk of rows at a time: each chunk is a short transaction
+of the write queue, so that the annotation writes are not blocked during the deletion.
+A dataset is marked as being deleted (see mark_deleting) before anything is archived
+or deleted, so that it is no longer listed nor annotated while its rows are read
+and deleted.
+A deletion which is interrupted can be run again, and continues where it stopped.
+"""
+from app import db, write_queue
+from app.models import (
+    Dataset,
+    DatasetStats,
+    EvidenceClient,
+    EvidenceDyad,
+    EvidenceTherapist,
+    PSAnnotatedSegment,
+    PSAnnotationClient,
+    PSAnnotationDyad,
+    PSAnnotationProgress,
+    PSAnnotationTherapist,
+    PSDialogEvent,
+    PSDialogTurn,
+    SMAnnotation,
+    SMPost,
+    SMReply,
+    SMTimeline,
+    TextDictionary,
+    dataset_annotator,
+)
+from app.search.utils import unindex_events
+from app.shards import current_shard, remove_unused_shard, use_dataset_shard
+
+CHUNK_SIZE = 1000  # number of rows deleted in each transaction
+
+# the tables deleted a chunk at a time, in order: the table, whether its rows are
+# the contents of the dataset (which can be shared with other datasets, see
+# Dataset.content_id) or belong to the dataset itself, and the rows of other tables
+# referencing them (table and column), deleted with them
+CHUNKED_TABLES = [
+    (
+        PSAnnotationClient.__table__,
+        False,
+        [(EvidenceClient.__table__, "id_ps_annotation_client")],
+    ),
+    (
+        PSAnnotationTherapist.__table__,
+        False,
+        [(EvidenceTherapist.__table__, "id_ps_annotation_therapist")],
+    ),
+    (
+        PSAnnotationDyad.__table__,
+        False,
+        [(EvidenceDyad.__table__, "id_ps_annotation_dyad")],
+    ),
+    (SMAnnotation.__table__, False, []),
+    (PSAnnotationProgress.__table__, False, []),
+    (
+        PSDialogEvent.__table__,
+        True,
+        [
+            (EvidenceClient.__table__, "id_ps_dialog_event"),
+            (EvidenceTherapist.__table__, "id_ps_dialog_event"),
+            (EvidenceDyad.__table__, "id_ps_dialog_event"),
+        ],
+    ),
+    (PSDialogTurn.__table__, True, []),
+    (SMReply.__table__, True, []),
+    (SMPost.__table__, True, [(SMAnnotation.__table__, "id_sm_post")]),
+    (SMTimeline.__table__, True, []),
+]
+
+# the tables of the contents of a dataset, moved to another dataset sharing them
+CONTENT_TABLES = [
+    PSDialogTurn.__table__,
+    PSDialogEvent.__table__,
+    SMPost.__table__,
+    SMReply.__table__,
+    SMTimeline.__table__,
+]
+
+
+def mark_deleting(id_dataset: int):
+    """
+    Write job for the write queue (see app/writer.py): mark a dataset as being deleted,
+    so that it is no longer listed nor annotated (the annotation writes check the mark,
+    see get_annotated_dataset in app/annotate/utils.py). Once it is committed, no new
+    annotation of the dataset is written, so its archive is complete.
+    """
+    db.session.execute(
+        db.update(Dataset).where(Dataset.id == id_dataset).values(deleting=True)
+    )
+
+
+def hand_over_content(id_dataset: int) -> int:
+    """
+    Write job for the write queue (see app/writer.py): if other datasets share the
+    contents of a dataset (uploaded from an identical file), move the contents to the
+    first of them, which the others then share, so that they are not deleted with the
+    dataset. The annotators of the dataset are removed too, so that it is no longer
+    listed while it is deleted.
+    Returns the id of the dataset which has the contents now, or None.
+    """
+    db.session.execute(
+        db.delete(dataset_annotator).where(dataset_annotator.c.id_dataset == id_dataset)
+    )
+    id_heir = db.session.scalar(
+        db.select(db.func.min(Dataset.id)).where(Dataset.id_content == id_dataset)
+    )
+    if id_heir is None:
+        return None
+    # one transaction, so that the other datasets never see part of the contents
+    for table in CONTENT_TABLES:
+        db.session.execute(
+            db.update(table)
+            .where(table.c.id_dataset == id_dataset)
+            .values(id_dataset=id_heir)
+        )
+    db.session.execute(
+        db.update(Dataset)
+        .where(Dataset.id_content == id_dataset)
+        .values(id_content=db.case((Dataset.id == id_heir, None), else_=id_heir))
+    )
+    return id_heir
+
+
+def delete_chunk(id_dataset: int, table_name: str, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Write job for the write queue (see app/writer.py): delete a chunk of rows of a table
+    (one of CHUNKED_TABLES) of a dataset, with the rows referencing them.
+    Returns the number of rows of the table deleted (0 when there are none left).
+    """
+    table, content, references = next(
+        item for item in CHUNKED_TABLES if item[0].name == table_name
+    )
+    dataset = db.session.get(Dataset, id_dataset)
+    id_owner = dataset.content_id if content else dataset.id
+    if content and id_owner != dataset.id:
+        return 0  # the contents belong to another dataset
+    ids = (
+        db.session.execute(
+            db.select(table.c.id)
+            .where(table.c.id_dataset == id_owner)
+            .order_by(table.c.id)
+            .limit(chunk_size)
+        )
+        .scalars()
+        .all()
+    )
+    if not ids:
+        return 0
+    if table.name == PSDialogEvent.__tablename__:
+        unindex_events(ids)  # the text of the events is needed to unindex them
+    for reference, column in references:
+        db.session.execute(db.delete(reference).where(reference.c[column].in_(ids)))
+    db.session.execute(db.delete(table).where(table.c.id.in_(ids)))
+    return len(ids)
+
+
+def delete_dataset_row(id_dataset: int):
+    """
+    Write job for the write queue (see app/writer.py): delete a dataset, once all
+    its rows in the other tables have been deleted (see delete_dataset), with its
+    text dictionary if no other dataset uses it
+    """
+    key = db.session.scalar(
+        db.select(Dataset.text_dictionary).where(Dataset.id == id_dataset)
+    )
+    for model in [PSAnnotatedSegment, DatasetStats]:
+        db.session.execute(db.delete(model).where(model.id_dataset == id_dataset))
+    db.session.execute(db.delete(Dataset).where(Dataset.id == id_dataset))
+    if key is not None and not db.session.scalar(
+        db.select(db.func.count()).where(Dataset.text_dictionary == key)
+    ):
+        db.session.execute(db.delete(TextDictionary).where(TextDictionary.key == key))
+
+
+def delete_dataset(id_dataset: int, chunk_size: int = CHUNK_SIZE) -> dict:
+    """
+    Delete a dataset and all its rows, through the write queue: its annotations
+    (with their dialog turns and evidence), annotation progress and contents
+    (dialog turns and events, or posts, replies and timelines), unless other datasets
+    share its contents, which are then kept for them (see hand_over_content).
+    The dataset is marked as being deleted first (see mark_deleting).
+    In sharding mode, the file of its shard is deleted too if no other dataset uses it.
+
+    Parameters
+    ----------
+    id_dataset : int
+        The id of the dataset
+    chunk_size : int
+        The number of rows deleted in each transaction
+
+    Returns
+    -------
+    n_rows : dict
+        The number of rows deleted from each table (not counting the rows referencing
+        them, e.g. evidence), by table name
+    """
+    use_dataset_shard(id_dataset)
+    shard = current_shard()
+    write_queue.submit(mark_deleting, id_dataset)
+    write_queue.submit(hand_over_content, id_dataset)
+    n_rows = {}
+    for table, _, _ in CHUNKED_TABLES:
+        n_rows[table.name] = 0
+        while True:
+            n_chunk = write_queue.submit(
+                delete_chunk, id_dataset, table.name, chunk_size
+            )
+            if not n_chunk:
+                break
+            n_rows[table.name] += n_chunk
+    write_queue.submit(delete_dataset_row, id_dataset)
+    remove_unused_shard(shard)
+    return n_rows
@@ -0,0 +1,42 @@
+# Desc: Admin forms for the app
+from flask_wtf import FlaskForm
+from wtforms import (
+    BooleanField,
+    SelectMultipleField,
+    StringField,
+    SubmitField,
+    TextAreaField,
+)
+from wtforms.validators import DataRequired, Length
+from app.upload.forms import UploadForm
+
+
+class CloneDatasetForm(FlaskForm):
+    """Form to clone a psychotherapy dataset, e.g. for a new annotation round"""
+
+    name = StringField(
+        "Dataset name", validators=[DataRequired(), Length(min=4, max=50)]
+    )
+    description = TextAreaField(
+        "Please provide a short description",
+        validators=[DataRequired(), Length(min=5, max=200)],
+    )
+    annotators = SelectMultipleField(
+        "Annotators", coerce=int, validators=[DataRequired()]
+    )  # who will be annotating the new dataset
+    with_annotations = BooleanField(
+        "Copy the annotations as pre-annotations"
+    )  # the annotations of the dataset, with their evidence
+    submit = SubmitField("Clone dataset")
+
+    # the annotators must not have a dataset with the same name already
+    validate_name = UploadForm.validate_name
+
+
+class DeleteDatasetForm(FlaskForm):
+    """Form to delete a dataset, optionally archived first"""
+
+    archive = BooleanField(
+        "Archive the dataset and its annotations first"
+    )  # they can be restored with `flask restore-dataset`
+    submit = SubmitField("Delete dataset")
@@ -0,0 +1,115 @@
+from app import db, write_queue
+from app.admin import bp
+from app.admin.archive import archive_dataset, archive_path
+from app.admin.clone import clone_dataset
+from app.admin.delete import delete_dataset, mark_deleting
+from app.admin.forms import CloneDatasetForm, DeleteDatasetForm
+from app.database import pool_stats
+from app.decorators import admin_required
+from app.models import Dataset, DatasetType, User
+from app.writer import run_in_background
+from flask import abort, flash, jsonify, redirect, render_template, request, url_for
+from flask_login import current_user, login_required
+import os
+
+
+@bp.route("/pool_stats")
+@login_required
+@admin_required
+def pool_stats_view():
+    """
+    Live statistics of the database connection pool(s) of the worker process
+    that handles the request (each process has its own pool).
+    """
+    engines = {
+        bind_key or "default": pool_stats(engine)
+        for bind_key, engine in db.engines.items()
+    }
+    return jsonify(pid=os.getpid(), engines=engines)
+
+
+@bp.route("/agreement/<int:dataset_id>")
+@login_required
+@admin_required
+def agreement(dataset_id: int):
+    """
+    Inter-annotator agreement report of a dataset.
+    The report is cached and only computed again when new annotations are added.
+    """
+    # numpy is only loaded when a report is requested
+    from app.agreement import agreement_report
+
+    dataset = Dataset.query.get_or_404(dataset_id)
+    report = agreement_report(dataset.id)
+    if request.args.get("format") == "json":
+        return jsonify(dataset=dataset.id, report=report)
+    return render_template(
+        "admin/agreement.html", title="Agreement", dataset=dataset, report=report
+    )
+
+
+@bp.route("/clone/<int:dataset_id>", methods=["GET", "POST"])
+@login_required
+@admin_required
+def clone(dataset_id: int):
+    """
+    Clone a psychotherapy dataset for a new annotation round: its dialog turns and
+    events, and optionally its annotations, are copied inside the database
+    (see app/admin/clone.py).
+    """
+    dataset = Dataset.query.get_or_404(dataset_id)
+    if dataset.type != DatasetType.psychotherapy:
+        abort(404)
+    form = CloneDatasetForm()
+    users = User.query.order_by(User.username.asc()).all()
+    form.annotators.choices = [(user.id, user.username) for user in users]
+    if form.validate_on_submit():
+        write_queue.submit(
+            clone_dataset,
+            dataset.id,
+            form.name.data,
+            form.description.data,
+            current_user.id,
+            form.annotators.data,
+            form.with_annotations.data,
+        )
+        flash('Dataset "{}" cloned successfully'.format(dataset.name))
+        return redirect(url_for("main.index"))
+    return render_template(
+        "admin/clone.html", title="Clone dataset", dataset=dataset, form=form
+    )
+
+
+@bp.route("/delete/<int:dataset_id>", methods=["GET", "POST"])
+@login_required
+@admin_required
+def delete(dataset_id: int):
+    """
+    Delete a dataset with its annotations, a chunk of rows at a time
+    (see app/admin/delete.py), optionally written to an archive file first
+    (see app/admin/archive.py). The dataset is marked as being deleted before the request
+    returns, so that it is no longer listed nor annotated, and the archive and deletion
+    run in the background (an interrupted deletion can be resumed with
+    `flask delete-dataset`).
+    """
+    dataset = Dataset.query.get_or_404(dataset_id)
+    form = DeleteDatasetForm()
+    if form.validate_on_submit():
+        name = dataset.name
+        path = archive_path(dataset) if form.archive.data else None
+        db.session.rollback()  # the rows are read and deleted by other transactions
+        write_queue.submit(mark_deleting, dataset_id)
+        if path is not None:
+            run_in_background(archive_dataset, dataset_id, path=path)
+            flash(
+                'Dataset "{}" is being archived to {} and deleted'.format(
+                    name, os.path.basename(path)
+                )
+            )
+        else:
+            run_in_background(delete_dataset, dataset_id)
+            flash('Dataset "{}" is being deleted'.format(name))
+        return redirect(url_for("main.index"))
+    return render_template(
+        "admin/delete.html", title="Delete dataset", dataset=dataset, form=form
+    )
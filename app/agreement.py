@@ -0,0 +1,461 @@
+"""
+Inter-annotator agreement for the psychotherapy annotations.
+For each speaker table, the latest annotations of each segment of a dataset are
+loaded (see load_segments) as a (segment, annotator) matrix of category codes per label,
+and the agreement metrics are computed on these NumPy arrays:
+- Cohen's kappa (averaged over all the pairs of annotators)
+- Fleiss' kappa (segments rated by all the annotators)
+- Krippendorff's alpha (nominal for the labels, ordinal for the strengths)
+- Jaccard index of the dialog events marked as evidence for each label
+A segment is identified by its first dialog turn (id_first_dialog_turn of the
+annotations). If an annotator annotated a segment more than once, only the latest
+annotation is used (as in the annotation page).
+Missing labels (None) are treated as missing ratings.
+The loaded segments are cached, and only the segments annotated again are loaded
+when the report is computed again (see agreement_report).
+"""
+import threading
+import numpy as np
+from app import db
+from app.models import ANNOTATION_TABLES
+from app.utils import Speaker
+from sqlalchemy import SmallInteger, func, type_coerce
+
+SEGMENTS_CHUNK_SIZE = 500  # number of segments loaded again in each query
+
+# cached reports: (dataset id, speaker) -> (partial results of the segments, report)
+_reports = {}
+_reports_lock = threading.Lock()
+
+
+def category_counts(ratings: np.ndarray, n_categories: int) -> np.ndarray:
+    """
+    Count the ratings of each category for each unit.
+
+    Parameters
+    ----------
+    ratings : np.ndarray
+        Matrix of category codes (units x annotators), -1 for missing ratings
+    n_categories : int
+        The number of categories
+
+    Returns
+    -------
+    counts : np.ndarray
+        Matrix of counts (units x categories)
+    """
+    return (ratings[:, :, None] == np.arange(n_categories)).sum(axis=1)
+
+
+def krippendorff_alpha(
+    ratings: np.ndarray, n_categories: int, level: str = "nominal"
+) -> float:
+    """
+    Krippendorff's alpha for nominal or ordinal data.
+    Units with less than two ratings are ignored.
+    Returns NaN if there is no expected disagreement (e.g. only one category is used).
+    see: https://repository.upenn.edu/asc_papers/43/
+    """
+    counts = category_counts(ratings, n_categories)
+    n_ratings = counts.sum(axis=1)
+    counts = counts[n_ratings > 1]
+    weights = 1 / (n_ratings[n_ratings > 1] - 1)
+    # coincidence matrix
+    coincidences = (counts.T * weights) @ counts - np.diag(weights @ counts)
+    marginals = coincidences.sum(axis=0)
+    n = marginals.sum()
+    if level == "nominal":
+        distance = 1 - np.eye(n_categories)
+    elif level == "ordinal":
+        cumulative = np.cumsum(marginals)
+        low = np.minimum.outer(np.arange(n_categories), np.arange(n_categories))
+        high = np.maximum.outer(np.arange(n_categories), np.arange(n_categories))
+        between = cumulative[high] - cumulative[low] + marginals[low]
+        distance = (between - np.add.outer(marginals, marginals) / 2) ** 2
+    else:
+        raise ValueError("Unknown level of measurement: " + level)
+    expected = (np.outer(marginals, marginals) * distance).sum()
+    if n < 2 or expected == 0:
+        return np.nan
+    return 1 - (n - 1) * (coincidences * distance).sum() / expected
+
+
+def fleiss_kappa(ratings: np.ndarray, n_categories: int) -> float:
+    """
+    Fleiss' kappa, computed on the units rated by all the annotators.
+    Returns NaN if there are less than two annotators or no such units.
+    """
+    n_annotators = ratings.shape[1]
+    complete = (ratings >= 0).all(axis=1)
+    if n_annotators < 2 or not complete.any():
+        return np.nan
+    counts = category_counts(ratings[complete], n_categories)
+    agreement = ((counts**2).sum(axis=1) - n_annotators) / (
+        n_annotators * (n_annotators - 1)
+    )
+    proportions = counts.sum(axis=0) / counts.sum()
+    expected = (proportions**2).sum()
+    if expected == 1:
+        return np.nan
+    return (agreement.mean() - expected) / (1 - expected)
+
+
+def cohen_kappa(ratings: np.ndarray, n_categories: int) -> float:
+    """
+    Cohen's kappa between each pair of annotators, on the units rated by both,
+    averaged over the pairs (Light's kappa if there are more than two annotators).
+    Returns NaN if it is not defined for any pair.
+    """
+    kappas = []
+    for a, b in zip(*np.triu_indices(ratings.shape[1], k=1)):
+        both = (ratings[:, a] >= 0) & (ratings[:, b] >= 0)
+        n = both.sum()
+        if n == 0:
+            continue
+        confusion = np.bincount(
+            ratings[both, a] * n_categories + ratings[both, b],
+            minlength=n_categories**2,
+        ).reshape(n_categories, n_categories)
+        observed = np.trace(confusion) / n
+        expected = confusion.sum(axis=1) @ confusion.sum(axis=0) / n**2
+        if expected < 1:
+            kappas.append((observed - expected) / (1 - expected))
+    return np.mean(kappas) if kappas else np.nan
+
+
+def evidence_jaccard(evidence: np.ndarray, annotations: np.ndarray) -> tuple:
+    """
+    Mean Jaccard index of the evidence of each pair of annotators, over the units
+    annotated by both where at least one of them marked some evidence.
+
+    Parameters
+    ----------
+    evidence : np.ndarray
+        Boolean matrix (annotations x dialog events), True if the event is marked as evidence
+    annotations : np.ndarray
+        Matrix of row indices in `evidence` (units x annotators), -1 if not annotated
+
+    Returns
+    -------
+    jaccard : float
+        The mean Jaccard index, NaN if there are no such pairs
+    n_pairs : int
+        The number of pairs of annotations compared
+    """
+    scores = []
+    for a, b in zip(*np.triu_indices(annotations.shape[1], k=1)):
+        both = (annotations[:, a] >= 0) & (annotations[:, b] >= 0)
+        evidence_a = evidence[annotations[both, a]]
+        evidence_b = evidence[annotations[both, b]]
+        union = (evidence_a | evidence_b).sum(axis=1)
+        intersection = (evidence_a & evidence_b).sum(axis=1)
+        scores.append(intersection[union > 0] / union[union > 0])
+    scores = np.concatenate(scores) if scores else np.array([])
+    return (scores.mean() if len(scores) else np.nan), len(scores)
+
+
+def encode(values: np.ndarray, categories: list) -> np.ndarray:
+    """
+    Convert an array of stored label codes (see app/vocabulary.py) to the positions
+    of their categories, given by their stored codes (-1 for None or unknown codes)
+    """
+    lookup = np.full(max(categories) + 2, -1)
+    lookup[categories] = np.arange(len(categories))
+    values = np.where(np.equal(values, None), -1, values).astype(np.int64)
+    return lookup[np.where((values >= 0) & (values < len(lookup)), values, -1)]
+
+
+def annotations_version(id_dataset: int, speaker: Speaker) -> tuple:
+    """
+    Return the number of annotations of the dataset for the speaker, the highest id
+    and the time the annotations were last written (see modified).
+    This changes whenever annotations are added (or deleted), or changed by a new version
+    of the dataset (see app/upload/diff.py), and is used to know when a cached report
+    is out of date. The time changes when the id of a deleted dataset is reused
+    (see app/admin/delete.py).
+    """
+    model = ANNOTATION_TABLES[speaker][0]
+    query = db.select(
+        func.count(model.id), func.max(model.id), func.max(model.modified)
+    ).where(model.id_dataset == id_dataset)
+    return tuple(db.session.execute(query).one())
+
+
+def rated_columns(model) -> list:
+    """The label and strength columns of an annotation table"""
+    return [
+        column
+        for column in model.__table__.columns
+        if column.name.startswith(("label_", "strength_"))
+    ]
+
+
+def load_segments(id_dataset: int, speaker: Speaker, segments: list = None) -> dict:
+    """
+    Load the latest annotation of each annotator for each segment of a dataset
+    for one speaker, with its label codes and evidence: the partial results
+    the metrics are computed from (see segment_metrics), which only change
+    for the segments annotated again.
+
+    Parameters
+    ----------
+    id_dataset : int
+        The id of the dataset
+    speaker : Speaker
+        The speaker of the annotation table
+    segments : list, optional
+        The segments to load (ids of their first dialog turns), all of them by default
+
+    Returns
+    -------
+    data : dict
+        NumPy arrays with one row per latest annotation: its id (ids), annotator (users),
+        segment (segments) and the positions of the categories of each label and
+        strength column (codes, -1 if missing); and the evidence of these annotations
+        (evidence: annotation id, label code, dialog event id)
+    """
+    model, evidence_model, evidence_column = ANNOTATION_TABLES[speaker]
+    columns = rated_columns(model)
+    # one row per annotation, with its segment (first dialog turn) and raw label codes
+    query = db.select(
+        model.id,
+        model.id_user,
+        model.timestamp,
+        model.id_first_dialog_turn,
+        *[type_coerce(column, SmallInteger) for column in columns],
+    ).where(model.id_dataset == id_dataset, model.id_first_dialog_turn.is_not(None))
+    evidence_id = getattr(evidence_model, evidence_column)
+    evidence_query = (
+        db.select(
+            evidence_id,
+            type_coerce(evidence_model.label, SmallInteger),
+            evidence_model.id_ps_dialog_event,
+        )
+        .join(model, model.id == evidence_id)
+        .where(model.id_dataset == id_dataset)
+    )
+    if segments is None:
+        rows = db.session.execute(query).all()
+        evidence = db.session.execute(evidence_query).all()
+    else:
+        rows, evidence = [], []
+        for start in range(0, len(segments), SEGMENTS_CHUNK_SIZE):
+            chunk = model.id_first_dialog_turn.in_(
+                segments[start : start + SEGMENTS_CHUNK_SIZE]
+            )
+            rows += db.session.execute(query.where(chunk)).all()
+            evidence += db.session.execute(evidence_query.where(chunk)).all()
+    data = np.array(rows, dtype=object).reshape(-1, 4 + len(columns))
+    ids = data[:, 0].astype(np.int64)
+    users = data[:, 1].astype(np.int64)
+    timestamps = data[:, 2].astype("datetime64[us]")
+    segment_ids = data[:, 3].astype(np.int64)
+
+    # keep the latest annotation of each annotator for each segment
+    order = np.lexsort((ids, timestamps, users, segment_ids))
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (segment_ids[order][1:] != segment_ids[order][:-1]) | (
+        users[order][1:] != users[order][:-1]
+    )
+    latest = order[last]
+    codes = np.full((len(latest), len(columns)), -1, dtype=np.int64)
+    for i, column in enumerate(columns):
+        categories = list(column.type.codes.values())  # in the order of the Enum
+        codes[:, i] = encode(data[latest, 4 + i], categories)
+
+    # evidence of the latest annotations only
+    evidence = np.array(evidence, dtype=object).reshape(-1, 3)
+    evidence = evidence[np.isin(evidence[:, 0].astype(np.int64), ids[latest])]
+    return {
+        "ids": ids[latest],
+        "users": users[latest],
+        "segments": segment_ids[latest],
+        "codes": codes,
+        "evidence": evidence.astype(np.int64),
+    }
+
+
+def segment_metrics(speaker: Speaker, data: dict) -> dict:
+    """
+    Compute the agreement metrics from the latest annotations of the segments
+    (see load_segments).
+
+    Returns
+    -------
+    report : dict
+        The number of segments and annotators, and for each label and strength column
+        the metrics (cohen_kappa, fleiss_kappa, alpha) and the number of segments
+        with at least two ratings (n_units). For each label, the evidence Jaccard index
+        (jaccard) and the number of pairs of annotations compared (n_pairs).
+        Metrics that are not defined are None.
+    """
+    model, evidence_model, _ = ANNOTATION_TABLES[speaker]
+    columns = rated_columns(model)
+    report = {"n_segments": 0, "n_annotators": 0, "metrics": {}}
+    if not len(data["ids"]):
+        return report
+    unit_ids, units = np.unique(data["segments"], return_inverse=True)
+    user_ids, annotators = np.unique(data["users"], return_inverse=True)
+    report["n_segments"] = len(unit_ids)
+    report["n_annotators"] = len(user_ids)
+
+    # position of the annotation of each (segment, annotator) in `data`, -1 if none
+    annotations = np.full((len(unit_ids), len(user_ids)), -1)
+    annotations[units, annotators] = np.arange(len(data["ids"]))
+
+    for i, column in enumerate(columns):
+        n_categories = len(column.type.codes)
+        codes = data["codes"][:, i]
+        ratings = np.where(annotations >= 0, codes[annotations], -1)
+        level = "ordinal" if column.name.startswith("strength_") else "nominal"
+        report["metrics"][column.name] = {
+            "cohen_kappa": cohen_kappa(ratings, n_categories),
+            "fleiss_kappa": fleiss_kappa(ratings, n_categories),
+            "alpha": krippendorff_alpha(ratings, n_categories, level),
+            "n_units": int(((ratings >= 0).sum(axis=1) > 1).sum()),
+        }
+
+    # evidence as a boolean (annotation x event) matrix per label
+    evidence = data["evidence"]
+    positions = np.full(data["ids"].max() + 1, -1)
+    positions[data["ids"]] = np.arange(len(data["ids"]))
+    events, event_index = np.unique(evidence[:, 2], return_inverse=True)
+    for label in [
+        column.name for column in columns if column.name.startswith("label_")
+    ]:
+        label_type = evidence_model.label.type
+        marked = evidence[:, 1] == label_type.codes[label_type.enum_class[label]]
+        matrix = np.zeros((len(data["ids"]), len(events)), dtype=bool)
+        matrix[positions[evidence[marked, 0]], event_index[marked]] = True
+        jaccard, n_pairs = evidence_jaccard(matrix, annotations)
+        report["metrics"][label].update({"jaccard": jaccard, "n_pairs": n_pairs})
+
+    # undefined metrics (NaN) are reported as None
+    for metrics in report["metrics"].values():
+        for name, value in metrics.items():
+            if isinstance(value, float) and np.isnan(value):
+                metrics[name] = None
+            elif isinstance(value, np.floating):
+                metrics[name] = float(value)
+    return report
+
+
+def speaker_agreement(id_dataset: int, speaker: Speaker) -> dict:
+    """
+    Compute the agreement metrics for the annotations of a dataset for one speaker
+    (see segment_metrics).
+    """
+    return segment_metrics(speaker, load_segments(id_dataset, speaker))
+
+
+def annotation_segments(id_dataset: int, speaker: Speaker, modified=None) -> tuple:
+    """
+    Return the ids, segments (-1 if none) and times written of the annotations
+    of a dataset for one speaker, only of those written after `modified` if given
+    """
+    model = ANNOTATION_TABLES[speaker][0]
+    query = db.select(
+        model.id, func.coalesce(model.id_first_dialog_turn, -1), model.modified
+    ).where(model.id_dataset == id_dataset)
+    if modified is not None:
+        query = query.where(model.modified > modified)
+    rows = np.array(db.session.execute(query).all(), dtype=object).reshape(-1, 3)
+    return rows[:, 0].astype(np.int64), rows[:, 1].astype(np.int64), rows[:, 2]
+
+
+def written_after(modified: np.ndarray, time) -> np.ndarray:
+    """Whether the annotations were written after a time (all of them if None)"""
+    if time is None:
+        return np.ones(len(modified), dtype=bool)
+    return modified > time
+
+
+def cache_segments(id_dataset: int, speaker: Speaker, version: tuple) -> dict:
+    """
+    Load the partial results of all the segments (see load_segments), with the segment
+    of each annotation and whether it was written after the version (recent, while
+    it was loaded): the annotations written until the version are known not to have
+    changed as long as there are as many of them.
+    """
+    ids, segments, modified = annotation_segments(id_dataset, speaker)
+    return {
+        "version": version,
+        "data": load_segments(id_dataset, speaker),
+        "ids": ids,
+        "segments": segments,
+        "recent": written_after(modified, version[2]),
+    }
+
+
+def update_segments(id_dataset: int, speaker: Speaker, cached: dict, version: tuple):
+    """
+    Update cached partial results (see cache_segments) to a new version of the
+    annotations, loading again only the segments with annotations written after
+    the cached version, before and after they were written (the annotations
+    relinked by a new version of the dataset change segment, see app/upload/diff.py).
+    Returns None if annotations written until the cached version were deleted
+    (or committed late), or if most segments changed: all the segments are then
+    loaded again.
+    """
+    model = ANNOTATION_TABLES[speaker][0]
+    since = cached["version"][2]
+    ids, segments, modified = annotation_segments(id_dataset, speaker, since)
+    kept = ~cached["recent"] & ~np.isin(cached["ids"], ids)
+    n_before = db.session.scalar(
+        db.select(func.count(model.id)).where(
+            model.id_dataset == id_dataset, model.modified <= since
+        )
+    )
+    if n_before != kept.sum():
+        return None
+    touched = np.union1d(segments, cached["segments"][~kept])
+    touched = touched[touched >= 0]
+    data = cached["data"]
+    if 2 * len(touched) > len(np.unique(data["segments"])):
+        return None
+    loaded = load_segments(id_dataset, speaker, touched.tolist())
+    unchanged = ~np.isin(data["segments"], touched)
+    evidence = data["evidence"]
+    evidence = evidence[np.isin(evidence[:, 0], data["ids"][unchanged])]
+    return {
+        "version": version,
+        "data": {
+            **{
+                name: np.concatenate([data[name][unchanged], loaded[name]])
+                for name in ["ids", "users", "segments", "codes"]
+            },
+            "evidence": np.concatenate([evidence, loaded["evidence"]]),
+        },
+        "ids": np.concatenate([cached["ids"][kept], ids]),
+        "segments": np.concatenate([cached["segments"][kept], segments]),
+        "recent": np.concatenate(
+            [np.zeros(kept.sum(), dtype=bool), written_after(modified, version[2])]
+        ),
+    }
+
+
+def agreement_report(id_dataset: int) -> dict:
+    """
+    Return the agreement report of a dataset, for each speaker (see speaker_agreement).
+    The partial results of the segments are cached (in each process) with the report,
+    which is only computed again if annotations were added or changed for the speaker
+    since it was cached, loading again only the segments of these annotations
+    (see update_segments).
+    """
+    report = {}
+    for speaker in Speaker:
+        version = annotations_version(id_dataset, speaker)
+        with _reports_lock:
+            cached = _reports.get((id_dataset, speaker))
+        if cached is not None and cached[0]["version"] == version:
+            report[speaker.value] = cached[1]
+            continue
+        segments = None
+        if cached is not None and version[0] and cached[0]["version"][0]:
+            segments = update_segments(id_dataset, speaker, cached[0], version)
+        if segments is None:
+            segments = cache_segments(id_dataset, speaker, version)
+        report[speaker.value] = segment_metrics(speaker, segments["data"])
+        with _reports_lock:
+            _reports[(id_dataset, speaker)] = (segments, report[speaker.value])
+    return report
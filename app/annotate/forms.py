@@ -1,46 +1,25 @@
 """
 Annotation forms for the app
 """
+from functools import lru_cache
 from flask_wtf import FlaskForm
-from wtforms import SelectField, SubmitField, TextAreaField, SelectMultipleField
+from wtforms import (
+    SelectField,
+    SubmitField,
+    TextAreaField,
+    SelectMultipleField,
+    HiddenField,
+)
 from wtforms.validators import (
     DataRequired,
     Length,
     Optional,
     InputRequired,
+    ValidationError,
 )
 
-from app.utils import (
-    LabelNamesClient,
-    LabelNamesTherapist,
-    LabelNamesDyad,
-    SubLabelsAClient,
-    SubLabelsATherapist,
-    SubLabelsADyad,
-    SubLabelsBClient,
-    SubLabelsBTherapist,
-    SubLabelsBDyad,
-    SubLabelsCClient,
-    SubLabelsCTherapist,
-    SubLabelsDClient,
-    SubLabelsDTherapist,
-    SubLabelsEClient,
-    SubLabelsETherapist,
-    SubLabelsFClient,
-    LabelStrengthAClient,
-    LabelStrengthATherapist,
-    LabelStrengthADyad,
-    LabelStrengthBClient,
-    LabelStrengthBTherapist,
-    LabelStrengthBDyad,
-    LabelStrengthCClient,
-    LabelStrengthCTherapist,
-    LabelStrengthDClient,
-    LabelStrengthDTherapist,
-    LabelStrengthEClient,
-    LabelStrengthETherapist,
-    LabelStrengthFClient,
-)
+from app.annotate.schema import ANNOTATION_SCHEMA, SpeakerSchema
+from app.utils import SMAnnotationType, Speaker
 
 
 class RequiredIf(InputRequired):
@@ -63,12 +42,18 @@ class RequiredIf(InputRequired):
             Optional().__call__(form, field)
 
 
+@lru_cache(maxsize=None)
+def enum_choices(enum_class) -> tuple:
+    """The choices of a select field of the members of an Enum, built once"""
+    return tuple((choice.name, choice.value) for choice in enum_class)
+
+
 def create_select_field(label, choices, name, default=None):
     """Create a select field with the given label, choices, name and default value"""
 
     return SelectField(
         label=label,
-        choices=[(choice.name, choice.value) for choice in choices],
+        choices=enum_choices(choices),
         validators=[DataRequired()],
         name=name,
         default=default,
@@ -126,222 +111,91 @@ def create_text_area_field(
     )
 
 
-class PSAnnotationFormClient(FlaskForm):
-    """Segment level annotation form of psychotherapy datasets for the client"""
-
-    label_a = create_select_field(
-        label=LabelNamesClient.label_a.value,
-        choices=SubLabelsAClient,
-        name="label_a_client",
-    )
-    label_b = create_select_field(
-        label=LabelNamesClient.label_b.value,
-        choices=SubLabelsBClient,
-        name="label_b_client",
-    )
-    label_c = create_select_field(
-        label=LabelNamesClient.label_c.value,
-        choices=SubLabelsCClient,
-        name="label_c_client",
-    )
-    label_d = create_select_field(
-        label=LabelNamesClient.label_d.value,
-        choices=SubLabelsDClient,
-        name="label_d_client",
-    )
-    label_e = create_select_field(
-        label=LabelNamesClient.label_e.value,
-        choices=SubLabelsEClient,
-        name="label_e_client",
-    )
-    label_f = create_select_field(
-        label=LabelNamesClient.label_f.value,
-        choices=SubLabelsFClient,
-        name="label_f_client",
-        default=SubLabelsFClient.no_change.name,
-    )
-    strength_a = create_select_field(
-        label="Strength", choices=LabelStrengthAClient, name="strength_a_client"
-    )
-    strength_b = create_select_field(
-        label="Strength", choices=LabelStrengthBClient, name="strength_b_client"
-    )
-    strength_c = create_select_field(
-        label="Strength", choices=LabelStrengthCClient, name="strength_c_client"
-    )
-    strength_d = create_select_field(
-        label="Strength", choices=LabelStrengthDClient, name="strength_d_client"
-    )
-    strength_e = create_select_field(
-        label="Strength", choices=LabelStrengthEClient, name="strength_e_client"
-    )
-    strength_f = create_select_field(
-        label="Strength",
-        choices=LabelStrengthFClient,
-        name="strength_f_client",
-        default=LabelStrengthFClient.no_change.name,
-    )
-    comment_a = create_text_area_field(
-        label="Comment", name="comment_a_client", required_if="label_a"
-    )  # Note that HTML "name" is unique and is used in the tests to identify the field
-    comment_b = create_text_area_field(
-        label="Comment", name="comment_b_client", required_if="label_b"
-    )
-    comment_c = create_text_area_field(
-        label="Comment", name="comment_c_client", required_if="label_c"
-    )
-    comment_d = create_text_area_field(
-        label="Comment", name="comment_d_client", required_if="label_d"
-    )
-    comment_e = create_text_area_field(
-        label="Comment", name="comment_e_client", required_if="label_e"
-    )
-    comment_f = create_text_area_field(label="Comment", name="comment_f_client")
-    relevant_events_a = create_select_multiple_field_without_choices(
-        label="Evidence", name="relevant_events_a_client"
-    )
-    relevant_events_b = create_select_multiple_field_without_choices(
-        label="Evidence", name="relevant_events_b_client"
-    )
-    relevant_events_c = create_select_multiple_field_without_choices(
-        label="Evidence", name="relevant_events_c_client"
-    )
-    relevant_events_d = create_select_multiple_field_without_choices(
-        label="Evidence", name="relevant_events_d_client"
-    )
-    relevant_events_e = create_select_multiple_field_without_choices(
-        label="Evidence", name="relevant_events_e_client"
-    )
-    start_event_f = create_select_field_without_choices(
-        label="Start", name="start_event_f_client"
-    )
-    end_event_f = create_select_field_without_choices(
-        label="End", name="end_event_f_client"
-    )
-    comment_summary = create_text_area_field(
+def build_annotation_form(schema: SpeakerSchema) -> type:
+    """
+    Compile the segment level annotation form class of a speaker from its schema
+    (see app/annotate/schema.py). The HTML name of each field ends with the name of
+    the speaker, and is used in the templates and the tests to identify the field.
+    """
+    suffix = "_" + schema.speaker.name
+    labels, strengths, comments, evidence = {}, {}, {}, {}
+    for label in schema.labels:
+        x = label.letter
+        labels["label_" + x] = create_select_field(
+            label=label.name.value,
+            choices=label.sublabels,
+            name="label_" + x + suffix,
+            default=label.default_sublabel,
+        )
+        strengths["strength_" + x] = create_select_field(
+            label="Strength",
+            choices=label.strengths,
+            name="strength_" + x + suffix,
+            default=label.default_strength,
+        )
+        comments["comment_" + x] = create_text_area_field(
+            label="Comment",
+            name="comment_" + x + suffix,
+            required_if="label_" + x if label.comment_if_other else None,
+        )
+        if label.evidence_range:
+            evidence["start_event_" + x] = create_select_field_without_choices(
+                label="Start", name="start_event_" + x + suffix
+            )
+            evidence["end_event_" + x] = create_select_field_without_choices(
+                label="End", name="end_event_" + x + suffix
+            )
+        else:
+            evidence[
+                "relevant_events_" + x
+            ] = create_select_multiple_field_without_choices(
+                label="Evidence", name="relevant_events_" + x + suffix
+            )
+    fields = {**labels, **strengths, **comments, **evidence}
+    fields["comment_summary"] = create_text_area_field(
         label="Summary Comment",
-        name="comment_summary_client",
+        name="comment_summary" + suffix,
         max_length=500,
         rows=3,
         cols=15,
     )
-    submit = SubmitField("Submit")
+    if schema.submit:
+        fields["submit"] = SubmitField("Submit")
+    name = "PSAnnotationForm" + schema.speaker.name.capitalize()
+    fields["__doc__"] = (
+        "Segment level annotation form of psychotherapy datasets for the "
+        + schema.speaker.name
+    )
+    fields["__module__"] = __name__
+    return type(name, (FlaskForm,), fields)
 
 
-class PSAnnotationFormTherapist(FlaskForm):
-    """Segment level annotation form of psychotherapy datasets for the therapist"""
+PSAnnotationFormClient = build_annotation_form(ANNOTATION_SCHEMA[Speaker.client])
+PSAnnotationFormTherapist = build_annotation_form(ANNOTATION_SCHEMA[Speaker.therapist])
+PSAnnotationFormDyad = build_annotation_form(ANNOTATION_SCHEMA[Speaker.dyad])
 
-    label_a = create_select_field(
-        label=LabelNamesTherapist.label_a.value,
-        choices=SubLabelsATherapist,
-        name="label_a_therapist",
-    )
-    label_b = create_select_field(
-        label=LabelNamesTherapist.label_b.value,
-        choices=SubLabelsBTherapist,
-        name="label_b_therapist",
-    )
-    label_c = create_select_field(
-        label=LabelNamesTherapist.label_c.value,
-        choices=SubLabelsCTherapist,
-        name="label_c_therapist",
-    )
-    label_d = create_select_field(
-        label=LabelNamesTherapist.label_d.value,
-        choices=SubLabelsDTherapist,
-        name="label_d_therapist",
-    )
-    label_e = create_select_field(
-        label=LabelNamesTherapist.label_e.value,
-        choices=SubLabelsETherapist,
-        name="label_e_therapist",
-    )
-    strength_a = create_select_field(
-        label="Strength", choices=LabelStrengthATherapist, name="strength_a_therapist"
-    )
-    strength_b = create_select_field(
-        label="Strength", choices=LabelStrengthBTherapist, name="strength_b_therapist"
-    )
-    strength_c = create_select_field(
-        label="Strength", choices=LabelStrengthCTherapist, name="strength_c_therapist"
-    )
-    strength_d = create_select_field(
-        label="Strength", choices=LabelStrengthDTherapist, name="strength_d_therapist"
-    )
-    strength_e = create_select_field(
-        label="Strength", choices=LabelStrengthETherapist, name="strength_e_therapist"
-    )
-    comment_a = create_text_area_field(
-        label="Comment", name="comment_a_therapist", required_if="label_a"
-    )
-    comment_b = create_text_area_field(
-        label="Comment", name="comment_b_therapist", required_if="label_b"
-    )
-    comment_c = create_text_area_field(
-        label="Comment", name="comment_c_therapist", required_if="label_c"
-    )
-    comment_d = create_text_area_field(
-        label="Comment", name="comment_d_therapist", required_if="label_d"
-    )
-    comment_e = create_text_area_field(
-        label="Comment", name="comment_e_therapist", required_if="label_e"
-    )
-    relevant_events_a = create_select_multiple_field_without_choices(
-        label="Evidence", name="relevant_events_a_therapist"
-    )
-    relevant_events_b = create_select_multiple_field_without_choices(
-        label="Evidence", name="relevant_events_b_therapist"
-    )
-    relevant_events_c = create_select_multiple_field_without_choices(
-        label="Evidence", name="relevant_events_c_therapist"
-    )
-    relevant_events_d = create_select_multiple_field_without_choices(
-        label="Evidence", name="relevant_events_d_therapist"
-    )
-    relevant_events_e = create_select_multiple_field_without_choices(
-        label="Evidence", name="relevant_events_e_therapist"
-    )
-    comment_summary = create_text_area_field(
-        label="Summary Comment",
-        name="comment_summary_therapist",
-        max_length=500,
-        rows=3,
-        cols=15,
-    )
-    submit = SubmitField("Submit")
+# the form class of each speaker
+ANNOTATION_FORMS = {
+    Speaker.client: PSAnnotationFormClient,
+    Speaker.therapist: PSAnnotationFormTherapist,
+    Speaker.dyad: PSAnnotationFormDyad,
+}
 
 
-class PSAnnotationFormDyad(FlaskForm):
-    """Segment level annotation form of psychotherapy datasets for the dyad"""
+class SMAnnotationForm(FlaskForm):
+    """Annotation form of a post of a social media dataset"""
 
-    label_a = create_select_field(
-        label=LabelNamesDyad.label_a.value, choices=SubLabelsADyad, name="label_a_dyad"
-    )
-    label_b = create_select_field(
-        label=LabelNamesDyad.label_b.value, choices=SubLabelsBDyad, name="label_b_dyad"
-    )
-    strength_a = create_select_field(
-        label="Strength", choices=LabelStrengthADyad, name="strength_a_dyad"
-    )
-    strength_b = create_select_field(
-        label="Strength", choices=LabelStrengthBDyad, name="strength_b_dyad"
-    )
-    comment_a = create_text_area_field(
-        label="Comment", name="comment_a_dyad", required_if="label_a"
-    )
-    comment_b = create_text_area_field(
-        label="Comment", name="comment_b_dyad", required_if="label_b"
-    )
-    relevant_events_a = create_select_multiple_field_without_choices(
-        label="Evidence", name="relevant_events_a_dyad"
-    )
-    relevant_events_b = create_select_multiple_field_without_choices(
-        label="Evidence", name="relevant_events_b_dyad"
-    )
-    comment_summary = create_text_area_field(
-        label="Summary Comment",
-        name="comment_summary_dyad",
-        max_length=500,
-        rows=3,
-        cols=15,
+    id_sm_post = HiddenField(validators=[DataRequired()])  # id of the annotated post
+    type = SelectField(
+        label="Type",
+        choices=[("", "None")]
+        + [(choice.name, choice.value) for choice in SMAnnotationType],
+        validators=[Optional()],
     )
+    body = create_text_area_field(label="Comment", name="body", max_length=500)
+    submit = SubmitField("Save")
+
+    def validate_body(self, field):
+        """An annotation has a type, a comment or both"""
+        if not self.type.data and not field.data:
+            raise ValidationError("Please select a type or write a comment.")
@@ -0,0 +1,83 @@
+"""
+Read-only projections of the psychotherapy annotations, to pre-populate the
+annotation forms. The columns are read with Core queries into immutable values
+(with the Enum names the forms use), so no ORM object is loaded, changed or
+flushed when a page is shown.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from types import MappingProxyType
+from typing import Mapping, Optional
+from app import db
+from app.models import ANNOTATION_TABLES
+from app.utils import Speaker
+
+
+@dataclass(frozen=True)
+class AnnotationValues:
+    """The values of an annotation shown in its form"""
+
+    id: int
+    timestamp: datetime
+    fields: Mapping[str, object]  # label_* and strength_* (Enum names), comment_*
+    evidence: Mapping[str, tuple]  # the evidence events of each label (ids, in order)
+
+    def form_data(self) -> dict:
+        """The data of the annotation form, with the evidence fields of each label"""
+        data = dict(self.fields)
+        for label, events in self.evidence.items():
+            data["relevant_events_" + label[-1]] = list(events)
+        if "label_f" in self.evidence:  # the client moment of change is a range
+            events = self.evidence["label_f"]
+            del data["relevant_events_f"]
+            data["start_event_f"] = events[0] if events else None
+            data["end_event_f"] = events[-1] if events else None
+        return data
+
+
+def fetch_annotation_values(
+    id_dialog_turns: list, speaker: Speaker, id_dataset: int, id_user: int
+) -> Optional[AnnotationValues]:
+    """
+    The latest annotation of a user for the speaker of the segment of the dialog turns
+    (whose first dialog turn is one of them), with its evidence, or None if the user
+    did not annotate them
+    """
+    model, evidence_model, evidence_column = ANNOTATION_TABLES[speaker]
+    columns = [
+        column
+        for column in model.__table__.columns
+        if column.name.startswith(("label_", "strength_", "comment_"))
+    ]
+    row = db.session.execute(
+        db.select(model.id, model.timestamp, *columns)
+        .where(
+            model.id_first_dialog_turn.in_(id_dialog_turns),
+            model.id_user == id_user,
+            model.id_dataset == id_dataset,
+        )
+        .order_by(model.timestamp.desc(), model.id.desc())
+        .limit(1)
+    ).first()
+    if row is None:
+        return None
+    fields = {
+        column.name: getattr(value, "name", value)
+        for column, value in zip(columns, row[2:])
+    }
+    evidence = {label.name: [] for label in evidence_model.label.type.enum_class}
+    for label, id_event in db.session.execute(
+        db.select(evidence_model.label, evidence_model.id_ps_dialog_event)
+        .where(getattr(evidence_model, evidence_column) == row.id)
+        .order_by(evidence_model.id_ps_dialog_event)
+    ):
+        if label is not None:
+            evidence[label.name].append(id_event)
+    return AnnotationValues(
+        id=row.id,
+        timestamp=row.timestamp,
+        fields=MappingProxyType(fields),
+        evidence=MappingProxyType(
+            {label: tuple(events) for label, events in evidence.items()}
+        ),
+    )
@@ -1,15 +1,24 @@
 from app.annotate import bp
-from app import db
+from app import db, write_queue
 from flask import render_template, request, url_for, current_app, abort, flash, redirect
-from flask_login import login_required
-from app.models import Dataset
-from app.utils import Speaker
+from flask_login import login_required, current_user
+from app.models import Dataset, PSDialogTurn, SMPost, SMTimeline
+from app.utils import DatasetType, Speaker
+from app.annotate.forms import SMAnnotationForm
+from app.annotate.sm import (
+    fetch_post_annotations,
+    get_adjacent_timelines,
+    get_page_timelines,
+    get_posts_page,
+    save_sm_annotation,
+)
 from app.annotate.utils import (
     split_dialog_turns,
     get_events_from_segments,
     get_page_items,
     fetch_dialog_turn_annotations,
-    new_dialog_turn_annotation_to_db,
+    save_dialog_turn_annotation,
+    annotation_form_data,
     create_psy_annotation_form,
     assign_dynamic_choices,
 )
@@ -51,7 +60,9 @@ class AnnotatePSView(View):
 
     def create_form(self, dialog_turns: list, page_items: list, speaker: Speaker):
         """Create the annotations form for the specified speaker"""
-        annotations = fetch_dialog_turn_annotations(dialog_turns, speaker)
+        annotations = fetch_dialog_turn_annotations(
+            dialog_turns, speaker, self.dataset.id
+        )
         form = create_psy_annotation_form(annotations, speaker)
         form = assign_dynamic_choices(form, page_items, speaker)
         return form, annotations
@@ -59,9 +70,13 @@ class AnnotatePSView(View):
     def dispatch_request(self, dataset_id: int):
         """This method is the equivalent of the view function"""
         self.dataset = Dataset.query.get_or_404(dataset_id)
+        if self.dataset.deleting:
+            abort(404)  # see app/admin/delete.py
         app_config = current_app.config
         segments = split_dialog_turns(
-            self.dataset.dialog_turns.order_by("timestamp").all(),
+            PSDialogTurn.query.filter_by(id_dataset=self.dataset.content_id)
+            .order_by("timestamp")
+            .all(),
             time_interval=app_config["PS_MINS_PER_PAGE"] * 60,
         )  # split the dialog turns into segments
         page = request.args.get(
@@ -90,17 +105,18 @@ class AnnotatePSView(View):
             # if the client form is submitted
             if form_client.validate_on_submit():
                 try:
-                    new_dialog_turn_annotation_to_db(
-                        form_client,
+                    write_queue.submit(
+                        save_dialog_turn_annotation,
+                        annotation_form_data(form_client),
                         Speaker.client,
-                        self.dataset,
-                        dialog_turns=segments[page - 1],
-                    )
+                        self.dataset.id,
+                        dialog_turns[0].id,  # the first dialog turn of the segment
+                        current_user.id,
+                        page,
+                    )  # add the annotation to the database and commit
                 except Exception as e:
                     print(e)
-                    db.session.rollback()
                     abort(500)
-                db.session.commit()
                 flash("Your annotations have been saved.", "success")
                 return redirect(
                     url_for(
@@ -111,17 +127,18 @@ class AnnotatePSView(View):
             # if the therapist form is submitted
             if form_therapist.validate_on_submit():
                 try:
-                    new_dialog_turn_annotation_to_db(
-                        form_therapist,
+                    write_queue.submit(
+                        save_dialog_turn_annotation,
+                        annotation_form_data(form_therapist),
                         Speaker.therapist,
-                        self.dataset,
-                        dialog_turns=segments[page - 1],
-                    )
+                        self.dataset.id,
+                        dialog_turns[0].id,  # the first dialog turn of the segment
+                        current_user.id,
+                        page,
+                    )  # add the annotation to the database and commit
                 except Exception as e:
                     print(e)
-                    db.session.rollback()
                     abort(500)
-                db.session.commit()
                 flash("Your annotations have been saved.", "success")
                 return redirect(
                     url_for(
@@ -132,17 +149,18 @@ class AnnotatePSView(View):
             # if the dyad form is submitted
             if form_dyad.validate_on_submit():
                 try:
-                    new_dialog_turn_annotation_to_db(
-                        form_dyad,
+                    write_queue.submit(
+                        save_dialog_turn_annotation,
+                        annotation_form_data(form_dyad),
                         Speaker.dyad,
-                        self.dataset,
-                        dialog_turns=segments[page - 1],
-                    )
+                        self.dataset.id,
+                        dialog_turns[0].id,  # the first dialog turn of the segment
+                        current_user.id,
+                        page,
+                    )  # add the annotation to the database and commit
                 except Exception as e:
                     print(e)
-                    db.session.rollback()
                     abort(500)
-                db.session.commit()
                 flash("Your annotations have been saved.", "success")
                 return redirect(
                     url_for(
@@ -177,11 +195,90 @@ bp.add_url_rule(
 )
 
 
-@bp.route("/annotate_social_media/<int:dataset_id>")
+@bp.route("/annotate_social_media/<int:dataset_id>", methods=["GET", "POST"])
 @login_required
 def annotate_sm(dataset_id):
     """This is the annotations page for social media datasets"""
     dataset = Dataset.query.get_or_404(
         dataset_id
     )  # fetch the dataset from the database
-    return render_template("annotate/annotate_sm.html", dataset=dataset)
+    if dataset.type != DatasetType.sm_thread or dataset.deleting:
+        abort(404)
+    after = request.args.get("after")
+    before = request.args.get("before")
+    timeline = None
+    id_timeline = request.args.get("timeline", type=int)
+    if id_timeline is not None:
+        # only the posts of this timeline
+        timeline = db.session.get(SMTimeline, id_timeline)
+        if timeline is None or timeline.id_dataset != dataset.content_id:
+            abort(404)
+    try:
+        posts, prev_cursor, next_cursor = get_posts_page(
+            dataset.content_id,
+            after=after,
+            before=before,
+            limit=current_app.config["SM_POSTS_PER_PAGE"],
+            timeline=timeline,
+        )
+    except ValueError:
+        abort(400)
+    form = SMAnnotationForm()
+    if form.validate_on_submit():
+        post = db.session.get(SMPost, int(form.id_sm_post.data))
+        if post is None or post.id_dataset != dataset.content_id:
+            abort(400)
+        try:
+            write_queue.submit(
+                save_sm_annotation,
+                post.id,
+                current_user.id,
+                dataset.id,
+                form.type.data,
+                form.body.data,
+            )  # add the annotation to the database and commit
+        except Exception as e:
+            print(e)
+            abort(500)
+        flash("Your annotation has been saved.", "success")
+        return redirect(
+            url_for(
+                "annotate.annotate_sm",
+                dataset_id=dataset.id,
+                after=after,
+                before=before,
+                timeline=id_timeline,
+                _anchor="post-{}".format(post.id),
+            )
+        )
+    return render_template(
+        "annotate/annotate_sm.html",
+        dataset=dataset,
+        posts=posts,
+        annotations=fetch_post_annotations(posts, current_user.id, dataset.id),
+        timelines=get_page_timelines(dataset.content_id, posts),
+        timeline=timeline,
+        adjacent_timelines=get_adjacent_timelines(timeline) if timeline else None,
+        form=form,
+        prev_url=url_for(
+            "annotate.annotate_sm",
+            dataset_id=dataset.id,
+            before=prev_cursor,
+            timeline=id_timeline,
+        )
+        if prev_cursor
+        else None,
+        next_url=url_for(
+            "annotate.annotate_sm",
+            dataset_id=dataset.id,
+            after=next_cursor,
+            timeline=id_timeline,
+        )
+        if next_cursor
+        else None,
+        first_url=url_for(
+            "annotate.annotate_sm", dataset_id=dataset.id, timeline=id_timeline
+        )
+        if prev_cursor
+        else None,
+    )
@@ -0,0 +1,157 @@
+"""
+Declarative schema of the segment level annotations of psychotherapy datasets.
+The annotation forms (see app/annotate/forms.py) are compiled from it once, when the
+app is imported: their classes, the choices of their select fields and the names of
+their evidence fields are cached, so that showing a page only binds the data of the
+annotations and sets the events of the page as the choices of the evidence fields.
+"""
+from dataclasses import dataclass
+from enum import Enum
+from typing import Optional, Type
+from app.utils import (
+    Speaker,
+    LabelNamesClient,
+    LabelNamesTherapist,
+    LabelNamesDyad,
+    SubLabelsAClient,
+    SubLabelsATherapist,
+    SubLabelsADyad,
+    SubLabelsBClient,
+    SubLabelsBTherapist,
+    SubLabelsBDyad,
+    SubLabelsCClient,
+    SubLabelsCTherapist,
+    SubLabelsDClient,
+    SubLabelsDTherapist,
+    SubLabelsEClient,
+    SubLabelsETherapist,
+    SubLabelsFClient,
+    LabelStrengthAClient,
+    LabelStrengthATherapist,
+    LabelStrengthADyad,
+    LabelStrengthBClient,
+    LabelStrengthBTherapist,
+    LabelStrengthBDyad,
+    LabelStrengthCClient,
+    LabelStrengthCTherapist,
+    LabelStrengthDClient,
+    LabelStrengthDTherapist,
+    LabelStrengthEClient,
+    LabelStrengthETherapist,
+    LabelStrengthFClient,
+)
+
+
+@dataclass(frozen=True)
+class LabelSchema:
+    """A label of an annotation, with its sublabels, strengths and evidence"""
+
+    name: Enum  # member of the LabelNames Enum of the speaker, e.g. label_a
+    sublabels: Type[Enum]
+    strengths: Type[Enum]
+    default_sublabel: Optional[str] = None  # name of the preselected sublabel
+    default_strength: Optional[str] = None  # name of the preselected strength
+    comment_if_other: bool = True  # a comment is required if "other" is selected
+    evidence_range: bool = False  # the evidence is a range of events (start and end)
+
+    @property
+    def letter(self) -> str:
+        """The letter of the label, which ends the names of its fields"""
+        return self.name.name[-1]
+
+
+@dataclass(frozen=True)
+class SpeakerSchema:
+    """The labels annotated for a speaker, in the order of the form"""
+
+    speaker: Speaker
+    labels: tuple
+    submit: bool = True  # the form has a submit field
+
+
+ANNOTATION_SCHEMA = {
+    Speaker.client: SpeakerSchema(
+        Speaker.client,
+        (
+            LabelSchema(
+                LabelNamesClient.label_a, SubLabelsAClient, LabelStrengthAClient
+            ),
+            LabelSchema(
+                LabelNamesClient.label_b, SubLabelsBClient, LabelStrengthBClient
+            ),
+            LabelSchema(
+                LabelNamesClient.label_c, SubLabelsCClient, LabelStrengthCClient
+            ),
+            LabelSchema(
+                LabelNamesClient.label_d, SubLabelsDClient, LabelStrengthDClient
+            ),
+            LabelSchema(
+                LabelNamesClient.label_e, SubLabelsEClient, LabelStrengthEClient
+            ),
+            LabelSchema(
+                LabelNamesClient.label_f,
+                SubLabelsFClient,
+                LabelStrengthFClient,
+                default_sublabel=SubLabelsFClient.no_change.name,
+                default_strength=LabelStrengthFClient.no_change.name,
+                comment_if_other=False,
+                evidence_range=True,
+            ),
+        ),
+    ),
+    Speaker.therapist: SpeakerSchema(
+        Speaker.therapist,
+        (
+            LabelSchema(
+                LabelNamesTherapist.label_a,
+                SubLabelsATherapist,
+                LabelStrengthATherapist,
+            ),
+            LabelSchema(
+                LabelNamesTherapist.label_b,
+                SubLabelsBTherapist,
+                LabelStrengthBTherapist,
+            ),
+            LabelSchema(
+                LabelNamesTherapist.label_c,
+                SubLabelsCTherapist,
+                LabelStrengthCTherapist,
+            ),
+            LabelSchema(
+                LabelNamesTherapist.label_d,
+                SubLabelsDTherapist,
+                LabelStrengthDTherapist,
+            ),
+            LabelSchema(
+                LabelNamesTherapist.label_e,
+                SubLabelsETherapist,
+                LabelStrengthETherapist,
+            ),
+        ),
+    ),
+    Speaker.dyad: SpeakerSchema(
+        Speaker.dyad,
+        (
+            LabelSchema(LabelNamesDyad.label_a, SubLabelsADyad, LabelStrengthADyad),
+            LabelSchema(LabelNamesDyad.label_b, SubLabelsBDyad, LabelStrengthBDyad),
+        ),
+        submit=False,  # the template of the dyad form has its own submit input
+    ),
+}
+
+
+def evidence_field_names(schema: SpeakerSchema) -> tuple:
+    """The names of the fields of a form whose choices are the events of the page"""
+    names = []
+    for label in schema.labels:
+        if label.evidence_range:
+            names += ["start_event_" + label.letter, "end_event_" + label.letter]
+        else:
+            names.append("relevant_events_" + label.letter)
+    return tuple(names)
+
+
+EVIDENCE_FIELDS = {
+    speaker: evidence_field_names(schema)
+    for speaker, schema in ANNOTATION_SCHEMA.items()
+}
@@ -0,0 +1,225 @@
+"""
+Annotation view of the social media datasets.
+The posts of a dataset are shown in the order of the timelines (user, timeline, date),
+a page at a time, with keyset pagination: a page starts after (or ends before) the key
+of a post, so that a page is a range scan of the index on (id_dataset, user_id,
+timeline_id, date, id) of sm_post, however far into the dataset it is.
+The replies to the posts on a page, and the annotations of the annotator, are each
+loaded with one query (IN the ids of the posts on the page).
+The timelines of a dataset (sm_timeline, filled at upload) are used for the navigation
+between the timelines, and a page can be limited to the posts of one timeline: a page
+only loads the timelines of its posts, and the timelines before and after the one shown.
+"""
+import base64
+import json
+from datetime import datetime
+from sqlalchemy.orm import selectinload
+from app import db
+from app.annotate.utils import get_annotated_dataset
+from app.models import SMAnnotation, SMPost, SMTimeline
+from app.utils import SMAnnotationType
+
+
+def post_key(post: SMPost) -> tuple:
+    """The sort key of a post: (user_id, timeline_id, date, id)"""
+    return post.user_id, post.timeline_id, post.date, post.id
+
+
+def encode_cursor(post: SMPost) -> str:
+    """Cursor of a page of posts starting after or ending before this post"""
+    user_id, timeline_id, date, id_post = post_key(post)
+    key = json.dumps([user_id, timeline_id, date.isoformat(), id_post])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Sort key of the post in a cursor, raises ValueError if invalid"""
+    try:
+        user_id, timeline_id, date, id_post = json.loads(
+            base64.urlsafe_b64decode(cursor.encode())
+        )
+        return (
+            str(user_id),
+            str(timeline_id),
+            datetime.fromisoformat(date),
+            int(id_post),
+        )
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor: " + cursor) from e
+
+
+def get_posts_page(
+    id_dataset: int,
+    after: str = None,
+    before: str = None,
+    limit: int = 20,
+    timeline: SMTimeline = None,
+) -> tuple:
+    """
+    Get a page of posts of a social media dataset, with their replies.
+
+    Parameters
+    ----------
+    id_dataset : int
+        The id of the dataset
+    after : str, optional
+        Cursor of the previous page (next_cursor): the page starts after this post
+    before : str, optional
+        Cursor of the next page (prev_cursor): the page ends before this post
+    limit : int
+        The number of posts per page
+    timeline : SMTimeline, optional
+        Only the posts of this timeline
+
+    Returns
+    -------
+    posts : list
+        The posts on the page, in the order of the timelines, with their replies
+        in post.thread
+    prev_cursor : str
+        Cursor of the previous page, None if this is the first page
+    next_cursor : str
+        Cursor of the next page, None if this is the last page
+
+    Raises
+    ------
+    ValueError
+        If a cursor is not valid
+    """
+    key = db.tuple_(SMPost.user_id, SMPost.timeline_id, SMPost.date, SMPost.id)
+    query = (
+        db.select(SMPost)
+        .where(SMPost.id_dataset == id_dataset)
+        .options(selectinload(SMPost.thread))
+        .limit(limit + 1)
+    )
+    if timeline is not None:
+        query = query.where(
+            SMPost.timeline_id == timeline.timeline_id,
+            SMPost.user_id == timeline.user_id,
+        )
+    if before:
+        # the posts before the cursor, in reverse order, then put back in order
+        query = query.where(key < decode_cursor(before)).order_by(
+            SMPost.user_id.desc(),
+            SMPost.timeline_id.desc(),
+            SMPost.date.desc(),
+            SMPost.id.desc(),
+        )
+        posts = db.session.execute(query).scalars().all()
+        more = len(posts) > limit
+        posts = posts[:limit][::-1]
+        prev_cursor = encode_cursor(posts[0]) if more else None
+        next_cursor = encode_cursor(posts[-1]) if posts else None
+        return posts, prev_cursor, next_cursor
+    if after:
+        query = query.where(key > decode_cursor(after))
+    query = query.order_by(SMPost.user_id, SMPost.timeline_id, SMPost.date, SMPost.id)
+    posts = db.session.execute(query).scalars().all()
+    more = len(posts) > limit
+    posts = posts[:limit]
+    prev_cursor = encode_cursor(posts[0]) if after and posts else None
+    next_cursor = encode_cursor(posts[-1]) if more else None
+    return posts, prev_cursor, next_cursor
+
+
+def get_page_timelines(id_dataset: int, posts: list) -> dict:
+    """
+    Get the timelines of the posts on a page of a social media dataset, with one query
+    (IN the (user_id, timeline_id) of the posts), so that a page does not load all the
+    timelines of the dataset.
+    Returns a dict: (user_id, timeline_id) -> SMTimeline.
+    """
+    keys = sorted({(post.user_id, post.timeline_id) for post in posts})
+    if not keys:
+        return {}
+    query = db.select(SMTimeline).where(
+        SMTimeline.id_dataset == id_dataset,
+        db.tuple_(SMTimeline.user_id, SMTimeline.timeline_id).in_(keys),
+    )
+    return {
+        (timeline.user_id, timeline.timeline_id): timeline
+        for timeline in db.session.execute(query).scalars()
+    }
+
+
+def get_adjacent_timelines(timeline: SMTimeline) -> tuple:
+    """
+    Get the ids of the timelines before and after a timeline of a social media dataset,
+    in the order of the timelines, with keyset queries on (user_id, timeline_id)
+    (range scans of the unique index of sm_timeline).
+    Returns (id of the previous timeline, id of the next timeline), None if there is none.
+    """
+    key = db.tuple_(SMTimeline.user_id, SMTimeline.timeline_id)
+    current = (timeline.user_id, timeline.timeline_id)
+    query = (
+        db.select(SMTimeline.id)
+        .where(SMTimeline.id_dataset == timeline.id_dataset)
+        .limit(1)
+    )
+    previous = db.session.execute(
+        query.where(key < current).order_by(
+            SMTimeline.user_id.desc(), SMTimeline.timeline_id.desc()
+        )
+    ).scalar()
+    following = db.session.execute(
+        query.where(key > current).order_by(SMTimeline.user_id, SMTimeline.timeline_id)
+    ).scalar()
+    return previous, following
+
+
+def fetch_post_annotations(posts: list, id_user: int, id_dataset: int) -> dict:
+    """
+    Get the annotations of an annotator for the posts on a page of a dataset
+    (the posts can be shared by several datasets, see Dataset.id_content).
+    Returns a dict: post id -> list of annotations, newest first.
+    """
+    annotations = {post.id: [] for post in posts}
+    if not posts:
+        return annotations
+    query = (
+        db.select(SMAnnotation)
+        .where(SMAnnotation.id_sm_post.in_(list(annotations)))
+        .where(SMAnnotation.id_user == id_user)
+        .where(SMAnnotation.id_dataset == id_dataset)
+        .order_by(SMAnnotation.timestamp.desc(), SMAnnotation.id.desc())
+    )
+    for annotation in db.session.execute(query).scalars():
+        annotations[annotation.id_sm_post].append(annotation)
+    return annotations
+
+
+def save_sm_annotation(
+    id_sm_post: int,
+    id_user: int,
+    id_dataset: int,
+    annotation_type: str = None,
+    body: str = None,
+):
+    """
+    Write job for the write queue (see app/writer.py): add a new annotation of a social
+    media post to the database session. It takes IDs rather than database objects, so that
+    it can run in the writer thread, which has its own database session.
+
+    Parameters
+    ----------
+    id_sm_post : int
+        The id of the annotated post
+    id_user : int
+        The id of the annotator
+    id_dataset : int
+        The id of the annotated dataset (the post can be shared by several datasets)
+    annotation_type : str, optional
+        The name of the type of annotation (see SMAnnotationType)
+    body : str, optional
+        The text of the annotation
+    """
+    get_annotated_dataset(id_dataset)
+    annotation = SMAnnotation(
+        type=SMAnnotationType[annotation_type] if annotation_type else None,
+        body=body or None,
+        id_user=id_user,
+        id_sm_post=id_sm_post,
+        id_dataset=id_dataset,
+    )
+    db.session.add(annotation)
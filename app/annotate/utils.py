@@ -5,24 +5,30 @@ from typing import Union
 from datetime import datetime
 import itertools
 from flask import url_for
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from flask_login import current_user
-from app.utils import Speaker, LabelNamesClient, LabelNamesTherapist, LabelNamesDyad
-from sqlalchemy import desc
+from app.utils import Speaker
 from app.models import (
     PSAnnotationClient,
     PSAnnotationTherapist,
     PSAnnotationDyad,
-    EvidenceClient,
-    EvidenceTherapist,
-    EvidenceDyad,
     Dataset,
+    PSDialogTurn,
+    User,
+    PSAnnotationProgress,
+    PSAnnotatedSegment,
+    ANNOTATION_TABLES,
 )
 from app import db
+from app.annotate.projections import AnnotationValues, fetch_annotation_values
 from app.annotate.forms import (
+    ANNOTATION_FORMS,
     PSAnnotationFormClient,
     PSAnnotationFormTherapist,
     PSAnnotationFormDyad,
 )
+from app.annotate.schema import ANNOTATION_SCHEMA, EVIDENCE_FIELDS
 
 
 def split_dialog_turns(dialog_turns: list, time_interval: int = 300) -> list:
@@ -60,6 +66,167 @@ def split_dialog_turns(dialog_turns: list, time_interval: int = 300) -> list:
     return segments
 
 
+def count_segments(dataset: Dataset, time_interval: int = 300) -> int:
+    """
+    Count the segments (pages) of a psychotherapy dataset, see split_dialog_turns.
+    Only the timestamps of the dialog turns are loaded.
+    """
+    timestamps = db.session.execute(
+        db.select(PSDialogTurn.timestamp)
+        .where(PSDialogTurn.id_dataset == dataset.content_id)
+        .order_by(PSDialogTurn.timestamp)
+    ).all()  # rows with a timestamp attribute, like dialog turns
+    return len(split_dialog_turns(timestamps, time_interval))
+
+
+def segments_by_dialog_turn(id_content: int, time_interval: int = 300) -> dict:
+    """
+    The ids of the dialog turns of the segment (page) of each dialog turn of a
+    psychotherapy dataset, see split_dialog_turns. An annotation references its
+    segment by the first dialog turn of the segment (id_first_dialog_turn), and this
+    gives the dialog turns it is for. Only the ids and timestamps of the dialog turns
+    are loaded.
+
+    Parameters
+    ----------
+    id_content : int
+        The id of the dataset the dialog turns belong to (see Dataset.content_id)
+    time_interval : int
+        The time interval of a segment in seconds (default is 300, i.e. 5 minutes)
+
+    Returns
+    -------
+    segments : dict
+        The ids of the dialog turns of its segment (a tuple, in time order) by dialog turn id
+    """
+    dialog_turns = db.session.execute(
+        db.select(PSDialogTurn.id, PSDialogTurn.timestamp)
+        .where(PSDialogTurn.id_dataset == id_content)
+        .order_by(PSDialogTurn.timestamp)
+    ).all()
+    if not dialog_turns:
+        return {}
+    segments = {}
+    for segment in split_dialog_turns(dialog_turns, time_interval):
+        ids = tuple(dialog_turn.id for dialog_turn in segment)
+        for id_dialog_turn in ids:
+            segments[id_dialog_turn] = ids
+    return segments
+
+
+def insert_if_missing(model, **values) -> bool:
+    """
+    Insert a row into the table of a model, unless it conflicts with a row already there
+    (INSERT ... ON CONFLICT DO NOTHING), so that two concurrent transactions inserting
+    the same row do not fail with an IntegrityError.
+    Returns True if the row was inserted.
+    """
+    if db.session.get_bind().dialect.name == "postgresql":
+        insert = pg_insert
+    else:
+        insert = sqlite_insert
+    result = db.session.execute(
+        insert(model.__table__).values(**values).on_conflict_do_nothing()
+    )
+    return result.rowcount == 1
+
+
+def update_annotation_progress(
+    dataset: Dataset, author: User, speaker: Speaker, page: int
+):
+    """
+    Update the annotation progress of the user for the dataset and the speaker
+    (PSAnnotationProgress) when a segment (page) is annotated.
+    Nothing changes if the user already annotated this segment for the speaker.
+    If the segment is the first one not annotated yet, the next one is looked up
+    (one primary key lookup per segment annotated already).
+    The rows are inserted with ON CONFLICT DO NOTHING and the number of segments is
+    incremented in SQL, so that concurrent saves of the same segment (e.g. a double
+    click) count it once instead of failing.
+    The changes are added to the database session, in the same transaction as the annotation.
+    """
+    key = dict(id_dataset=dataset.id, id_user=author.id, speaker=speaker)
+    if not insert_if_missing(PSAnnotatedSegment, page=page, **key):
+        return  # already annotated
+    insert_if_missing(PSAnnotationProgress, n_segments_annotated=0, next_page=1, **key)
+    table = PSAnnotationProgress.__table__
+    where = [table.c[name] == value for name, value in key.items()]
+    db.session.execute(
+        db.update(table)
+        .where(*where)
+        .values(n_segments_annotated=table.c.n_segments_annotated + 1)
+    )
+    if db.session.execute(db.select(table.c.next_page).where(*where)).scalar() == page:
+        next_page = page + 1
+        while db.session.get(
+            PSAnnotatedSegment, (dataset.id, author.id, speaker, next_page)
+        ):
+            next_page += 1
+        db.session.execute(
+            db.update(table)
+            .where(*where, table.c.next_page == page)
+            .values(next_page=next_page)
+        )
+
+
+def rebuild_annotation_progress(dataset: Dataset, time_interval: int = 300):
+    """
+    Compute the number of segments and the annotation progress of all the users
+    of a psychotherapy dataset from its annotations, e.g. for datasets annotated before
+    the progress was recorded, or after PS_MINS_PER_PAGE was changed.
+    The changes are added to the database session.
+    """
+    dialog_turns = db.session.execute(
+        db.select(PSDialogTurn.id, PSDialogTurn.timestamp)
+        .where(PSDialogTurn.id_dataset == dataset.content_id)
+        .order_by(PSDialogTurn.timestamp)
+    ).all()
+    segments = split_dialog_turns(dialog_turns, time_interval)
+    dataset.n_segments = len(segments)
+    pages = {
+        dialog_turn.id: page
+        for page, segment in enumerate(segments, start=1)
+        for dialog_turn in segment
+    }
+    PSAnnotatedSegment.query.filter_by(id_dataset=dataset.id).delete()
+    PSAnnotationProgress.query.filter_by(id_dataset=dataset.id).delete()
+    annotated = set()  # (user id, speaker, page)
+    for speaker, model in [
+        (Speaker.client, PSAnnotationClient),
+        (Speaker.therapist, PSAnnotationTherapist),
+        (Speaker.dyad, PSAnnotationDyad),
+    ]:
+        annotations = db.session.execute(
+            db.select(model.id_user, model.id_first_dialog_turn).where(
+                model.id_dataset == dataset.id,
+                model.id_first_dialog_turn.is_not(None),
+            )
+        )
+        for id_user, id_dialog_turn in annotations:
+            annotated.add((id_user, speaker, pages[id_dialog_turn]))
+    progress = {}  # (user id, speaker) -> set of pages
+    for id_user, speaker, page in annotated:
+        progress.setdefault((id_user, speaker), set()).add(page)
+        db.session.add(
+            PSAnnotatedSegment(
+                id_dataset=dataset.id, id_user=id_user, speaker=speaker, page=page
+            )
+        )
+    for (id_user, speaker), user_pages in progress.items():
+        next_page = 1
+        while next_page in user_pages:
+            next_page += 1
+        db.session.add(
+            PSAnnotationProgress(
+                id_dataset=dataset.id,
+                id_user=id_user,
+                speaker=speaker,
+                n_segments_annotated=len(user_pages),
+                next_page=next_page,
+            )
+        )
+
+
 def get_events_from_segments(segments: list) -> list:
     """
     Get the events corresponding to each segment of dialog turns.
@@ -145,8 +312,8 @@ def get_page_items(page: int, events: list, dataset_id: int):
 
 
 def fetch_dialog_turn_annotations(
-    dialog_turns: list, speaker: Speaker
-) -> Union[None, PSAnnotationClient, PSAnnotationTherapist, PSAnnotationDyad]:
+    dialog_turns: list, speaker: Speaker, id_dataset: int
+) -> Union[None, AnnotationValues]:
     """
     Fetch the annotations for the dialog turns from the database and
     only return the annotation with the latest timestamp.
@@ -157,298 +324,174 @@ def fetch_dialog_turn_annotations(
         A list of PSDialogTurn objects
     speaker : Speaker
         The speaker the annotation is for (client, therapist or dyad)
+    id_dataset : int
+        The id of the annotated dataset (the dialog turns can be shared by several datasets)
 
     Returns
     -------
-    annotation : PSAnnotationClient or PSAnnotationTherapist or PSAnnotationDyad or None
-        The annotation with the latest timestamp for the client, therapist or dyad if it exists, otherwise None.
-        The "label_*" and "strength_*" attributes are converted to their corresponding Enum values.
-    """
-
-    annotations = []
-    if speaker == Speaker.client:
-        for dialog_turn in dialog_turns:
-            annotation = (
-                dialog_turn.annotations_client.filter_by(id_user=current_user.id)
-                .order_by(desc("timestamp"))
-                .first()
-            )  # for this dialog turn, get the annotation for the client with the latest timestamp
-            if annotation:
-                annotations.append(annotation)
-    elif speaker == Speaker.therapist:
-        for dialog_turn in dialog_turns:
-            annotation = (
-                dialog_turn.annotations_therapist.filter_by(id_user=current_user.id)
-                .order_by(desc("timestamp"))
-                .first()
-            )  # for this dialog turn, get the annotation for the therapist with the latest timestamp
-            if annotation:
-                annotations.append(annotation)
-    elif speaker == Speaker.dyad:
-        for dialog_turn in dialog_turns:
-            annotation = (
-                dialog_turn.annotations_dyad.filter_by(id_user=current_user.id)
-                .order_by(desc("timestamp"))
-                .first()
-            )  # for this dialog turn, get the annotation for the dyad with the latest timestamp
-            if annotation:
-                annotations.append(annotation)
-    if annotations:
-        # sort the annotations by timestamp in ascending order and get the last one
-        annotations.sort(key=lambda x: x.timestamp)
-        annotation = annotations[-1]
-        # convert the "label_*" and "strength_*" attributes to their corresponding Enum names
-        # this is needed so that the annotations form can be pre-populated correctly
-        for attr in annotation.__dict__.keys():
-            if attr.startswith("label_") and getattr(annotation, attr) is not None:
-                setattr(annotation, attr, getattr(annotation, attr).name)
-            elif attr.startswith("strength_") and getattr(annotation, attr) is not None:
-                setattr(annotation, attr, getattr(annotation, attr).name)
-    else:
-        annotation = None
-    return annotation
+    annotation : AnnotationValues or None
+        The values of the annotation with the latest timestamp for the client, therapist
+        or dyad if it exists, otherwise None. The "label_*" and "strength_*" values are
+        the names of their Enum members. The values are read-only copies (see
+        app/annotate/projections.py), so the annotation is not changed in the session.
+    """
+    return fetch_annotation_values(
+        [dialog_turn.id for dialog_turn in dialog_turns],
+        speaker,
+        id_dataset,
+        current_user.id,
+    )
+
+
+def annotation_form_data(
+    form: Union[
+        PSAnnotationFormClient, PSAnnotationFormTherapist, PSAnnotationFormDyad
+    ],
+) -> dict:
+    """
+    The data of a (validated) psychotherapy annotation form, by field name: the labels,
+    strengths, comments and evidence events, without the CSRF token and the submit button.
+    These are plain values, read in the request, which are passed to the write job
+    (see save_dialog_turn_annotation) instead of the form.
+    """
+    return {
+        name: value
+        for name, value in form.data.items()
+        if name not in ("csrf_token", "submit")
+    }
 
 
 def new_dialog_turn_annotation_to_db(
-    form: Union[PSAnnotationClient, PSAnnotationFormTherapist, PSAnnotationFormDyad],
+    data: dict,
     speaker: Speaker,
     dataset: Dataset,
-    dialog_turns: list,
+    id_first_dialog_turn: int,
+    author: User = None,
+    page: int = None,
 ):
     """
     Create a new psychotherapy dialog turn annotation object and add it to the database session.
+    The annotation references its segment by the first dialog turn of the segment,
+    so one row is written whatever the number of dialog turns in the segment.
+    Its columns and evidence are those of the labels of the annotation schema of the
+    speaker (see app/annotate/schema.py).
 
     Parameters
     ----------
-    form : PSAnnotationFormClient or PSAnnotationFormTherapist or PSAnnotationFormDyad
-        The form containing the annotation data
+    data : dict
+        The annotation data, by field name of the annotation form (see annotation_form_data)
     speaker : Speaker
         The speaker the annotation is for (client, therapist or dyad)
     dataset : Dataset
         The dataset object the annotation is for
-    dialog_turns : list of PSDialogTurn objects
-        The dialog turns the annotation is for
-    """
-    if speaker == Speaker.client:
-        annotation = PSAnnotationClient(
-            label_a=form.label_a.data,
-            label_b=form.label_b.data,
-            label_c=form.label_c.data,
-            label_d=form.label_d.data,
-            label_e=form.label_e.data,
-            label_f=form.label_f.data,
-            strength_a=form.strength_a.data,
-            strength_b=form.strength_b.data,
-            strength_c=form.strength_c.data,
-            strength_d=form.strength_d.data,
-            strength_e=form.strength_e.data,
-            strength_f=form.strength_f.data,
-            comment_a=form.comment_a.data,
-            comment_b=form.comment_b.data,
-            comment_c=form.comment_c.data,
-            comment_d=form.comment_d.data,
-            comment_e=form.comment_e.data,
-            comment_f=form.comment_f.data,
-            comment_summary=form.comment_summary.data,
-            author=current_user,
-            dataset=dataset,
-        )
-        for dialog_turn in dialog_turns:
-            annotation.dialog_turns.append(dialog_turn)
-        db.session.add(annotation)
-        new_client_evidence_events_to_db(form, annotation)
-    elif speaker == Speaker.therapist:
-        annotation = PSAnnotationTherapist(
-            label_a=form.label_a.data,
-            label_b=form.label_b.data,
-            label_c=form.label_c.data,
-            label_d=form.label_d.data,
-            label_e=form.label_e.data,
-            strength_a=form.strength_a.data,
-            strength_b=form.strength_b.data,
-            strength_c=form.strength_c.data,
-            strength_d=form.strength_d.data,
-            strength_e=form.strength_e.data,
-            comment_a=form.comment_a.data,
-            comment_b=form.comment_b.data,
-            comment_c=form.comment_c.data,
-            comment_d=form.comment_d.data,
-            comment_e=form.comment_e.data,
-            comment_summary=form.comment_summary.data,
-            author=current_user,
-            dataset=dataset,
-        )
-        for dialog_turn in dialog_turns:
-            annotation.dialog_turns.append(dialog_turn)
-        db.session.add(annotation)
-        new_therapist_evidence_events_to_db(form, annotation)
-    elif speaker == Speaker.dyad:
-        annotation = PSAnnotationDyad(
-            label_a=form.label_a.data,
-            label_b=form.label_b.data,
-            strength_a=form.strength_a.data,
-            strength_b=form.strength_b.data,
-            comment_a=form.comment_a.data,
-            comment_b=form.comment_b.data,
-            comment_summary=form.comment_summary.data,
-            author=current_user,
-            dataset=dataset,
-        )
-        for dialog_turn in dialog_turns:
-            annotation.dialog_turns.append(dialog_turn)
-        db.session.add(annotation)
-        new_dyad_evidence_events_to_db(form, annotation)
+    id_first_dialog_turn : int
+        The id of the first dialog turn of the segment the annotation is for
+    author : User
+        The annotator (default is the logged in user)
+    page : int, optional
+        The page (segment) the dialog turns are on, used to update the annotation progress
+    """
+    if author is None:
+        author = current_user
+    if page is not None:
+        update_annotation_progress(dataset, author, speaker, page)
+    model = ANNOTATION_TABLES[speaker][0]
+    columns = {"comment_summary": data["comment_summary"]}
+    for label in ANNOTATION_SCHEMA[speaker].labels:
+        for prefix in ["label_", "strength_", "comment_"]:
+            columns[prefix + label.letter] = data[prefix + label.letter]
+    annotation = model(
+        **columns,
+        author=author,
+        dataset=dataset,
+        id_first_dialog_turn=id_first_dialog_turn,
+    )
+    db.session.add(annotation)
+    new_evidence_events_to_db(data, speaker, annotation)
 
 
-def new_client_evidence_events_to_db(
-    form: PSAnnotationFormClient, annotation: PSAnnotationClient
-):
+def get_annotated_dataset(id_dataset: int) -> Dataset:
     """
-    Given a new annotation for the client, add the evidence
-    events of the form to the database session.
+    Load the dataset of an annotation write, with a shared lock of its row on PostgreSQL,
+    so that the write is serialized with the mark of a dataset being deleted
+    (see mark_deleting in app/admin/delete.py). Raises ValueError if the dataset
+    is being deleted, since the annotation would not be archived.
     """
+    dataset = db.session.get(Dataset, id_dataset, with_for_update={"read": True})
+    if dataset is None or dataset.deleting:
+        raise ValueError("dataset {} is being deleted".format(id_dataset))
+    return dataset
 
-    events_a = form.relevant_events_a.data  # these are events IDs
-    events_b = form.relevant_events_b.data
-    events_c = form.relevant_events_c.data
-    events_d = form.relevant_events_d.data
-    events_e = form.relevant_events_e.data
-    start_event_f = form.start_event_f.data
-    end_event_f = form.end_event_f.data
 
-    evidences = []
-    for event in events_a:
-        evidence = EvidenceClient(
-            annotation=annotation,
-            id_ps_dialog_event=event,
-            label=LabelNamesClient.label_a,
-        )
-        evidences.append(evidence)
-    for event in events_b:
-        evidence = EvidenceClient(
-            annotation=annotation,
-            id_ps_dialog_event=event,
-            label=LabelNamesClient.label_b,
-        )
-        evidences.append(evidence)
-    for event in events_c:
-        evidence = EvidenceClient(
-            annotation=annotation,
-            id_ps_dialog_event=event,
-            label=LabelNamesClient.label_c,
-        )
-        evidences.append(evidence)
-    for event in events_d:
-        evidence = EvidenceClient(
-            annotation=annotation,
-            id_ps_dialog_event=event,
-            label=LabelNamesClient.label_d,
-        )
-        evidences.append(evidence)
-    for event in events_e:
-        evidence = EvidenceClient(
-            annotation=annotation,
-            id_ps_dialog_event=event,
-            label=LabelNamesClient.label_e,
-        )
-        evidences.append(evidence)
-    if start_event_f and end_event_f:
-        for event in range(start_event_f, end_event_f + 1):
-            evidence = EvidenceClient(
-                annotation=annotation,
-                id_ps_dialog_event=event,
-                label=LabelNamesClient.label_f,
-            )
-            evidences.append(evidence)
-    db.session.add_all(evidences)
-
-
-def new_therapist_evidence_events_to_db(
-    form: PSAnnotationFormTherapist, annotation: PSAnnotationTherapist
+def save_dialog_turn_annotation(
+    data: dict,
+    speaker: Speaker,
+    id_dataset: int,
+    id_first_dialog_turn: int,
+    id_user: int,
+    page: int = None,
 ):
     """
-    Given a new annotation for the therapist, add the evidence
-    events of the form to the database session.
-    """
-
-    events_a = form.relevant_events_a.data  # these are events IDs
-    events_b = form.relevant_events_b.data
-    events_c = form.relevant_events_c.data
-    events_d = form.relevant_events_d.data
-    events_e = form.relevant_events_e.data
+    Write job for the write queue (see app/writer.py): add a new psychotherapy dialog turn
+    annotation to the database session. It takes IDs and the data of the form rather than
+    database objects and the form, so that it can run in the writer thread, which has its
+    own database session.
 
-    evidences = []
-    for event in events_a:
-        evidence = EvidenceTherapist(
-            annotation=annotation,
-            id_ps_dialog_event=event,
-            label=LabelNamesTherapist.label_a,
-        )
-        evidences.append(evidence)
-    for event in events_b:
-        evidence = EvidenceTherapist(
-            annotation=annotation,
-            id_ps_dialog_event=event,
-            label=LabelNamesTherapist.label_b,
-        )
-        evidences.append(evidence)
-    for event in events_c:
-        evidence = EvidenceTherapist(
-            annotation=annotation,
-            id_ps_dialog_event=event,
-            label=LabelNamesTherapist.label_c,
-        )
-        evidences.append(evidence)
-    for event in events_d:
-        evidence = EvidenceTherapist(
-            annotation=annotation,
-            id_ps_dialog_event=event,
-            label=LabelNamesTherapist.label_d,
-        )
-        evidences.append(evidence)
-    for event in events_e:
-        evidence = EvidenceTherapist(
-            annotation=annotation,
-            id_ps_dialog_event=event,
-            label=LabelNamesTherapist.label_e,
-        )
-        evidences.append(evidence)
-    db.session.add_all(evidences)
+    Parameters
+    ----------
+    data : dict
+        The data of the (validated) annotation form (see annotation_form_data)
+    speaker : Speaker
+        The speaker the annotation is for (client, therapist or dyad)
+    id_dataset : int
+        The id of the dataset the annotation is for
+    id_first_dialog_turn : int
+        The id of the first dialog turn of the segment the annotation is for
+    id_user : int
+        The id of the annotator
+    page : int, optional
+        The page (segment) the dialog turns are on, used to update the annotation progress
+    """
+    dataset = get_annotated_dataset(id_dataset)
+    author = db.session.get(User, id_user)
+    new_dialog_turn_annotation_to_db(
+        data, speaker, dataset, id_first_dialog_turn, author, page
+    )
 
 
-def new_dyad_evidence_events_to_db(
-    form: PSAnnotationFormDyad, annotation: PSAnnotationDyad
+def new_evidence_events_to_db(
+    data: dict,
+    speaker: Speaker,
+    annotation: Union[PSAnnotationClient, PSAnnotationTherapist, PSAnnotationDyad],
 ):
     """
-    Given a new annotation for the dyad, add the evidence
-    events of the form to the database session.
+    Given a new annotation, add the evidence events of its data (see
+    annotation_form_data) to the database session: the events selected for each label,
+    or all the events from the start to the end event if its evidence is a range.
     """
-
-    events_a = form.relevant_events_a.data  # these are events IDs
-    events_b = form.relevant_events_b.data
-
+    evidence_model = ANNOTATION_TABLES[speaker][1]
     evidences = []
-    for event in events_a:
-        evidence = EvidenceDyad(
-            annotation=annotation,
-            id_ps_dialog_event=event,
-            label=LabelNamesDyad.label_a,
-        )
-        evidences.append(evidence)
-    for event in events_b:
-        evidence = EvidenceDyad(
-            annotation=annotation,
-            id_ps_dialog_event=event,
-            label=LabelNamesDyad.label_b,
-        )
-        evidences.append(evidence)
+    for label in ANNOTATION_SCHEMA[speaker].labels:
+        if label.evidence_range:
+            start_event = data["start_event_" + label.letter]
+            end_event = data["end_event_" + label.letter]
+            events = []
+            if start_event and end_event:
+                events = range(start_event, end_event + 1)
+        else:
+            events = data["relevant_events_" + label.letter]  # these are events IDs
+        for event in events:
+            evidence = evidence_model(
+                annotation=annotation,
+                id_ps_dialog_event=event,
+                label=label.name,
+            )
+            evidences.append(evidence)
     db.session.add_all(evidences)
 
 
 def create_psy_annotation_form(
-    annotations: Union[
-        PSAnnotationClient, PSAnnotationTherapist, PSAnnotationDyad, None
-    ],
+    annotations: Union[AnnotationValues, None],
     speaker: Speaker,
 ) -> Union[PSAnnotationFormClient, PSAnnotationFormTherapist, PSAnnotationFormDyad]:
     """
@@ -457,8 +500,9 @@ def create_psy_annotation_form(
 
     Parameters
     ----------
-    annotations : PSAnnotationClient or PSAnnotationTherapist or PSAnnotationDyad or None
-        The annotations object for the client, therapist or dyad if it exists, otherwise None
+    annotations : AnnotationValues or None
+        The values of the annotation for the client, therapist or dyad if it exists,
+        otherwise None (see fetch_dialog_turn_annotations)
     speaker : Speaker
         The speaker the annotation is for (client, therapist or dyad)
 
@@ -468,65 +512,12 @@ def create_psy_annotation_form(
         The annotation form, either pre-populated with previous annotation values or empty (if there are no annotations)
     """
 
-    if speaker == Speaker.client:
-        if annotations:
-            # if there are annotations, fill the form with the values
-            (
-                id_events_a,
-                id_events_b,
-                id_events_c,
-                id_events_d,
-                id_events_e,
-                id_start_event_f,
-                id_end_event_f,
-            ) = fetch_evidence_client(annotations)
-            form = PSAnnotationFormClient(
-                obj=annotations,
-                relevant_events_a=id_events_a,
-                relevant_events_b=id_events_b,
-                relevant_events_c=id_events_c,
-                relevant_events_d=id_events_d,
-                relevant_events_e=id_events_e,
-                start_event_f=id_start_event_f,
-                end_event_f=id_end_event_f,
-            )
-        else:
-            # if there are no annotations, create an empty form
-            form = PSAnnotationFormClient()
-    elif speaker == Speaker.therapist:
-        if annotations:
-            # if there are annotations, fill the form with the values
-            (
-                id_events_a,
-                id_events_b,
-                id_events_c,
-                id_events_d,
-                id_events_e,
-            ) = fetch_evidence_therapist(annotations)
-            form = PSAnnotationFormTherapist(
-                obj=annotations,
-                relevant_events_a=id_events_a,
-                relevant_events_b=id_events_b,
-                relevant_events_c=id_events_c,
-                relevant_events_d=id_events_d,
-                relevant_events_e=id_events_e,
-            )
-        else:
-            # if there are no annotations, create an empty form
-            form = PSAnnotationFormTherapist()
-    elif speaker == Speaker.dyad:
-        if annotations:
-            # if there are annotations, fill the form with the values
-            (id_events_a, id_events_b) = fetch_evidence_dyad(annotations)
-            form = PSAnnotationFormDyad(
-                obj=annotations,
-                relevant_events_a=id_events_a,
-                relevant_events_b=id_events_b,
-            )
-        else:
-            # if there are no annotations, create an empty form
-            form = PSAnnotationFormDyad()
-    return form
+    form_class = ANNOTATION_FORMS[speaker]  # compiled from the annotation schema
+    if annotations:
+        # if there are annotations, fill the form with the values
+        return form_class(data=annotations.form_data())
+    # if there are no annotations, create an empty form
+    return form_class()
 
 
 def get_dynamic_choices(page_items: list, speaker: Speaker) -> list:
@@ -549,23 +540,14 @@ def get_dynamic_choices(page_items: list, speaker: Speaker) -> list:
         for the select fields
     """
 
-    if speaker == Speaker.client:
-        choices = [
-            (item.id, item.event_n)
-            for item in page_items
-            if item.event_speaker.lower() == "client"
-        ]
-    elif speaker == Speaker.therapist:
-        choices = [
-            (item.id, item.event_n)
-            for item in page_items
-            if item.event_speaker.lower() == "therapist"
-        ]
-    elif speaker == Speaker.dyad:
-        choices = [
-            (item.id, item.event_n) for item in page_items
-        ]  # all events are shown for the dyad
-    return choices
+    if speaker == Speaker.dyad:
+        # all events are shown for the dyad
+        return [(item.id, item.event_n) for item in page_items]
+    return [
+        (item.id, item.event_n)
+        for item in page_items
+        if item.event_speaker.lower() == speaker.value
+    ]
 
 
 def assign_dynamic_choices(
@@ -590,154 +572,11 @@ def assign_dynamic_choices(
     Returns
     -------
     form : PSAnnotationFormClient or PSAnnotationFormTherapist or PSAnnotationFormDyad
-        The annotation form with the dynamic choices assigned to the select fields or select
-        multiple fields that start with "start_event_", "end_event_" or "relevant_events_"
+        The annotation form with the dynamic choices assigned to its evidence fields
+        (the "relevant_events_", "start_event_" and "end_event_" fields of the schema)
     """
 
     choices = get_dynamic_choices(page_items, speaker)
-    # find the select multiple field(s) in the form. They all start with "relevant_events_",
-    # "start_event_" or "end_event_"
-    for field_name in form.__dict__.keys():
-        if (
-            field_name.startswith("relevant_events_")
-            or field_name.startswith("start_event_")
-            or field_name.startswith("end_event_")
-        ):
-            form[field_name].choices = choices
+    for field_name in EVIDENCE_FIELDS[speaker]:
+        form[field_name].choices = choices
     return form
-
-
-def fetch_evidence_client(annotation: PSAnnotationClient):
-    """
-    Given a client annotation, fetch the evidence events from the database
-    and return them as a list of event IDs.
-
-    Parameters
-    ----------
-    annotation : PSAnnotationClient
-        The annotation object for the client
-
-    Returns
-    -------
-    Lists of event IDs for the evidence events for each label and the start
-    and end event IDs for label F
-    """
-
-    evidence = annotation.evidence
-
-    label_names = [
-        LabelNamesClient.label_a,
-        LabelNamesClient.label_b,
-        LabelNamesClient.label_c,
-        LabelNamesClient.label_d,
-        LabelNamesClient.label_e,
-    ]
-
-    events = {}
-    for label in label_names:
-        filtered_events = evidence.filter_by(label=label).all()
-        if filtered_events:
-            events[label] = [event.id_ps_dialog_event for event in filtered_events]
-        else:
-            events[label] = []
-
-    ordered_events_f = (
-        evidence.filter_by(label=LabelNamesClient.label_f)
-        .order_by("id_ps_dialog_event")
-        .all()
-    )
-
-    id_start_event_f = (
-        ordered_events_f[0].id_ps_dialog_event if ordered_events_f else None
-    )
-    id_end_event_f = (
-        ordered_events_f[-1].id_ps_dialog_event if ordered_events_f else None
-    )
-
-    return (
-        events[LabelNamesClient.label_a],
-        events[LabelNamesClient.label_b],
-        events[LabelNamesClient.label_c],
-        events[LabelNamesClient.label_d],
-        events[LabelNamesClient.label_e],
-        id_start_event_f,
-        id_end_event_f,
-    )
-
-
-def fetch_evidence_therapist(annotation: PSAnnotationTherapist):
-    """
-    Given a therapist annotation, fetch the evidence events from the database
-    and return them as a list of event IDs.
-
-    Parameters
-    ----------
-    annotation : PSAnnotationTherapist
-        The annotation object for the therapist
-
-    Returns
-    -------
-    Lists of event IDs for the evidence events for each label
-    """
-
-    evidence = annotation.evidence
-
-    label_names = [
-        LabelNamesTherapist.label_a,
-        LabelNamesTherapist.label_b,
-        LabelNamesTherapist.label_c,
-        LabelNamesTherapist.label_d,
-        LabelNamesTherapist.label_e,
-    ]
-
-    events = {}
-    for label in label_names:
-        filtered_events = evidence.filter_by(label=label).all()
-        if filtered_events:
-            events[label] = [event.id_ps_dialog_event for event in filtered_events]
-        else:
-            events[label] = []
-
-    return (
-        events[LabelNamesTherapist.label_a],
-        events[LabelNamesTherapist.label_b],
-        events[LabelNamesTherapist.label_c],
-        events[LabelNamesTherapist.label_d],
-        events[LabelNamesTherapist.label_e],
-    )
-
-
-def fetch_evidence_dyad(annotation: PSAnnotationDyad):
-    """
-    Given a dyad annotation, fetch the evidence events from the database
-    and return them as a list of event IDs.
-
-    Parameters
-    ----------
-    annotation : PSAnnotationDyad
-        The annotation object for the dyad
-
-    Returns
-    -------
-    Lists of event IDs for the evidence events for each label
-    """
-
-    evidence = annotation.evidence
-
-    label_names = [
-        LabelNamesDyad.label_a,
-        LabelNamesDyad.label_b,
-    ]
-
-    events = {}
-    for label in label_names:
-        filtered_events = evidence.filter_by(label=label).all()
-        if filtered_events:
-            events[label] = [event.id_ps_dialog_event for event in filtered_events]
-        else:
-            events[label] = []
-
-    return (
-        events[LabelNamesDyad.label_a],
-        events[LabelNamesDyad.label_b],
-    )
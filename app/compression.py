@@ -0,0 +1,183 @@
+"""
+Optional compressed storage of the text of the transcripts and posts (see COMPRESS_TEXT
+in config.py), on SQLite. PostgreSQL already compresses large values itself (TOAST).
+The texts of a dataset are compressed with zlib, each one separately, with a preset
+dictionary trained on the texts of the dataset (see build_dictionary): short texts
+compress well because they share the dictionary. A compressed text is stored as a BLOB:
+a version byte, the key of its dictionary and the raw deflate stream. The dictionaries
+are stored once, by key (the start of their SHA-256), in the "text_dictionary" table.
+The columns with compressed texts (CompressedText) are decompressed by the database,
+with the decompress_text function registered on every SQLite connection, so only the
+texts actually selected are decompressed, and the texts stored before compression was
+enabled (or too short to compress) are still plain text.
+The compression of the datasets is in app/upload/compress.py.
+"""
+import functools
+import hashlib
+import re
+import threading
+import zlib
+from collections import Counter
+from sqlalchemy import Text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import TypeDecorator
+
+FORMAT_VERSION = b"\x01"
+KEY_SIZE = 8  # bytes of the SHA-256 of a dictionary used as its key
+HEADER_SIZE = len(FORMAT_VERSION) + KEY_SIZE
+DICTIONARY_SIZE = 32 * 1024  # the size of the deflate window
+SAMPLE_SIZE = 20000  # number of texts a dictionary is trained on
+# the phrases of up to 3 words starting at each word (overlapping)
+PHRASES = re.compile(r"\b(?=(\w+(?:\W+\w+){0,2}\W*))")
+
+# dictionaries by key, they never change (in each process)
+_dictionaries = {}
+_dictionaries_lock = threading.Lock()
+
+
+def build_dictionary(texts: list, size: int = DICTIONARY_SIZE) -> bytes:
+    """
+    Train a zlib preset dictionary on texts: the phrases (up to 3 words) which save
+    the most bytes (length x number of occurrences in a sample of the texts), the most
+    useful at the end (deflate finds the nearest matches with the shortest codes).
+    """
+    step = max(1, len(texts) // SAMPLE_SIZE)
+    counts = Counter()
+    for text in texts[::step]:
+        counts.update(PHRASES.findall(text))
+    phrases = []
+    n_bytes = 0
+    for phrase, count in sorted(
+        counts.items(), key=lambda item: -len(item[0].encode()) * item[1]
+    ):
+        if count < 2:
+            break
+        phrase = phrase.encode()
+        if n_bytes + len(phrase) > size:
+            continue
+        phrases.append(phrase)
+        n_bytes += len(phrase)
+    return b"".join(reversed(phrases))
+
+
+def dictionary_key(dictionary: bytes) -> str:
+    """The key of a dictionary (hex)"""
+    return hashlib.sha256(dictionary).digest()[:KEY_SIZE].hex()
+
+
+def remember_dictionary(key: str, dictionary: bytes):
+    """Add a dictionary to the dictionaries of the process"""
+    with _dictionaries_lock:
+        _dictionaries[key] = dictionary
+
+
+@functools.lru_cache(maxsize=16)
+def primed_compressor(dictionary: bytes):
+    """
+    A compressor with a dictionary, copied to compress each text: setting the
+    dictionary costs more than compressing a short text
+    """
+    return zlib.compressobj(6, zlib.DEFLATED, -15, zdict=dictionary)
+
+
+def compress_text(text: str, dictionary: bytes, key: str = None):
+    """
+    Compress a text with a dictionary.
+    Returns the compressed text (bytes), or the text if it is not shorter compressed.
+    """
+    if text is None:
+        return None
+    compressor = primed_compressor(dictionary).copy()
+    data = text.encode()
+    compressed = compressor.compress(data) + compressor.flush()
+    if HEADER_SIZE + len(compressed) >= len(data):
+        return text
+    return (
+        FORMAT_VERSION + bytes.fromhex(key or dictionary_key(dictionary)) + compressed
+    )
+
+
+def decompress_text(value, load_dictionary=None):
+    """
+    Decompress a text compressed with compress_text (a plain text is returned as is).
+    load_dictionary(key) returns a dictionary which is not known to the process yet.
+    """
+    if not isinstance(value, bytes):
+        return value
+    if value[:1] != FORMAT_VERSION:
+        raise ValueError("unknown compressed text format")
+    key = value[1:HEADER_SIZE].hex()
+    with _dictionaries_lock:
+        dictionary = _dictionaries.get(key)
+    if dictionary is None:
+        dictionary = load_dictionary(key) if load_dictionary else None
+        if dictionary is None:
+            raise LookupError("unknown text dictionary: " + key)
+        remember_dictionary(key, dictionary)
+    decompressor = zlib.decompressobj(-15, zdict=dictionary)
+    data = decompressor.decompress(value[HEADER_SIZE:]) + decompressor.flush()
+    return data.decode()
+
+
+def register_sqlite_functions(dbapi_connection):
+    """
+    Register the decompress_text SQL function on a raw SQLite (DBAPI) connection.
+    The dictionaries are read through the same connection, so that the ones added
+    by its current transaction are found.
+    """
+
+    def load_dictionary(key: str) -> bytes:
+        row = dbapi_connection.execute(
+            "SELECT data FROM text_dictionary WHERE key = ?", (key,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    dbapi_connection.create_function(
+        "decompress_text",
+        1,
+        lambda value: decompress_text(value, load_dictionary),
+        deterministic=True,
+    )
+
+
+class decompressed(FunctionElement):
+    """SQL expression of the decompressed text of a column (see CompressedText)"""
+
+    inherit_cache = True
+    name = "decompress_text"
+    type = Text()
+
+
+@compiles(decompressed)
+def compile_decompressed(element, compiler, **kw):
+    """The texts are only compressed on SQLite"""
+    return compiler.process(element.clauses, **kw)
+
+
+@compiles(decompressed, "sqlite")
+def compile_decompressed_sqlite(element, compiler, **kw):
+    return "decompress_text(%s)" % compiler.process(element.clauses, **kw)
+
+
+class CompressedText(TypeDecorator):
+    """
+    Text column whose values can be compressed (see app/upload/compress.py).
+    The values are decompressed by the database when they are selected.
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def column_expression(self, column):
+        return decompressed(column)
+
+
+def compress_rows(tables: list, dictionary: bytes, key: str):
+    """
+    Compress the texts of rows with a dictionary, in place.
+    tables gives the rows (dicts) and the name of their column to compress, for each table.
+    """
+    for rows, column in tables:
+        for row in rows:
+            row[column] = compress_text(row[column], dictionary, key)
@@ -0,0 +1,234 @@
+"""
+Database engine configuration for the app
+"""
+import os
+import threading
+import time
+import weakref
+from sqlalchemy import DateTime, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.functions import FunctionElement
+from app.compression import register_sqlite_functions
+
+
+def get_backend_name(database_uri: str) -> str:
+    """Return the database backend of the URI, e.g. "sqlite" or "postgresql" """
+    return make_url(database_uri).get_backend_name()
+
+
+def is_memory_sqlite(database_uri: str) -> bool:
+    """Check if the URI is an in-memory SQLite database"""
+    url = make_url(database_uri)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+class utc_now(FunctionElement):
+    """
+    SQL expression of the current time (UTC), evaluated by the database when the statement
+    which writes a row runs, rather than by the app before the statement is sent
+    """
+
+    inherit_cache = True
+    name = "utc_now"
+    type = DateTime()
+
+
+@compiles(utc_now)
+def compile_utc_now(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utc_now, "sqlite")
+def compile_utc_now_sqlite(element, compiler, **kw):
+    # in the format of the DateTime columns, CURRENT_TIMESTAMP has no fraction of a second
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+
+@compiles(utc_now, "postgresql")
+def compile_utc_now_postgresql(element, compiler, **kw):
+    return "(statement_timestamp() AT TIME ZONE 'UTC')"
+
+
+class TimedQueuePool(QueuePool):
+    """
+    Connection pool that keeps track of the number of checkouts and of how long
+    the callers waited to get a connection (including the time to open new connections).
+    The statistics are reported by pool_stats().
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.n_checkouts = 0
+        self.wait_time_total = 0.0  # seconds
+        self.wait_time_max = 0.0  # seconds
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait_time = time.perf_counter() - start
+            with self._stats_lock:
+                self.n_checkouts += 1
+                self.wait_time_total += wait_time
+                self.wait_time_max = max(self.wait_time_max, wait_time)
+
+
+def set_engine_options(app):
+    """
+    Set the engine options of the app from the preset of its database backend
+    (ENGINE_OPTIONS_PRESETS in the config), unless they are overridden in
+    SQLALCHEMY_ENGINE_OPTIONS. The connection pool records usage statistics
+    (see TimedQueuePool), unless another pool class is given.
+    This must be called before the database extension is bound to the app.
+
+    :param app: Flask application instance
+    :return: None
+    """
+    database_uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    if is_memory_sqlite(database_uri):
+        return  # a single connection is shared (StaticPool), there is no pool to configure
+    presets = app.config.get("ENGINE_OPTIONS_PRESETS") or {}
+    options = dict(presets.get(get_backend_name(database_uri), {}))
+    options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    options.setdefault("poolclass", TimedQueuePool)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+
+# the engines whose pooled connections are discarded in forked processes, held weakly
+# so that the engines of the apps no longer used (e.g. one app per test module) are not
+# kept alive by the fork hook, which cannot be unregistered
+FORK_ENGINES = weakref.WeakSet()
+
+
+def dispose_engines(engines: list = None):
+    """
+    Discard the pooled connections inherited from the parent process after a fork
+    (e.g. gunicorn workers with --preload), so that a worker never uses a connection
+    opened by another process. The connections are not closed, since they still
+    belong to the parent process (close=False).
+    By default, the engines registered with dispose_after_fork are disposed.
+    """
+    for engine in list(FORK_ENGINES if engines is None else engines):
+        engine.dispose(close=False)
+
+
+def dispose_after_fork(engine: Engine):
+    """Register an engine so that its pooled connections are discarded after a fork"""
+    FORK_ENGINES.add(engine)
+
+
+# a single hook for all the engines of the process
+os.register_at_fork(after_in_child=dispose_engines)
+
+
+def pool_stats(engine: Engine) -> dict:
+    """
+    Return the current statistics of the connection pool of the engine, for this process.
+
+    Parameters
+    ----------
+    engine : Engine
+        The SQLAlchemy engine
+
+    Returns
+    -------
+    stats : dict
+        The pool class, its size and the number of connections checked in, checked out
+        and in overflow. For a TimedQueuePool, also the number of checkouts and the total,
+        average and maximum time (in seconds) spent waiting for a connection.
+    """
+    pool = engine.pool
+    stats = {"pool_class": type(pool).__name__, "status": pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            {
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": max(pool.overflow(), 0),
+                "max_overflow": pool._max_overflow,
+            }
+        )
+    if isinstance(pool, TimedQueuePool):
+        stats.update(
+            {
+                "checkouts": pool.n_checkouts,
+                "wait_time_total": pool.wait_time_total,
+                "wait_time_avg": pool.wait_time_total / pool.n_checkouts
+                if pool.n_checkouts
+                else 0.0,
+                "wait_time_max": pool.wait_time_max,
+            }
+        )
+    return stats
+
+
+def set_sqlite_pragmas(dbapi_connection, pragmas: dict):
+    """
+    Apply the given PRAGMA statements to a raw SQLite (DBAPI) connection.
+
+    Parameters
+    ----------
+    dbapi_connection : sqlite3.Connection
+        The raw SQLite connection
+    pragmas : dict
+        A dictionary of PRAGMA names and values, e.g. {"journal_mode": "WAL"}
+    """
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def register_sqlite_pragmas(engine: Engine, pragmas: dict):
+    """
+    Register an event hook on the engine, so that the given PRAGMA statements
+    are applied to every new connection opened by the connection pool.
+    Most SQLite settings (e.g. busy_timeout, cache_size) are per connection,
+    so they need to be set each time a connection is created.
+
+    Parameters
+    ----------
+    engine : Engine
+        The SQLAlchemy engine
+    pragmas : dict
+        A dictionary of PRAGMA names and values, e.g. {"journal_mode": "WAL"}
+    """
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        set_sqlite_pragmas(dbapi_connection, pragmas)
+
+
+def register_sqlite_decompression(engine: Engine):
+    """
+    Register an event hook on the engine, so that the SQL function which decompresses
+    the compressed texts (see app/compression.py) is added to every new connection
+    """
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        register_sqlite_functions(dbapi_connection)
+
+
+def configure_engines(app, db):
+    """
+    Apply the database settings from the app config to all the engines
+    of the app. This must be called within an application context.
+
+    :param app: Flask application instance
+    :param db: Flask-SQLAlchemy database instance
+    :return: None
+    """
+    pragmas = app.config.get("SQLITE_PRAGMAS")
+    for engine in db.engines.values():
+        if engine.dialect.name == "sqlite" and pragmas:
+            register_sqlite_pragmas(engine, pragmas)
+        if engine.dialect.name == "sqlite":
+            register_sqlite_decompression(engine)
+        # new processes (e.g. forked gunicorn workers) start with empty connection pools
+        dispose_after_fork(engine)
@@ -0,0 +1,27 @@
+"""
+Custom view decorators for the app
+"""
+from functools import wraps
+from flask import abort
+from flask_login import current_user
+from app.utils import Permission
+
+
+def permission_required(permission):
+    """Decorator for views that require the logged in user to have a permission"""
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not current_user.can(permission):
+                abort(403)  # raise a HTTP 403 Forbidden error
+            return f(*args, **kwargs)
+
+        return decorated_function
+
+    return decorator
+
+
+def admin_required(f):
+    """Decorator for views that are only available to administrators"""
+    return permission_required(Permission.ADMIN)(f)
@@ -10,6 +10,12 @@ def bad_request_error(error):
     return render_template("errors/400.html"), 400
 
 
+@bp.app_errorhandler(403)
+def forbidden_error(error):
+    """403 error handler"""
+    return render_template("errors/403.html"), 403
+
+
 @bp.app_errorhandler(404)
 def not_found_error(error):
     """404 error handler"""
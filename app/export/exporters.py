@@ -0,0 +1,258 @@
+"""
+Streaming export of the psychotherapy annotations.
+The annotations are read in chunks with a server-side cursor (yield_per), converted
+to flat rows and written out chunk by chunk, so the memory used by an export does not
+depend on the number of annotations: only the ids of the dialog turns of the dataset
+being exported are kept, to give the dialog turns of the segment of each annotation.
+Exports can be incremental: only the annotations written (created, or changed by a new
+version of their dataset) in a time window [since, until) are exported, and `until`
+is the watermark for the next export.
+"""
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from enum import Enum
+from flask import current_app
+from app import db
+from app.database import utc_now
+from app.annotate.utils import segments_by_dialog_turn
+from app.models import ANNOTATION_TABLES, Dataset
+from app.shards import dataset_shards, use_shard
+from app.utils import Speaker
+
+EXPORT_CHUNK_SIZE = 1000  # number of annotations fetched from the database at a time
+
+LABELS = ["a", "b", "c", "d", "e", "f"]  # the client has the most labels (A to F)
+
+# columns of the exported rows, the same for all the speakers
+# (labels that a speaker does not have are left empty)
+EXPORT_COLUMNS = (
+    ["id", "speaker", "id_dataset", "id_user", "timestamp", "modified"]
+    + ["label_" + label for label in LABELS]
+    + ["strength_" + label for label in LABELS]
+    + ["comment_" + label for label in LABELS]
+    + ["comment_summary", "dialog_turn_ids"]
+    + ["evidence_" + label for label in LABELS]
+)
+
+# columns holding lists of ids
+LIST_COLUMNS = ["dialog_turn_ids"] + ["evidence_" + label for label in LABELS]
+
+
+def export_watermark(lag: float) -> datetime:
+    """
+    Return the upper bound (exclusive) of the time window of an export, i.e. the watermark
+    to use for the next incremental export.
+    The annotations are exported by their modified time, set by the database when they
+    are written (see utc_now), shortly before they are committed, so the watermark is
+    `lag` seconds in the past on the clock of the database: annotations still being
+    committed are left for the next export instead of being missed.
+    The annotations are only changed by a new version of their dataset (their segment
+    is linked again, or their evidence deleted, see app/upload/diff.py), which sets their
+    modified time again: they are then exported again, with the same id, and the latest
+    export of an annotation (the latest modified time) replaces the previous ones.
+    """
+    return db.session.scalar(db.select(utc_now())) - timedelta(seconds=lag)
+
+
+def annotation_chunks(
+    id_dataset: int = None,
+    speakers: list = None,
+    since: datetime = None,
+    until: datetime = None,
+):
+    """
+    Read the annotations of a dataset in chunks and convert them to flat rows.
+
+    Parameters
+    ----------
+    id_dataset : int, optional
+        The id of the dataset, by default the annotations of all the datasets are exported
+    speakers : list, optional
+        The speakers whose annotations are exported, by default all of them
+    since : datetime, optional
+        Only export the annotations written at or after this time (UTC, see modified)
+    until : datetime, optional
+        Only export the annotations written before this time (UTC), see export_watermark()
+
+    Yields
+    ------
+    rows : list
+        A list of at most EXPORT_CHUNK_SIZE rows (dictionaries with the keys in EXPORT_COLUMNS).
+        The label and strength enums are converted to their names (e.g. "high", rather
+        than the text shown in the forms, "5. high quality"), and the dialog turns
+        and the evidence of each annotation are given as lists of ids
+        (the dialog turns of its segment, and the dialog event ids marked as evidence
+        for each label).
+    """
+    time_interval = current_app.config["PS_MINS_PER_PAGE"] * 60
+    # the dialog turns of the segments of the dataset being exported: the annotations
+    # are sorted by dataset, so only the segments of one dataset are kept at a time
+    id_segments_dataset, segments = None, {}
+    # in sharding mode, the annotations are read from each shard (see app/shards.py)
+    for shard in dataset_shards(id_dataset):
+        use_shard(shard)
+        for speaker in speakers or list(Speaker):
+            model, evidence_model, evidence_column = ANNOTATION_TABLES[speaker]
+            query = db.select(*model.__table__.columns)
+            if id_dataset is not None:
+                query = query.where(model.id_dataset == id_dataset)
+            else:
+                query = query.order_by(model.id_dataset)
+            if since is not None or until is not None:
+                # range scan on the (id_dataset, modified) or modified index
+                if since is not None:
+                    query = query.where(model.modified >= since)
+                if until is not None:
+                    query = query.where(model.modified < until)
+                query = query.order_by(model.modified, model.id)
+            else:
+                query = query.order_by(model.id)
+            query = query.execution_options(yield_per=EXPORT_CHUNK_SIZE)
+            result = db.session.execute(query)
+            for partition in result.partitions():
+                rows = {}
+                for annotation in partition:
+                    row = dict.fromkeys(EXPORT_COLUMNS)
+                    for name, value in annotation._mapping.items():
+                        row[name] = value.name if isinstance(value, Enum) else value
+                    row["speaker"] = speaker.name
+                    for column in LIST_COLUMNS:
+                        row[column] = []
+                    # the dialog turns of the segment, split once for each dataset
+                    id_first_dialog_turn = row.pop("id_first_dialog_turn")
+                    if annotation.id_dataset != id_segments_dataset:
+                        id_segments_dataset = annotation.id_dataset
+                        dataset = db.session.get(Dataset, id_segments_dataset)
+                        segments = segments_by_dialog_turn(
+                            dataset.content_id, time_interval
+                        )
+                    row["dialog_turn_ids"] = list(
+                        segments.get(id_first_dialog_turn, ())
+                    )
+                    rows[annotation.id] = row
+                # fetch the evidence of the whole chunk at once
+                evidence_id = getattr(evidence_model, evidence_column)
+                evidence = db.session.execute(
+                    db.select(
+                        evidence_id,
+                        evidence_model.label,
+                        evidence_model.id_ps_dialog_event,
+                    )
+                    .where(evidence_id.in_(rows))
+                    .order_by(evidence_model.id_ps_dialog_event)
+                )
+                for id_annotation, label, id_dialog_event in evidence:
+                    if label is not None:
+                        column = label.name.replace("label_", "evidence_")
+                        rows[id_annotation][column].append(id_dialog_event)
+                yield list(rows.values())
+
+
+def format_csv_value(value):
+    """Format a value for a CSV cell: lists of ids are separated by spaces"""
+    if isinstance(value, list):
+        return " ".join(str(item) for item in value)
+    return value
+
+
+def iter_csv(chunks):
+    """Write the chunks of rows as CSV, yielding the encoded text of each chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        for row in rows:
+            writer.writerow(
+                [format_csv_value(row[column]) for column in EXPORT_COLUMNS]
+            )
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")  # header of an empty export
+
+
+def iter_jsonl(chunks):
+    """Write the chunks of rows as JSON Lines, yielding the encoded text of each chunk"""
+    for rows in chunks:
+        lines = [json.dumps(row, default=str) + "\n" for row in rows]
+        yield "".join(lines).encode("utf-8")
+
+
+class ChunkedSink(io.RawIOBase):
+    """
+    Write-only file that keeps what is written to it until it is taken with pop().
+    Used to stream a Parquet file while it is being written.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.position = 0
+        self.buffer = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def pop(self) -> bytes:
+        """Return the data written since the last call and clear it"""
+        data = b"".join(self.buffer)
+        self.buffer = []
+        return data
+
+
+def iter_parquet(chunks):
+    """Write the chunks of rows as a Parquet file (one row group per chunk), yielding its bytes"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    fields = []
+    for column in EXPORT_COLUMNS:
+        if column in LIST_COLUMNS:
+            field_type = pa.list_(pa.int64())
+        elif column.startswith("id"):
+            field_type = pa.int64()
+        elif column in ("timestamp", "modified"):
+            field_type = pa.timestamp("us")
+        else:
+            field_type = pa.string()
+        fields.append(pa.field(column, field_type))
+    schema = pa.schema(fields)
+    sink = ChunkedSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for rows in chunks:
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            yield sink.pop()
+    yield sink.pop()  # footer
+
+
+# file extension: (writer, MIME type)
+EXPORT_FORMATS = {
+    "csv": (iter_csv, "text/csv"),
+    "jsonl": (iter_jsonl, "application/x-ndjson"),
+    "parquet": (iter_parquet, "application/vnd.apache.parquet"),
+}
+
+
+def export_annotations(
+    id_dataset: int,
+    export_format: str,
+    speakers: list = None,
+    since: datetime = None,
+    until: datetime = None,
+):
+    """
+    Export the annotations of a dataset (or of all the datasets if id_dataset is None)
+    in the given format (csv, jsonl or parquet), see annotation_chunks().
+    Returns a generator of bytes, to be streamed to a response or written to a file.
+    """
+    writer, _ = EXPORT_FORMATS[export_format]
+    return writer(annotation_chunks(id_dataset, speakers, since, until))
@@ -0,0 +1,73 @@
+from app.export import bp
+from app.export.exporters import export_annotations, export_watermark, EXPORT_FORMATS
+from app.decorators import admin_required
+from app.models import Dataset
+from app.utils import Speaker
+from datetime import datetime
+from flask import Response, abort, current_app, request, stream_with_context
+from flask_login import login_required, current_user
+
+
+def stream_export(id_dataset: int, export_format: str, filename: str):
+    """
+    Stream the export of the annotations of a dataset (or of all the datasets if
+    id_dataset is None) as a file download. The query string can contain:
+    - `speaker`: only export the annotations of this speaker (can be repeated)
+    - `since`: only export the annotations written (created or changed) at or after this
+      time (ISO format, UTC). The annotations written up to the watermark returned in the X-Export-Watermark header
+      are exported. Use it as `since` in the next export to get only the new (or changed) annotations.
+      To start, use the earliest date (e.g. `since=2000-01-01`).
+    """
+    if export_format not in EXPORT_FORMATS:
+        abort(404)
+    try:
+        speakers = [Speaker(speaker) for speaker in request.args.getlist("speaker")]
+    except ValueError:
+        abort(400)
+    since = request.args.get("since", type=datetime.fromisoformat)
+    if "since" in request.args and since is None:
+        abort(400)  # invalid date
+    headers = {"Content-Disposition": "attachment; filename=" + filename}
+    until = None
+    if since is not None:  # incremental export
+        until = export_watermark(current_app.config["EXPORT_WATERMARK_LAG"])
+        headers["X-Export-Watermark"] = until.isoformat()
+    _, mimetype = EXPORT_FORMATS[export_format]
+    return Response(
+        stream_with_context(
+            export_annotations(id_dataset, export_format, speakers, since, until)
+        ),
+        mimetype=mimetype,
+        headers=headers,
+    )
+
+
+@bp.route("/<int:dataset_id>/annotations.<export_format>")
+@login_required
+def export_dataset_annotations(dataset_id: int, export_format: str):
+    """
+    Download the annotations of a dataset as a CSV, JSON Lines or Parquet file.
+    The file is streamed while it is written. The annotations can be limited to
+    some speakers, e.g. `?speaker=client&speaker=dyad`, and to the ones written
+    since the watermark of a previous export, e.g. `?since=2023-10-01T00:00:00`.
+    """
+    dataset = Dataset.query.get_or_404(dataset_id)
+    if not (
+        current_user.is_administrator()
+        or dataset.id_author == current_user.id
+        or dataset.annotators.filter_by(id=current_user.id).count()
+    ):
+        abort(403)
+    filename = "dataset_{}_annotations.{}".format(dataset.id, export_format)
+    return stream_export(dataset.id, export_format, filename)
+
+
+@bp.route("/annotations.<export_format>")
+@login_required
+@admin_required
+def export_all_annotations(export_format: str):
+    """
+    Download the annotations of all the datasets (admin only),
+    with the same options as export_dataset_annotations.
+    """
+    return stream_export(None, export_format, "annotations." + export_format)
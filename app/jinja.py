@@ -0,0 +1,39 @@
+"""
+Jinja template settings for the app
+"""
+import os
+from jinja2 import FileSystemBytecodeCache
+
+
+def set_bytecode_cache(app):
+    """
+    If JINJA_BYTECODE_CACHE_DIR is set, store the compiled templates in that directory,
+    so that new processes (e.g. restarted workers) load them instead of compiling them again.
+    This must be called before the Jinja environment of the app is first used.
+
+    :param app: Flask application instance
+    :return: None
+    """
+    cache_dir = app.config.get("JINJA_BYTECODE_CACHE_DIR")
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_options = dict(
+            app.jinja_options, bytecode_cache=FileSystemBytecodeCache(cache_dir)
+        )
+
+
+def precompile_templates(app) -> int:
+    """
+    Load (and compile) all the templates of the app and its blueprints.
+    The compiled templates are kept in the template cache of the Jinja environment,
+    and in the bytecode cache (if any).
+    Called in the gunicorn master process, so that the workers share them.
+
+    :param app: Flask application instance
+    :return: the number of templates loaded
+    """
+    env = app.jinja_env
+    names = env.list_templates(extensions=["html"])
+    for name in names:
+        env.get_template(name)
+    return len(names)
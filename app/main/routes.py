@@ -1,4 +1,8 @@
+from app import db
 from app.main import bp
+from app.models import Dataset, PSAnnotationProgress
+from app.shards import use_shard
+from app.utils import Speaker
 from flask import render_template
 from flask_login import login_required, current_user
 
@@ -9,5 +13,32 @@ from flask_login import login_required, current_user
 def index():
     """This is the index page"""
     # find all the datasets that the logged in user has access to
-    datasets = current_user.datasets.all()
-    return render_template("index.html", title="Home page", datasets=datasets)
+    # (but not the datasets being deleted, see app/admin/delete.py)
+    datasets = (
+        current_user.datasets.filter(Dataset.deleting.is_(False))
+        .options(db.joinedload(Dataset.stats))
+        .all()
+    )
+    # annotation progress of the user, for each dataset and speaker
+    progress = {dataset.id: {} for dataset in datasets}
+    # read from the shard of each dataset in sharding mode (see app/shards.py)
+    for shard in sorted({dataset.shard for dataset in datasets}, key=str):
+        use_shard(shard)
+        for row in PSAnnotationProgress.query.filter_by(id_user=current_user.id):
+            progress.setdefault(row.id_dataset, {})[row.speaker] = row
+    use_shard(None)
+    # first page that is not annotated for all the speakers
+    resume_pages = {
+        id_dataset: min(
+            rows[speaker].next_page if speaker in rows else 1 for speaker in Speaker
+        )
+        for id_dataset, rows in progress.items()
+    }
+    return render_template(
+        "index.html",
+        title="Home page",
+        datasets=datasets,
+        progress=progress,
+        resume_pages=resume_pages,
+        speakers=list(Speaker),
+    )
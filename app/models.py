@@ -3,6 +3,10 @@ from datetime import datetime, date
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin, AnonymousUserMixin
 from flask import current_app
+from sqlalchemy import DDL, event
+from app.compression import CompressedText
+from app.database import utc_now
+from app.vocabulary import LabelCode, vocabulary_rows
 from app.utils import (
     SMAnnotationType,
     DatasetType,
@@ -36,6 +40,7 @@ from app.utils import (
     LabelNamesClient,
     LabelNamesTherapist,
     LabelNamesDyad,
+    Speaker,
 )
 
 
@@ -53,39 +58,24 @@ dataset_annotator = db.Table(
 )
 
 
-# association table for many-to-many relationship between PSDialogTurn and PSAnnotationClient
-annotationclient_dialogturn = db.Table(
-    "annotationclient_dialogturn",
-    db.Column("id_dialog_turn", db.Integer, db.ForeignKey("ps_dialog_turn.id")),
-    db.Column(
-        "id_annotation_client",
-        db.Integer,
-        db.ForeignKey("ps_annotation_client.id"),
-    ),
-)
-
+def comments_document(columns: list) -> str:
+    """
+    SQL expression of the text of the comments of an annotation (the given columns),
+    searched with the full-text search of the annotations on PostgreSQL
+    """
+    return " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
 
-# association table for many-to-many relationship between PSDialogTurn and PSAnnotationTherapist
-annotationtherapist_dialogturn = db.Table(
-    "annotationtherapist_dialogturn",
-    db.Column("id_dialog_turn", db.Integer, db.ForeignKey("ps_dialog_turn.id")),
-    db.Column(
-        "id_annotation_therapist",
-        db.Integer,
-        db.ForeignKey("ps_annotation_therapist.id"),
-    ),
-)
 
-# association table for many-to-many relationship between PSDialogTurn and PSAnnotationDyad
-annotationsdyad_dialogturn = db.Table(
-    "annotationsdyad_dialogturn",
-    db.Column("id_dialog_turn", db.Integer, db.ForeignKey("ps_dialog_turn.id")),
-    db.Column(
-        "id_annotation_dyad",
-        db.Integer,
-        db.ForeignKey("ps_annotation_dyad.id"),
-    ),
-)
+def comments_search_index(table_name: str, columns: list) -> db.Index:
+    """
+    Full-text search index of the comments of an annotation table on PostgreSQL
+    (GIN index on their tsvector). SQLite uses FTS5 tables instead, see add_comments_fts.
+    """
+    return db.Index(
+        f"ix_{table_name}_comments_tsv",
+        db.text(f"to_tsvector('english', {comments_document(columns)})"),
+        postgresql_using="gin",
+    ).ddl_if(dialect="postgresql")
 
 
 class User(UserMixin, db.Model):
@@ -232,6 +222,10 @@ class Role(db.Model):
 class SMAnnotation(db.Model):
     """Social Media Annotation class for database"""
 
+    __table_args__ = (
+        # for the annotations of the posts on a page of the annotation view
+        db.Index("ix_sm_annotation_id_sm_post_id_user", "id_sm_post", "id_user"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.Enum(SMAnnotationType), nullable=True)  # type of annotation
     body = db.Column(db.Text)  # annotation body
@@ -244,6 +238,9 @@ class SMAnnotation(db.Model):
     id_sm_post = db.Column(
         db.Integer, db.ForeignKey("sm_post.id")
     )  # id of post which is annotated
+    id_dataset = db.Column(
+        db.Integer, db.ForeignKey("dataset.id")
+    )  # id of the dataset annotated, the post can be shared by several datasets
 
     def __repr__(self):
         """How to print objects of this class"""
@@ -253,6 +250,25 @@ class SMAnnotation(db.Model):
 class SMPost(db.Model):
     """Social Media Post class for database"""
 
+    __table_args__ = (
+        # for the keyset pagination of the posts of a dataset in the annotation view
+        # (see app/annotate/sm.py), in the order of the timelines
+        db.Index(
+            "ix_sm_post_id_dataset_user_id_timeline_id_date_id",
+            "id_dataset",
+            "user_id",
+            "timeline_id",
+            "date",
+            "id",
+        ),
+        # for the posts of a timeline, in order
+        db.Index(
+            "ix_sm_post_id_dataset_timeline_id_date",
+            "id_dataset",
+            "timeline_id",
+            "date",
+        ),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(64), index=True, unique=False)
     timeline_id = db.Column(db.String(64), index=True, unique=False)
@@ -260,7 +276,7 @@ class SMPost(db.Model):
     mood = db.Column(db.String(64))
     date = db.Column(db.DateTime, default=datetime.utcnow)
     ldate = db.Column(db.DateTime, default=datetime.utcnow)
-    question = db.Column(db.Text)
+    question = db.Column(CompressedText)  # see COMPRESS_TEXT
     id_dataset = db.Column(db.Integer, db.ForeignKey("dataset.id"))
     annotations = db.relationship(
         "SMAnnotation", backref="post", lazy="dynamic"
@@ -268,21 +284,54 @@ class SMPost(db.Model):
     replies = db.relationship(
         "SMReply", backref="post", lazy="dynamic"
     )  # one-to-many relationship with SMReply class
+    thread = db.relationship(
+        "SMReply", viewonly=True, order_by="SMReply.date"
+    )  # the replies as a list, in order, to be eager-loaded with selectinload
 
     def __repr__(self):
         """How to print objects of this class"""
         return "<Social Media Post {}>".format(self.question)
 
 
+class SMTimeline(db.Model):
+    """
+    Social Media Timeline class for database
+    One row per timeline of a user in a social media dataset, created when the dataset
+    is uploaded (see the upload parsers), with the dates of its first and last posts and
+    its numbers of posts and replies, for the navigation between the timelines.
+    """
+
+    __tablename__ = "sm_timeline"
+    __table_args__ = (
+        db.UniqueConstraint("id_dataset", "user_id", "timeline_id"),
+    )  # one row per timeline, in the order of the timelines of a dataset
+    id = db.Column(db.Integer, primary_key=True)
+    id_dataset = db.Column(db.Integer, db.ForeignKey("dataset.id"))
+    user_id = db.Column(db.String(64))
+    timeline_id = db.Column(db.String(64))
+    first_post_date = db.Column(db.DateTime)  # date of the first post
+    last_post_date = db.Column(db.DateTime)  # date of the last post
+    n_posts = db.Column(db.Integer)
+    n_replies = db.Column(db.Integer)
+
+    def __repr__(self):
+        """How to print objects of this class"""
+        return "<Social Media Timeline {}>".format(self.timeline_id)
+
+
 class SMReply(db.Model):
     """Social Media Reply class for database"""
 
+    __table_args__ = (
+        # for the replies to the posts on a page of the annotation view
+        db.Index("ix_sm_reply_id_sm_post_date", "id_sm_post", "date"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     reply_id = db.Column(db.Integer, index=True, unique=False)
     user_id = db.Column(db.String(64), index=True, unique=False)
     date = db.Column(db.DateTime, default=datetime.utcnow)
     ldate = db.Column(db.DateTime, default=datetime.utcnow)
-    comment = db.Column(db.Text)
+    comment = db.Column(CompressedText)  # see COMPRESS_TEXT
     id_sm_post = db.Column(db.Integer, db.ForeignKey("sm_post.id"))
     id_dataset = db.Column(db.Integer, db.ForeignKey("dataset.id"))
 
@@ -299,9 +348,30 @@ class Dataset(db.Model):
     description = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     type = db.Column(db.Enum(DatasetType), nullable=True)  # type of dataset
+    n_segments = db.Column(
+        db.Integer, nullable=True
+    )  # number of segments (pages) of a psychotherapy dataset, see PS_MINS_PER_PAGE
     id_author = db.Column(
         db.Integer, db.ForeignKey("user.id")
     )  # id of user who created this dataset
+    file_sha256 = db.Column(
+        db.String(64), index=True, nullable=True
+    )  # SHA-256 of the uploaded file, to find the datasets uploaded from identical files
+    id_content = db.Column(
+        db.Integer, db.ForeignKey("dataset.id"), nullable=True
+    )  # id of the dataset whose posts or dialog turns are shared with this dataset
+    version = db.Column(
+        db.Integer, nullable=False, default=1, server_default="1"
+    )  # incremented when a new version of the file is uploaded (see app/upload/diff.py)
+    text_dictionary = db.Column(
+        db.String(16), db.ForeignKey("text_dictionary.key"), nullable=True
+    )  # dictionary of the compressed texts of the dataset, see app/compression.py
+    shard = db.Column(
+        db.String(64), nullable=True
+    )  # database file of the rows of the dataset (NULL: the main database), see app/shards.py
+    deleting = db.Column(
+        db.Boolean, nullable=False, default=False, server_default=db.false()
+    )  # set when the dataset is being (archived and) deleted, see app/admin/delete.py
     annotators = db.relationship(
         "User",
         secondary=dataset_annotator,
@@ -314,6 +384,9 @@ class Dataset(db.Model):
     replies = db.relationship(
         "SMReply", backref="dataset", lazy="dynamic"
     )  # one-to-many relationship with SMReply class
+    timelines = db.relationship(
+        "SMTimeline", backref="dataset", lazy="dynamic"
+    )  # one-to-many relationship with SMTimeline class
     dialog_turns = db.relationship(
         "PSDialogTurn", backref="dataset", lazy="dynamic"
     )  # one-to-many relationship with PSDialogTurn class
@@ -329,12 +402,91 @@ class Dataset(db.Model):
     annotations_dyad = db.relationship(
         "PSAnnotationDyad", backref="dataset", lazy="dynamic"
     )  # one-to-many relationship with PSAnnotationDyad class
+    stats = db.relationship(
+        "DatasetStats", backref="dataset", uselist=False
+    )  # one-to-one relationship with DatasetStats class
+
+    @property
+    def content_id(self) -> int:
+        """
+        Id of the dataset the posts and replies, or dialog turns and events,
+        of this dataset belong to: the dataset itself, unless it was uploaded
+        from the same file as another dataset and shares its contents (see id_content)
+        """
+        return self.id_content or self.id
 
     def __repr__(self):
         """How to print objects of this class"""
         return "<Dataset {}>".format(self.name)
 
 
+class TextDictionary(db.Model):
+    """
+    Dictionary used to compress the texts of datasets (see app/compression.py),
+    stored once by key (the start of its SHA-256), which is recorded in the texts
+    """
+
+    __tablename__ = "text_dictionary"
+    key = db.Column(db.String(16), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+
+class LabelVocabulary(db.Model):
+    """
+    Code of each label and strength stored in the annotation and evidence tables
+    (see app/vocabulary.py), to read them in SQL
+    """
+
+    __tablename__ = "label_vocabulary"
+    enum = db.Column(db.String(64), primary_key=True)  # name of the Enum class
+    code = db.Column(db.SmallInteger, primary_key=True)
+    name = db.Column(db.String(64), nullable=False)  # name of the Enum member
+    value = db.Column(db.String(255), nullable=False)  # text shown to the annotators
+
+    @staticmethod
+    def insert_labels():
+        """
+        Insert the codes of the labels into the database, and update their names and
+        texts. To add a label, add it to its Enum and to LABEL_CODES.
+        """
+        rows = {(row.enum, row.code): row for row in LabelVocabulary.query}
+        for values in vocabulary_rows():
+            row = rows.get((values["enum"], values["code"]))
+            if row is None:
+                db.session.add(LabelVocabulary(**values))
+            else:
+                row.name = values["name"]
+                row.value = values["value"]
+        db.session.commit()
+
+
+class DatasetStats(db.Model):
+    """
+    Summary statistics of a dataset, computed once when the dataset is uploaded
+    (see the upload parsers), instead of aggregating the posts, replies, dialog turns
+    and dialog events each time they are needed.
+    """
+
+    __tablename__ = "dataset_stats"
+    id_dataset = db.Column(db.Integer, db.ForeignKey("dataset.id"), primary_key=True)
+    # psychotherapy datasets
+    n_dialog_turns = db.Column(db.Integer, nullable=True)
+    n_dialog_events = db.Column(db.Integer, nullable=True)
+    n_sessions = db.Column(db.Integer, nullable=True)
+    n_patients = db.Column(db.Integer, nullable=True)  # number of distinct c_code
+    n_speakers = db.Column(
+        db.Integer, nullable=True
+    )  # number of distinct event_speaker
+    duration = db.Column(
+        db.Integer, nullable=True
+    )  # total duration of the sessions, in seconds
+    # social media datasets
+    n_posts = db.Column(db.Integer, nullable=True)
+    n_replies = db.Column(db.Integer, nullable=True)
+    n_users = db.Column(db.Integer, nullable=True)  # authors of posts and replies
+    n_timelines = db.Column(db.Integer, nullable=True)
+
+
 class PSDialogTurn(db.Model):
     """
     Psychotherapy Dialog Turn class for database
@@ -344,6 +496,15 @@ class PSDialogTurn(db.Model):
     """
 
     __tablename__ = "ps_dialog_turn"
+    __table_args__ = (
+        # the dialog turns of a dataset by key, e.g. to compare them with a new version
+        db.Index(
+            "ix_ps_dialog_turn_id_dataset_session_n_dialog_turn_n",
+            "id_dataset",
+            "session_n",
+            "dialog_turn_n",
+        ),
+    )
     id = db.Column(db.Integer, primary_key=True)
     c_code = db.Column(db.String(64), index=True, unique=False)  # patient ID
     t_init = db.Column(db.String(64), default=None)  # therapist initials
@@ -357,6 +518,9 @@ class PSDialogTurn(db.Model):
     )  # one of 'Therapist', 'Client' or 'Annotator'
     session_n = db.Column(db.Integer)  # session number
     dialog_turn_n = db.Column(db.Integer)  # dialog turn number
+    fingerprint = db.Column(
+        db.String(32), nullable=True
+    )  # hash of the values of the dialog turn, see row_fingerprint
     id_dataset = db.Column(
         db.Integer, db.ForeignKey("dataset.id")
     )  # id of dataset associated with this dialog turn
@@ -373,12 +537,26 @@ class PSDialogEvent(db.Model):
     """
 
     __tablename__ = "ps_dialog_event"
+    __table_args__ = (
+        # full-text search index on PostgreSQL (see app/search/utils.py),
+        # SQLite uses the FTS5 table created below instead
+        db.Index(
+            "ix_ps_dialog_event_plaintext_tsv",
+            db.text("to_tsvector('english', event_plaintext)"),
+            postgresql_using="gin",
+        ).ddl_if(dialect="postgresql"),
+        # the dialog events of a dataset by number, e.g. to compare them with a new version
+        db.Index("ix_ps_dialog_event_id_dataset_event_n", "id_dataset", "event_n"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     event_n = db.Column(db.Integer)  # event number
     event_speaker = db.Column(
         db.String(64)
     )  # one of 'Therapist', 'Client' or 'Annotator
-    event_plaintext = db.Column(db.Text)  # speech turn
+    event_plaintext = db.Column(CompressedText)  # speech turn, see COMPRESS_TEXT
+    fingerprint = db.Column(
+        db.String(32), nullable=True
+    )  # hash of the speaker and text of the dialog event, see row_fingerprint
     id_ps_dialog_turn = db.Column(
         db.Integer, db.ForeignKey("ps_dialog_turn.id")
     )  # id of dialog turn
@@ -396,6 +574,41 @@ class PSDialogEvent(db.Model):
     )  # one-to-many relationship with EvidenceDyad class
 
 
+# Full-text search index of the dialog events on SQLite: an FTS5 table
+# with the text of the events (external content table, the text is not copied),
+# filled when a dataset is uploaded (see app/search/utils.py).
+# Its content is a view of the decompressed text of the events (see app/compression.py)
+PS_DIALOG_EVENT_FTS = "ps_dialog_event_fts"
+PS_DIALOG_EVENT_TEXT = "ps_dialog_event_text"
+event.listen(
+    PSDialogEvent.__table__,
+    "after_create",
+    DDL(
+        f"CREATE VIEW {PS_DIALOG_EVENT_TEXT} AS SELECT id, "
+        "decompress_text(event_plaintext) AS event_plaintext FROM ps_dialog_event"
+    ).execute_if(dialect="sqlite"),
+)
+event.listen(
+    PSDialogEvent.__table__,
+    "after_create",
+    DDL(
+        f"CREATE VIRTUAL TABLE {PS_DIALOG_EVENT_FTS} USING fts5("
+        f"event_plaintext, content='{PS_DIALOG_EVENT_TEXT}', content_rowid='id', "
+        "tokenize='porter unicode61 remove_diacritics 2')"
+    ).execute_if(dialect="sqlite"),
+)
+event.listen(
+    PSDialogEvent.__table__,
+    "before_drop",
+    DDL(f"DROP TABLE IF EXISTS {PS_DIALOG_EVENT_FTS}").execute_if(dialect="sqlite"),
+)
+event.listen(
+    PSDialogEvent.__table__,
+    "before_drop",
+    DDL(f"DROP VIEW IF EXISTS {PS_DIALOG_EVENT_TEXT}").execute_if(dialect="sqlite"),
+)
+
+
 class PSAnnotationClient(db.Model):
     """
     Psychotherapy Dialog Turn Annotation class for the Client.
@@ -403,22 +616,54 @@ class PSAnnotationClient(db.Model):
     """
 
     __tablename__ = "ps_annotation_client"
+    __table_args__ = (
+        # for the search of the annotations of a dataset (newest first)
+        db.Index(
+            "ix_ps_annotation_client_id_dataset_timestamp", "id_dataset", "timestamp"
+        ),
+        # for the incremental export of the annotations of a dataset (range scan on modified)
+        db.Index(
+            "ix_ps_annotation_client_id_dataset_modified", "id_dataset", "modified"
+        ),
+        # for the search of the annotations of an annotator (see app/search/annotations.py)
+        db.Index(
+            "ix_ps_annotation_client_id_dataset_id_user_timestamp",
+            "id_dataset",
+            "id_user",
+            "timestamp",
+        ),
+        comments_search_index(
+            "ps_annotation_client",
+            [
+                "comment_a",
+                "comment_b",
+                "comment_c",
+                "comment_d",
+                "comment_e",
+                "comment_f",
+                "comment_summary",
+            ],
+        ),
+    )
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(
         db.DateTime, index=True, default=datetime.utcnow
     )  # when annotation was created
-    label_a = db.Column(db.Enum(SubLabelsAClient), nullable=True, default=None)
-    label_b = db.Column(db.Enum(SubLabelsBClient), nullable=True, default=None)
-    label_c = db.Column(db.Enum(SubLabelsCClient), nullable=True, default=None)
-    label_d = db.Column(db.Enum(SubLabelsDClient), nullable=True, default=None)
-    label_e = db.Column(db.Enum(SubLabelsEClient), nullable=True, default=None)
-    label_f = db.Column(db.Enum(SubLabelsFClient), nullable=True, default=None)
-    strength_a = db.Column(db.Enum(LabelStrengthAClient), nullable=True, default=None)
-    strength_b = db.Column(db.Enum(LabelStrengthBClient), nullable=True, default=None)
-    strength_c = db.Column(db.Enum(LabelStrengthCClient), nullable=True, default=None)
-    strength_d = db.Column(db.Enum(LabelStrengthDClient), nullable=True, default=None)
-    strength_e = db.Column(db.Enum(LabelStrengthEClient), nullable=True, default=None)
-    strength_f = db.Column(db.Enum(LabelStrengthFClient), nullable=True, default=None)
+    modified = db.Column(
+        db.DateTime, index=True, default=utc_now(), onupdate=utc_now()
+    )  # when the row was last written, by the database (for the incremental exports)
+    label_a = db.Column(LabelCode(SubLabelsAClient), nullable=True, default=None)
+    label_b = db.Column(LabelCode(SubLabelsBClient), nullable=True, default=None)
+    label_c = db.Column(LabelCode(SubLabelsCClient), nullable=True, default=None)
+    label_d = db.Column(LabelCode(SubLabelsDClient), nullable=True, default=None)
+    label_e = db.Column(LabelCode(SubLabelsEClient), nullable=True, default=None)
+    label_f = db.Column(LabelCode(SubLabelsFClient), nullable=True, default=None)
+    strength_a = db.Column(LabelCode(LabelStrengthAClient), nullable=True, default=None)
+    strength_b = db.Column(LabelCode(LabelStrengthBClient), nullable=True, default=None)
+    strength_c = db.Column(LabelCode(LabelStrengthCClient), nullable=True, default=None)
+    strength_d = db.Column(LabelCode(LabelStrengthDClient), nullable=True, default=None)
+    strength_e = db.Column(LabelCode(LabelStrengthEClient), nullable=True, default=None)
+    strength_f = db.Column(LabelCode(LabelStrengthFClient), nullable=True, default=None)
     comment_a = db.Column(db.Text, nullable=True)
     comment_b = db.Column(db.Text, nullable=True)
     comment_c = db.Column(db.Text, nullable=True)
@@ -426,12 +671,12 @@ class PSAnnotationClient(db.Model):
     comment_e = db.Column(db.Text, nullable=True)
     comment_f = db.Column(db.Text, nullable=True)
     comment_summary = db.Column(db.Text, nullable=True)
-    dialog_turns = db.relationship(
-        "PSDialogTurn",
-        secondary=annotationclient_dialogturn,
-        backref=db.backref("annotations_client", lazy="dynamic"),
-        lazy="dynamic",
-    )  # many-to-many relationship with PSDialogTurn class
+    id_first_dialog_turn = db.Column(
+        db.Integer, db.ForeignKey("ps_dialog_turn.id"), index=True
+    )  # first dialog turn of the annotated segment (page), which identifies the segment
+    first_dialog_turn = db.relationship(
+        "PSDialogTurn"
+    )  # many-to-one relationship with PSDialogTurn class
     id_user = db.Column(
         db.Integer, db.ForeignKey("user.id")
     )  # id of user (annotator) who created this annotation
@@ -450,29 +695,60 @@ class PSAnnotationTherapist(db.Model):
     """
 
     __tablename__ = "ps_annotation_therapist"
+    __table_args__ = (
+        # for the search of the annotations of a dataset (newest first)
+        db.Index(
+            "ix_ps_annotation_therapist_id_dataset_timestamp", "id_dataset", "timestamp"
+        ),
+        # for the incremental export of the annotations of a dataset (range scan on modified)
+        db.Index(
+            "ix_ps_annotation_therapist_id_dataset_modified", "id_dataset", "modified"
+        ),
+        # for the search of the annotations of an annotator (see app/search/annotations.py)
+        db.Index(
+            "ix_ps_annotation_therapist_id_dataset_id_user_timestamp",
+            "id_dataset",
+            "id_user",
+            "timestamp",
+        ),
+        comments_search_index(
+            "ps_annotation_therapist",
+            [
+                "comment_a",
+                "comment_b",
+                "comment_c",
+                "comment_d",
+                "comment_e",
+                "comment_summary",
+            ],
+        ),
+    )
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(
         db.DateTime, index=True, default=datetime.utcnow
     )  # when annotation was created
-    label_a = db.Column(db.Enum(SubLabelsATherapist), nullable=True, default=None)
-    label_b = db.Column(db.Enum(SubLabelsBTherapist), nullable=True, default=None)
-    label_c = db.Column(db.Enum(SubLabelsCTherapist), nullable=True, default=None)
-    label_d = db.Column(db.Enum(SubLabelsDTherapist), nullable=True, default=None)
-    label_e = db.Column(db.Enum(SubLabelsETherapist), nullable=True, default=None)
+    modified = db.Column(
+        db.DateTime, index=True, default=utc_now(), onupdate=utc_now()
+    )  # when the row was last written, by the database (for the incremental exports)
+    label_a = db.Column(LabelCode(SubLabelsATherapist), nullable=True, default=None)
+    label_b = db.Column(LabelCode(SubLabelsBTherapist), nullable=True, default=None)
+    label_c = db.Column(LabelCode(SubLabelsCTherapist), nullable=True, default=None)
+    label_d = db.Column(LabelCode(SubLabelsDTherapist), nullable=True, default=None)
+    label_e = db.Column(LabelCode(SubLabelsETherapist), nullable=True, default=None)
     strength_a = db.Column(
-        db.Enum(LabelStrengthATherapist), nullable=True, default=None
+        LabelCode(LabelStrengthATherapist), nullable=True, default=None
     )
     strength_b = db.Column(
-        db.Enum(LabelStrengthBTherapist), nullable=True, default=None
+        LabelCode(LabelStrengthBTherapist), nullable=True, default=None
     )
     strength_c = db.Column(
-        db.Enum(LabelStrengthCTherapist), nullable=True, default=None
+        LabelCode(LabelStrengthCTherapist), nullable=True, default=None
     )
     strength_d = db.Column(
-        db.Enum(LabelStrengthDTherapist), nullable=True, default=None
+        LabelCode(LabelStrengthDTherapist), nullable=True, default=None
     )
     strength_e = db.Column(
-        db.Enum(LabelStrengthETherapist), nullable=True, default=None
+        LabelCode(LabelStrengthETherapist), nullable=True, default=None
     )
     comment_a = db.Column(db.Text, nullable=True)
     comment_b = db.Column(db.Text, nullable=True)
@@ -480,12 +756,12 @@ class PSAnnotationTherapist(db.Model):
     comment_d = db.Column(db.Text, nullable=True)
     comment_e = db.Column(db.Text, nullable=True)
     comment_summary = db.Column(db.Text, nullable=True)
-    dialog_turns = db.relationship(
-        "PSDialogTurn",
-        secondary=annotationtherapist_dialogturn,
-        backref=db.backref("annotations_therapist", lazy="dynamic"),
-        lazy="dynamic",
-    )  # many-to-many relationship with PSDialogTurn class
+    id_first_dialog_turn = db.Column(
+        db.Integer, db.ForeignKey("ps_dialog_turn.id"), index=True
+    )  # first dialog turn of the annotated segment (page), which identifies the segment
+    first_dialog_turn = db.relationship(
+        "PSDialogTurn"
+    )  # many-to-one relationship with PSDialogTurn class
     id_user = db.Column(
         db.Integer, db.ForeignKey("user.id")
     )  # id of user (annotator) who created this annotation
@@ -504,23 +780,45 @@ class PSAnnotationDyad(db.Model):
     """
 
     __tablename__ = "ps_annotation_dyad"
+    __table_args__ = (
+        # for the search of the annotations of a dataset (newest first)
+        db.Index(
+            "ix_ps_annotation_dyad_id_dataset_timestamp", "id_dataset", "timestamp"
+        ),
+        # for the incremental export of the annotations of a dataset (range scan on modified)
+        db.Index("ix_ps_annotation_dyad_id_dataset_modified", "id_dataset", "modified"),
+        # for the search of the annotations of an annotator (see app/search/annotations.py)
+        db.Index(
+            "ix_ps_annotation_dyad_id_dataset_id_user_timestamp",
+            "id_dataset",
+            "id_user",
+            "timestamp",
+        ),
+        comments_search_index(
+            "ps_annotation_dyad",
+            ["comment_a", "comment_b", "comment_summary"],
+        ),
+    )
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(
         db.DateTime, index=True, default=datetime.utcnow
     )  # when annotation was created
-    label_a = db.Column(db.Enum(SubLabelsADyad), nullable=True, default=None)
-    label_b = db.Column(db.Enum(SubLabelsBDyad), nullable=True, default=None)
-    strength_a = db.Column(db.Enum(LabelStrengthADyad), nullable=True, default=None)
-    strength_b = db.Column(db.Enum(LabelStrengthBDyad), nullable=True, default=None)
+    modified = db.Column(
+        db.DateTime, index=True, default=utc_now(), onupdate=utc_now()
+    )  # when the row was last written, by the database (for the incremental exports)
+    label_a = db.Column(LabelCode(SubLabelsADyad), nullable=True, default=None)
+    label_b = db.Column(LabelCode(SubLabelsBDyad), nullable=True, default=None)
+    strength_a = db.Column(LabelCode(LabelStrengthADyad), nullable=True, default=None)
+    strength_b = db.Column(LabelCode(LabelStrengthBDyad), nullable=True, default=None)
     comment_a = db.Column(db.Text, nullable=True)
     comment_b = db.Column(db.Text, nullable=True)
     comment_summary = db.Column(db.Text, nullable=True)
-    dialog_turns = db.relationship(
-        "PSDialogTurn",
-        secondary=annotationsdyad_dialogturn,
-        backref=db.backref("annotations_dyad", lazy="dynamic"),
-        lazy="dynamic",
-    )  # many-to-many relationship with PSDialogTurn class
+    id_first_dialog_turn = db.Column(
+        db.Integer, db.ForeignKey("ps_dialog_turn.id"), index=True
+    )  # first dialog turn of the annotated segment (page), which identifies the segment
+    first_dialog_turn = db.relationship(
+        "PSDialogTurn"
+    )  # many-to-one relationship with PSDialogTurn class
     id_user = db.Column(
         db.Integer, db.ForeignKey("user.id")
     )  # id of user (annotator) who created this annotation
@@ -532,6 +830,45 @@ class PSAnnotationDyad(db.Model):
     )  # one-to-many relationship with EvidenceDyad class
 
 
+def add_comments_fts(table: db.Table):
+    """
+    Full-text search index of the comments of an annotation table on SQLite: an FTS5 table
+    (external content table, the comments are not copied), kept up to date by triggers
+    when annotations are added or deleted (see app/search/annotations.py)
+    """
+    fts = table.name + "_fts"
+    columns = [
+        column.name for column in table.columns if column.name.startswith("comment_")
+    ]
+    names = ", ".join(columns)
+    new_values = ", ".join("new." + column for column in columns)
+    old_values = ", ".join("old." + column for column in columns)
+    statements = [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({names}, content='{table.name}', "
+        "content_rowid='id', tokenize='porter unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER {fts}_insert AFTER INSERT ON {table.name} BEGIN "
+        f"INSERT INTO {fts} (rowid, {names}) VALUES (new.id, {new_values}); END",
+        f"CREATE TRIGGER {fts}_delete AFTER DELETE ON {table.name} BEGIN "
+        f"INSERT INTO {fts} ({fts}, rowid, {names}) "
+        f"VALUES ('delete', old.id, {old_values}); END",
+        f"CREATE TRIGGER {fts}_update AFTER UPDATE ON {table.name} BEGIN "
+        f"INSERT INTO {fts} ({fts}, rowid, {names}) "
+        f"VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {fts} (rowid, {names}) VALUES (new.id, {new_values}); END",
+    ]
+    for statement in statements:
+        event.listen(table, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+    event.listen(
+        table,
+        "before_drop",
+        DDL(f"DROP TABLE IF EXISTS {fts}").execute_if(dialect="sqlite"),
+    )
+
+
+for annotation_model in [PSAnnotationClient, PSAnnotationTherapist, PSAnnotationDyad]:
+    add_comments_fts(annotation_model.__table__)
+
+
 class EvidenceClient(db.Model):
     """Table to store the dialog events that are marked as evidence for a particular annotation for the client"""
 
@@ -541,7 +878,7 @@ class EvidenceClient(db.Model):
     id_ps_annotation_client = db.Column(
         db.Integer, db.ForeignKey("ps_annotation_client.id")
     )
-    label = db.Column(db.Enum(LabelNamesClient), nullable=True, default=None)
+    label = db.Column(LabelCode(LabelNamesClient), nullable=True, default=None)
 
 
 class EvidenceTherapist(db.Model):
@@ -553,7 +890,7 @@ class EvidenceTherapist(db.Model):
     id_ps_annotation_therapist = db.Column(
         db.Integer, db.ForeignKey("ps_annotation_therapist.id")
     )
-    label = db.Column(db.Enum(LabelNamesTherapist), nullable=True, default=None)
+    label = db.Column(LabelCode(LabelNamesTherapist), nullable=True, default=None)
 
 
 class EvidenceDyad(db.Model):
@@ -565,4 +902,64 @@ class EvidenceDyad(db.Model):
     id_ps_annotation_dyad = db.Column(
         db.Integer, db.ForeignKey("ps_annotation_dyad.id")
     )
-    label = db.Column(db.Enum(LabelNamesDyad), nullable=True, default=None)
+    label = db.Column(LabelCode(LabelNamesDyad), nullable=True, default=None)
+
+
+# for each speaker: the annotation table and the evidence table,
+# with the column pointing to the annotation
+ANNOTATION_TABLES = {
+    Speaker.client: (PSAnnotationClient, EvidenceClient, "id_ps_annotation_client"),
+    Speaker.therapist: (
+        PSAnnotationTherapist,
+        EvidenceTherapist,
+        "id_ps_annotation_therapist",
+    ),
+    Speaker.dyad: (PSAnnotationDyad, EvidenceDyad, "id_ps_annotation_dyad"),
+}
+
+
+def touch_annotations(id_dataset: int):
+    """
+    Stamp the annotations of a dataset as modified now (see utc_now), at the end of a long
+    write job which adds them (a clone or a restore), so that they are not behind the
+    watermark of an incremental export (see app/export/exporters.py) when it is committed
+    """
+    for model, _, _ in ANNOTATION_TABLES.values():
+        db.session.execute(
+            db.update(model)
+            .where(model.id_dataset == id_dataset)
+            .values(modified=utc_now())
+        )
+
+
+class PSAnnotationProgress(db.Model):
+    """
+    Number of segments of a psychotherapy dataset annotated by a user for a speaker.
+    Updated when a new annotation is added, in the same transaction.
+    """
+
+    __tablename__ = "ps_annotation_progress"
+    __table_args__ = (
+        db.UniqueConstraint("id_dataset", "id_user", "speaker"),
+    )  # one row per dataset, user and speaker
+    id = db.Column(db.Integer, primary_key=True)
+    id_dataset = db.Column(db.Integer, db.ForeignKey("dataset.id"))
+    id_user = db.Column(db.Integer, db.ForeignKey("user.id"))
+    speaker = db.Column(db.Enum(Speaker))
+    n_segments_annotated = db.Column(db.Integer, default=0)
+    next_page = db.Column(
+        db.Integer, default=1
+    )  # first segment (page) not annotated yet, for the "resume" link
+
+
+class PSAnnotatedSegment(db.Model):
+    """
+    Segments (pages) of a psychotherapy dataset annotated by a user for a speaker.
+    Used to update PSAnnotationProgress when a segment is annotated for the first time.
+    """
+
+    __tablename__ = "ps_annotated_segment"
+    id_dataset = db.Column(db.Integer, db.ForeignKey("dataset.id"), primary_key=True)
+    id_user = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    speaker = db.Column(db.Enum(Speaker), primary_key=True)
+    page = db.Column(db.Integer, primary_key=True)  # page number, starting from 1
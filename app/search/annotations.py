@@ -0,0 +1,194 @@
+"""
+Search of the psychotherapy annotations of a dataset, for one speaker:
+filters on the labels and strengths, the annotator and the creation date,
+full-text search of the comments, and keyset pagination (newest annotations first).
+The comments are indexed in FTS5 tables on SQLite and with GIN indexes on PostgreSQL
+(see add_comments_fts and comments_search_index in app/models.py).
+"""
+from bisect import bisect_right
+from datetime import datetime
+from app import db
+from app.models import ANNOTATION_TABLES, PSDialogTurn, User, comments_document
+from app.search.utils import fts_query, segment_starts
+from app.utils import Speaker
+
+
+def filter_columns(speaker: Speaker) -> list:
+    """The label and strength columns of the annotation table of a speaker"""
+    model = ANNOTATION_TABLES[speaker][0]
+    return [
+        column
+        for column in model.__table__.columns
+        if column.name.startswith(("label_", "strength_"))
+    ]
+
+
+def comment_columns(speaker: Speaker) -> list:
+    """The names of the comment columns of the annotation table of a speaker"""
+    model = ANNOTATION_TABLES[speaker][0]
+    return [
+        column.name
+        for column in model.__table__.columns
+        if column.name.startswith("comment_")
+    ]
+
+
+def encode_cursor(timestamp: datetime, id_annotation: int) -> str:
+    """Cursor of the next page of results: the last annotation on this page"""
+    return "{}_{}".format(timestamp.isoformat(), id_annotation)
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Timestamp and id of the annotation in a cursor, raises ValueError if invalid"""
+    timestamp, id_annotation = cursor.rsplit("_", 1)
+    return datetime.fromisoformat(timestamp), int(id_annotation)
+
+
+def search_annotations(
+    id_dataset: int,
+    speaker: Speaker,
+    labels: dict = None,
+    id_user: int = None,
+    since: datetime = None,
+    until: datetime = None,
+    text: str = None,
+    after: str = None,
+    latest: bool = True,
+    limit: int = 20,
+    time_interval: int = 300,
+) -> tuple:
+    """
+    Search the annotations of a psychotherapy dataset for a speaker.
+
+    Parameters
+    ----------
+    id_dataset : int
+        The id of the dataset
+    speaker : Speaker
+        The speaker of the annotations
+    labels : dict, optional
+        Label and strength values to match, e.g. {"label_d": "hard_negative", "strength_d": "high"}
+    id_user : int, optional
+        Only the annotations of this annotator
+    since, until : datetime, optional
+        Only the annotations created in [since, until)
+    text : str, optional
+        Words to search for in the comments (see fts_query for the syntax on SQLite,
+        websearch_to_tsquery is used on PostgreSQL)
+    after : str, optional
+        Cursor returned with the previous page of results
+    latest : bool
+        Only the latest annotation of each annotator for each segment (default),
+        since an annotation is replaced when the segment is annotated again
+    limit : int
+        The maximum number of annotations returned
+    time_interval : int
+        The time interval of the segments (pages) in seconds
+
+    Returns
+    -------
+    annotations : list
+        The annotations, newest first. Each annotation is a dict with its id, timestamp,
+        annotator, labels and strengths, comments, and the page of its segment
+    next_cursor : str
+        Cursor of the next page of results, None if this is the last page
+
+    Raises
+    ------
+    ValueError
+        If a label or strength column or value, or the cursor, is not valid
+    """
+    model = ANNOTATION_TABLES[speaker][0]
+    columns = {column.name: column for column in filter_columns(speaker)}
+    query = (
+        db.select(model, User.username)
+        .join(User, User.id == model.id_user)
+        .where(model.id_dataset == id_dataset)
+    )
+    for name, value in (labels or {}).items():
+        if name not in columns:
+            raise ValueError("Unknown label: " + name)
+        if value not in columns[name].type.enum_class.__members__:
+            raise ValueError("Unknown value of {}: {}".format(name, value))
+        query = query.where(columns[name] == columns[name].type.enum_class[value])
+    if id_user is not None:
+        query = query.where(model.id_user == id_user)
+    if since is not None:
+        query = query.where(model.timestamp >= since)
+    if until is not None:
+        query = query.where(model.timestamp < until)
+    if text:
+        if db.engine.dialect.name == "sqlite":
+            fts = model.__tablename__ + "_fts"
+            text = fts_query(text)
+            if not text:
+                return [], None
+            matches = db.text(f"SELECT rowid FROM {fts} WHERE {fts} MATCH :text")
+        else:
+            document = comments_document(comment_columns(speaker))
+            matches = db.text(
+                f"SELECT id FROM {model.__tablename__} "
+                f"WHERE to_tsvector('english', {document}) "
+                "@@ websearch_to_tsquery('english', :text)"
+            )
+        query = query.where(
+            model.id.in_(matches.bindparams(text=text).columns(db.column("id")))
+        )
+    if latest:
+        # no newer annotation of the same annotator on the same segment
+        # (of the same dataset: the dialog turns can be shared by several datasets)
+        newer = model.__table__.alias("newer")
+        query = query.where(
+            ~db.exists()
+            .where(newer.c.id_first_dialog_turn == model.id_first_dialog_turn)
+            .where(newer.c.id_user == model.id_user)
+            .where(newer.c.id_dataset == model.id_dataset)
+            .where(newer.c.id > model.id)
+        )
+    if after:
+        timestamp, id_annotation = decode_cursor(after)
+        query = query.where(
+            db.tuple_(model.timestamp, model.id) < (timestamp, id_annotation)
+        )
+    query = query.order_by(model.timestamp.desc(), model.id.desc()).limit(limit + 1)
+    rows = db.session.execute(query).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][0].timestamp, rows[-1][0].id)
+
+    # first dialog turn of each annotation, to find the page of its segment
+    first_turns = dict(
+        db.session.execute(
+            db.select(PSDialogTurn.id, PSDialogTurn.timestamp).where(
+                PSDialogTurn.id.in_(
+                    {row[0].id_first_dialog_turn for row in rows} - {None}
+                )
+            )
+        ).all()
+    )
+    starts = segment_starts(id_dataset, time_interval)
+    annotations = []
+    for annotation, username in rows:
+        start_time = first_turns.get(annotation.id_first_dialog_turn)
+        annotations.append(
+            {
+                "id": annotation.id,
+                "timestamp": annotation.timestamp.isoformat(),
+                "annotator": username,
+                "labels": {
+                    name: getattr(annotation, name).name
+                    for name in columns
+                    if getattr(annotation, name) is not None
+                },
+                "comments": {
+                    name: getattr(annotation, name)
+                    for name in comment_columns(speaker)
+                    if getattr(annotation, name)
+                },
+                "page": bisect_right(starts, start_time)
+                if start_time is not None
+                else None,
+            }
+        )
+    return annotations, next_cursor
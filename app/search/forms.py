@@ -0,0 +1,28 @@
+"""
+Search forms for the app
+"""
+from flask_wtf import FlaskForm
+from wtforms import SelectField, StringField, SubmitField
+from wtforms.validators import DataRequired, Length
+
+
+class SearchForm(FlaskForm):
+    """Full-text search form for the dialog events of a psychotherapy dataset"""
+
+    class Meta:
+        csrf = (
+            False  # the form is submitted with GET, the search does not change anything
+        )
+
+    q = StringField("Search", validators=[DataRequired(), Length(max=200)])
+    speaker = SelectField(
+        "Speaker",
+        choices=[
+            ("", "All speakers"),
+            ("Client", "Client"),
+            ("Therapist", "Therapist"),
+            ("Annotator", "Annotator"),
+        ],
+        default="",
+    )
+    submit = SubmitField("Search")
@@ -0,0 +1,174 @@
+from app.search import bp
+from app.search.forms import SearchForm
+from app.search.utils import search_events
+from app.search.annotations import search_annotations, filter_columns
+from app.models import Dataset, User
+from app.utils import (
+    DatasetType,
+    Speaker,
+    LabelNamesClient,
+    LabelNamesTherapist,
+    LabelNamesDyad,
+)
+from datetime import datetime
+from flask import abort, current_app, jsonify, render_template, request, url_for
+from flask_login import login_required, current_user
+
+
+LABEL_NAMES = {
+    Speaker.client: LabelNamesClient,
+    Speaker.therapist: LabelNamesTherapist,
+    Speaker.dyad: LabelNamesDyad,
+}
+
+
+def get_dataset(dataset_id: int) -> Dataset:
+    """
+    Get a psychotherapy dataset that the current user can search (author, annotator
+    or administrator), or abort with 404 or 403
+    """
+    dataset = Dataset.query.get_or_404(dataset_id)
+    if dataset.type != DatasetType.psychotherapy:
+        abort(404)
+    if not (
+        current_user.is_administrator()
+        or dataset.id_author == current_user.id
+        or dataset.annotators.filter_by(id=current_user.id).count()
+    ):
+        abort(403)
+    return dataset
+
+
+@bp.route("/<int:dataset_id>")
+@login_required
+def search_dataset(dataset_id: int):
+    """
+    Full-text search of the dialog events of a psychotherapy dataset.
+    The hits are ranked by relevance and link to the page they are on.
+    The query string contains the words to search for (`q`), optionally a speaker
+    (`speaker`) and the page of results (`page`). With `format=json`, the hits are
+    returned as JSON.
+    """
+    dataset = get_dataset(dataset_id)
+    form = SearchForm(request.args)
+    page = request.args.get("page", 1, type=int)
+    per_page = current_app.config["SEARCH_RESULTS_PER_PAGE"]
+    hits, total = [], 0
+    if form.validate():
+        hits, total = search_events(
+            dataset.content_id,  # the dialog events can be shared with another dataset
+            form.q.data,
+            speaker=form.speaker.data or None,
+            limit=per_page,
+            offset=(max(page, 1) - 1) * per_page,
+            time_interval=current_app.config["PS_MINS_PER_PAGE"] * 60,
+        )
+    if request.args.get("format") == "json":
+        return jsonify(dataset=dataset.id, total=total, page=page, hits=hits)
+    args = {"q": form.q.data, "speaker": form.speaker.data}
+    prev_url = next_url = None
+    if page > 1:
+        prev_url = url_for(
+            "search.search_dataset", dataset_id=dataset.id, page=page - 1, **args
+        )
+    if page * per_page < total:
+        next_url = url_for(
+            "search.search_dataset", dataset_id=dataset.id, page=page + 1, **args
+        )
+    return render_template(
+        "search/search.html",
+        title="Search",
+        dataset=dataset,
+        form=form,
+        hits=hits,
+        total=total,
+        page=page,
+        prev_url=prev_url,
+        next_url=next_url,
+    )
+
+
+@bp.route("/<int:dataset_id>/annotations")
+@login_required
+def search_dataset_annotations(dataset_id: int):
+    """
+    Search the annotations of a psychotherapy dataset for a speaker (`speaker`, default
+    client), newest first. The query string can contain:
+    - label and strength values, e.g. `label_d=hard_negative&strength_d=very_adaptive`
+    - `annotator`: id of the annotator
+    - `since` and `until`: creation dates (ISO format, UTC)
+    - `q`: words to search for in the comments
+    - `all_versions=1`: include the annotations replaced by a newer one
+    - `after`: cursor of the next page of results (keyset pagination)
+    With `format=json`, the annotations are returned as JSON.
+    """
+    dataset = get_dataset(dataset_id)
+    try:
+        speaker = Speaker(request.args.get("speaker", "client"))
+    except ValueError:
+        abort(400)
+    columns = filter_columns(speaker)
+    labels = {
+        column.name: request.args[column.name]
+        for column in columns
+        if request.args.get(column.name)
+    }
+    since = request.args.get("since", type=datetime.fromisoformat)
+    until = request.args.get("until", type=datetime.fromisoformat)
+    for name, value in [("since", since), ("until", until)]:
+        if request.args.get(name) and value is None:
+            abort(400)  # invalid date
+    try:
+        annotations, next_cursor = search_annotations(
+            dataset.id,
+            speaker,
+            labels=labels,
+            id_user=request.args.get("annotator", type=int),
+            since=since,
+            until=until,
+            text=request.args.get("q"),
+            after=request.args.get("after"),
+            latest=not request.args.get("all_versions"),
+            limit=current_app.config["SEARCH_RESULTS_PER_PAGE"],
+            time_interval=current_app.config["PS_MINS_PER_PAGE"] * 60,
+        )
+    except ValueError:
+        abort(400)  # unknown label or value, or invalid cursor
+    next_url = None
+    if next_cursor:
+        args = request.args.to_dict()
+        args["after"] = next_cursor
+        next_url = url_for(
+            "search.search_dataset_annotations", dataset_id=dataset.id, **args
+        )
+    if request.args.get("format") == "json":
+        return jsonify(
+            dataset=dataset.id,
+            speaker=speaker.value,
+            annotations=annotations,
+            next=next_url,
+        )
+    label_names = {label.name: label.value for label in LABEL_NAMES[speaker]}
+    filters = [
+        {
+            "name": column.name,
+            "title": label_names[column.name]
+            if column.name.startswith("label_")
+            else label_names["label_" + column.name[-1]] + " strength",
+            "choices": [(value.name, value.value) for value in column.type.enum_class],
+        }
+        for column in columns
+    ]
+    return render_template(
+        "search/annotations.html",
+        title="Search annotations",
+        dataset=dataset,
+        speaker=speaker,
+        speakers=list(Speaker),
+        filters=filters,
+        titles={item["name"]: item["title"] for item in filters},
+        choices={item["name"]: dict(item["choices"]) for item in filters},
+        annotators=dataset.annotators.order_by(User.username).all(),
+        annotations=annotations,
+        next_url=next_url,
+    )
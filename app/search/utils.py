@@ -0,0 +1,315 @@
+"""
+Full-text search over the dialog events of the psychotherapy datasets.
+On SQLite, the text of the events is indexed in an FTS5 table (PS_DIALOG_EVENT_FTS),
+filled when a dataset is uploaded. On PostgreSQL, a GIN index on the tsvector of the text
+is kept up to date by the database (see PSDialogEvent). In both cases, the hits are
+ranked by relevance (BM25 on SQLite, ts_rank on PostgreSQL), with a snippet of the text
+where the matching words are highlighted, and the page (segment) they are on.
+"""
+import re
+import threading
+from bisect import bisect_right
+from markupsafe import Markup, escape
+from app import db
+from app.annotate.utils import split_dialog_turns
+from app.models import Dataset, PSDialogTurn, PS_DIALOG_EVENT_FTS
+
+# the matching words in the snippets are delimited with these characters,
+# which are replaced with <mark> tags once the text is escaped (see highlight)
+MARK_START = "\x02"
+MARK_END = "\x03"
+SNIPPET_WORDS = 16  # approximate number of words in a snippet
+
+# start times of the segments (pages) of each dataset:
+# (dataset id, time interval) -> (version of the dataset, list)
+_segment_starts = {}
+_segment_starts_lock = threading.Lock()
+
+SQLITE_SEARCH = f"""
+SELECT e.id, e.event_n, e.event_speaker, t.c_code, t.session_n, t.timestamp,
+    -bm25({PS_DIALOG_EVENT_FTS}) AS score
+FROM {PS_DIALOG_EVENT_FTS}
+JOIN ps_dialog_event AS e ON e.id = {PS_DIALOG_EVENT_FTS}.rowid
+JOIN ps_dialog_turn AS t ON t.id = e.id_ps_dialog_turn
+WHERE {PS_DIALOG_EVENT_FTS} MATCH :query AND e.id_dataset = :id_dataset {{speaker}}
+ORDER BY bm25({PS_DIALOG_EVENT_FTS}), e.id
+LIMIT :limit OFFSET :offset
+"""
+
+# the snippets are only computed for the hits on the current page of results
+SQLITE_SNIPPETS = f"""
+SELECT rowid, snippet({PS_DIALOG_EVENT_FTS}, 0, :start, :end, '…', {SNIPPET_WORDS})
+FROM {PS_DIALOG_EVENT_FTS}
+WHERE {PS_DIALOG_EVENT_FTS} MATCH :query AND rowid IN ({{ids}})
+"""
+
+SQLITE_COUNT = f"""
+SELECT count(*)
+FROM {PS_DIALOG_EVENT_FTS}
+JOIN ps_dialog_event AS e ON e.id = {PS_DIALOG_EVENT_FTS}.rowid
+WHERE {PS_DIALOG_EVENT_FTS} MATCH :query AND e.id_dataset = :id_dataset {{speaker}}
+"""
+
+# to_tsvector('english', event_plaintext) is the expression of the GIN index
+POSTGRES_SEARCH = f"""
+SELECT hit.*, ts_headline('english', hit.event_plaintext,
+    websearch_to_tsquery('english', :query),
+    'StartSel={MARK_START}, StopSel={MARK_END}, MaxWords={SNIPPET_WORDS}, MinWords=5,
+    MaxFragments=2, FragmentDelimiter=" … "') AS snippet
+FROM (
+    SELECT e.id, e.event_n, e.event_speaker, e.event_plaintext,
+        t.c_code, t.session_n, t.timestamp,
+        ts_rank(to_tsvector('english', e.event_plaintext),
+            websearch_to_tsquery('english', :query)) AS score
+    FROM ps_dialog_event AS e
+    JOIN ps_dialog_turn AS t ON t.id = e.id_ps_dialog_turn
+    WHERE to_tsvector('english', e.event_plaintext)
+        @@ websearch_to_tsquery('english', :query)
+        AND e.id_dataset = :id_dataset {{speaker}}
+    ORDER BY score DESC, e.id
+    LIMIT :limit OFFSET :offset
+) AS hit
+ORDER BY hit.score DESC, hit.id
+"""
+
+POSTGRES_COUNT = """
+SELECT count(*)
+FROM ps_dialog_event AS e
+WHERE to_tsvector('english', e.event_plaintext)
+    @@ websearch_to_tsquery('english', :query)
+    AND e.id_dataset = :id_dataset {speaker}
+"""
+
+
+def fts_query(query: str) -> str:
+    """
+    Convert a search query typed by a user to an FTS5 query, so that FTS5 syntax errors
+    cannot happen: the words must all be in the text, in any order, "quoted words"
+    must be next to each other, and a word ending with * matches any word starting with it.
+    Returns an empty string if there are no words to search for.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"?|(\S+)', query):
+        term = phrase or word.replace('"', "")
+        if not re.search(r"\w", term):
+            continue
+        prefix = word.endswith("*")
+        terms.append('"{}"{}'.format(term.rstrip("*"), "*" if prefix else ""))
+    return " ".join(terms)
+
+
+def highlight(snippet: str) -> Markup:
+    """Escape the text of a snippet and highlight the matching words with <mark> tags"""
+    escaped = str(escape(snippet))
+    return Markup(escaped.replace(MARK_START, "<mark>").replace(MARK_END, "</mark>"))
+
+
+def segment_starts(id_dataset: int, time_interval: int = 300) -> list:
+    """
+    Return the start times of the segments (pages) of a psychotherapy dataset,
+    see split_dialog_turns. The start times are cached (in each process).
+    The dialog turns are those of the contents of the dataset (see Dataset.id_content).
+    The cached start times are used while the version of the dataset is the same
+    (a new version can change its dialog turns, see app/upload/diff.py), and its upload
+    time too, as the id of a deleted dataset can be reused (see app/admin/delete.py).
+    """
+    key = (id_dataset, time_interval)
+    version = db.session.execute(
+        db.select(Dataset.version, Dataset.timestamp).where(Dataset.id == id_dataset)
+    ).one_or_none()
+    with _segment_starts_lock:
+        cached = _segment_starts.get(key)
+    if cached is not None and cached[0] == version:
+        starts = cached[1]
+    else:
+        id_content = (
+            db.select(db.func.coalesce(Dataset.id_content, Dataset.id))
+            .where(Dataset.id == id_dataset)
+            .scalar_subquery()
+        )
+        timestamps = db.session.execute(
+            db.select(PSDialogTurn.timestamp)
+            .where(PSDialogTurn.id_dataset == id_content)
+            .order_by(PSDialogTurn.timestamp)
+        ).all()
+        starts = (
+            [
+                segment[0].timestamp
+                for segment in split_dialog_turns(timestamps, time_interval)
+            ]
+            if timestamps
+            else []
+        )
+        with _segment_starts_lock:
+            _segment_starts[key] = version, starts
+    return starts
+
+
+def index_dataset_events(id_dataset: int):
+    """
+    Add the dialog events of a dataset to the full-text search index.
+    Only needed on SQLite (FTS5 table), PostgreSQL maintains its index itself.
+    The events must already be flushed to the database. Their text is indexed
+    decompressed (see app/compression.py).
+    """
+    if db.engine.dialect.name != "sqlite":
+        return
+    db.session.execute(
+        db.text(
+            f"INSERT INTO {PS_DIALOG_EVENT_FTS} (rowid, event_plaintext) "
+            "SELECT id, decompress_text(event_plaintext) FROM ps_dialog_event "
+            "WHERE id_dataset = :id"
+        ),
+        {"id": id_dataset},
+    )
+
+
+def index_events(ids: list):
+    """
+    Add some dialog events (ids) to the full-text search index (SQLite only),
+    e.g. the events added or changed by a new version of a dataset.
+    """
+    if db.engine.dialect.name != "sqlite" or not ids:
+        return
+    db.session.execute(
+        db.text(
+            f"INSERT INTO {PS_DIALOG_EVENT_FTS} (rowid, event_plaintext) "
+            "SELECT id, decompress_text(event_plaintext) FROM ps_dialog_event "
+            "WHERE id IN :ids"
+        ).bindparams(db.bindparam("ids", expanding=True)),
+        {"ids": ids},
+    )
+
+
+def unindex_events(ids: list):
+    """
+    Remove some dialog events (ids) from the full-text search index (SQLite only).
+    It must run before the events are changed or deleted: the FTS5 table does not
+    store the text, its old text is needed to remove an event.
+    """
+    if db.engine.dialect.name != "sqlite" or not ids:
+        return
+    db.session.execute(
+        db.text(
+            f"INSERT INTO {PS_DIALOG_EVENT_FTS} ({PS_DIALOG_EVENT_FTS}, rowid, "
+            "event_plaintext) SELECT 'delete', id, "
+            "decompress_text(event_plaintext) "
+            "FROM ps_dialog_event WHERE id IN :ids"
+        ).bindparams(db.bindparam("ids", expanding=True)),
+        {"ids": ids},
+    )
+
+
+def rebuild_search_index():
+    """Rebuild the full-text search index from all the dialog events (SQLite only)"""
+    if db.engine.dialect.name != "sqlite":
+        return
+    db.session.execute(
+        db.text(
+            f"INSERT INTO {PS_DIALOG_EVENT_FTS} ({PS_DIALOG_EVENT_FTS}) VALUES ('rebuild')"
+        )
+    )
+
+
+def search_events(
+    id_dataset: int,
+    query: str,
+    speaker: str = None,
+    limit: int = 20,
+    offset: int = 0,
+    time_interval: int = 300,
+) -> tuple:
+    """
+    Search the dialog events of a psychotherapy dataset.
+
+    Parameters
+    ----------
+    id_dataset : int
+        The id of the dataset
+    query : str
+        The words to search for (see fts_query for the syntax on SQLite,
+        websearch_to_tsquery is used on PostgreSQL)
+    speaker : str, optional
+        Only search the events of this speaker, e.g. "Client"
+    limit : int
+        The maximum number of hits returned
+    offset : int
+        The number of hits to skip, for the next pages of results
+    time_interval : int
+        The time interval of the segments (pages) in seconds
+
+    Returns
+    -------
+    hits : list
+        The hits, most relevant first. Each hit is a dict with the event id, number,
+        speaker, patient (c_code), session number, timestamp of its dialog turn,
+        relevance score, page of the segment it is on and snippet (Markup)
+    total : int
+        The total number of hits
+    """
+    params = {
+        "query": query,
+        "id_dataset": id_dataset,
+        "limit": limit,
+        "offset": offset,
+    }
+    speaker_filter = ""
+    if speaker:
+        speaker_filter = "AND e.event_speaker = :speaker"
+        params["speaker"] = speaker
+    if db.engine.dialect.name == "sqlite":
+        params["query"] = fts_query(query)
+        if not params["query"]:
+            return [], 0
+        search_sql, count_sql = SQLITE_SEARCH, SQLITE_COUNT
+    else:
+        search_sql, count_sql = POSTGRES_SEARCH, POSTGRES_COUNT
+    rows = (
+        db.session.execute(
+            db.text(search_sql.format(speaker=speaker_filter)).columns(
+                timestamp=db.Time
+            ),
+            params,
+        )
+        .mappings()
+        .all()
+    )
+    if not rows:
+        total = count_hits(count_sql, speaker_filter, params) if offset else 0
+        return [], total
+    if db.engine.dialect.name == "sqlite":
+        snippets = dict(
+            db.session.execute(
+                db.text(
+                    SQLITE_SNIPPETS.format(ids=", ".join(str(row.id) for row in rows))
+                ),
+                {"query": params["query"], "start": MARK_START, "end": MARK_END},
+            ).all()
+        )
+    else:
+        snippets = {row.id: row.snippet for row in rows}
+    starts = segment_starts(id_dataset, time_interval)
+    hits = [
+        {
+            "id": row.id,
+            "event_n": row.event_n,
+            "speaker": row.event_speaker,
+            "c_code": row.c_code,
+            "session_n": row.session_n,
+            "timestamp": row.timestamp.isoformat(),
+            "score": float(row.score),
+            "page": bisect_right(starts, row.timestamp),
+            "snippet": highlight(snippets[row.id]),
+        }
+        for row in rows
+    ]
+    if offset == 0 and len(rows) < limit:
+        return hits, len(rows)  # all the hits are on the first page
+    return hits, count_hits(count_sql, speaker_filter, params)
+
+
+def count_hits(count_sql: str, speaker_filter: str, params: dict) -> int:
+    """Count all the hits of a search (see search_events)"""
+    return db.session.execute(
+        db.text(count_sql.format(speaker=speaker_filter)), params
+    ).scalar()
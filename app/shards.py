@@ -0,0 +1,294 @@
+"""
+Per-dataset database files (sharding mode, see SHARD_DATASETS in config.py), on SQLite.
+The catalog (users, roles, datasets with their annotators, statistics and text
+dictionaries) stays in the main database file, and the rows of each new dataset
+(dialog turns and events or posts and replies, annotations, annotation progress,
+search index) are stored in a database file of its own (a shard) in the SHARD_FOLDER.
+The uploads and annotations of a dataset then only lock its own file, so the writes
+to different datasets run in parallel, and each file can be vacuumed and backed up
+on its own.
+
+The file of a shard is used through an engine of its own, whose connections attach
+the main database file as "catalog". SQLite looks up unqualified table names in the
+main database of a connection (the shard) first, then in the attached ones, so the
+queries, and the joins between the rows of a dataset and the catalog, do not change.
+The session sends all its statements to the engine of the current shard of the
+session (see ShardSession), which is selected from the dataset of the request
+(dataset_id in the URL), by the write jobs (see app/writer.py) and by the commands.
+The datasets uploaded before sharding was enabled (Dataset.shard is NULL) stay in the
+main database file. The datasets sharing their contents (see Dataset.content_id)
+and the clones of a dataset share its shard.
+"""
+import os
+import sqlite3
+import threading
+import uuid
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+# the tables which stay in the main database file, the other tables are in the shards
+CATALOG_TABLES = {
+    "user",
+    "role",
+    "dataset",
+    "dataset_annotator",
+    "dataset_stats",
+    "text_dictionary",
+    "label_vocabulary",
+}
+CATALOG = "catalog"  # schema name of the main database file in the shard connections
+
+
+class ShardSession(Session):
+    """
+    Session which sends its statements to the engine of its current shard
+    (see use_shard), or to the engine of the main database if none is selected.
+    All the statements of the session go to the shard, whatever the table, so that
+    a transaction writing to a shard and to the catalog uses a single connection.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        shard = self.info.get("shard")
+        if bind is None and shard is not None:
+            return current_app.extensions["shards"].engine(shard)
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
+class Shards:
+    """The engines of the shards of an application, created when first used"""
+
+    def __init__(self, app, db):
+        self.db = db
+        self.folder = app.config["SHARD_FOLDER"]
+        self.catalog_path = os.path.abspath(db.engine.url.database)
+        self.engine_options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+        self.pragmas = app.config["SQLITE_PRAGMAS"]
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def path(self, shard: str) -> str:
+        """The path of the database file of a shard"""
+        return os.path.join(self.folder, shard)
+
+    def engine(self, shard: str) -> Engine:
+        """The engine of a shard, created on first use"""
+        with self._lock:
+            engine = self._engines.get(shard)
+            if engine is None:
+                engine = self._engines[shard] = self._create_engine(shard)
+        return engine
+
+    def _create_engine(self, shard: str) -> Engine:
+        from app.database import (
+            dispose_after_fork,
+            register_sqlite_decompression,
+            register_sqlite_pragmas,
+        )
+
+        engine = create_engine("sqlite:///" + self.path(shard), **self.engine_options)
+        # new processes (e.g. forked gunicorn workers) start with empty connection pools
+        dispose_after_fork(engine)
+        if self.pragmas:
+            register_sqlite_pragmas(engine, self.pragmas)
+        register_sqlite_decompression(engine)
+        catalog_path = self.catalog_path
+
+        @event.listens_for(engine, "connect")
+        def attach_catalog(dbapi_connection, connection_record):
+            dbapi_connection.execute(
+                f"ATTACH DATABASE ? AS {CATALOG}", (catalog_path,)
+            ).close()
+
+        return engine
+
+    def create(self) -> str:
+        """Create the database file of a new shard, with its tables. Returns its name."""
+        os.makedirs(self.folder, exist_ok=True)
+        shard = "dataset-{}.db".format(uuid.uuid4().hex)
+        self.db.metadata.create_all(
+            self.engine(shard),
+            tables=[
+                table
+                for table in self.db.metadata.sorted_tables
+                if table.name not in CATALOG_TABLES
+            ],
+        )
+        return shard
+
+    def files(self) -> list:
+        """The names of the shard files in the folder, used by a dataset or not"""
+        if not os.path.isdir(self.folder):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(self.folder)
+            if name.startswith("dataset-") and name.endswith(".db")
+        )
+
+    def remove(self, shard: str):
+        """Close the connections of a shard and delete its database file"""
+        with self._lock:
+            engine = self._engines.pop(shard, None)
+        if engine is not None:
+            engine.dispose()
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(self.path(shard) + suffix):
+                os.remove(self.path(shard) + suffix)
+
+
+def init_app(app, db):
+    """
+    Enable the sharding mode of the app if SHARD_DATASETS is set: the rows of the
+    datasets are read from and written to the shard of the dataset of the request
+    """
+    if not app.config["SHARD_DATASETS"]:
+        return
+    url = db.engine.url
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        raise ValueError("SHARD_DATASETS needs a SQLite database file")
+    app.extensions["shards"] = Shards(app, db)
+
+    @app.url_value_preprocessor
+    def use_request_shard(endpoint, values):
+        if values and "dataset_id" in values:
+            use_dataset_shard(values["dataset_id"])
+
+
+def sharding_enabled() -> bool:
+    """Check if the datasets of the current app are stored in shards"""
+    return "shards" in current_app.extensions
+
+
+def current_shard() -> str:
+    """The shard selected in the current session (None for the main database)"""
+    from app import db
+
+    return db.session.info.get("shard")
+
+
+def use_shard(shard: str):
+    """
+    Select the shard the current session reads from and writes to (None for the main
+    database). The rows added or changed since the last flush are written to the new
+    shard, so the shard is selected before the rows of a dataset are touched.
+    """
+    from app import db
+
+    if shard is None:
+        db.session.info.pop("shard", None)
+    else:
+        db.session.info["shard"] = shard
+
+
+def dataset_shard(id_dataset: int) -> str:
+    """The shard of a dataset (None if its rows are in the main database)"""
+    from app import db
+    from app.models import Dataset
+
+    return db.session.scalar(
+        db.select(Dataset.shard).where(Dataset.id == id_dataset),
+        bind_arguments={"bind": db.engine},  # the catalog is in the main database
+    )
+
+
+def use_dataset_shard(id_dataset: int):
+    """Select the shard of a dataset in the current session, in sharding mode"""
+    if sharding_enabled():
+        use_shard(dataset_shard(id_dataset))
+
+
+def use_new_shard() -> str:
+    """
+    Create a new shard and select it in the current session, in sharding mode,
+    for a new dataset. Returns its name, to store in Dataset.shard (None if sharding
+    is not enabled).
+    """
+    if not sharding_enabled():
+        return None
+    shard = current_app.extensions["shards"].create()
+    use_shard(shard)
+    return shard
+
+
+def all_shards() -> list:
+    """The shards of the datasets, and None for the main database"""
+    from app import db
+    from app.models import Dataset
+
+    if not sharding_enabled():
+        return [None]
+    shards = db.session.scalars(
+        db.select(Dataset.shard)
+        .where(Dataset.shard.is_not(None))
+        .distinct()
+        .order_by(Dataset.shard),
+        bind_arguments={"bind": db.engine},
+    ).all()
+    return [None] + shards
+
+
+def dataset_shards(id_dataset: int = None) -> list:
+    """
+    The shards with the rows of a dataset, or of all the datasets if id_dataset
+    is None (see all_shards)
+    """
+    if id_dataset is None:
+        return all_shards()
+    return [dataset_shard(id_dataset) if sharding_enabled() else None]
+
+
+def shard_engine(shard: str) -> Engine:
+    """The engine of a shard (of the main database for None)"""
+    from app import db
+
+    if shard is None:
+        return db.engine
+    return current_app.extensions["shards"].engine(shard)
+
+
+def shard_path(shard: str) -> str:
+    """The path of the database file of a shard (of the main database for None)"""
+    return os.path.abspath(shard_engine(shard).url.database)
+
+
+def vacuum_shard(shard: str):
+    """Rebuild the database file of a shard (of the main database for None)"""
+    with shard_engine(shard).connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    ) as connection:
+        connection.exec_driver_sql("VACUUM")  # only the main schema, not the catalog
+
+
+def backup_shard(shard: str, path: str):
+    """
+    Copy the database file of a shard (of the main database for None) to path,
+    with the SQLite online backup API: the copy is consistent even if the database
+    is written to during the backup
+    """
+    connection = shard_engine(shard).raw_connection()
+    target = sqlite3.connect(path)
+    try:
+        connection.driver_connection.backup(target)
+    finally:
+        target.close()
+        connection.close()
+
+
+def remove_unused_shard(shard: str):
+    """Delete the database file of a shard if no dataset uses it anymore"""
+    from app import db
+    from app.models import Dataset
+
+    if shard is None or not sharding_enabled():
+        return
+    n_datasets = db.session.scalar(
+        db.select(db.func.count()).where(Dataset.shard == shard),
+        bind_arguments={"bind": db.engine},
+    )
+    if not n_datasets:
+        if current_shard() == shard:
+            use_shard(None)
+        db.session.rollback()  # return the connection to the shard before it is deleted
+        current_app.extensions["shards"].remove(shard)
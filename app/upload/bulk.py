@@ -0,0 +1,188 @@
+"""
+Bulk import of the dataset files of a directory (see `flask import-datasets`).
+The files are read and converted to table rows (see sm_dict_to_rows and
+psychotherapy_df_to_rows) in a pool of worker processes, which do not use the database.
+The rows are written by the main process only, through the write queue, one transaction
+per file, so that a file which cannot be imported does not stop the import of the others.
+"""
+import csv
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from flask import current_app
+from app import db, write_queue
+from app.annotate.utils import count_segments
+from app.models import Dataset, User
+from app.upload.parsers import (
+    psychotherapy_df_to_rows,
+    psychotherapy_rows_to_sql,
+    read_pickle,
+    sm_dict_to_rows,
+    sm_rows_to_sql,
+)
+from app.shards import use_new_shard
+from app.upload.storage import hash_file
+from app.utils import DatasetType
+
+DATASET_EXTENSIONS = {"pickle", "pkl", "parquet"}
+
+
+def find_dataset_files(directory: str) -> list:
+    """The pickle and Parquet files of a directory, sorted by name"""
+    return sorted(
+        os.path.join(directory, filename)
+        for filename in os.listdir(directory)
+        if filename.rsplit(".", 1)[-1].lower() in DATASET_EXTENSIONS
+        and os.path.isfile(os.path.join(directory, filename))
+    )
+
+
+def read_manifest(path: str) -> dict:
+    """
+    Read a CSV manifest of the files to import, with a "file" column and optional
+    "name", "description" and "annotators" columns (usernames separated by spaces).
+    Returns a dict: file name -> row.
+    """
+    with open(path, newline="") as handle:
+        return {
+            os.path.basename(row["file"]): row
+            for row in csv.DictReader(handle)
+            if row.get("file")
+        }
+
+
+def read_dataset_file(path: str) -> tuple:
+    """
+    Read a dataset file: a pickle file with a social media dictionary or a psychotherapy
+    dataframe, or a Parquet file with a psychotherapy dataframe.
+    Returns the type of the dataset and its data, raises ValueError for other contents.
+    """
+    if path.lower().endswith(".parquet"):
+        import pandas as pd
+
+        return DatasetType.psychotherapy, pd.read_parquet(path)
+    data = read_pickle(path)
+    if isinstance(data, dict):
+        return DatasetType.sm_thread, data
+    if type(data).__name__ == "DataFrame":
+        return DatasetType.psychotherapy, data
+    raise ValueError("not a dataset: " + type(data).__name__)
+
+
+def parse_dataset_file(path: str) -> tuple:
+    """
+    Read a dataset file and convert it to table rows (runs in a worker process).
+    Returns the type of the dataset, its rows and the SHA-256 of the file.
+    """
+    dataset_type, data = read_dataset_file(path)
+    if dataset_type == DatasetType.sm_thread:
+        return dataset_type, sm_dict_to_rows(data), hash_file(path)
+    return dataset_type, psychotherapy_df_to_rows(data), hash_file(path)
+
+
+def save_imported_dataset(
+    dataset_type: DatasetType,
+    rows: dict,
+    name: str,
+    description: str,
+    id_author: int,
+    id_annotators: list,
+    time_interval: int = 300,
+    file_sha256: str = None,
+) -> int:
+    """
+    Write job for the write queue (see app/writer.py): create a new dataset and
+    add its rows (see parse_dataset_file) to the database session.
+    Returns the id of the new dataset.
+    """
+    shard = use_new_shard()  # in sharding mode, before anything is written
+    dataset = Dataset(
+        name=name,
+        description=description,
+        author=db.session.get(User, id_author),
+        type=dataset_type,
+        file_sha256=file_sha256,  # so that later uploads of the same file are found
+        shard=shard,
+    )
+    db.session.add(dataset)
+    for id_annotator in id_annotators:
+        dataset.annotators.append(db.session.get(User, id_annotator))
+    if dataset_type == DatasetType.sm_thread:
+        sm_rows_to_sql(rows, dataset)
+    else:
+        psychotherapy_rows_to_sql(rows, dataset)
+        db.session.flush()
+        dataset.n_segments = count_segments(dataset, time_interval)
+    return dataset.id
+
+
+def import_datasets(files: dict, id_author: int, workers: int = None):
+    """
+    Import dataset files, reading them in parallel in worker processes.
+
+    Parameters
+    ----------
+    files : dict
+        The files to import: path -> dict with the name, description and
+        annotators (list of user ids) of the dataset
+    id_author : int
+        The id of the author of the datasets
+    workers : int, optional
+        The number of worker processes (default: the number of CPUs)
+
+    Yields
+    ------
+    path : str
+        The path of a file, in the order the files are read
+    id_dataset : int
+        The id of the new dataset, None if the file could not be imported
+    stats : dict
+        The statistics of the dataset (see DatasetStats), None if it could not be imported
+    error : Exception
+        The reason the file could not be imported, None if it was imported
+    """
+    time_interval = current_app.config["PS_MINS_PER_PAGE"] * 60
+    workers = workers or os.cpu_count() or 1
+    paths = iter(files)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}  # future -> path
+
+        def submit_next():
+            path = next(paths, None)
+            if path is not None:
+                pending[executor.submit(parse_dataset_file, path)] = path
+
+        # a few files are read ahead of the writer, but not all of them,
+        # so that the rows waiting to be written fit in memory
+        for _ in range(2 * workers):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                submit_next()
+                try:
+                    dataset_type, rows, file_sha256 = future.result()
+                    id_dataset = write_queue.submit(
+                        save_imported_dataset,
+                        dataset_type,
+                        rows,
+                        files[path]["name"],
+                        files[path]["description"],
+                        id_author,
+                        files[path]["annotators"],
+                        time_interval,
+                        file_sha256,
+                    )
+                except Exception as e:
+                    yield path, None, None, e
+                    continue
+                yield path, id_dataset, rows["stats"], None
+
+
+def format_stats(stats: dict) -> str:
+    """Summary of the statistics of a new dataset, for the progress of an import"""
+    if "n_posts" in stats:
+        return "{n_posts} posts, {n_replies} replies".format(**stats)
+    return "{n_dialog_turns} dialog turns, {n_dialog_events} dialog events".format(
+        **stats
+    )
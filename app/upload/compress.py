@@ -0,0 +1,267 @@
+"""
+Compression of the texts of the datasets (see app/compression.py): the texts of a new
+dataset are compressed when it is uploaded if COMPRESS_TEXT is enabled, and the datasets
+uploaded before can be compressed with `flask compress-datasets`.
+"""
+from flask import current_app
+from sqlalchemy import func
+from app import db, write_queue
+from app.compression import (
+    SAMPLE_SIZE,
+    build_dictionary,
+    compress_rows,
+    dictionary_key,
+    remember_dictionary,
+)
+from app.models import Dataset, PSDialogEvent, SMPost, SMReply, TextDictionary
+from app.shards import use_dataset_shard
+
+CHUNK_SIZE = 1000  # number of texts compressed in each transaction
+
+# the columns compressed, for each type of dataset
+COMPRESSED_COLUMNS = {
+    "psychotherapy": [PSDialogEvent.event_plaintext],
+    "sm_thread": [SMPost.question, SMReply.comment],
+}
+
+
+def compression_enabled() -> bool:
+    """Check if COMPRESS_TEXT is enabled, and the database is SQLite"""
+    return (
+        current_app.config["COMPRESS_TEXT"]
+        and db.session.get_bind().dialect.name == "sqlite"
+    )
+
+
+def store_dictionary(dictionary: bytes) -> str:
+    """
+    Add a dictionary to the database session, if it is not stored already.
+    Returns its key.
+    """
+    key = dictionary_key(dictionary)
+    if db.session.get(TextDictionary, key) is None:
+        db.session.add(TextDictionary(key=key, data=dictionary))
+        db.session.flush()  # before the dataset and the rows referencing it
+    remember_dictionary(key, dictionary)
+    return key
+
+
+def add_dictionary(dataset: Dataset, texts: list) -> bytes:
+    """
+    Train a dictionary on the texts of a dataset, add it to the database session
+    (if it is not stored already) and record it as the dictionary of the dataset.
+    Returns the dictionary, or None if the texts are too short to train one.
+    """
+    dictionary = build_dictionary(texts)
+    if not dictionary:
+        return None
+    dataset.text_dictionary = store_dictionary(dictionary)
+    return dictionary
+
+
+def compress_dataset_rows(dataset: Dataset, tables: list):
+    """
+    If compression is enabled (see compression_enabled), train a dictionary on the texts
+    of the rows of a new dataset and compress them, in place.
+
+    Parameters
+    ----------
+    dataset : Dataset
+        The dataset, whose dictionary is recorded (Dataset.text_dictionary)
+    tables : list
+        The rows (dicts) and the name of their column to compress, for each table
+    """
+    if not compression_enabled():
+        return
+    texts = [row[column] for rows, column in tables for row in rows if row[column]]
+    dictionary = add_dictionary(dataset, texts)
+    if dictionary is not None:
+        compress_rows(tables, dictionary, dataset.text_dictionary)
+
+
+def compress_new_rows(dataset: Dataset, tables: list):
+    """
+    Compress the texts of rows added to a dataset (e.g. by a new version of its file)
+    with the dictionary of the dataset, if its texts are compressed
+    """
+    if dataset.text_dictionary is None:
+        return
+    dictionary = db.session.get(TextDictionary, dataset.text_dictionary).data
+    compress_rows(tables, dictionary, dataset.text_dictionary)
+
+
+def compressed_columns(dataset: Dataset) -> list:
+    """The names of the tables and columns with the texts of a dataset"""
+    return [
+        (column.class_.__tablename__, column.key)
+        for column in COMPRESSED_COLUMNS[dataset.type.name]
+    ]
+
+
+def train_dictionary(id_dataset: int) -> tuple:
+    """
+    Write job for the write queue (see app/writer.py): train a dictionary on a sample
+    of the texts of a dataset uploaded before compression was enabled (see SAMPLE_SIZE
+    in app/compression.py), and store it. It is not recorded as the dictionary of the
+    dataset until all the texts are compressed (see compress_dataset).
+
+    Returns
+    -------
+    id_content : int
+        The id of the dataset which has the texts (see Dataset.content_id)
+    key : str
+        The key of the dictionary, None if the texts are compressed already, or too
+        short to train one
+    columns : list
+        The names of the tables and columns with the texts (see compressed_columns)
+    """
+    use_dataset_shard(id_dataset)
+    dataset = db.session.get(Dataset, id_dataset)
+    dataset = db.session.get(Dataset, dataset.content_id)
+    columns = compressed_columns(dataset)
+    if dataset.text_dictionary is not None or dataset.deleting:
+        return dataset.id, None, columns
+    texts = []
+    for column in COMPRESSED_COLUMNS[dataset.type.name]:
+        model = column.class_
+        n_texts = db.session.scalar(
+            db.select(func.count(model.id)).where(model.id_dataset == dataset.id)
+        )
+        step = max(1, n_texts // SAMPLE_SIZE)  # rows spread over the dataset
+        texts += db.session.scalars(
+            db.select(column)
+            .where(model.id_dataset == dataset.id, model.id % step == 0)
+            .order_by(model.id)
+        ).all()
+    dictionary = build_dictionary([text for text in texts if text])
+    if not dictionary:
+        return dataset.id, None, columns
+    return dataset.id, store_dictionary(dictionary), columns
+
+
+def being_compressed(id_dataset: int) -> bool:
+    """Check that a dataset still exists, and is not being deleted"""
+    return bool(
+        db.session.scalar(
+            db.select(func.count(Dataset.id)).where(
+                Dataset.id == id_dataset, Dataset.deleting.is_(False)
+            )
+        )
+    )
+
+
+def compress_chunk(
+    id_dataset: int,
+    table_name: str,
+    column_name: str,
+    key: str,
+    after_id: int,
+    chunk_size: int = CHUNK_SIZE,
+):
+    """
+    Write job for the write queue (see app/writer.py): compress the texts of the next
+    rows of a table of a dataset, in the order of their ids, with a dictionary.
+    The texts compressed already are read decompressed, and compressed again.
+
+    Returns
+    -------
+    chunk : tuple
+        The id of the last row, and the number of bytes of the texts before and after
+        the compression; None if there are no more rows, or if the dataset is being
+        deleted (see app/admin/delete.py)
+    """
+    use_dataset_shard(id_dataset)
+    if not being_compressed(id_dataset):
+        return None
+    table = db.metadata.tables[table_name]
+    column = table.c[column_name]
+    rows = [
+        {"id_row": id_row, column_name: text}
+        for id_row, text in db.session.execute(
+            db.select(table.c.id, column)
+            .where(table.c.id_dataset == id_dataset, table.c.id > after_id)
+            .order_by(table.c.id)
+            .limit(chunk_size)
+        )
+    ]
+    if not rows:
+        return None
+    size_before = sum(len((row[column_name] or "").encode()) for row in rows)
+    dictionary = db.session.get(TextDictionary, key).data
+    compress_rows([(rows, column_name)], dictionary, key)
+    size_after = sum(
+        len(value.encode() if isinstance(value, str) else value)
+        for value in (row[column_name] for row in rows)
+        if value is not None
+    )
+    db.session.execute(
+        db.update(table).where(table.c.id == db.bindparam("id_row")), rows
+    )
+    return rows[-1]["id_row"], size_before, size_after
+
+
+def set_dictionary(id_dataset: int, key: str):
+    """
+    Write job for the write queue (see app/writer.py): record the dictionary of the
+    texts of a dataset, and of the datasets sharing them, once they are compressed
+    (unless the dataset is being deleted)
+    """
+    use_dataset_shard(id_dataset)
+    if not being_compressed(id_dataset):
+        return
+    db.session.execute(
+        db.update(Dataset)
+        .where((Dataset.id == id_dataset) | (Dataset.id_content == id_dataset))
+        .values(text_dictionary=key)
+    )
+
+
+def compress_dataset(id_dataset: int, chunk_size: int = CHUNK_SIZE) -> tuple:
+    """
+    Compress the texts of a dataset uploaded before compression was enabled, with a
+    dictionary trained on them, through the write queue: a chunk of rows at a time,
+    each one in its own transaction (see compress_chunk). Until the last chunk is
+    committed, the dataset has both compressed and plain texts, which are read alike
+    (the compressed texts give the key of their dictionary, see app/compression.py);
+    the dictionary is only recorded as the dictionary of the dataset then.
+    The texts shared with other datasets (see Dataset.content_id) are compressed once,
+    for all of them. The full-text search index does not change, it indexes the
+    decompressed texts.
+
+    Parameters
+    ----------
+    id_dataset : int
+        The id of the dataset
+    chunk_size : int
+        The number of texts compressed in each transaction
+
+    Returns
+    -------
+    sizes : tuple
+        The number of bytes of the texts before and after the compression
+        (0, 0 if they are compressed already)
+    """
+    use_dataset_shard(id_dataset)
+    id_content, key, columns = write_queue.submit(train_dictionary, id_dataset)
+    if key is None:
+        return 0, 0
+    size_before = size_after = 0
+    for table_name, column_name in columns:
+        after_id = 0
+        while True:
+            chunk = write_queue.submit(
+                compress_chunk,
+                id_content,
+                table_name,
+                column_name,
+                key,
+                after_id,
+                chunk_size,
+            )
+            if chunk is None:
+                break
+            after_id = chunk[0]
+            size_before += chunk[1]
+            size_after += chunk[2]
+    write_queue.submit(set_dictionary, id_content, key)
+    return size_before, size_after
@@ -0,0 +1,368 @@
+"""
+New versions of psychotherapy datasets (e.g. after typos were fixed in a transcript).
+The rows of the new version of the file (see psychotherapy_df_to_rows) are compared
+with the stored dialog turns and events, and only the differences are written, so that
+the annotations of the dialog turns and the evidence of the dialog events which did not
+change are kept.
+The dialog turns are compared by (session_n, dialog_turn_n) and the dialog events by
+(session_n, dialog_turn_n, event_n), with the fingerprints of their values
+(see row_fingerprint): only the keys and fingerprints of the stored rows are read.
+These numbers are positions in the file, so a dialog turn or event added or removed
+in the middle of a file changes the keys of the rows after it, which are replaced
+(and lose their evidence links): a new version is meant for corrections.
+"""
+from datetime import date, datetime, timedelta
+from app import db
+from app.database import utc_now
+from app.annotate.utils import rebuild_annotation_progress
+from app.models import (
+    ANNOTATION_TABLES,
+    Dataset,
+    DatasetStats,
+    PSDialogEvent,
+    PSDialogTurn,
+)
+from app.search.utils import index_events, unindex_events
+from app.upload.compress import compress_new_rows
+from app.upload.parsers import (
+    dialog_event_fingerprint,
+    dialog_turn_fingerprint,
+    insert_rows,
+)
+
+CHUNK_SIZE = 500  # number of ids in each "IN (...)" list
+
+
+def chunks(ids: list):
+    """Split a list of ids into chunks of CHUNK_SIZE ids"""
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start : start + CHUNK_SIZE]
+
+
+def turn_key(dialog_turn) -> tuple:
+    """The key of a dialog turn (row dict or row): (session_n, dialog_turn_n)"""
+    if isinstance(dialog_turn, dict):
+        return dialog_turn["session_n"], dialog_turn["dialog_turn_n"]
+    return dialog_turn.session_n, dialog_turn.dialog_turn_n
+
+
+def fill_fingerprints(stored: dict, columns: list, fingerprint):
+    """
+    Compute the fingerprints missing from stored rows (key -> (id, fingerprint)),
+    for the datasets uploaded before the fingerprints were recorded
+    """
+    missing = {id_row: key for key, (id_row, value) in stored.items() if value is None}
+    for ids in chunks(list(missing)):
+        query = db.select(columns[0].class_.id, *columns).where(
+            columns[0].class_.id.in_(ids)
+        )
+        for row in db.session.execute(query):
+            stored[missing[row.id]] = row.id, fingerprint(row)
+
+
+def compare(stored: dict, new: dict) -> tuple:
+    """
+    Compare stored rows (key -> (id, fingerprint)) with new rows
+    (key -> (position, fingerprint)).
+    Returns the positions of the rows to insert, the (id, position) of the rows
+    to update and the ids of the rows to delete.
+    """
+    insert = [position for key, (position, _) in new.items() if key not in stored]
+    update = [
+        (stored[key][0], position)
+        for key, (position, value) in new.items()
+        if key in stored and stored[key][1] != value
+    ]
+    delete = [id_row for key, (id_row, _) in stored.items() if key not in new]
+    return insert, update, delete
+
+
+def diff_psychotherapy_rows(rows: dict, id_dataset: int) -> dict:
+    """
+    Compare the rows of a new version of a psychotherapy dataset
+    (see psychotherapy_df_to_rows) with its stored dialog turns and events.
+
+    Parameters
+    ----------
+    rows : dict
+        The rows of the new version
+    id_dataset : int
+        The id of the dataset
+
+    Returns
+    -------
+    diff : dict
+        For the dialog turns ("turns") and the dialog events ("events"), a tuple with
+        the positions of the rows to insert (in rows), the (id, position) of the rows
+        to update and the ids of the rows to delete, and the ids of the stored
+        dialog turns by key ("turn_ids").
+    """
+    stored_turns = {
+        turn_key(row): (row.id, row.fingerprint)
+        for row in db.session.execute(
+            db.select(
+                PSDialogTurn.id,
+                PSDialogTurn.session_n,
+                PSDialogTurn.dialog_turn_n,
+                PSDialogTurn.fingerprint,
+            ).where(PSDialogTurn.id_dataset == id_dataset)
+        )
+    }
+    fill_fingerprints(
+        stored_turns,
+        [
+            PSDialogTurn.c_code,
+            PSDialogTurn.t_init,
+            PSDialogTurn.date,
+            PSDialogTurn.timestamp,
+            PSDialogTurn.main_speaker,
+        ],
+        dialog_turn_fingerprint,
+    )
+    stored_events = {
+        turn_key(row) + (row.event_n,): (row.id, row.fingerprint)
+        for row in db.session.execute(
+            db.select(
+                PSDialogEvent.id,
+                PSDialogTurn.session_n,
+                PSDialogTurn.dialog_turn_n,
+                PSDialogEvent.event_n,
+                PSDialogEvent.fingerprint,
+            )
+            .join(PSDialogTurn, PSDialogTurn.id == PSDialogEvent.id_ps_dialog_turn)
+            .where(PSDialogEvent.id_dataset == id_dataset)
+        )
+    }
+    fill_fingerprints(
+        stored_events,
+        [PSDialogEvent.event_speaker, PSDialogEvent.event_plaintext],
+        dialog_event_fingerprint,
+    )
+    dialog_turns = rows["dialog_turns"]
+    new_turns = {
+        turn_key(dialog_turn): (position, dialog_turn["fingerprint"])
+        for position, dialog_turn in enumerate(dialog_turns)
+    }
+    new_events = {
+        turn_key(dialog_turns[position_turn])
+        + (dialog_event["event_n"],): (position, dialog_event["fingerprint"])
+        for position, (position_turn, dialog_event) in enumerate(rows["dialog_events"])
+    }
+    return {
+        "turns": compare(stored_turns, new_turns),
+        "events": compare(stored_events, new_events),
+        "turn_ids": {key: id_turn for key, (id_turn, _) in stored_turns.items()},
+    }
+
+
+def relink_segments(unlinked: list, id_dataset: int, time_interval: int = 300) -> int:
+    """
+    Link the annotations whose segment started with a deleted dialog turn to the new
+    first dialog turn of their segment: the earliest dialog turn left whose timestamp
+    is in the time interval of the segment.
+
+    Parameters
+    ----------
+    unlinked : list
+        The (annotation table, id of the annotation, timestamp of the deleted first
+        dialog turn of its segment) of the annotations unlinked
+    id_dataset : int
+        The id of the dataset
+    time_interval : int
+        The time interval of a segment in seconds (default is 300, i.e. 5 minutes)
+
+    Returns
+    -------
+    n_links : int
+        The number of annotations left unlinked, whose segment has no dialog turns left
+    """
+    first_turns = {}  # start of a segment -> id of its first dialog turn left, or None
+    for start in {start for _, _, start in unlinked}:
+        end = datetime.combine(date.min, start) + timedelta(seconds=time_interval)
+        query = db.select(PSDialogTurn.id).where(
+            PSDialogTurn.id_dataset == id_dataset, PSDialogTurn.timestamp >= start
+        )
+        if end.date() == date.min:  # the segment does not end after midnight
+            query = query.where(PSDialogTurn.timestamp < end.time())
+        first_turns[start] = db.session.execute(
+            query.order_by(PSDialogTurn.timestamp, PSDialogTurn.id).limit(1)
+        ).scalar()
+    n_links = 0
+    for table, id_annotation, start in unlinked:
+        if first_turns[start] is None:
+            n_links += 1
+            continue
+        db.session.execute(
+            db.update(table)
+            .where(table.c.id == id_annotation)
+            .values(id_first_dialog_turn=first_turns[start])
+        )
+    return n_links
+
+
+def apply_psychotherapy_diff(
+    diff: dict, rows: dict, dataset: Dataset, time_interval: int = 300
+) -> dict:
+    """
+    Write the differences between the stored rows of a psychotherapy dataset and the rows
+    of its new version (see diff_psychotherapy_rows) to the database session.
+    The evidence of the dialog events deleted is deleted too, and the annotations of
+    the segments starting with a deleted dialog turn are linked to the new first dialog
+    turn of their segment (see relink_segments). The statistics of the dataset are replaced, and its
+    annotation progress is computed again if its dialog turns changed.
+
+    Returns
+    -------
+    changes : dict
+        The numbers of dialog turns and dialog events inserted, updated and deleted
+        (tuples), and the number of evidence links deleted and of annotations
+        whose segment was deleted
+    """
+    dialog_turns = rows["dialog_turns"]
+    dialog_events = rows["dialog_events"]
+    insert_turns, update_turns, delete_turns = diff["turns"]
+    insert_events, update_events, delete_events = diff["events"]
+    turn_table = PSDialogTurn.__table__
+    event_table = PSDialogEvent.__table__
+    n_links = 0
+
+    # the old text of the events is needed to remove them from the search index
+    for ids in chunks([id_event for id_event, _ in update_events] + delete_events):
+        unindex_events(ids)
+    for ids in chunks(delete_events):
+        for model, evidence_model, evidence_column in ANNOTATION_TABLES.values():
+            table = evidence_model.__table__
+            # the annotations losing evidence are changed: they are exported again
+            db.session.execute(
+                db.update(model)
+                .where(
+                    model.id.in_(
+                        db.select(table.c[evidence_column]).where(
+                            table.c.id_ps_dialog_event.in_(ids)
+                        )
+                    )
+                )
+                .values(modified=utc_now())
+            )
+            n_links += db.session.execute(
+                db.delete(table).where(table.c.id_ps_dialog_event.in_(ids))
+            ).rowcount
+        db.session.execute(db.delete(event_table).where(event_table.c.id.in_(ids)))
+    # the annotations of the segments starting with deleted dialog turns are unlinked,
+    # and linked again to the new first dialog turn of their segment below (both updates
+    # set their modified time, see the annotation models, so they are exported again)
+    unlinked = []  # (annotation table, id of the annotation, start of its segment)
+    for ids in chunks(delete_turns):
+        for model, _, _ in ANNOTATION_TABLES.values():
+            table = model.__table__
+            unlinked += [
+                (table, id_annotation, start)
+                for id_annotation, start in db.session.execute(
+                    db.select(table.c.id, turn_table.c.timestamp)
+                    .join(turn_table, turn_table.c.id == table.c.id_first_dialog_turn)
+                    .where(table.c.id_first_dialog_turn.in_(ids))
+                )
+            ]
+            db.session.execute(
+                db.update(table)
+                .where(table.c.id_first_dialog_turn.in_(ids))
+                .values(id_first_dialog_turn=None)
+            )
+        db.session.execute(db.delete(turn_table).where(turn_table.c.id.in_(ids)))
+
+    # the changed rows are updated in place, so that their links are kept
+    if update_turns:
+        db.session.execute(
+            db.update(turn_table).where(turn_table.c.id == db.bindparam("id_row")),
+            [
+                dict(dialog_turns[position], id_row=id_turn)
+                for id_turn, position in update_turns
+            ],
+        )
+    updated_events = [
+        dict(dialog_events[position][1], id_row=id_event)
+        for id_event, position in update_events
+    ]
+    inserted_events = [
+        dict(
+            dialog_events[position][1],
+            id_ps_dialog_turn=None,
+            id_dataset=dataset.id,
+        )
+        for position in insert_events
+    ]
+    # the texts are compressed like the other texts of the dataset (if they are)
+    compress_new_rows(
+        dataset,
+        [(updated_events, "event_plaintext"), (inserted_events, "event_plaintext")],
+    )
+    if updated_events:
+        db.session.execute(
+            db.update(event_table).where(event_table.c.id == db.bindparam("id_row")),
+            updated_events,
+        )
+
+    turn_ids = dict(diff["turn_ids"])
+    new_turn_ids = insert_rows(
+        turn_table,
+        [
+            dict(dialog_turns[position], id_dataset=dataset.id)
+            for position in insert_turns
+        ],
+    )
+    for position, id_turn in zip(insert_turns, new_turn_ids):
+        turn_ids[turn_key(dialog_turns[position])] = id_turn
+    for position, dialog_event in zip(insert_events, inserted_events):
+        dialog_event["id_ps_dialog_turn"] = turn_ids[
+            turn_key(dialog_turns[dialog_events[position][0]])
+        ]
+    new_event_ids = insert_rows(event_table, inserted_events)
+    for ids in chunks([id_event for id_event, _ in update_events] + new_event_ids):
+        index_events(ids)
+
+    n_links += relink_segments(unlinked, dataset.id, time_interval)
+
+    stats = db.session.get(DatasetStats, dataset.id) or DatasetStats(dataset=dataset)
+    for name, value in rows["stats"].items():
+        setattr(stats, name, value)
+    db.session.add(stats)
+    if insert_turns or update_turns or delete_turns:
+        # the segments (pages) can change
+        db.session.flush()
+        rebuild_annotation_progress(dataset, time_interval)
+    return {
+        "dialog_turns": (len(insert_turns), len(update_turns), len(delete_turns)),
+        "dialog_events": (len(insert_events), len(update_events), len(delete_events)),
+        "links": n_links,
+    }
+
+
+def save_dataset_version(
+    id_dataset: int, rows: dict, file_sha256: str, time_interval: int = 300
+) -> dict:
+    """
+    Write job for the write queue (see app/writer.py): apply the differences between
+    a psychotherapy dataset and the rows of its new version to the database session,
+    and increment the version of the dataset.
+    Returns the numbers of changes (see apply_psychotherapy_diff).
+    """
+    dataset = db.session.get(Dataset, id_dataset)
+    diff = diff_psychotherapy_rows(rows, dataset.id)
+    changes = apply_psychotherapy_diff(diff, rows, dataset, time_interval)
+    dataset.file_sha256 = file_sha256
+    dataset.version += 1
+    return changes
+
+
+def format_changes(changes: dict) -> str:
+    """Summary of the changes of a new version of a dataset"""
+    summary = "; ".join(
+        "{}: {} inserted, {} updated, {} deleted".format(name, *changes[key])
+        for key, name in [
+            ("dialog_turns", "dialog turns"),
+            ("dialog_events", "dialog events"),
+        ]
+    )
+    if changes["links"]:
+        summary += "; {} annotation and evidence links deleted".format(changes["links"])
+    return summary
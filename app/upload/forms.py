@@ -44,3 +44,10 @@ class UploadForm(FlaskForm):
                     raise ValidationError(
                         f"User '{annotator.username}' already has a dataset with the name '{name.data}'"
                     )
+
+
+class DatasetVersionForm(FlaskForm):
+    """Form to upload a new version of the file of a psychotherapy dataset"""
+
+    file = FileField("File", validators=[DataRequired()])
+    submit = SubmitField("Upload new version")
@@ -1,8 +1,30 @@
 from datetime import datetime, timedelta
-from app.models import SMPost, SMReply, Dataset, PSDialogTurn, PSDialogEvent
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
+from app.utils import DatasetType
+from app.models import (
+    SMPost,
+    SMReply,
+    SMTimeline,
+    Dataset,
+    DatasetStats,
+    PSDialogTurn,
+    PSDialogEvent,
+)
 from app import db
-import pandas as pd
+from app.search.utils import index_dataset_events
+from app.upload.compress import compress_dataset_rows
+from sqlalchemy import Table, text
+import hashlib
 import pickle
+import io
+
+if TYPE_CHECKING:
+    # pandas is slow to import, and it is only needed once a dataset is read
+    # (unpickling a dataframe imports it), so it is not imported at startup
+    import pandas as pd
+
+COPY_CHUNK_SIZE = 10000  # number of rows sent to the database in each COPY statement
 
 
 def read_pickle(file_path: str):
@@ -35,58 +57,284 @@ def format_date(date):
         return date
 
 
+def row_fingerprint(*values) -> str:
+    """
+    Fingerprint of the values of a row (128-bit BLAKE2b hash, hex digest), stored with
+    the dialog turns and events, so that the rows changed by a new version of a dataset
+    are found without reading their contents (see app/upload/diff.py).
+    """
+    data = "\x1f".join(str(value) for value in values).encode()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def dialog_turn_fingerprint(dialog_turn) -> str:
+    """Fingerprint of a dialog turn (row dict or PSDialogTurn), without its key"""
+    if isinstance(dialog_turn, dict):
+        dialog_turn = SimpleNamespace(**dialog_turn)
+    return row_fingerprint(
+        dialog_turn.c_code,
+        dialog_turn.t_init,
+        dialog_turn.date,
+        dialog_turn.timestamp,
+        dialog_turn.main_speaker,
+    )
+
+
+def dialog_event_fingerprint(dialog_event) -> str:
+    """Fingerprint of a dialog event (row dict or PSDialogEvent), without its key"""
+    if isinstance(dialog_event, dict):
+        dialog_event = SimpleNamespace(**dialog_event)
+    return row_fingerprint(dialog_event.event_speaker, dialog_event.event_plaintext)
+
+
+def use_copy_from() -> bool:
+    """
+    Check if rows can be bulk loaded with COPY FROM STDIN,
+    i.e. the database is PostgreSQL and the driver is psycopg2.
+    """
+    dialect = db.session.get_bind().dialect
+    return dialect.name == "postgresql" and dialect.driver == "psycopg2"
+
+
+def format_csv_value(value) -> str:
+    """
+    Format a value for the CSV format of COPY FROM STDIN.
+    NULL is written as an unquoted empty string, everything else is quoted
+    (so that an empty string is not loaded as NULL).
+    """
+    if value is None:
+        return ""
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def copy_from_rows(table: Table, columns: list, rows):
+    """
+    Bulk load rows into a table with PostgreSQL's COPY FROM STDIN.
+    The rows are sent in chunks, within the transaction of the current database session,
+    so a rollback of the session also discards them.
+
+    Args:
+        table (Table): The table to load the rows into.
+        columns (list): The names of the columns, in the same order as the values of each row.
+        rows (iterable): The rows to load, each row is a tuple of values.
+    """
+    # the raw psycopg2 connection of the current transaction
+    dbapi_connection = db.session.connection().connection.dbapi_connection
+    sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+        table.name, ", ".join(columns)
+    )
+    with dbapi_connection.cursor() as cursor:
+        buffer = io.StringIO()
+        n_rows = 0
+        for row in rows:
+            buffer.write(",".join(format_csv_value(value) for value in row) + "\n")
+            n_rows += 1
+            if n_rows == COPY_CHUNK_SIZE:
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+                buffer = io.StringIO()
+                n_rows = 0
+        if n_rows:
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+
+
+def reserve_ids(table: Table, n: int) -> list:
+    """
+    Reserve n primary key values from the PostgreSQL sequence of the table,
+    for rows that are bulk loaded with COPY and referenced by other rows.
+    """
+    result = db.session.execute(
+        text(
+            "SELECT nextval(pg_get_serial_sequence(:table, 'id')) "
+            "FROM generate_series(1, :n)"
+        ),
+        {"table": table.name, "n": n},
+    )
+    return [row[0] for row in result]
+
+
+def insert_rows(table: Table, rows: list) -> list:
+    """
+    Bulk insert rows into a table and return their ids, in the same order,
+    for rows that are referenced by other rows. On PostgreSQL the rows are loaded with
+    COPY FROM STDIN (with ids reserved from the sequence), otherwise with a multi-row
+    INSERT ... RETURNING.
+
+    Args:
+        table (Table): The table to insert the rows into.
+        rows (list): The rows to insert, each row is a dict with the same keys (columns).
+    """
+    if not rows:
+        return []
+    if use_copy_from():
+        ids = reserve_ids(table, len(rows))
+        columns = list(rows[0])
+        copy_from_rows(
+            table,
+            ["id"] + columns,
+            ((id_row,) + tuple(row.values()) for id_row, row in zip(ids, rows)),
+        )
+        return ids
+    query = db.insert(table).returning(table.c.id, sort_by_parameter_order=True)
+    return db.session.execute(query, rows).scalars().all()
+
+
+def append_rows(table: Table, rows: list):
+    """
+    Bulk insert rows into a table (with COPY FROM STDIN on PostgreSQL).
+
+    Args:
+        table (Table): The table to insert the rows into.
+        rows (list): The rows to insert, each row is a dict with the same keys (columns).
+    """
+    if not rows:
+        return
+    if use_copy_from():
+        copy_from_rows(table, list(rows[0]), (tuple(row.values()) for row in rows))
+    else:
+        db.session.execute(db.insert(table), rows)
+
+
+def sm_dict_to_rows(sm_data: dict) -> dict:
+    """
+    Convert the social media dictionary to the rows of the "sm_timeline", "sm_post"
+    and "sm_reply" tables, and compute the dataset statistics.
+    This does not use the database, so it can run in another process (see app/upload/bulk.py).
+
+    Args:
+        sm_data (dict): The social media dictionary, read from the pickle file uploaded by the user.
+
+    Returns:
+        dict: The rows of the timelines, posts and replies (each reply with the position
+        of its post in the list of posts), and the statistics of the dataset.
+    """
+    timelines = []
+    posts = []
+    replies = []  # (position of the post, reply)
+    authors = set()  # users who wrote posts or replies
+    for user, user_timelines in sm_data.items():
+        for timeline, timeline_posts in user_timelines.items():
+            n_replies = 0
+            for post in timeline_posts:
+                authors.add(user)
+                for reply in post["replies"]:
+                    replies.append(
+                        (
+                            len(posts),
+                            {
+                                "reply_id": reply["id"],
+                                "user_id": reply["user"],
+                                "date": remove_microsecs(reply["date"]),
+                                "ldate": datetime(*reply["ldate"]),
+                                "comment": reply["comment"],
+                            },
+                        )
+                    )
+                    authors.add(str(reply["user"]))  # reply user ids are integers
+                    n_replies += 1
+                posts.append(
+                    {
+                        "user_id": user,
+                        "timeline_id": timeline,
+                        "post_id": post["post_id"],
+                        "mood": post["mood"],
+                        "date": remove_microsecs(post["date"]),
+                        "ldate": datetime(*post["ldate"]),
+                        "question": post["question"],
+                    }
+                )
+            if timeline_posts:
+                dates = [post["date"] for post in posts[-len(timeline_posts) :]]
+                timelines.append(
+                    {
+                        "user_id": user,
+                        "timeline_id": timeline,
+                        "first_post_date": min(dates),
+                        "last_post_date": max(dates),
+                        "n_posts": len(timeline_posts),
+                        "n_replies": n_replies,
+                    }
+                )
+    stats = {
+        "n_posts": len(posts),
+        "n_replies": len(replies),
+        "n_users": len(authors),
+        "n_timelines": sum(len(user_timelines) for user_timelines in sm_data.values()),
+    }
+    return {"timelines": timelines, "posts": posts, "replies": replies, "stats": stats}
+
+
+def sm_rows_to_sql(rows: dict, dataset: Dataset):
+    """
+    Add the rows of a social media dataset (see sm_dict_to_rows) to the database.
+    The posts and replies are bulk loaded (with COPY FROM STDIN on PostgreSQL),
+    their texts compressed if COMPRESS_TEXT is enabled (the rows are changed).
+
+    Args:
+        rows (dict): The rows of the dataset, returned by sm_dict_to_rows.
+        dataset (Dataset): The dataset object, created when the user uploaded the pickle file.
+    """
+    db.session.flush()  # assign an id to the dataset
+    compress_dataset_rows(
+        dataset,
+        [
+            (rows["posts"], "question"),
+            ([reply for _, reply in rows["replies"]], "comment"),
+        ],
+    )
+    append_rows(
+        SMTimeline.__table__,
+        [dict(timeline, id_dataset=dataset.id) for timeline in rows["timelines"]],
+    )
+    post_ids = insert_rows(
+        SMPost.__table__,
+        [dict(post, id_dataset=dataset.id) for post in rows["posts"]],
+    )
+    append_rows(
+        SMReply.__table__,
+        [
+            dict(reply, id_sm_post=post_ids[position], id_dataset=dataset.id)
+            for position, reply in rows["replies"]
+        ],
+    )
+    db.session.add(DatasetStats(dataset=dataset, **rows["stats"]))
+
+
 def sm_dict_to_sql(sm_data: dict, dataset: Dataset):
     """
     Convert the social media dictionary to SQL and add it to the database.
+    On PostgreSQL, the posts and replies are bulk loaded with COPY FROM STDIN.
 
     Args:
         sm_data (dict): The social media dictionary, read from the pickle file uploaded by the user.
         dataset (Dataset): The dataset object, created when the user uploaded the pickle file.
     """
-    users = list(sm_data.keys())
-    for user in users:
-        timelines = list(sm_data[user].keys())
-        for timeline in timelines:
-            posts = sm_data[user][timeline]
-            for post in posts:
-                sm_post = SMPost(
-                    user_id=user,
-                    timeline_id=timeline,
-                    post_id=post["post_id"],
-                    mood=post["mood"],
-                    date=remove_microsecs(post["date"]),
-                    ldate=datetime(*post["ldate"]),
-                    question=post["question"],
-                    dataset=dataset,
-                )
-                db.session.add(sm_post)
-                replies = post["replies"]
-                for reply in replies:
-                    sm_reply = SMReply(
-                        reply_id=reply["id"],
-                        user_id=reply["user"],
-                        date=remove_microsecs(reply["date"]),
-                        ldate=datetime(*reply["ldate"]),
-                        comment=reply["comment"],
-                        post=sm_post,
-                        dataset=dataset,
-                    )
-                    db.session.add(sm_reply)
+    sm_rows_to_sql(sm_dict_to_rows(sm_data), dataset)
 
 
-def psychotherapy_df_to_sql(df: pd.DataFrame, dataset: Dataset):
+def psychotherapy_df_to_rows(df: "pd.DataFrame") -> dict:
     """
-    Convert the psychotherapy dataframe to SQL and add it to the database.
+    Convert the psychotherapy dataframe to the rows of the "ps_dialog_turn"
+    and "ps_dialog_event" tables, and compute the dataset statistics.
+    This does not use the database, so it can run in another process (see app/upload/bulk.py).
 
     Args:
         df (pd.DataFrame): The psychotherapy dataframe, read from the pickle file uploaded by the user.
-        dataset (Dataset): The dataset object, created when the user uploaded the pickle file.
+
+    Returns:
+        dict: The rows of the dialog turns and dialog events (each event with the position
+        of its dialog turn in the list of dialog turns), and the statistics of the dataset.
     """
     # find the row indices where the "dialog_turn_main_speaker" column is "timestamp"
     # these are the rows that mark the start of a dialog turn
     dialog_indices = df.loc[df["dialog_turn_main_speaker"] == "Timestamp"].index
-    dialog_counter = 0  # counter for the dialog turns
-    event_counter = 0  # counter for the dialog events
+    dialog_turns = []
+    dialog_events = []  # (position of the dialog turn, dialog event)
+    # dataset statistics, computed while the dialog turns and events are added
+    patients = set()
+    speakers = set()
+    session_durations = {}  # (c_code, session_n) -> timestamp of the last dialog turn
     for i, (index, row) in enumerate(df.loc[dialog_indices].iterrows()):
         # Each row in the dataframe is a different speech turn
         # A dialog turn can contain multiple speech turns
@@ -94,33 +342,238 @@ def psychotherapy_df_to_sql(df: pd.DataFrame, dataset: Dataset):
             next_index = dialog_indices[i + 1]
         else:
             next_index = len(df)
-        # create a PSDialogTurn object for each dialog turn
-        ps_dialog_turn = PSDialogTurn(
-            c_code=row["c_code"],
+        # a row of the "ps_dialog_turn" table for each dialog turn
+        dialog_turn = {
+            "c_code": row["c_code"],
             # if "t_init" is not in the dataframe, set it to None
-            t_init=row["t_init"] if "t_init" in df.columns else None,
-            date=format_date(row["date"]),
+            "t_init": row["t_init"] if "t_init" in df.columns else None,
+            "date": format_date(row["date"]),
             # timestamp given as a string in "event_plaintext" column
-            timestamp=datetime.strptime(
+            "timestamp": datetime.strptime(
                 (row["event_plaintext"]).replace(" ", ""), "%H:%M:%S"
             ).time(),
             # then "main_speaker" for this dialog turn is contained in
             # the next row of the "dialog_turn_main_speaker" column
-            main_speaker=df.loc[index + 1, "dialog_turn_main_speaker"],
-            session_n=int(row["session_n"]),
-            dialog_turn_n=dialog_counter,
-            dataset=dataset,
+            "main_speaker": df.loc[index + 1, "dialog_turn_main_speaker"],
+            "session_n": int(row["session_n"]),
+            "dialog_turn_n": i,
+        }
+        dialog_turn["fingerprint"] = dialog_turn_fingerprint(dialog_turn)
+        patients.add(dialog_turn["c_code"])
+        session = (dialog_turn["c_code"], dialog_turn["session_n"])
+        timestamp = dialog_turn["timestamp"]
+        session_durations[session] = max(
+            session_durations.get(session, 0),
+            timestamp.hour * 3600 + timestamp.minute * 60 + timestamp.second,
         )
-        dialog_counter += 1
-        db.session.add(ps_dialog_turn)  # add the dialog turn to the database
-        # create a PSDialogEvent object for each speech turn in the dialog turn
+        # a row of the "ps_dialog_event" table for each speech turn in the dialog turn
         for j in range(index + 1, next_index):
-            ps_dialog_event = PSDialogEvent(
-                event_n=event_counter,
-                event_speaker=df.loc[j, "event_speaker"],
-                event_plaintext=df.loc[j, "event_plaintext"],
-                dialog_turn=ps_dialog_turn,
-                dataset=dataset,
+            speakers.add(df.loc[j, "event_speaker"])
+            dialog_event = {
+                "event_n": len(dialog_events),
+                "event_speaker": df.loc[j, "event_speaker"],
+                "event_plaintext": df.loc[j, "event_plaintext"],
+            }
+            dialog_event["fingerprint"] = dialog_event_fingerprint(dialog_event)
+            dialog_events.append((i, dialog_event))
+        dialog_turns.append(dialog_turn)
+    stats = {
+        "n_dialog_turns": len(dialog_turns),
+        "n_dialog_events": len(dialog_events),
+        "n_sessions": len(session_durations),
+        "n_patients": len(patients),
+        "n_speakers": len(speakers),
+        "duration": sum(session_durations.values()),
+    }
+    return {
+        "dialog_turns": dialog_turns,
+        "dialog_events": dialog_events,
+        "stats": stats,
+    }
+
+
+def psychotherapy_rows_to_sql(rows: dict, dataset: Dataset):
+    """
+    Add the rows of a psychotherapy dataset (see psychotherapy_df_to_rows) to the database,
+    and add its dialog events to the full-text search index.
+    The dialog turns and events are bulk loaded (with COPY FROM STDIN on PostgreSQL),
+    the texts of the events compressed if COMPRESS_TEXT is enabled (the rows are changed).
+
+    Args:
+        rows (dict): The rows of the dataset, returned by psychotherapy_df_to_rows.
+        dataset (Dataset): The dataset object, created when the user uploaded the pickle file.
+    """
+    db.session.flush()  # assign an id to the dataset
+    compress_dataset_rows(
+        dataset,
+        [
+            (
+                [dialog_event for _, dialog_event in rows["dialog_events"]],
+                "event_plaintext",
+            )
+        ],
+    )
+    dialog_turn_ids = insert_rows(
+        PSDialogTurn.__table__,
+        [
+            dict(dialog_turn, id_dataset=dataset.id)
+            for dialog_turn in rows["dialog_turns"]
+        ],
+    )
+    append_rows(
+        PSDialogEvent.__table__,
+        [
+            dict(
+                dialog_event,
+                id_ps_dialog_turn=dialog_turn_ids[position],
+                id_dataset=dataset.id,
+            )
+            for position, dialog_event in rows["dialog_events"]
+        ],
+    )
+    db.session.add(DatasetStats(dataset=dataset, **rows["stats"]))
+    # add the dialog events to the full-text search index
+    db.session.flush()
+    index_dataset_events(dataset.id)
+
+
+def psychotherapy_df_to_sql(df: "pd.DataFrame", dataset: Dataset):
+    """
+    Convert the psychotherapy dataframe to SQL and add it to the database.
+    On PostgreSQL, the dialog turns and events are bulk loaded with COPY FROM STDIN.
+
+    Args:
+        df (pd.DataFrame): The psychotherapy dataframe, read from the pickle file uploaded by the user.
+        dataset (Dataset): The dataset object, created when the user uploaded the pickle file.
+    """
+    psychotherapy_rows_to_sql(psychotherapy_df_to_rows(df), dataset)
+
+
+def compute_dataset_stats(dataset: Dataset) -> DatasetStats:
+    """
+    Compute the statistics of a dataset already in the database with aggregate queries,
+    for the datasets uploaded before the statistics were recorded by the parsers above.
+    The statistics of the dataset are replaced. The statistics of a dataset which shares
+    the contents of another dataset (see Dataset.id_content) are those of the contents.
+
+    Parameters
+    ----------
+    dataset : Dataset
+        The dataset
+
+    Returns
+    -------
+    stats : DatasetStats
+        The statistics of the dataset, added to the session
+    """
+    stats = db.session.get(DatasetStats, dataset.id) or DatasetStats(dataset=dataset)
+    count = db.func.count
+    id_content = dataset.content_id
+    if dataset.type == DatasetType.psychotherapy:
+        turns = db.select(PSDialogTurn).where(PSDialogTurn.id_dataset == id_content)
+        turns = turns.subquery()
+        stats.n_dialog_turns, stats.n_patients = db.session.execute(
+            db.select(count(), count(turns.c.c_code.distinct()))
+        ).one()
+        stats.n_dialog_events, stats.n_speakers = db.session.execute(
+            db.select(count(), count(PSDialogEvent.event_speaker.distinct())).where(
+                PSDialogEvent.id_dataset == id_content
+            )
+        ).one()
+        # the duration of a session is the timestamp of its last dialog turn
+        last_turns = db.session.execute(
+            db.select(db.func.max(turns.c.timestamp)).group_by(
+                turns.c.c_code, turns.c.session_n
             )
-            event_counter += 1
-            db.session.add(ps_dialog_event)  # add the dialog event to the database
+        ).scalars()
+        durations = [
+            timestamp.hour * 3600 + timestamp.minute * 60 + timestamp.second
+            for timestamp in last_turns
+        ]
+        stats.n_sessions = len(durations)
+        stats.duration = sum(durations)
+    else:
+        stats.n_posts, stats.n_timelines = db.session.execute(
+            db.select(
+                count(),
+                count(db.distinct(SMPost.user_id + "/" + SMPost.timeline_id)),
+            ).where(SMPost.id_dataset == id_content)
+        ).one()
+        stats.n_replies = db.session.scalar(
+            db.select(count()).where(SMReply.id_dataset == id_content)
+        )
+        authors = db.union(
+            db.select(SMPost.user_id).where(SMPost.id_dataset == id_content),
+            db.select(SMReply.user_id).where(SMReply.id_dataset == id_content),
+        ).subquery()
+        stats.n_users = db.session.scalar(db.select(count()).select_from(authors))
+        if dataset.id_content is None:
+            compute_sm_timelines(
+                dataset
+            )  # the shared timelines are those of the contents
+    db.session.add(stats)
+    return stats
+
+
+def compute_sm_timelines(dataset: Dataset):
+    """
+    Compute the timelines of a social media dataset already in the database
+    (INSERT ... SELECT), for the datasets uploaded before the timelines were recorded
+    by sm_rows_to_sql. The timelines of the dataset are replaced.
+    """
+    db.session.execute(db.delete(SMTimeline).where(SMTimeline.id_dataset == dataset.id))
+    n_replies = (
+        db.select(SMReply.id_sm_post, db.func.count().label("n_replies"))
+        .where(SMReply.id_dataset == dataset.id)
+        .group_by(SMReply.id_sm_post)
+        .subquery()
+    )
+    timelines = (
+        db.select(
+            SMPost.id_dataset,
+            SMPost.user_id,
+            SMPost.timeline_id,
+            db.func.min(SMPost.date),
+            db.func.max(SMPost.date),
+            db.func.count(),
+            db.func.coalesce(db.func.sum(n_replies.c.n_replies), 0),
+        )
+        .outerjoin(n_replies, n_replies.c.id_sm_post == SMPost.id)
+        .where(SMPost.id_dataset == dataset.id)
+        .group_by(SMPost.id_dataset, SMPost.user_id, SMPost.timeline_id)
+    )
+    db.session.execute(
+        db.insert(SMTimeline).from_select(
+            [
+                "id_dataset",
+                "user_id",
+                "timeline_id",
+                "first_post_date",
+                "last_post_date",
+                "n_posts",
+                "n_replies",
+            ],
+            timelines,
+        )
+    )
+
+
+def share_dataset_content(dataset: Dataset, source: Dataset):
+    """
+    Make a new dataset share the contents of a dataset uploaded from an identical file
+    (see Dataset.id_content): the posts and replies, or dialog turns and events, are not
+    added again, and the statistics and number of segments of the source are copied.
+    The annotations of the two datasets are kept apart (they record their dataset).
+    """
+    dataset.id_content = source.content_id
+    dataset.shard = source.shard
+    dataset.n_segments = source.n_segments
+    dataset.text_dictionary = source.text_dictionary
+    if source.stats is not None:
+        dataset.stats = DatasetStats(
+            **{
+                column.key: getattr(source.stats, column.key)
+                for column in DatasetStats.__table__.columns
+                if column.key != "id_dataset"
+            }
+        )
@@ -1,12 +1,20 @@
-import os
-from app import db
+from app import db, write_queue
 from app.upload import bp
 from app.models import Dataset, User, DatasetType
-from werkzeug.utils import secure_filename
 from flask import request, redirect, url_for, flash, render_template, current_app, abort
 from flask_login import login_required, current_user
-from app.upload.forms import UploadForm
-from app.upload.parsers import sm_dict_to_sql, psychotherapy_df_to_sql, read_pickle
+from app.upload.forms import DatasetVersionForm, UploadForm
+from app.annotate.utils import count_segments
+from app.upload.diff import format_changes, save_dataset_version
+from app.upload.parsers import (
+    sm_dict_to_sql,
+    psychotherapy_df_to_rows,
+    psychotherapy_df_to_sql,
+    read_pickle,
+    share_dataset_content,
+)
+from app.upload.storage import save_upload
+from app.shards import use_new_shard, use_shard
 
 
 def allowed_file(filename: str):
@@ -29,31 +37,182 @@ def form_choices():
     return choices
 
 
-def get_file_path(filename: str):
+def upload_form_data(form: UploadForm) -> dict:
     """
-    Get the path of the file that will be saved to disk.
-    The path is the UPLOAD_FOLDER from the app config, joined with the filename.
+    The name, description and annotators (IDs) of a dataset from its (validated) upload
+    form. These are plain values, read in the request, which are passed to the write job
+    (see save_dataset) instead of the form.
     """
-    app_config = current_app.config  # Get the app config
-    file_path = os.path.join(app_config["UPLOAD_FOLDER"], filename)
-    return file_path
+    return {
+        "name": form.name.data,
+        "description": form.description.data,
+        "annotators": list(form.annotators.data),
+    }
 
 
-def new_dataset_to_db(form: UploadForm, dataset_type: DatasetType):
-    """Create a new dataset object and add it to the database session"""
+def new_dataset_to_db(form_data: dict, dataset_type: DatasetType, author: User = None):
+    """
+    Create a new dataset object and add it to the database session, from the data of
+    its upload form (see upload_form_data).
+    The author of the dataset is the logged in user, unless another user is given.
+    """
+    if author is None:
+        author = current_user
     dataset = Dataset(
-        name=form.name.data,
-        description=form.description.data,
-        author=current_user,
+        name=form_data["name"],
+        description=form_data["description"],
+        author=author,
         type=dataset_type,
     )
-    for annotator_id in form.annotators.data:
+    for annotator_id in form_data["annotators"]:
         annotator = User.query.get(annotator_id)
         dataset.annotators.append(annotator)
     db.session.add(dataset)
     return dataset
 
 
+def authored_datasets(dataset_type: DatasetType) -> list:
+    """Datasets of the given type uploaded by the current user, with their statistics"""
+    return (
+        current_user.authored_datasets.filter_by(type=dataset_type)
+        .options(db.joinedload(Dataset.stats))
+        .order_by(Dataset.timestamp.desc())
+        .all()
+    )
+
+
+def save_dataset(
+    form_data: dict,
+    dataset_type: DatasetType,
+    data,
+    id_author: int,
+    file_sha256: str = None,
+):
+    """
+    Write job for the write queue (see app/writer.py): create a new dataset and
+    add its contents (already read from the uploaded file) to the database session.
+    It takes the author's ID and the data of the form (see upload_form_data) rather than
+    the user object and the form, so that it can run in the writer thread, which has
+    its own database session.
+    Returns the id of the new dataset.
+    """
+    shard = use_new_shard()  # in sharding mode, before anything is written
+    author = db.session.get(User, id_author)
+    dataset = new_dataset_to_db(form_data, dataset_type, author)
+    dataset.shard = shard
+    dataset.file_sha256 = file_sha256  # to find the uploads of identical files
+    if dataset_type == DatasetType.sm_thread:
+        sm_dict_to_sql(data, dataset)  # Convert the dictionary to SQL
+    elif dataset_type == DatasetType.psychotherapy:
+        psychotherapy_df_to_sql(data, dataset)  # Convert the dataframe to SQL
+    db.session.flush()  # assign the dataset id
+    if dataset_type == DatasetType.psychotherapy:
+        dataset.n_segments = count_segments(
+            dataset, current_app.config["PS_MINS_PER_PAGE"] * 60
+        )  # for the annotation progress
+    return dataset.id
+
+
+def save_shared_dataset(
+    form_data: dict, id_source: int, id_author: int, file_sha256: str
+):
+    """
+    Write job for the write queue (see app/writer.py): create a new dataset from
+    a file identical to the file of an existing dataset, sharing the contents
+    of the existing dataset instead of adding them again (see share_dataset_content).
+    Returns the id of the new dataset, or None if the existing dataset, or the dataset
+    owning its contents, is being deleted (see app/admin/delete.py) since the request:
+    its contents can no longer be shared.
+    """
+    # shared locks of their rows on PostgreSQL: they are not marked as being deleted
+    # (see mark_deleting) until the new dataset is committed, and the contents are
+    # then handed over with the contents of the other datasets (see hand_over_content)
+    source = db.session.get(Dataset, id_source, with_for_update={"read": True})
+    if source is None or source.deleting:
+        return None
+    owner = db.session.get(Dataset, source.content_id, with_for_update={"read": True})
+    if owner.deleting:
+        return None
+    use_shard(source.shard)  # the new dataset is in the shard of its contents
+    author = db.session.get(User, id_author)
+    dataset = new_dataset_to_db(form_data, source.type, author)
+    dataset.file_sha256 = file_sha256
+    share_dataset_content(dataset, source)
+    db.session.flush()  # assign the dataset id
+    return dataset.id
+
+
+def find_uploaded_dataset(file_sha256: str, dataset_type: DatasetType) -> Dataset:
+    """
+    The first dataset of the given type uploaded from a file with this SHA-256,
+    which is not being deleted (see app/admin/delete.py)
+    """
+    return (
+        Dataset.query.filter_by(file_sha256=file_sha256, type=dataset_type)
+        .filter(Dataset.deleting.is_(False))
+        .order_by(Dataset.id)
+        .first()
+    )
+
+
+def upload_dataset(form: UploadForm, dataset_type: DatasetType, endpoint: str):
+    """
+    Save the file of a valid upload form and create its dataset.
+    The file is stored under its SHA-256 (see save_upload). If a dataset of the same
+    type was uploaded from an identical file, the new dataset shares its contents,
+    or the upload is rejected, depending on DUPLICATE_UPLOADS in the app config.
+    Returns the response: a redirect to the upload page (endpoint).
+    """
+    # Check if a file is present in the request
+    if "file" not in request.files:
+        flash("No file part")
+        return redirect(url_for(endpoint))  # Redirect to the upload page
+    file = request.files["file"]  # Get the file from the request
+    # If the user does not select a file,
+    # the browser submits an empty file without a filename
+    if file.filename == "":
+        flash("No selected file")
+        return redirect(url_for(endpoint))  # Redirect to the upload page
+    if not allowed_file(file.filename):
+        return None  # show the upload form again
+    file_path, file_sha256 = save_upload(file)  # Save the file to disk, hashed
+    source = find_uploaded_dataset(file_sha256, dataset_type)
+    if source is not None and current_app.config["DUPLICATE_UPLOADS"] == "reject":
+        if source.id_author == current_user.id:
+            flash(
+                'This file was uploaded already, as the dataset "{}"'.format(
+                    source.name
+                )
+            )
+        else:
+            flash("This file was uploaded already")
+        return redirect(url_for(endpoint))
+    form_data = upload_form_data(form)
+    try:
+        id_dataset = None
+        if source is not None:
+            # an identical file was uploaded already: its contents are not read again
+            id_dataset = write_queue.submit(
+                save_shared_dataset, form_data, source.id, current_user.id, file_sha256
+            )
+        if id_dataset is None:
+            data = read_pickle(file_path)  # Read the pickle file
+            # Create a new dataset object, convert the data to SQL,
+            # add it to the database and commit the changes
+            write_queue.submit(
+                save_dataset,
+                form_data,
+                dataset_type,
+                data,
+                current_user.id,
+                file_sha256,
+            )
+    except:
+        abort(400)  # raise a HTTP 400 Bad Request error
+    flash("File uploaded successfully")
+    return redirect(url_for(endpoint))  # Redirect to the upload page
+
+
 @bp.route("/upload_sm", methods=["GET", "POST"])
 @login_required
 def upload_sm():
@@ -63,46 +222,15 @@ def upload_sm():
     # This condition below is true when the request method is POST and the
     # form data passes all the defined validation checks.
     if form.validate_on_submit():
-        # Check if a file is present in the request
-        if "file" not in request.files:
-            flash("No file part")
-            return redirect(
-                url_for("upload.upload_sm")
-            )  # Redirect to the upload_sm page
-        file = request.files["file"]  # Get the file from the request
-        # If the user does not select a file,
-        # the browser submits an empty file without a filename
-        if file.filename == "":
-            flash("No selected file")
-            return redirect(
-                url_for("upload.upload_sm")
-            )  # Redirect to the upload_sm page
-        if file and allowed_file(file.filename):  # If the file is valid
-            # Secure the filename before saving it
-            filename = secure_filename(file.filename)  # Get the filename
-            file_path = get_file_path(filename)  # Get the file path
-            file.save(file_path)  # Save the file to disk
-            # Create a new dataset object and add it to the database
-            dataset_type = DatasetType.sm_thread
-            dataset = new_dataset_to_db(form, dataset_type)
-            sm_data = read_pickle(file_path)  # Read the pickle file
-            try:
-                sm_dict_to_sql(
-                    sm_data, dataset
-                )  # Convert the dictionary to SQL and add it to the database
-            except:
-                db.session.rollback()  # Rollback the changes to the database
-                abort(400)  # raise a HTTP 400 Bad Request error
-            db.session.commit()  # Commit the changes to the database
-            flash("File uploaded successfully")
-            return redirect(
-                url_for("upload.upload_sm")
-            )  # Redirect to the upload_sm page
+        response = upload_dataset(form, DatasetType.sm_thread, "upload.upload_sm")
+        if response is not None:
+            return response
     return render_template(
         "upload/upload.html",
         title="Upload dataset",
         heading="Upload new social media dataset",
         form=form,
+        datasets=authored_datasets(DatasetType.sm_thread),
     )
 
 
@@ -115,44 +243,71 @@ def upload_psychotherapy():
     # This condition below is true when the request method is POST and the
     # form data passes all the defined validation checks.
     if form.validate_on_submit():
-        # Check if a file is present in the request
-        if "file" not in request.files:
-            flash("No file part")
-            return redirect(
-                url_for("upload.upload_psychotherapy")
-            )  # Redirect to the upload_psychotherapy page
-        file = request.files["file"]  # Get the file from the request
-        # If the user does not select a file,
-        # the browser submits an empty file without a filename
-        if file.filename == "":
-            flash("No selected file")
-            return redirect(
-                url_for("upload.upload_psychotherapy")
-            )  # Redirect to the upload_psychotherapy page
-        if file and allowed_file(file.filename):  # If the file is valid
-            # Secure the filename before saving it
-            filename = secure_filename(file.filename)  # Get the filename
-            file_path = get_file_path(filename)  # Get the file path
-            file.save(file_path)  # Save the file to disk
-            # Create a new dataset object and add it to the database
-            dataset_type = DatasetType.psychotherapy
-            dataset = new_dataset_to_db(form, dataset_type)
-            psychotherapy_data = read_pickle(file_path)  # Read the pickle file
-            try:
-                psychotherapy_df_to_sql(
-                    psychotherapy_data, dataset
-                )  # Convert the dataframe to SQL and add it to the database
-            except:
-                db.session.rollback()  # Rollback the changes to the database
-                abort(400)  # raise a HTTP 400 Bad Request error
-            db.session.commit()  # Commit the changes to the database
-            flash("File uploaded successfully")
-            return redirect(
-                url_for("upload.upload_psychotherapy")
-            )  # Redirect to the upload_sm page
+        response = upload_dataset(
+            form, DatasetType.psychotherapy, "upload.upload_psychotherapy"
+        )
+        if response is not None:
+            return response
     return render_template(
         "upload/upload.html",
         title="Upload dataset",
         heading="Upload new psychotherapy session dataset",
         form=form,
+        datasets=authored_datasets(DatasetType.psychotherapy),
+    )
+
+
+@bp.route("/upload_psychotherapy/<int:dataset_id>/version", methods=["GET", "POST"])
+@login_required
+def upload_psychotherapy_version(dataset_id: int):
+    """
+    This is the upload route for a new version of the file of a psychotherapy dataset:
+    only the dialog turns and events which changed are written (see app/upload/diff.py)
+    """
+    dataset = Dataset.query.get_or_404(dataset_id)
+    if dataset.type != DatasetType.psychotherapy:
+        abort(404)
+    if dataset.id_author != current_user.id and not current_user.is_administrator():
+        abort(403)
+    endpoint = "upload.upload_psychotherapy"
+    form = DatasetVersionForm()
+    if form.validate_on_submit():
+        file = request.files.get("file")
+        if file is None or file.filename == "" or not allowed_file(file.filename):
+            flash("No selected file")
+            return redirect(request.url)
+        if (
+            dataset.id_content is not None
+            or Dataset.query.filter_by(id_content=dataset.id).first() is not None
+        ):
+            # the dialog turns of the other dataset would change too
+            flash(
+                "This dataset shares its dialog turns with another dataset "
+                "(uploaded from an identical file), it cannot have a new version"
+            )
+            return redirect(url_for(endpoint))
+        file_path, file_sha256 = save_upload(file)  # Save the file to disk, hashed
+        if file_sha256 == dataset.file_sha256:
+            flash("This file is identical to the current version of the dataset")
+            return redirect(url_for(endpoint))
+        try:
+            rows = psychotherapy_df_to_rows(read_pickle(file_path))
+            changes = write_queue.submit(
+                save_dataset_version,
+                dataset.id,
+                rows,
+                file_sha256,
+                current_app.config["PS_MINS_PER_PAGE"] * 60,
+            )
+        except:
+            abort(400)  # raise a HTTP 400 Bad Request error
+        flash(
+            "New version of the dataset uploaded ({})".format(format_changes(changes))
+        )
+        return redirect(url_for(endpoint))
+    return render_template(
+        "upload/upload.html",
+        title="Upload dataset",
+        heading='Upload a new version of "{}"'.format(dataset.name),
+        form=form,
     )
@@ -0,0 +1,69 @@
+"""
+Content-addressed storage of the uploaded files.
+An uploaded file is hashed (SHA-256) while it is streamed to disk, and stored under
+its hash, in UPLOAD_FOLDER/<first 2 characters of the hash>/<hash>.<extension>:
+identical files are stored once, and different files with the same name do not
+overwrite each other. The hash is recorded with the dataset (Dataset.file_sha256,
+indexed), to find the datasets uploaded from an identical file.
+"""
+import hashlib
+import os
+import tempfile
+from flask import current_app
+
+CHUNK_SIZE = 1024 * 1024  # bytes read at a time from an uploaded file
+
+
+def get_file_path(sha256: str, filename: str) -> str:
+    """
+    Get the path of an uploaded file with this SHA-256 (hex digest).
+    The path is in the UPLOAD_FOLDER from the app config, and keeps the extension
+    of the name of the uploaded file.
+    """
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else "bin"
+    return os.path.join(
+        current_app.config["UPLOAD_FOLDER"],
+        sha256[:2],
+        "{}.{}".format(sha256, extension),
+    )
+
+
+def save_upload(file) -> tuple:
+    """
+    Save an uploaded file (werkzeug FileStorage) to disk, hashing it while it is
+    streamed to a temporary file, which is then renamed after its hash.
+
+    Returns
+    -------
+    file_path : str
+        The path of the saved file
+    sha256 : str
+        The SHA-256 of the file (hex digest)
+    """
+    upload_folder = current_app.config["UPLOAD_FOLDER"]
+    os.makedirs(upload_folder, exist_ok=True)
+    sha256 = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=upload_folder)
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            for chunk in iter(lambda: file.stream.read(CHUNK_SIZE), b""):
+                sha256.update(chunk)
+                handle.write(chunk)
+        file_path = get_file_path(sha256.hexdigest(), file.filename)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # atomic: an identical file stored already is replaced by the same contents
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return file_path, sha256.hexdigest()
+
+
+def hash_file(file_path: str) -> str:
+    """The SHA-256 (hex digest) of a file on disk, read a chunk at a time"""
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
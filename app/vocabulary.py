@@ -0,0 +1,184 @@
+"""
+Integer codes of the labels and strengths of the psychotherapy annotations.
+The label and strength columns of the annotation tables and the label column of the
+evidence tables (LabelCode) store the small integer code of their Enum member (see
+app/utils.py), instead of its name: the rows and indexes are smaller, and adding
+a label only needs a new code, not a migration rewriting the tables. The codes are
+also stored in the "label_vocabulary" table (see LabelVocabulary in app/models.py),
+to read the labels in SQL.
+
+The codes of each Enum are the positions (from 1) of the names of its members in
+LABEL_CODES. New members are added at the end of their list, and the names of the
+members removed from an Enum are kept, so that the codes never change.
+"""
+from sqlalchemy import SmallInteger
+from sqlalchemy.types import TypeDecorator
+from app.utils import (
+    SubLabelsAClient,
+    SubLabelsATherapist,
+    SubLabelsADyad,
+    SubLabelsBClient,
+    SubLabelsBTherapist,
+    SubLabelsBDyad,
+    SubLabelsCClient,
+    SubLabelsCTherapist,
+    SubLabelsDClient,
+    SubLabelsDTherapist,
+    SubLabelsEClient,
+    SubLabelsETherapist,
+    SubLabelsFClient,
+    LabelStrengthAClient,
+    LabelStrengthATherapist,
+    LabelStrengthADyad,
+    LabelStrengthBClient,
+    LabelStrengthBTherapist,
+    LabelStrengthBDyad,
+    LabelStrengthCClient,
+    LabelStrengthCTherapist,
+    LabelStrengthDClient,
+    LabelStrengthDTherapist,
+    LabelStrengthEClient,
+    LabelStrengthETherapist,
+    LabelStrengthFClient,
+    LabelNamesClient,
+    LabelNamesTherapist,
+    LabelNamesDyad,
+)
+
+CLIENT_STRENGTHS = [
+    "highly_maladaptive",
+    "very_maladaptive",
+    "moderately_adaptive",
+    "very_adaptive",
+    "highly_adaptive",
+]
+THERAPIST_STRENGTHS = ["low", "medium", "high"]
+
+# the names of the members of each Enum, in the order of their codes (append only)
+LABEL_CODES = {
+    # client
+    SubLabelsAClient: ["attachment", "identity", "security", "excitement", "other"],
+    SubLabelsBClient: ["attachment", "identity", "security", "excitement", "other"],
+    SubLabelsCClient: ["acceptance", "esteem", "fight", "flight", "other"],
+    SubLabelsDClient: ["hard_negative", "soft_negative", "neutral", "positive"],
+    SubLabelsEClient: ["insight"],
+    SubLabelsFClient: ["no_change", "switch", "escalation"],
+    LabelStrengthAClient: CLIENT_STRENGTHS,
+    LabelStrengthBClient: CLIENT_STRENGTHS,
+    LabelStrengthCClient: CLIENT_STRENGTHS,
+    LabelStrengthDClient: CLIENT_STRENGTHS,
+    LabelStrengthEClient: [
+        "no_recognition",
+        "low_recognition",
+        "moderate_recognition",
+        "good_recognition",
+        "excellent_recognition",
+    ],
+    LabelStrengthFClient: [
+        "significant_deterioration",
+        "some_deterioration",
+        "no_change",
+        "some_improvement",
+        "significant_improvement",
+    ],
+    LabelNamesClient: [
+        "label_a",
+        "label_b",
+        "label_c",
+        "label_d",
+        "label_e",
+        "label_f",
+    ],
+    # therapist
+    SubLabelsATherapist: ["emotional", "cognitive", "respect", "calming", "other"],
+    SubLabelsBTherapist: [
+        "interpretation",
+        "reframing",
+        "reflection",
+        "transference",
+        "other",
+    ],
+    SubLabelsCTherapist: ["questions", "exploration", "upregulation", "other"],
+    SubLabelsDTherapist: [
+        "restructuring",
+        "suggest_change",
+        "encouragement",
+        "advice",
+        "other",
+    ],
+    SubLabelsETherapist: ["general_helpfulness"],
+    LabelStrengthATherapist: THERAPIST_STRENGTHS,
+    LabelStrengthBTherapist: THERAPIST_STRENGTHS,
+    LabelStrengthCTherapist: THERAPIST_STRENGTHS,
+    LabelStrengthDTherapist: THERAPIST_STRENGTHS,
+    LabelStrengthETherapist: THERAPIST_STRENGTHS,
+    LabelNamesTherapist: ["label_a", "label_b", "label_c", "label_d", "label_e"],
+    # dyad
+    SubLabelsADyad: ["bond", "tasks_goals"],
+    SubLabelsBDyad: ["confrontational", "withdrawal", "other"],
+    LabelStrengthADyad: ["low", "medium", "high"],
+    LabelStrengthBDyad: ["high", "medium", "low"],
+    LabelNamesDyad: ["label_a", "label_b"],
+}
+
+
+def label_codes(enum_class) -> dict:
+    """The code of each member of an Enum"""
+    names = LABEL_CODES[enum_class]
+    missing = [member.name for member in enum_class if member.name not in names]
+    if missing:
+        raise LookupError(
+            "no code for {}.{}, add it to LABEL_CODES".format(
+                enum_class.__name__, ", ".join(missing)
+            )
+        )
+    return {member: names.index(member.name) + 1 for member in enum_class}
+
+
+class LabelCode(TypeDecorator):
+    """
+    Enum column stored as the integer codes of its members (see LABEL_CODES).
+    Like an Enum column, it takes the members or their names, and gives the members.
+    """
+
+    impl = SmallInteger
+    cache_ok = True
+
+    def __init__(self, enum_class):
+        super().__init__()
+        self.enum_class = enum_class
+        self.codes = label_codes(enum_class)
+        self.members = {code: member for member, code in self.codes.items()}
+
+    @property
+    def python_type(self):
+        return self.enum_class
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            value = self.enum_class[value]  # e.g. the names given by the forms
+        return self.codes[value]
+
+    def process_literal_param(self, value, dialect):
+        return str(self.process_bind_param(value, dialect))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self.members[value]
+
+
+def vocabulary_rows() -> list:
+    """The rows of the label_vocabulary table: the code of each member of each Enum"""
+    return [
+        {
+            "enum": enum_class.__name__,
+            "code": code,
+            "name": member.name,
+            "value": member.value,
+        }
+        for enum_class in LABEL_CODES
+        for member, code in label_codes(enum_class).items()
+    ]
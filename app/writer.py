@@ -0,0 +1,206 @@
+"""
+Serialized database writes (single-writer mode).
+SQLite allows only one writer at a time, so instead of letting every request
+commit its own transaction (and retry when the database is locked), the writes
+are handed to a dedicated writer thread. The writer thread runs all the writes
+that are waiting in the queue in a single transaction (group commit), i.e. many
+small annotation transactions share one fsync.
+Callers block until their write has been committed, so from the point of view of
+the request nothing changes.
+In sharding mode (see app/shards.py), each database file has a single writer: the writes
+are run by SHARD_WRITER_THREADS threads, the writes to a shard always by the same one,
+so the writes to different shards run in parallel.
+"""
+import os
+import queue
+import threading
+import zlib
+from concurrent.futures import Future
+from flask import current_app
+from app.database import is_memory_sqlite
+from app.shards import current_shard, sharding_enabled, use_shard
+
+
+class WriteJob:
+    """
+    A write to be run by the writer thread: a function and its arguments, and the shard
+    selected by the caller (see app/shards.py), which the write uses too
+    """
+
+    def __init__(self, func, args, kwargs, shard: str = None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.shard = shard
+        self.future = Future()  # used to wait for the result of the write
+
+    def run(self):
+        return self.func(*self.args, **self.kwargs)
+
+
+class Writer:
+    """
+    Writer thread(s) of an application. The threads are started on the first write,
+    so that they are never inherited by a forked (gunicorn) worker process.
+    """
+
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self.batch_size = app.config["SINGLE_WRITER_BATCH_SIZE"]
+        self.n_threads = (
+            app.config["SHARD_WRITER_THREADS"] if app.config["SHARD_DATASETS"] else 1
+        )
+        self.n_commits = 0  # number of transactions committed by the writer threads
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queues = {}  # queue of each writer thread
+
+    def thread_index(self, shard: str) -> int:
+        """The writer thread of the writes to a shard (0 for the main database)"""
+        if shard is None:
+            return 0
+        return zlib.crc32(shard.encode()) % self.n_threads
+
+    def put(self, job: WriteJob):
+        """Add a job to the queue of its writer thread, starting the thread if needed"""
+        index = self.thread_index(job.shard)
+        with self._lock:
+            if self._pid != os.getpid():
+                # first write in this process (e.g. after fork): start new threads
+                self._pid = os.getpid()
+                self._queues = {}
+            if index not in self._queues:
+                self._queues[index] = queue.Queue()
+                threading.Thread(
+                    target=self._run,
+                    args=(self._queues[index],),
+                    name="db-writer-{}".format(index),
+                    daemon=True,
+                ).start()
+            jobs = self._queues[index]
+        jobs.put(job)
+
+    def _run(self, jobs_queue: queue.Queue):
+        """Writer thread loop"""
+        while True:
+            jobs = [jobs_queue.get()]  # wait for the next write
+            # then take all the other writes that are already waiting
+            while len(jobs) < self.batch_size:
+                try:
+                    jobs.append(jobs_queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self.app.app_context():
+                for group in self._shard_groups(jobs):
+                    self._commit_group(group)
+
+    def _shard_groups(self, jobs: list) -> list:
+        """
+        Split the jobs into the groups committed together: in sharding mode, the jobs
+        of each shard. The jobs without a shard (e.g. creating a dataset in a new
+        shard) are committed one by one, since they can write to any shard.
+        """
+        if not sharding_enabled():
+            return [jobs]
+        groups = {}
+        for job in jobs:
+            groups.setdefault(job.shard or id(job), []).append(job)
+        return list(groups.values())
+
+    def _commit_group(self, jobs: list):
+        """
+        Run a group of jobs in a single transaction and commit it.
+        If one of the jobs fails, the transaction is rolled back and
+        the jobs are retried one by one, so that only the failing job
+        reports an error.
+        """
+        session = self.db.session
+        try:
+            results = []
+            for job in jobs:
+                use_shard(job.shard)
+                results.append(job.run())
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            if len(jobs) == 1:
+                jobs[0].future.set_exception(e)
+            else:
+                for job in jobs:
+                    self._commit_group([job])
+            return
+        self.n_commits += 1
+        for job, result in zip(jobs, results):
+            job.future.set_result(result)
+
+
+class WriteQueue:
+    """
+    Extension used to run database writes.
+    If SINGLE_WRITER is enabled, the writes are run by the writer thread of the app
+    (see Writer), otherwise they are run and committed directly in the current session.
+    """
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        """Bind the write queue to the application"""
+        app.extensions["write_queue"] = Writer(app, db)
+
+    @staticmethod
+    def get_writer() -> Writer:
+        """Return the writer of the current application"""
+        return current_app.extensions["write_queue"]
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) and commit the database session.
+        The write functions add objects to `db.session`. In single-writer mode
+        they run in the writer thread, so they must take plain values
+        (e.g. IDs) instead of objects loaded in the session of the request.
+        Blocks until the write is committed and returns the result of func.
+        Any exception raised by func (or by the commit) is raised again here.
+        """
+        writer = self.get_writer()
+        if not current_app.config["SINGLE_WRITER"]:
+            session = writer.db.session
+            try:
+                result = func(*args, **kwargs)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            return result
+        job = WriteJob(func, args, kwargs, current_shard())
+        writer.put(job)
+        return job.future.result(timeout=current_app.config["SINGLE_WRITER_TIMEOUT"])
+
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Run func(*args, **kwargs) in a background thread, in an application context of the
+    current app, e.g. a long job started by a request (the deletion of a dataset, see
+    app/admin/routes.py), which submits its writes to the write queue itself.
+    The errors are logged. With an in-memory SQLite database (the tests), whose single
+    connection is shared by the threads, the job runs before returning instead.
+    """
+    app = current_app._get_current_object()
+    if is_memory_sqlite(app.config["SQLALCHEMY_DATABASE_URI"]):
+        func(*args, **kwargs)
+        return
+
+    def run():
+        with app.app_context():
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                app.logger.exception("background job %s failed", func.__name__)
+
+    thread = threading.Thread(
+        target=run, name="background-{}".format(func.__name__), daemon=True
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,170 @@
+"""
+Benchmark of the compressed storage of the texts (COMPRESS_TEXT) on SQLite.
+Uploads the same synthetic psychotherapy dataset (200,000 dialog events by default)
+to a SQLite database file with and without compression, and compares the size of the
+database files (after VACUUM) and the time to load the dialog events of a page
+(the query of the annotation view, decompressing the texts) and to search them.
+
+Usage: python benchmarks/compression.py [--events N] [--runs N]
+"""
+import argparse
+import datetime
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa: E402
+from app.models import Dataset, PSDialogEvent, PSDialogTurn  # noqa: E402
+from app.search.utils import search_events  # noqa: E402
+from app.upload.parsers import (  # noqa: E402
+    dialog_event_fingerprint,
+    dialog_turn_fingerprint,
+    psychotherapy_rows_to_sql,
+)
+from app.utils import DatasetType  # noqa: E402
+from config import TestConfig  # noqa: E402
+
+# sentences of the transcripts: conversational phrases with words drawn from
+# a vocabulary with a Zipf distribution of word frequencies (as in natural language)
+VOCABULARY = ["w{}".format(rank) for rank in range(5000)]
+for rank, word in [(5, "work"), (60, "mother"), (300, "anxious"), (2000, "panic")]:
+    VOCABULARY[rank] = word
+CUM_WEIGHTS = list(itertools.accumulate(1 / (rank + 1) for rank in range(5000)))
+PHRASES = [
+    "I don't know, I think {} is",
+    "and then I felt really {} about it",
+    "How did that make you feel when {} happened?",
+    "It sounds like {} has been difficult for you",
+    "yeah, I mean, {} and {}",
+    "I've been trying to {} but",
+    "Can you tell me more about {}?",
+    "so last week when I was at {}",
+    "Mm-hmm.",
+    "I keep thinking about {} all the time",
+]
+EVENTS_PER_TURN = 4
+TURNS_PER_SESSION = 500
+TURNS_PER_PAGE = 30  # 10 s per dialog turn, 5 minutes per page
+
+
+def random_text() -> str:
+    """A random dialog event: a few phrases"""
+    return " ".join(
+        phrase.format(
+            *random.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=phrase.count("{}"))
+        )
+        for phrase in random.choices(PHRASES, k=random.randint(1, 4))
+    )
+
+
+def dataset_rows(n_events: int) -> dict:
+    """The rows of a synthetic psychotherapy dataset (see psychotherapy_df_to_rows)"""
+    random.seed(0)
+    dialog_turns = []
+    for turn in range(n_events // EVENTS_PER_TURN):
+        seconds = turn % TURNS_PER_SESSION * 10
+        dialog_turn = {
+            "c_code": "AA0001",
+            "t_init": None,
+            "date": None,
+            "timestamp": datetime.time(
+                seconds // 3600, seconds // 60 % 60, seconds % 60
+            ),
+            "main_speaker": "Client",
+            "session_n": turn // TURNS_PER_SESSION + 1,
+            "dialog_turn_n": turn,
+        }
+        dialog_turn["fingerprint"] = dialog_turn_fingerprint(dialog_turn)
+        dialog_turns.append(dialog_turn)
+    dialog_events = []
+    for event in range(len(dialog_turns) * EVENTS_PER_TURN):
+        dialog_event = {
+            "event_n": event,
+            "event_speaker": random.choice(["Client", "Therapist"]),
+            "event_plaintext": random_text(),
+        }
+        dialog_event["fingerprint"] = dialog_event_fingerprint(dialog_event)
+        dialog_events.append((event // EVENTS_PER_TURN, dialog_event))
+    return {"dialog_turns": dialog_turns, "dialog_events": dialog_events, "stats": {}}
+
+
+def timed(function, runs: int) -> float:
+    """Return the median time (in ms) of the function"""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def load_page(id_dataset: int, page: int) -> list:
+    """The dialog events of a page, as the annotation view loads them"""
+    first_turn = (page - 1) * TURNS_PER_PAGE
+    return (
+        PSDialogEvent.query.join(PSDialogTurn)
+        .filter(
+            PSDialogEvent.id_dataset == id_dataset,
+            PSDialogTurn.dialog_turn_n >= first_turn,
+            PSDialogTurn.dialog_turn_n < first_turn + TURNS_PER_PAGE,
+        )
+        .order_by(PSDialogEvent.event_n)
+        .all()
+    )
+
+
+def run(directory: str, compress: bool, n_events: int, runs: int) -> dict:
+    """Upload the dataset to a new database and measure it"""
+    path = os.path.join(directory, "compressed.db" if compress else "plain.db")
+    config = type(
+        "BenchmarkConfig",
+        (TestConfig,),
+        {"SQLALCHEMY_DATABASE_URI": "sqlite:///" + path, "COMPRESS_TEXT": compress},
+    )
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        rows = dataset_rows(n_events)
+        start = time.perf_counter()
+        dataset = Dataset(name="Benchmark", type=DatasetType.psychotherapy)
+        db.session.add(dataset)
+        psychotherapy_rows_to_sql(rows, dataset)
+        db.session.commit()
+        upload_time = time.perf_counter() - start
+        id_dataset = dataset.id
+        db.session.execute(db.text("VACUUM"))
+        n_pages = len(rows["dialog_turns"]) // TURNS_PER_PAGE
+        pages = iter(itertools.cycle(range(1, n_pages + 1, max(1, n_pages // 97))))
+        results = {
+            "upload (s)": upload_time,
+            "size (MB)": os.path.getsize(path) / 1e6,
+            "page (ms)": timed(lambda: load_page(id_dataset, next(pages)), runs),
+            "search (ms)": timed(lambda: search_events(id_dataset, "anxious"), runs),
+        }
+        db.session.remove()
+        db.engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=200_000)
+    parser.add_argument("--runs", type=int, default=20, help="number of runs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        plain = run(directory, False, args.events, args.runs)
+        compressed = run(directory, True, args.events, args.runs)
+    print("{:<14}{:>12}{:>12}".format("", "plain", "compressed"))
+    for name in plain:
+        print("{:<14}{:>12.2f}{:>12.2f}".format(name, plain[name], compressed[name]))
+
+
+if __name__ == "__main__":
+    main()
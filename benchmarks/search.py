@@ -0,0 +1,147 @@
+"""
+Benchmark of the full-text search of the dialog events on SQLite.
+Fills a SQLite database file with a synthetic psychotherapy dataset (one million dialog
+events by default), indexes it like an upload does, and compares the time of a search
+with the FTS5 index (search_events: most relevant hits, snippets and number of hits)
+to counting the hits with a LIKE query, which scans all the events.
+
+Usage: python benchmarks/search.py [--events N] [--runs N]
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa: E402
+from app.models import Dataset  # noqa: E402
+from app.search.utils import index_dataset_events, search_events  # noqa: E402
+from app.utils import DatasetType  # noqa: E402
+from config import TestConfig  # noqa: E402
+
+# vocabulary with a Zipf distribution of word frequencies, as in natural language:
+# a few very common words and many rare ones (synthetic words like "w123"),
+# with some topic words at different ranks
+VOCABULARY = ["w{}".format(rank) for rank in range(5000)]
+for rank, word in [(5, "feel"), (60, "mother"), (300, "anxious"), (2000, "panic")]:
+    VOCABULARY[rank] = word
+CUM_WEIGHTS = list(itertools.accumulate(1 / (rank + 1) for rank in range(5000)))
+EVENTS_PER_TURN = 4
+TURNS_PER_SESSION = 500
+QUERIES = ["feel", "mother", "anxious", "panic", '"panic attack"', "moth*", "zebra"]
+
+
+def fill_database(n_events: int) -> int:
+    """Add a dataset with n_events random dialog events and index it, return its id"""
+    dataset = Dataset(name="Benchmark", type=DatasetType.psychotherapy)
+    db.session.add(dataset)
+    db.session.flush()
+    connection = db.session.connection()
+    random.seed(0)
+    n_turns = n_events // EVENTS_PER_TURN
+    connection.exec_driver_sql(
+        "INSERT INTO ps_dialog_turn (id, c_code, timestamp, main_speaker, session_n, "
+        "dialog_turn_n, id_dataset) VALUES (?, 'AA0001', ?, 'Client', ?, ?, ?)",
+        [
+            (
+                turn + 1,
+                "{:02d}:{:02d}:{:02d}.000000".format(
+                    seconds // 3600, seconds // 60 % 60, seconds % 60
+                ),
+                turn // TURNS_PER_SESSION + 1,
+                turn,
+                dataset.id,
+            )
+            for turn in range(n_turns)
+            for seconds in [turn % TURNS_PER_SESSION * 10]  # 10 s per dialog turn
+        ],
+    )
+    for chunk in range(0, n_events, 100_000):
+        connection.exec_driver_sql(
+            "INSERT INTO ps_dialog_event (event_n, event_speaker, event_plaintext, "
+            "id_ps_dialog_turn, id_dataset) VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    event,
+                    random.choice(["Client", "Therapist"]),
+                    " ".join(
+                        random.choices(
+                            VOCABULARY, cum_weights=CUM_WEIGHTS, k=random.randint(5, 25)
+                        )
+                    )
+                    + (" panic attack" if random.random() < 0.001 else ""),
+                    event // EVENTS_PER_TURN + 1,
+                    dataset.id,
+                )
+                for event in range(chunk, min(chunk + 100_000, n_events))
+            ],
+        )
+    start = time.perf_counter()
+    index_dataset_events(dataset.id)
+    db.session.commit()
+    print("indexing: {:.1f} s".format(time.perf_counter() - start))
+    return dataset.id
+
+
+def timed(function, runs: int) -> tuple:
+    """Return the median time (in ms) of the function and its last result"""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--runs", type=int, default=5, help="number of runs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        config = type(
+            "BenchmarkConfig",
+            (TestConfig,),
+            {"SQLALCHEMY_DATABASE_URI": "sqlite:///" + directory + "/app.db"},
+        )
+        app = create_app(config)
+        with app.app_context():
+            db.create_all()
+            id_dataset = fill_database(args.events)
+            print(
+                "{:<16}{:>8}{:>12}{:>12}".format(
+                    "query", "hits", "FTS (ms)", "LIKE (ms)"
+                )
+            )
+            for query in QUERIES:
+                fts_time, (_, total) = timed(
+                    lambda: search_events(id_dataset, query), args.runs
+                )
+                # a LIKE query scans all the events (to count the hits)
+                pattern = "%" + query.strip('"').rstrip("*") + "%"
+                like_time, _ = timed(
+                    lambda: db.session.execute(
+                        db.text(
+                            "SELECT count(*) FROM ps_dialog_event "
+                            "WHERE id_dataset = :id AND event_plaintext LIKE :pattern"
+                        ),
+                        {"id": id_dataset, "pattern": pattern},
+                    ).scalar(),
+                    args.runs,
+                )
+                print(
+                    "{:<16}{:>8}{:>12.1f}{:>12.1f}".format(
+                        query, total, fts_time, like_time
+                    )
+                )
+            db.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
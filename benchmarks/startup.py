@@ -0,0 +1,65 @@
+"""
+Benchmark of the startup time of a worker process.
+Measures, in a new Python process, the time to import the app and to render all
+the templates for the first time, without and with the Jinja bytecode cache on disk.
+
+Usage: python benchmarks/startup.py [--runs N]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# code run in each new process, prints the import and compile times in seconds
+WORKER = """
+import time
+start = time.perf_counter()
+import annotations_interface
+imported = time.perf_counter()
+from app.jinja import precompile_templates
+precompile_templates(annotations_interface.app)
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def run_worker(env: dict) -> tuple:
+    """Start a new Python process and return its import and compile times"""
+    output = subprocess.run(
+        [sys.executable, "-c", WORKER],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    import_time, compile_time = output.split()
+    return float(import_time), float(compile_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="number of runs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, DATABASE_URL="sqlite://")
+        env.pop("JINJA_BYTECODE_CACHE_DIR", None)
+        cases = {
+            "no cache": env,
+            "warm cache": dict(env, JINJA_BYTECODE_CACHE_DIR=cache_dir),
+        }
+        run_worker(cases["warm cache"])  # fill the cache
+        print("{:<12}{:>12}{:>16}".format("", "import (ms)", "templates (ms)"))
+        for name, case_env in cases.items():
+            times = [run_worker(case_env) for _ in range(args.runs)]
+            import_time = statistics.median(t[0] for t in times) * 1000
+            compile_time = statistics.median(t[1] for t in times) * 1000
+            print("{:<12}{:>12.1f}{:>16.1f}".format(name, import_time, compile_time))
+
+
+if __name__ == "__main__":
+    main()
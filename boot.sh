@@ -1,4 +1,5 @@
 #!/bin/bash
 # This is used to boot a Docker container
 flask db upgrade
-exec gunicorn -b :5000 --access-logfile - --error-logfile - annotations_interface:app
+# server settings are in gunicorn.conf.py
+exec gunicorn -c gunicorn.conf.py annotations_interface:app
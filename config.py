@@ -1,5 +1,6 @@
 import os
 import ast
+import tempfile
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -9,17 +10,96 @@ def get_app_admin(admin_emails):
     return ast.literal_eval(admin_emails)
 
 
+def get_database_url(database_url):
+    """
+    Return the database URL in the form expected by SQLAlchemy.
+    Some hosting providers use the "postgres://" scheme, which
+    SQLAlchemy does not accept anymore (it must be "postgresql://").
+    """
+    if database_url and database_url.startswith("postgres://"):
+        database_url = database_url.replace("postgres://", "postgresql://", 1)
+    return database_url
+
+
 class BaseConfig(object):
     """Base configuration. Configuration settings are defined here."""
 
     SECRET_KEY = os.environ.get("SECRET_KEY") or "you-will-never-guess"
-    SQLALCHEMY_DATABASE_URI = os.environ.get(
-        "DATABASE_URL"
+    SQLALCHEMY_DATABASE_URI = get_database_url(
+        os.environ.get("DATABASE_URL")
     ) or "sqlite:///" + os.path.join(basedir, "app.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = os.path.join(basedir, "data")  # folder for uploaded files
+    # folder for the archives of the datasets deleted with their archive
+    ARCHIVE_FOLDER = os.environ.get("ARCHIVE_FOLDER") or os.path.join(
+        basedir, "archives"
+    )
     APP_ADMIN = os.environ.get("APP_ADMIN")  # admin email(s), specified in .flaskenv
     PS_MINS_PER_PAGE = 5  # number of minutes per page in psychotherapy timeline
+    # SQLite settings applied to every new database connection,
+    # so that several (gunicorn) workers can share the same database file.
+    # Set to None to use the SQLite defaults.
+    # see: https://www.sqlite.org/pragma.html
+    SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",  # readers and the writer do not block each other
+        "synchronous": "NORMAL",  # fsync only at WAL checkpoints (safe in WAL mode)
+        "busy_timeout": int(
+            os.environ.get("SQLITE_BUSY_TIMEOUT") or 5000
+        ),  # wait (ms) for a lock instead of raising "database is locked"
+        "cache_size": -64000,  # page cache per connection, in KiB (i.e. 64 MB)
+        "mmap_size": 268435456,  # memory-mapped I/O for reads (256 MB)
+        "temp_store": "MEMORY",  # temporary tables and indices are kept in memory
+    }
+    # Connection pool settings for each database backend (per process).
+    # Values given in SQLALCHEMY_ENGINE_OPTIONS take precedence.
+    # An in-memory SQLite database uses a single connection and ignores these settings.
+    # see: https://docs.sqlalchemy.org/en/20/core/pooling.html
+    ENGINE_OPTIONS_PRESETS = {
+        "sqlite": {
+            "pool_size": int(os.environ.get("DB_POOL_SIZE") or 5),
+            "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW") or 10),
+            "pool_timeout": 30,  # seconds to wait for a connection from the pool
+        },
+        "postgresql": {
+            # connections kept open, and extra connections allowed under load
+            "pool_size": int(os.environ.get("DB_POOL_SIZE") or 10),
+            "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW") or 10),
+            "pool_timeout": 30,
+            "pool_pre_ping": True,  # check connections are alive before using them
+            "pool_recycle": 1800,  # replace connections older than 30 minutes
+        },
+        "mysql": {
+            "pool_size": int(os.environ.get("DB_POOL_SIZE") or 10),
+            "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW") or 10),
+            "pool_timeout": 30,
+            "pool_pre_ping": True,
+            "pool_recycle": 3600,  # below MySQL's default wait_timeout
+        },
+    }
+    # Single-writer mode: annotation and upload writes are handed to one writer thread
+    # (per process), which commits all the pending writes together (group commit)
+    SINGLE_WRITER = os.environ.get("SINGLE_WRITER") == "1"
+    SINGLE_WRITER_BATCH_SIZE = 100  # max number of writes committed together
+    SINGLE_WRITER_TIMEOUT = 60  # seconds a request waits for its write to be committed
+    # sharding mode: the rows of each new dataset are stored in a SQLite file of its own
+    # in the SHARD_FOLDER, the users and datasets stay in the main database (see app/shards.py)
+    SHARD_DATASETS = os.environ.get("SHARD_DATASETS") == "1"
+    SHARD_FOLDER = os.environ.get("SHARD_FOLDER") or os.path.join(basedir, "shards")
+    # number of writer threads in single-writer mode with sharding (one writer per shard)
+    SHARD_WRITER_THREADS = int(os.environ.get("SHARD_WRITER_THREADS") or 4)
+    # seconds between the end of the time window of an incremental export and the export,
+    # so that the annotations still being committed are left for the next export
+    EXPORT_WATERMARK_LAG = 10
+    SM_POSTS_PER_PAGE = 20  # number of posts per page in social media annotation view
+    SEARCH_RESULTS_PER_PAGE = 20  # number of hits per page of full-text search results
+    # an upload identical to the file of an existing dataset of the same type (same
+    # SHA-256) creates a dataset which shares its contents ("share"), or is rejected
+    DUPLICATE_UPLOADS = os.environ.get("DUPLICATE_UPLOADS") or "share"
+    # compress the texts of the new datasets (dialog events, posts and replies) on SQLite,
+    # with a dictionary trained on each dataset (see app/compression.py)
+    COMPRESS_TEXT = os.environ.get("COMPRESS_TEXT") == "1"
+    # directory where compiled templates are stored (disabled if not set)
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get("JINJA_BYTECODE_CACHE_DIR")
     if APP_ADMIN:
         # convert string to list if APP_ADMIN environment variable is set
         APP_ADMIN = get_app_admin(APP_ADMIN)
@@ -31,6 +111,12 @@ class TestConfig(BaseConfig):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"  # in-memory database
     WTF_CSRF_ENABLED = False  # disable CSRF tokens in the Forms
+    UPLOAD_FOLDER = os.path.join(
+        tempfile.gettempdir(), "annotations-interface-test-uploads"
+    )  # not the data folder of the app
+    ARCHIVE_FOLDER = os.path.join(
+        tempfile.gettempdir(), "annotations-interface-test-archives"
+    )
     APP_ADMIN = get_app_admin("['admin1@example.com', 'admin2@example.com']")
     SM_DATASET_PATH = os.path.join(
         basedir, "tests", "data", "timelines_example_lorem.pickle"
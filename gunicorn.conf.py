@@ -0,0 +1,33 @@
+"""
+Gunicorn configuration for production, used by boot.sh.
+The app is loaded once in the master process (preload_app) and the workers are forked
+from it, so they share the imported modules and compiled templates (copy-on-write)
+instead of loading them again.
+see: https://docs.gunicorn.org/en/stable/settings.html
+"""
+import gc
+import multiprocessing
+import os
+
+# compiled templates are also stored on disk, for faster restarts
+os.environ.setdefault("JINJA_BYTECODE_CACHE_DIR", "/tmp/annotations-interface/jinja")
+
+bind = ":5000"
+workers = int(os.environ.get("WEB_CONCURRENCY") or multiprocessing.cpu_count() * 2 + 1)
+threads = int(os.environ.get("GUNICORN_THREADS") or 2)
+preload_app = True
+accesslog = "-"  # log to stdout
+errorlog = "-"  # log to stderr
+worker_tmp_dir = "/dev/shm"  # worker heartbeat files in memory
+
+
+def when_ready(server):
+    """Run in the master process, after the app is loaded and before the workers are forked"""
+    from annotations_interface import app
+    from app.jinja import precompile_templates
+
+    n_templates = precompile_templates(app)
+    server.log.info("Precompiled %d templates", n_templates)
+    # move all the objects created so far out of reach of the garbage collector,
+    # so that collections in the workers do not write to (and copy) the shared memory pages
+    gc.freeze()
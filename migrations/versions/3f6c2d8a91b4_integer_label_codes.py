@@ -0,0 +1,281 @@
+"""integer label codes
+
+Revision ID: 3f6c2d8a91b4
+Revises: 714e8feb1345
+Create Date: 2026-10-19 14:20:41.512093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6c2d8a91b4'
+down_revision = '714e8feb1345'
+branch_labels = None
+depends_on = None
+
+# the codes of the labels at this revision (see LABEL_CODES in app/vocabulary.py):
+# the code of a label is its position (from 1), with the text shown to annotators
+LABELS = {
+    'SubLabelsAClient': [
+        ('attachment', 'attachment'),
+        ('identity', 'identity'),
+        ('security', 'security'),
+        ('excitement', 'excitement/interest/joy'),
+        ('other', 'other'),
+    ],
+    'SubLabelsBClient': [
+        ('attachment', "other's response to attachment needs"),
+        ('identity', "other's response to identity needs"),
+        ('security', "other's response to security needs"),
+        ('excitement', "other's response to excitement needs"),
+        ('other', 'other'),
+    ],
+    'SubLabelsCClient': [
+        ('acceptance', 'self acceptance, care and compassion'),
+        ('esteem', 'self esteem'),
+        ('fight', 'fight'),
+        ('flight', 'flight'),
+        ('other', 'other'),
+    ],
+    'SubLabelsDClient': [
+        ('hard_negative', 'hard negative'),
+        ('soft_negative', 'soft negative'),
+        ('neutral', 'neutral'),
+        ('positive', 'positive'),
+    ],
+    'SubLabelsEClient': [
+        ('insight', 'insight'),
+    ],
+    'SubLabelsFClient': [
+        ('no_change', 'no change'),
+        ('switch', 'switch'),
+        ('escalation', 'escalation'),
+    ],
+    'LabelStrengthAClient': [
+        ('highly_maladaptive', '1. highly maladaptive'),
+        ('very_maladaptive', '2. very maladaptive'),
+        ('moderately_adaptive', '3. moderately adaptive/maladaptive'),
+        ('very_adaptive', '4. very adaptive'),
+        ('highly_adaptive', '5. highly adaptive'),
+    ],
+    'LabelStrengthBClient': [
+        ('highly_maladaptive', '1. highly maladaptive'),
+        ('very_maladaptive', '2. very maladaptive'),
+        ('moderately_adaptive', '3. moderately adaptive/maladaptive'),
+        ('very_adaptive', '4. very adaptive'),
+        ('highly_adaptive', '5. highly adaptive'),
+    ],
+    'LabelStrengthCClient': [
+        ('highly_maladaptive', '1. highly maladaptive'),
+        ('very_maladaptive', '2. very maladaptive'),
+        ('moderately_adaptive', '3. moderately adaptive/maladaptive'),
+        ('very_adaptive', '4. very adaptive'),
+        ('highly_adaptive', '5. highly adaptive'),
+    ],
+    'LabelStrengthDClient': [
+        ('highly_maladaptive', '1. highly maladaptive'),
+        ('very_maladaptive', '2. very maladaptive'),
+        ('moderately_adaptive', '3. moderately adaptive/maladaptive'),
+        ('very_adaptive', '4. very adaptive'),
+        ('highly_adaptive', '5. highly adaptive'),
+    ],
+    'LabelStrengthEClient': [
+        ('no_recognition', '1. no recognition'),
+        ('low_recognition', '2. low recognition'),
+        ('moderate_recognition', '3. moderate recognition'),
+        ('good_recognition', '4. good recognition'),
+        ('excellent_recognition', '5. excellent recognition (Aha! moment)'),
+    ],
+    'LabelStrengthFClient': [
+        ('significant_deterioration', '1. significant deterioration'),
+        ('some_deterioration', '2. some deterioration'),
+        ('no_change', '3. no change'),
+        ('some_improvement', '4. some improvement'),
+        ('significant_improvement', '5. significant improvement'),
+    ],
+    'LabelNamesClient': [
+        ('label_a', '(A) Need'),
+        ('label_b', '(B) Response of Other'),
+        ('label_c', '(C) Response of Self'),
+        ('label_d', '(D) Emotional experience and regulation'),
+        ('label_e', '(E) Insight'),
+        ('label_f', '(F) Moment of Change'),
+    ],
+    'SubLabelsATherapist': [
+        ('emotional', 'emotional empathy, encouragement, warmth'),
+        ('cognitive', 'cognitive empathy (empathic accuracy)'),
+        ('respect', 'respect, appreciation'),
+        ('calming', 'calming, down-regulating'),
+        ('other', 'other'),
+    ],
+    'SubLabelsBTherapist': [
+        ('interpretation', 'interpretation'),
+        ('reframing', 'reframing'),
+        ('reflection', 'reflection'),
+        ('transference', 'transference'),
+        ('other', 'other'),
+    ],
+    'SubLabelsCTherapist': [
+        ('questions', 'questions'),
+        ('exploration', 'exploration and expansion'),
+        ('upregulation', 'upregulation of emotion'),
+        ('other', 'other'),
+    ],
+    'SubLabelsDTherapist': [
+        ('restructuring', 'cognitive restructuring'),
+        ('suggest_change', 'suggests change in behavior or behavioral activation'),
+        ('encouragement', 'encourages the patient to think or do things they are afraid of'),
+        ('advice', 'provides advice, sets an agenda'),
+        ('other', 'other'),
+    ],
+    'SubLabelsETherapist': [
+        ('general_helpfulness', 'general helpfulness'),
+    ],
+    'LabelStrengthATherapist': [
+        ('low', '1. low quality'),
+        ('medium', '3. medium quality'),
+        ('high', '5. high quality'),
+    ],
+    'LabelStrengthBTherapist': [
+        ('low', '1. low quality'),
+        ('medium', '3. medium quality'),
+        ('high', '5. high quality'),
+    ],
+    'LabelStrengthCTherapist': [
+        ('low', '1. low quality'),
+        ('medium', '3. medium quality'),
+        ('high', '5. high quality'),
+    ],
+    'LabelStrengthDTherapist': [
+        ('low', '1. low quality'),
+        ('medium', '3. medium quality'),
+        ('high', '5. high quality'),
+    ],
+    'LabelStrengthETherapist': [
+        ('low', '1. low quality'),
+        ('medium', '3. medium quality'),
+        ('high', '5. high quality'),
+    ],
+    'LabelNamesTherapist': [
+        ('label_a', '(A) Supportive'),
+        ('label_b', '(B) Expressive'),
+        ('label_c', '(C) Exploratory'),
+        ('label_d', '(D) Directive'),
+        ('label_e', '(E) General helpfulness'),
+    ],
+    'SubLabelsADyad': [
+        ('bond', 'bond'),
+        ('tasks_goals', 'tasks and goals'),
+    ],
+    'SubLabelsBDyad': [
+        ('confrontational', 'confrontational rupture'),
+        ('withdrawal', 'withdrawal rupture'),
+        ('other', 'other'),
+    ],
+    'LabelStrengthADyad': [
+        ('low', '1. low alliance/collaboration/reciprocity'),
+        ('medium', '3. moderate alliance/collaboration/reciprocity'),
+        ('high', '5. high alliance/collaboration/reciprocity'),
+    ],
+    'LabelStrengthBDyad': [
+        ('high', '1. tension is high'),
+        ('medium', '3. tension is moderate'),
+        ('low', '5. tension is low'),
+    ],
+    'LabelNamesDyad': [
+        ('label_a', '(A) Alliance/Reciprocity'),
+        ('label_b', '(B) Tension'),
+    ],
+}
+# the Enum of each label column
+COLUMNS = {
+    'ps_annotation_client': {
+        'label_a': 'SubLabelsAClient',
+        'label_b': 'SubLabelsBClient',
+        'label_c': 'SubLabelsCClient',
+        'label_d': 'SubLabelsDClient',
+        'label_e': 'SubLabelsEClient',
+        'label_f': 'SubLabelsFClient',
+        'strength_a': 'LabelStrengthAClient',
+        'strength_b': 'LabelStrengthBClient',
+        'strength_c': 'LabelStrengthCClient',
+        'strength_d': 'LabelStrengthDClient',
+        'strength_e': 'LabelStrengthEClient',
+        'strength_f': 'LabelStrengthFClient',
+    },
+    'ps_annotation_therapist': {
+        'label_a': 'SubLabelsATherapist',
+        'label_b': 'SubLabelsBTherapist',
+        'label_c': 'SubLabelsCTherapist',
+        'label_d': 'SubLabelsDTherapist',
+        'label_e': 'SubLabelsETherapist',
+        'strength_a': 'LabelStrengthATherapist',
+        'strength_b': 'LabelStrengthBTherapist',
+        'strength_c': 'LabelStrengthCTherapist',
+        'strength_d': 'LabelStrengthDTherapist',
+        'strength_e': 'LabelStrengthETherapist',
+    },
+    'ps_annotation_dyad': {
+        'label_a': 'SubLabelsADyad',
+        'label_b': 'SubLabelsBDyad',
+        'strength_a': 'LabelStrengthADyad',
+        'strength_b': 'LabelStrengthBDyad',
+    },
+    'evidence_client': {
+        'label': 'LabelNamesClient',
+    },
+    'evidence_therapist': {
+        'label': 'LabelNamesTherapist',
+    },
+    'evidence_dyad': {
+        'label': 'LabelNamesDyad',
+    },
+}
+
+
+def case(column, pairs):
+    """SQL expression converting the values of a column (CASE ... END)"""
+    whens = ' '.join(f"WHEN {old!r} THEN {new!r}" for old, new in pairs)
+    return f"CASE {column} {whens} END"
+
+
+def convert_column(table, column, new_type, pairs):
+    """
+    Replace a column by a column of another type, with its values converted.
+    The column is added, filled and renamed in place (ALTER TABLE), so the table and
+    its triggers are not recreated (SQLite 3.35 or later).
+    """
+    op.add_column(table, sa.Column(column + '_new', new_type, nullable=True))
+    op.execute(f"UPDATE {table} SET {column}_new = {case(column, pairs)}")
+    op.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+    op.execute(f"ALTER TABLE {table} RENAME COLUMN {column}_new TO {column}")
+
+
+def upgrade():
+    label_vocabulary = op.create_table('label_vocabulary',
+    sa.Column('enum', sa.String(length=64), nullable=False),
+    sa.Column('code', sa.SmallInteger(), nullable=False),
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('value', sa.String(length=255), nullable=False),
+    sa.PrimaryKeyConstraint('enum', 'code', name=op.f('pk_label_vocabulary'))
+    )
+    op.bulk_insert(label_vocabulary, [
+        {'enum': enum, 'code': code, 'name': name, 'value': value}
+        for enum, labels in LABELS.items()
+        for code, (name, value) in enumerate(labels, start=1)
+    ])
+    for table, columns in COLUMNS.items():
+        for column, enum in columns.items():
+            codes = [(name, code) for code, (name, _) in enumerate(LABELS[enum], start=1)]
+            convert_column(table, column, sa.SmallInteger(), codes)
+
+
+def downgrade():
+    for table, columns in COLUMNS.items():
+        for column, enum in columns.items():
+            names = [(code, name) for code, (name, _) in enumerate(LABELS[enum], start=1)]
+            length = max(len(name) for name, _ in LABELS[enum])
+            convert_column(table, column, sa.String(length=length), names)
+    op.drop_table('label_vocabulary')
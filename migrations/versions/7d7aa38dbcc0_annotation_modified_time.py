@@ -0,0 +1,35 @@
+"""annotation modified time
+
+Revision ID: 7d7aa38dbcc0
+Revises: 94dcb67ead55
+Create Date: 2026-10-19 14:56:19.415050
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d7aa38dbcc0'
+down_revision = '94dcb67ead55'
+branch_labels = None
+depends_on = None
+
+TABLES = ['ps_annotation_client', 'ps_annotation_therapist', 'ps_annotation_dyad']
+
+
+def upgrade():
+    for table in TABLES:
+        # added in place (ALTER TABLE), so the table and its triggers are not recreated
+        op.add_column(table, sa.Column('modified', sa.DateTime(), nullable=True))
+        # the annotations were never changed after they were written
+        op.execute(f"UPDATE {table} SET modified = timestamp")
+        op.create_index(op.f(f'ix_{table}_modified'), table, ['modified'], unique=False)
+        op.create_index(f'ix_{table}_id_dataset_modified', table, ['id_dataset', 'modified'], unique=False)
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_index(f'ix_{table}_id_dataset_modified', table_name=table)
+        op.drop_index(op.f(f'ix_{table}_modified'), table_name=table)
+        op.execute(f"ALTER TABLE {table} DROP COLUMN modified")
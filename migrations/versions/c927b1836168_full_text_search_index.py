@@ -0,0 +1,47 @@
+"""full-text search index
+
+Revision ID: c927b1836168
+Revises: 1deac2fbc2c8
+Create Date: 2026-10-19 12:48:36.168237
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c927b1836168'
+down_revision = '1deac2fbc2c8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # full-text search index of the dialog events (see app/search/utils.py)
+    if op.get_context().dialect.name == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE ps_dialog_event_fts USING fts5("
+            "event_plaintext, content='ps_dialog_event', content_rowid='id', "
+            "tokenize='porter unicode61 remove_diacritics 2')"
+        )
+        # index the dialog events already in the database
+        op.execute(
+            "INSERT INTO ps_dialog_event_fts (ps_dialog_event_fts) VALUES ('rebuild')"
+        )
+    elif op.get_context().dialect.name == 'postgresql':
+        op.create_index(
+            'ix_ps_dialog_event_plaintext_tsv',
+            'ps_dialog_event',
+            [sa.text("to_tsvector('english', event_plaintext)")],
+            unique=False,
+            postgresql_using='gin',
+        )
+
+
+def downgrade():
+    if op.get_context().dialect.name == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS ps_dialog_event_fts")
+    elif op.get_context().dialect.name == 'postgresql':
+        op.drop_index(
+            'ix_ps_dialog_event_plaintext_tsv', table_name='ps_dialog_event'
+        )
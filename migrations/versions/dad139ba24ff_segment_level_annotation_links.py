@@ -0,0 +1,112 @@
+"""segment level annotation links
+
+Revision ID: dad139ba24ff
+Revises: 3f6c2d8a91b4
+Create Date: 2026-10-19 14:21:41.907004
+
+"""
+from datetime import datetime, timedelta
+from alembic import op
+from flask import current_app
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'dad139ba24ff'
+down_revision = '3f6c2d8a91b4'
+branch_labels = None
+depends_on = None
+
+# the annotation tables, with the table linking their annotations to dialog turns
+# and its column referencing the annotation
+LINK_TABLES = [
+    ('ps_annotation_client', 'annotationclient_dialogturn', 'id_annotation_client'),
+    ('ps_annotation_therapist', 'annotationtherapist_dialogturn', 'id_annotation_therapist'),
+    ('ps_annotation_dyad', 'annotationsdyad_dialogturn', 'id_annotation_dyad'),
+]
+
+
+def add_first_dialog_turn(table):
+    """
+    Add the id_first_dialog_turn column to an annotation table, in place (ALTER TABLE),
+    so the table and its triggers are not recreated: SQLite adds the foreign key with
+    the column, the other databases add it as a constraint of the table.
+    """
+    name = f'fk_{table}_id_first_dialog_turn_ps_dialog_turn'
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute(
+            f"ALTER TABLE {table} ADD COLUMN id_first_dialog_turn INTEGER "
+            f"CONSTRAINT {name} REFERENCES ps_dialog_turn (id)"
+        )
+    else:
+        op.add_column(table, sa.Column('id_first_dialog_turn', sa.Integer(), nullable=True))
+        op.create_foreign_key(op.f(name), table, 'ps_dialog_turn', ['id_first_dialog_turn'], ['id'])
+
+
+def drop_first_dialog_turn(table):
+    """Drop the id_first_dialog_turn column of an annotation table, in place"""
+    if op.get_bind().dialect.name != 'sqlite':
+        op.drop_constraint(op.f(f'fk_{table}_id_first_dialog_turn_ps_dialog_turn'), table, type_='foreignkey')
+    op.execute(f"ALTER TABLE {table} DROP COLUMN id_first_dialog_turn")
+
+
+def upgrade():
+    for table, link_table, link_column in LINK_TABLES:
+        add_first_dialog_turn(table)
+        # the segment of an annotation starts with the first of its dialog turns
+        op.execute(
+            f"UPDATE {table} SET id_first_dialog_turn = ("
+            f"SELECT link.id_dialog_turn FROM {link_table} link "
+            "JOIN ps_dialog_turn turn ON turn.id = link.id_dialog_turn "
+            f"WHERE link.{link_column} = {table}.id "
+            "ORDER BY turn.timestamp, turn.id LIMIT 1)"
+        )
+        op.create_index(op.f(f'ix_{table}_id_first_dialog_turn'), table, ['id_first_dialog_turn'], unique=False)
+        op.drop_index(f'ix_{link_table}_{link_column}', table_name=link_table)
+        op.drop_index(f'ix_{link_table}_id_dialog_turn', table_name=link_table)
+        op.drop_table(link_table)
+
+
+def downgrade():
+    # the dialog turns of the segment of each annotation are linked again: the dialog
+    # turns of its dataset less than PS_MINS_PER_PAGE after the first one
+    interval = timedelta(minutes=current_app.config.get('PS_MINS_PER_PAGE', 5))
+    connection = op.get_bind()
+    turns = sa.table(
+        'ps_dialog_turn',
+        sa.column('id', sa.Integer),
+        sa.column('id_dataset', sa.Integer),
+        sa.column('timestamp', sa.Time),
+    )
+    dataset_turns = {}  # id of the dataset -> [(timestamp, id of the dialog turn)]
+    for table, link_table, link_column in LINK_TABLES:
+        links = op.create_table(link_table,
+        sa.Column('id_dialog_turn', sa.Integer(), nullable=True),
+        sa.Column(link_column, sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint([link_column], [f'{table}.id'], name=op.f(f'fk_{link_table}_{link_column}_{table}')),
+        sa.ForeignKeyConstraint(['id_dialog_turn'], ['ps_dialog_turn.id'], name=op.f(f'fk_{link_table}_id_dialog_turn_ps_dialog_turn'))
+        )
+        annotations = sa.table(table, sa.column('id', sa.Integer), sa.column('id_first_dialog_turn', sa.Integer))
+        rows = []
+        for id_annotation, id_dataset, start in connection.execute(
+            sa.select(annotations.c.id, turns.c.id_dataset, turns.c.timestamp)
+            .join(turns, turns.c.id == annotations.c.id_first_dialog_turn)
+        ):
+            if id_dataset not in dataset_turns:
+                dataset_turns[id_dataset] = connection.execute(
+                    sa.select(turns.c.timestamp, turns.c.id)
+                    .where(turns.c.id_dataset == id_dataset)
+                    .order_by(turns.c.timestamp, turns.c.id)
+                ).all()
+            end = datetime.combine(datetime.min, start) + interval
+            rows += [
+                {'id_dialog_turn': id_turn, link_column: id_annotation}
+                for timestamp, id_turn in dataset_turns[id_dataset]
+                if start <= timestamp and datetime.combine(datetime.min, timestamp) < end
+            ]
+        if rows:
+            op.bulk_insert(links, rows)
+        op.create_index(f'ix_{link_table}_id_dialog_turn', link_table, ['id_dialog_turn'], unique=False)
+        op.create_index(f'ix_{link_table}_{link_column}', link_table, [link_column, 'id_dialog_turn'], unique=False)
+        op.drop_index(op.f(f'ix_{table}_id_first_dialog_turn'), table_name=table)
+        drop_first_dialog_turn(table)
@@ -1,4 +1,8 @@
 import pytest
+import os
+import shutil
+import socket
+import subprocess
 from datetime import datetime, date
 
 from app import create_app, db
@@ -8,6 +12,7 @@ from app.models import (
     SMPost,
     SMReply,
     Dataset,
+    LabelVocabulary,
     Role,
     PSDialogTurn,
     PSDialogEvent,
@@ -34,7 +39,7 @@ from app.utils import (
     LabelNamesDyad,
 )
 from config import TestConfig
-from app.upload.parsers import read_pickle, psychotherapy_df_to_sql
+from app.upload.parsers import read_pickle, psychotherapy_df_to_sql, sm_dict_to_sql
 
 
 @pytest.fixture(scope="module")
@@ -121,10 +126,58 @@ def flask_app():
     with flask_app.app_context():
         db.create_all()
         Role.insert_roles()
+        LabelVocabulary.insert_labels()
         yield flask_app  # this is where the testing happens!
         db.drop_all()
 
 
+@pytest.fixture(scope="session")
+def postgres_url(tmp_path_factory):
+    """
+    Fixture to start a throwaway PostgreSQL server for the tests and return its URL.
+    The server binaries (initdb, pg_ctl) are looked up in the directory given by the
+    POSTGRES_BIN environment variable, or on the PATH.
+    Tests using this fixture are skipped if PostgreSQL or psycopg2 are not available.
+    """
+    pytest.importorskip("psycopg2")
+    bin_dir = os.environ.get("POSTGRES_BIN")
+    initdb = shutil.which("initdb", path=bin_dir)
+    pg_ctl = shutil.which("pg_ctl", path=bin_dir)
+    if initdb is None or pg_ctl is None:
+        pytest.skip("PostgreSQL server binaries (initdb, pg_ctl) not found")
+    base_dir = tmp_path_factory.mktemp("postgres")
+    data_dir = str(base_dir / "data")
+    result = subprocess.run(
+        [initdb, "-D", data_dir, "-U", "postgres", "-A", "trust"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        pytest.skip("Could not create a PostgreSQL cluster: " + result.stderr)
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))  # find a free port
+        port = sock.getsockname()[1]
+    subprocess.run(
+        [
+            pg_ctl,
+            "-D",
+            data_dir,
+            "-l",
+            str(base_dir / "postgres.log"),
+            "-o",
+            f"-p {port} -k {base_dir} -c listen_addresses=localhost",
+            "-w",
+            "start",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    yield f"postgresql+psycopg2://postgres@localhost:{port}/postgres"
+    subprocess.run(
+        [pg_ctl, "-D", data_dir, "-m", "fast", "-w", "stop"], capture_output=True
+    )
+
+
 @pytest.fixture(scope="module")
 def db_session(flask_app):
     """Fixture to create a database session for testing"""
@@ -166,6 +219,15 @@ def insert_ps_dialog_turns(flask_app, db_session, insert_datasets):
     db_session.commit()
 
 
+@pytest.fixture(scope="module")
+def insert_sm_posts(flask_app, db_session, insert_datasets):
+    """Fixture to insert social media posts (and corresponding replies) into the database"""
+    sm_data = read_pickle(flask_app.config["SM_DATASET_PATH"])
+    dataset = Dataset.query.filter_by(name="Social Media Dataset Test").first()
+    sm_dict_to_sql(sm_data, dataset)
+    db_session.commit()
+
+
 @pytest.fixture(scope="module")
 def new_ps_dialog_turn(new_ps_dataset):
     """Fixture to create a new psychotherapy dialog turn"""
@@ -208,8 +270,8 @@ def new_ps_dialog_turn_annotation_client(
         comment_summary="test comment summary",
         author=user_annotator1,
         dataset=new_ps_dataset,
+        first_dialog_turn=new_ps_dialog_turn,
     )
-    dialog_turn_annotation.dialog_turns.append(new_ps_dialog_turn)
     return dialog_turn_annotation
 
 
@@ -227,8 +289,8 @@ def new_ps_dialog_turn_annotation_therapist(
         comment_summary="test comment summary",
         author=user_annotator1,
         dataset=new_ps_dataset,
+        first_dialog_turn=new_ps_dialog_turn,
     )
-    dialog_turn_annotation.dialog_turns.append(new_ps_dialog_turn)
     return dialog_turn_annotation
 
 
@@ -246,8 +308,8 @@ def new_ps_dialog_turn_annotation_dyad(
         comment_summary="test comment summary",
         author=user_annotator1,
         dataset=new_ps_dataset,
+        first_dialog_turn=new_ps_dialog_turn,
     )
-    dialog_turn_annotation.dialog_turns.append(new_ps_dialog_turn)
     return dialog_turn_annotation
 
 
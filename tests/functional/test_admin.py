@@ -0,0 +1,146 @@
+"""
+Functional tests for the admin (`admin`) blueprint.
+"""
+from app.models import User, Dataset, PSDialogTurn, PSAnnotationClient, EvidenceClient
+from app import agreement
+from app.utils import SubLabelsAClient, LabelNamesClient, Speaker
+import json
+import pytest
+
+
+@pytest.mark.order(15)
+def test_pool_stats_login_required(test_client):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the '/admin/pool_stats' page is requested (GET) without logging in
+    THEN check that the user is redirected to the login page
+    """
+    response = test_client.get("/admin/pool_stats")
+    assert response.status_code == 302
+    assert "/auth/login" in response.headers["Location"]
+
+
+def test_pool_stats_admin_only(test_client, insert_users):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the '/admin/pool_stats' page is requested (GET) by an annotator and by an admin
+    THEN check that only the admin can see the connection pool statistics
+    """
+    response = test_client.post(
+        "/auth/login",
+        data={"username": "annotator1", "password": "annotator1password"},
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+    response = test_client.get("/admin/pool_stats")
+    assert response.status_code == 403
+    test_client.get("/auth/logout", follow_redirects=True)
+
+    response = test_client.post(
+        "/auth/login",
+        data={"username": "admin1", "password": "admin1password"},
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+    response = test_client.get("/admin/pool_stats")
+    assert response.status_code == 200
+    stats = response.get_json()
+    assert "pid" in stats
+    assert stats["engines"]["default"]["pool_class"] == "StaticPool"
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_agreement_report(
+    test_client,
+    db_session,
+    insert_users,
+    insert_ps_dialog_turns,
+    user_admin1,
+    monkeypatch,
+):
+    """
+    GIVEN a psychotherapy dataset annotated by two annotators
+    WHEN the agreement report of the dataset is requested (GET) by an admin
+    THEN check that the agreement metrics are computed from the latest annotations,
+    and that the report is computed again when a new annotation is added, loading
+    again only the segment of the new annotation
+    """
+    dataset = Dataset.query.filter_by(name="Psychotherapy Dataset Test").first()
+    annotator2 = User(username="annotator2", email="annotator2@example.com")
+    db_session.add(annotator2)
+    dialog_turns = dataset.dialog_turns.order_by(PSDialogTurn.id).all()
+    segments = [dialog_turns[0:2], dialog_turns[2:4], dialog_turns[4:6]]
+    labels = {
+        user_admin1: [SubLabelsAClient.attachment, SubLabelsAClient.identity, None],
+        annotator2: [SubLabelsAClient.attachment, SubLabelsAClient.security, None],
+    }
+    for author, author_labels in labels.items():
+        for segment, label in zip(segments, author_labels):
+            annotation = PSAnnotationClient(
+                label_a=label,
+                author=author,
+                dataset=dataset,
+                first_dialog_turn=segment[0],
+            )
+            db_session.add(annotation)
+            event = segment[0].dialog_events.first()
+            db_session.add(
+                EvidenceClient(
+                    dialog_event=event,
+                    annotation=annotation,
+                    label=LabelNamesClient.label_a,
+                )
+            )
+    db_session.commit()
+
+    response = test_client.post(
+        "/auth/login",
+        data={"username": "admin1", "password": "admin1password"},
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+    response = test_client.get("/admin/agreement/{}".format(dataset.id))
+    assert response.status_code == 200
+    assert b"Krippendorff" in response.data
+    url = "/admin/agreement/{}?format=json".format(dataset.id)
+    report = test_client.get(url).get_json()["report"]
+    assert report["client"]["n_segments"] == 3
+    assert report["client"]["n_annotators"] == 2
+    label_a = report["client"]["metrics"]["label_a"]
+    assert label_a["n_units"] == 2
+    assert label_a["cohen_kappa"] == pytest.approx(1 / 3)
+    assert label_a["alpha"] == pytest.approx(0.4)
+    assert label_a["jaccard"] == 1
+    assert label_a["n_pairs"] == 3
+    assert report["therapist"]["metrics"] == {}
+
+    # annotator2 changes their mind about the second segment
+    annotation = PSAnnotationClient(
+        label_a=SubLabelsAClient.identity,
+        author=annotator2,
+        dataset=dataset,
+        first_dialog_turn=segments[1][0],
+    )
+    db_session.add(annotation)
+    db_session.commit()
+    loaded = []  # the segments loaded again
+    original_load_segments = agreement.load_segments
+
+    def load_segments(id_dataset, speaker, segments=None):
+        loaded.append(segments)
+        return original_load_segments(id_dataset, speaker, segments)
+
+    monkeypatch.setattr(agreement, "load_segments", load_segments)
+    report = test_client.get(url).get_json()["report"]
+    assert loaded == [[segments[1][0].id]]
+    monkeypatch.undo()
+    assert report["client"] == json.loads(
+        json.dumps(agreement.speaker_agreement(dataset.id, Speaker.client))
+    )
+    label_a = report["client"]["metrics"]["label_a"]
+    assert label_a["cohen_kappa"] == 1
+    assert label_a["alpha"] == 1
+    assert label_a["jaccard"] == pytest.approx(
+        2 / 3
+    )  # no evidence in the new annotation
+    test_client.get("/auth/logout", follow_redirects=True)
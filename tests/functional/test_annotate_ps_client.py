@@ -6,6 +6,8 @@ Tests specific to the client role.
 from flask_login import current_user
 from flask import url_for
 from bs4 import BeautifulSoup
+from sqlalchemy import event
+from app import db
 from app.models import PSAnnotationClient, EvidenceClient
 from tests.functional.utils import create_segment_level_annotation_client
 import re
@@ -275,3 +277,46 @@ def test_retrieve_existing_annotations_client(test_client):
     # log out
     response = test_client.get("/auth/logout", follow_redirects=True)
     assert response.status_code == 200
+
+
+@pytest.mark.dependency(depends=["test_valid_segment_level_annotation_client"])
+def test_get_existing_annotations_no_writes(test_client):
+    """
+    GIVEN a Flask application configured for testing and a client annotation of page 1
+    WHEN the '/annotate_psychotherapy' page is requested (GET) with the form pre-populated
+    THEN check that no UPDATE (or any other write) is sent to the database, and that
+    the annotation is not loaded and changed in the session
+    """
+    test_client.post(
+        "/auth/login",
+        data={"username": "annotator1", "password": "annotator1password"},
+        follow_redirects=True,
+    )
+    dataset = current_user.datasets.filter_by(name="Psychotherapy Dataset Test").first()
+    url = url_for("annotate.annotate_ps", dataset_id=dataset.id, page=1)
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = test_client.get(url)
+        db.session.commit()  # anything the request left to flush would be written now
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    assert "have already been submitted" in re.sub(r"\s+", " ", response.text)
+    assert statements  # the annotations were read
+    writes = [
+        statement
+        for statement in statements
+        if statement.lstrip().upper().startswith(("UPDATE", "INSERT", "DELETE"))
+    ]
+    assert writes == []
+    assert not any(
+        isinstance(instance, PSAnnotationClient)
+        for instance in db.session.identity_map.values()
+    )
+    test_client.get("/auth/logout", follow_redirects=True)
@@ -10,6 +10,7 @@ import pytest
 import re
 from app.models import (
     PSAnnotationDyad,
+    PSDialogTurn,
     EvidenceDyad,
 )
 from app.utils import (
@@ -82,6 +83,13 @@ def test_valid_segment_level_annotation_dyad(test_client, insert_ps_dialog_turns
     assert annotation.strength_b == LabelStrengthBDyad.medium
     assert annotation.comment_a == "test comment A"
     assert annotation.comment_summary == "test comment summary dyad"
+    # the annotation references its segment by the first dialog turn of the page
+    first_dialog_turn = (
+        PSDialogTurn.query.filter_by(id_dataset=dataset_id)
+        .order_by(PSDialogTurn.timestamp)
+        .first()
+    )
+    assert annotation.first_dialog_turn == first_dialog_turn
 
     # test that the events submitted as evidence for the different labels
     # have been saved to the database
@@ -0,0 +1,244 @@
+"""
+Functional tests for the annotation page of social media datasets
+(keyset pagination of the posts, replies and annotations of each post).
+"""
+from flask import url_for
+from bs4 import BeautifulSoup
+from sqlalchemy import event
+from app import db
+from app.models import Dataset, SMAnnotation, SMPost, SMTimeline, User
+from app.upload.parsers import share_dataset_content
+from app.utils import SMAnnotationType
+import pytest
+
+
+def login(test_client, username: str):
+    """Log in to the app"""
+    response = test_client.post(
+        "/auth/login",
+        data={"username": username, "password": username + "password"},
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+
+
+def get_page(test_client, url: str) -> tuple:
+    """Get a page of posts, return the ids of the posts and the previous and next links"""
+    response = test_client.get(url)
+    assert response.status_code == 200
+    soup = BeautifulSoup(response.data, "html.parser")
+    ids = [int(div["id"].split("-")[1]) for div in soup.select("div.panel[id^=post-]")]
+    links = {
+        name: soup.select_one("li.{} a".format(name))["href"]
+        for name in ["previous", "next"]
+    }
+    return ids, links["previous"], links["next"], soup
+
+
+@pytest.mark.order(21)
+def test_annotate_sm_pages(test_client, insert_users, insert_sm_posts):
+    """
+    GIVEN a social media dataset with 43 posts and 92 replies
+    WHEN the pages of the annotation view are followed with the next links, then back
+    with the previous links
+    THEN check that every post is shown once, in the order of the timelines,
+    with all its replies, and that going back shows the same pages
+    """
+    test_client.application.config["SM_POSTS_PER_PAGE"] = 10
+    login(test_client, "annotator1")
+    dataset = Dataset.query.filter_by(name="Social Media Dataset Test").first()
+    url = url_for("annotate.annotate_sm", dataset_id=dataset.id)
+    pages = []
+    n_replies = 0
+    while url != "#":
+        ids, prev_url, url, soup = get_page(test_client, url)
+        assert 0 < len(ids) <= 10
+        assert (prev_url == "#") == (not pages)
+        pages.append(ids)
+        n_replies += len(soup.select("div.panel[id^=post-] li.list-group-item"))
+    assert [len(ids) for ids in pages] == [10, 10, 10, 10, 3]
+    posts = (
+        SMPost.query.filter_by(id_dataset=dataset.id)
+        .order_by(SMPost.user_id, SMPost.timeline_id, SMPost.date, SMPost.id)
+        .all()
+    )
+    assert sum(pages, []) == [post.id for post in posts]
+    assert n_replies == 92
+
+    # back to the first page with the previous links
+    url = prev_url
+    for ids in reversed(pages[:-1]):
+        page_ids, url, _, _ = get_page(test_client, url)
+        assert page_ids == ids
+    assert url == "#"
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_annotate_sm_timeline(test_client, insert_users, insert_sm_posts):
+    """
+    GIVEN a social media dataset with its timelines recorded at upload
+    WHEN a timeline is selected in the annotation view
+    THEN check that all the timelines can be reached with the next and previous
+    timeline links, and that only the posts of the selected timeline are shown,
+    on as many pages as needed
+    """
+    test_client.application.config["SM_POSTS_PER_PAGE"] = 4
+    login(test_client, "annotator1")
+    dataset = Dataset.query.filter_by(name="Social Media Dataset Test").first()
+    timeline_ids = [
+        timeline.id
+        for timeline in dataset.timelines.order_by(
+            SMTimeline.user_id, SMTimeline.timeline_id
+        )
+    ]
+    url = url_for("annotate.annotate_sm", dataset_id=dataset.id)
+    soup = BeautifulSoup(test_client.get(url).data, "html.parser")
+    url = soup.select_one("a.timeline-link")["href"]
+    visited = []
+    while url != "#":
+        visited.append(int(url.split("timeline=")[1]))
+        soup = BeautifulSoup(test_client.get(url).data, "html.parser")
+        url = soup.select_one("li.next-timeline a")["href"]
+    assert visited == timeline_ids
+    url = soup.select_one("li.previous-timeline a")["href"]
+    assert url.endswith("timeline={}".format(timeline_ids[-2]))
+    timeline = SMTimeline.query.filter_by(
+        id_dataset=dataset.id, timeline_id="746731_1"
+    ).one()
+    url = url_for("annotate.annotate_sm", dataset_id=dataset.id, timeline=timeline.id)
+    ids = []
+    while url != "#":
+        page_ids, _, url, _ = get_page(test_client, url)
+        ids += page_ids
+    posts = SMPost.query.filter_by(
+        id_dataset=dataset.id, user_id=timeline.user_id, timeline_id="746731_1"
+    ).order_by(SMPost.date, SMPost.id)
+    assert ids == [post.id for post in posts]
+    assert len(ids) == timeline.n_posts == 10
+    # a timeline which does not exist
+    response = test_client.get(
+        url_for("annotate.annotate_sm", dataset_id=dataset.id, timeline=10**6)
+    )
+    assert response.status_code == 404
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_annotate_sm_queries(test_client, insert_users, insert_sm_posts):
+    """
+    GIVEN a social media dataset
+    WHEN a page of the annotation view is requested (GET)
+    THEN check that the replies and the annotations of all the posts on the page
+    are loaded with one query each (no query per post)
+    """
+    test_client.application.config["SM_POSTS_PER_PAGE"] = 10
+    login(test_client, "annotator1")
+    dataset = Dataset.query.filter_by(name="Social Media Dataset Test").first()
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        response = test_client.get(
+            url_for("annotate.annotate_sm", dataset_id=dataset.id)
+        )
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    assert sum("FROM sm_reply" in statement for statement in statements) == 1
+    assert sum("FROM sm_annotation" in statement for statement in statements) == 1
+    assert sum("FROM sm_post" in statement for statement in statements) == 1
+    # only the timelines of the posts on the page
+    assert sum("FROM sm_timeline" in statement for statement in statements) == 1
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_annotate_sm_save(test_client, insert_users, insert_sm_posts):
+    """
+    GIVEN a social media dataset
+    WHEN an annotation of a post is submitted (POST) on the second page
+    THEN check that it is saved for the annotator and shown on the same page,
+    and that invalid annotations, posts and cursors are rejected
+    """
+    test_client.application.config["SM_POSTS_PER_PAGE"] = 10
+    login(test_client, "annotator1")
+    user = User.query.filter_by(username="annotator1").first()
+    dataset = Dataset.query.filter_by(name="Social Media Dataset Test").first()
+    _, _, url, _ = get_page(
+        test_client, url_for("annotate.annotate_sm", dataset_id=dataset.id)
+    )
+    ids, _, _, _ = get_page(test_client, url)
+    response = test_client.post(
+        url,
+        data={
+            "id_sm_post": ids[3],
+            "type": SMAnnotationType.escalation.name,
+            "body": "test annotation",
+        },
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+    assert b"Your annotation has been saved" in response.data
+    annotation = SMAnnotation.query.filter_by(id_sm_post=ids[3]).one()
+    assert annotation.id_user == user.id
+    assert annotation.type == SMAnnotationType.escalation
+    assert annotation.body == "test annotation"
+    soup = BeautifulSoup(response.data, "html.parser")
+    post = soup.find(id="post-{}".format(ids[3]))
+    assert "Escalation" in post.text and "test annotation" in post.text
+
+    # an annotation needs a type or a comment
+    response = test_client.post(url, data={"id_sm_post": ids[3], "body": ""})
+    assert b"Please select a type or write a comment" in response.data
+    assert SMAnnotation.query.filter_by(id_sm_post=ids[3]).count() == 1
+    # a post of another dataset
+    response = test_client.post(url, data={"id_sm_post": 10**6, "body": "test"})
+    assert response.status_code == 400
+    # an invalid cursor
+    response = test_client.get(
+        url_for("annotate.annotate_sm", dataset_id=dataset.id, after="invalid")
+    )
+    assert response.status_code == 400
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_annotate_sm_shared_dataset(test_client, insert_users, insert_sm_posts):
+    """
+    GIVEN a social media dataset which shares the posts of another dataset
+    (uploaded from an identical file)
+    WHEN a post is annotated in the annotation view of the new dataset
+    THEN check that the new dataset shows the posts and timelines of the other one,
+    and that the annotation is recorded for the new dataset only
+    """
+    test_client.application.config["SM_POSTS_PER_PAGE"] = 10
+    login(test_client, "annotator1")
+    source = Dataset.query.filter_by(name="Social Media Dataset Test").first()
+    dataset = Dataset(
+        name="Social Media Dataset Copy",
+        type=source.type,
+        author=source.author,
+    )
+    share_dataset_content(dataset, source)
+    db.session.add(dataset)
+    db.session.commit()
+    url = url_for("annotate.annotate_sm", dataset_id=dataset.id)
+    ids, _, _, soup = get_page(test_client, url)
+    assert (
+        ids
+        == get_page(test_client, url_for("annotate.annotate_sm", dataset_id=source.id))[
+            0
+        ]
+    )
+    assert soup.select("a.timeline-link")
+    response = test_client.post(
+        url,
+        data={"id_sm_post": ids[0], "body": "annotation of the copy"},
+        follow_redirects=True,
+    )
+    assert b"annotation of the copy" in response.data
+    annotation = SMAnnotation.query.filter_by(body="annotation of the copy").one()
+    assert annotation.id_dataset == dataset.id
+    response = test_client.get(url_for("annotate.annotate_sm", dataset_id=source.id))
+    assert b"annotation of the copy" not in response.data
+    test_client.get("/auth/logout", follow_redirects=True)
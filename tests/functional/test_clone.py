@@ -0,0 +1,185 @@
+"""
+Functional tests for the cloning of psychotherapy datasets by the admin
+(the rows are copied inside the database, see app/admin/clone.py).
+"""
+import os
+import re
+from flask import url_for
+from bs4 import BeautifulSoup
+from sqlalchemy import event
+from app import db
+from app.models import (
+    Dataset,
+    DatasetStats,
+    EvidenceDyad,
+    PSAnnotationDyad,
+    PSAnnotationProgress,
+    PSDialogEvent,
+    PSDialogTurn,
+    User,
+)
+from app.export.exporters import annotation_chunks, export_watermark
+from app.search.utils import search_events
+from tests.functional.utils import create_segment_level_annotation_dyad
+import pytest
+
+
+def login(test_client, username: str):
+    """Log in to the app"""
+    response = test_client.post(
+        "/auth/login",
+        data={"username": username, "password": username + "password"},
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.order(24)
+def test_clone_dataset(test_client, insert_users):
+    """
+    GIVEN a psychotherapy dataset with an annotation of its first page
+    WHEN the admin clones it with its annotations
+    THEN check that the dialog turns, events, annotations, annotation links and
+    evidence are copied with one INSERT ... SELECT statement per table, that the
+    references between the copies are remapped, and that the copied events can be
+    searched
+    """
+    login(test_client, "admin1")
+    admin1 = User.query.filter_by(username="admin1").first()
+    annotator1 = User.query.filter_by(username="annotator1").first()
+    path = test_client.application.config["PS_DATASET_PATH"]
+    with open(path, "rb") as handle:
+        response = test_client.post(
+            "/upload/upload_psychotherapy",
+            data={
+                "name": "round_1_dataset",
+                "description": "test description",
+                "annotators": admin1.id,
+                "file": (handle, os.path.basename(path)),
+            },
+            follow_redirects=True,
+        )
+    assert b"File uploaded successfully" in response.data
+    source = Dataset.query.filter_by(name="round_1_dataset").one()
+    url = url_for("annotate.annotate_ps", dataset_id=source.id, page=1)
+    soup = BeautifulSoup(test_client.get(url).data, "html.parser")
+    response = test_client.post(
+        url, data=create_segment_level_annotation_dyad(soup)[0], follow_redirects=True
+    )
+    assert b"Your annotations have been saved" in response.data
+    response = test_client.get(url_for("main.index"))
+    assert url_for("admin.clone", dataset_id=source.id).encode() in response.data
+
+    watermark = export_watermark(0)  # of an incremental export before the clone
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, executemany))
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        response = test_client.post(
+            url_for("admin.clone", dataset_id=source.id),
+            data={
+                "name": "round_2_dataset",
+                "description": "second annotation round",
+                "annotators": [annotator1.id],
+                "with_annotations": "y",
+            },
+            follow_redirects=True,
+        )
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    assert b"cloned successfully" in response.data
+    # the rows are not read by the app, and are copied with one statement per table
+    copies = [
+        statement
+        for statement, executemany in statements
+        if re.match(
+            r"INSERT INTO (ps_dialog_turn|ps_dialog_event|ps_annotation_dyad"
+            r"|evidence_dyad)\b",
+            statement,
+        )
+    ]
+    assert len(copies) == 4
+    assert all("SELECT" in statement for statement in copies)
+
+    db.session.expire_all()
+    clone = Dataset.query.filter_by(name="round_2_dataset").one()
+    assert clone.annotators.all() == [annotator1]
+    assert clone.n_segments == source.n_segments
+    assert db.session.get(DatasetStats, clone.id).n_dialog_events == (
+        db.session.get(DatasetStats, source.id).n_dialog_events
+    )
+    turns = PSDialogTurn.query.filter_by(id_dataset=source.id).order_by(PSDialogTurn.id)
+    clone_turns = PSDialogTurn.query.filter_by(id_dataset=clone.id).order_by(
+        PSDialogTurn.id
+    )
+    assert [turn.timestamp for turn in clone_turns] == [
+        turn.timestamp for turn in turns
+    ]
+    for dialog_event in PSDialogEvent.query.filter_by(id_dataset=clone.id):
+        assert dialog_event.dialog_turn.id_dataset == clone.id
+    annotations = PSAnnotationDyad.query.filter_by(id_dataset=source.id).all()
+    clone_annotations = PSAnnotationDyad.query.filter_by(id_dataset=clone.id).all()
+    assert len(clone_annotations) == len(annotations) == 1
+    assert clone_annotations[0].label_a == annotations[0].label_a
+    # the copies keep the timestamps of the originals, and are marked as modified
+    # by the clone, so the next incremental export exports them
+    assert clone_annotations[0].timestamp == annotations[0].timestamp
+    assert clone_annotations[0].modified >= watermark > annotations[0].modified
+    exported = [
+        row["id"]
+        for rows in annotation_chunks(clone.id, since=watermark)
+        for row in rows
+    ]
+    assert exported == [clone_annotations[0].id]
+    # the segment of the copy starts with the copy of the first dialog turn
+    first_turn = clone_annotations[0].first_dialog_turn
+    assert first_turn.id_dataset == clone.id
+    assert first_turn.timestamp == annotations[0].first_dialog_turn.timestamp
+    evidence = EvidenceDyad.query.filter_by(
+        id_ps_annotation_dyad=clone_annotations[0].id
+    ).all()
+    assert (
+        len(evidence)
+        == EvidenceDyad.query.filter_by(id_ps_annotation_dyad=annotations[0].id).count()
+    )
+    assert {item.dialog_event.id_dataset for item in evidence} == {clone.id}
+    assert PSAnnotationProgress.query.filter_by(id_dataset=clone.id).count() == (
+        PSAnnotationProgress.query.filter_by(id_dataset=source.id).count()
+    )
+    assert (
+        search_events(clone.id, "consectetur")[1]
+        == search_events(source.id, "consectetur")[1]
+    )
+
+    # without the annotations
+    response = test_client.post(
+        url_for("admin.clone", dataset_id=source.id),
+        data={
+            "name": "round_3_dataset",
+            "description": "third annotation round",
+            "annotators": [annotator1.id],
+        },
+        follow_redirects=True,
+    )
+    assert b"cloned successfully" in response.data
+    clone = Dataset.query.filter_by(name="round_3_dataset").one()
+    assert PSDialogTurn.query.filter_by(id_dataset=clone.id).count() == turns.count()
+    assert PSAnnotationDyad.query.filter_by(id_dataset=clone.id).count() == 0
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_clone_dataset_admin_only(test_client, insert_users):
+    """
+    GIVEN a psychotherapy dataset
+    WHEN annotator1 requests the page to clone it (GET)
+    THEN check that it is forbidden
+    """
+    login(test_client, "annotator1")
+    dataset = Dataset.query.filter_by(name="round_1_dataset").one()
+    response = test_client.get(url_for("admin.clone", dataset_id=dataset.id))
+    assert response.status_code == 403
+    test_client.get("/auth/logout", follow_redirects=True)
@@ -0,0 +1,300 @@
+"""
+Functional tests for the compressed storage of the texts (COMPRESS_TEXT, see
+app/compression.py and app/upload/compress.py).
+"""
+import os
+import pandas as pd
+from flask import url_for
+from app import db, write_queue
+from app.models import Dataset, PSDialogEvent, SMPost, SMReply, TextDictionary, User
+from app.admin.clone import clone_dataset
+from app.admin.delete import delete_dataset
+from app.search.utils import search_events
+from app.upload.compress import compress_chunk, compress_dataset, train_dictionary
+from app.upload.parsers import read_pickle
+import pytest
+
+
+def login(test_client, username: str):
+    """Log in to the app"""
+    response = test_client.post(
+        "/auth/login",
+        data={"username": username, "password": username + "password"},
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+
+
+def upload(test_client, url: str, path: str, data: dict = None):
+    """Upload a file to an upload page"""
+    with open(path, "rb") as handle:
+        return test_client.post(
+            url,
+            data=dict(data or {}, file=(handle, os.path.basename(path))),
+            follow_redirects=True,
+        )
+
+
+def upload_dataset(test_client, url: str, path: str, name: str) -> Dataset:
+    """Upload a dataset (as admin1), with admin1 as its annotator"""
+    admin1 = User.query.filter_by(username="admin1").first()
+    response = upload(
+        test_client,
+        url,
+        path,
+        {"name": name, "description": "test description", "annotators": admin1.id},
+    )
+    assert b"File uploaded successfully" in response.data
+    return Dataset.query.filter_by(name=name).one()
+
+
+def stored_types(table: str, column: str, id_dataset: int) -> dict:
+    """The number of texts of a dataset stored with each SQLite type (text or blob)"""
+    return dict(
+        db.session.execute(
+            db.text(
+                f"SELECT typeof({column}), count(*) FROM {table} "
+                "WHERE id_dataset = :id_dataset GROUP BY 1"
+            ),
+            {"id_dataset": id_dataset},
+        ).all()
+    )
+
+
+def file_texts(df: pd.DataFrame) -> list:
+    """The texts of the dialog events of a file (the timestamps are not dialog events)"""
+    return list(df.loc[df["event_speaker"] != "Timestamp", "event_plaintext"])
+
+
+def event_texts(id_dataset: int) -> list:
+    """The texts of the dialog events of a dataset, in order"""
+    return db.session.scalars(
+        db.select(PSDialogEvent.event_plaintext)
+        .where(PSDialogEvent.id_dataset == id_dataset)
+        .order_by(PSDialogEvent.id)
+    ).all()
+
+
+@pytest.mark.order(26)
+def test_compress_datasets_command(test_client, insert_users):
+    """
+    GIVEN two psychotherapy datasets uploaded from the same file before compression
+    was enabled (they share their dialog events)
+    WHEN the `flask compress-datasets` command is run
+    THEN check that the texts of the dialog events are stored compressed, once, and that
+    they, the annotation page and the full-text search are unchanged
+    """
+    from annotations_interface import compress_datasets
+
+    login(test_client, "admin1")
+    path = test_client.application.config["PS_DATASET_PATH"]
+    dataset = upload_dataset(
+        test_client, "/upload/upload_psychotherapy", path, "plain_dataset"
+    )
+    sharer = upload_dataset(
+        test_client, "/upload/upload_psychotherapy", path, "plain_dataset_copy"
+    )
+    assert sharer.content_id == dataset.id
+    assert set(stored_types("ps_dialog_event", "event_plaintext", dataset.id)) == {
+        "text"
+    }
+    texts = event_texts(dataset.id)
+    n_hits = search_events(dataset.id, "consectetur")[1]
+    assert n_hits > 0
+
+    runner = test_client.application.test_cli_runner(mix_stderr=False)
+    result = runner.invoke(compress_datasets, [])
+    assert result.exit_code == 0, result.output
+    assert "Dataset {}: ".format(dataset.id) in result.output
+    db.session.expire_all()
+    assert stored_types("ps_dialog_event", "event_plaintext", dataset.id)["blob"] > 0
+    dataset = db.session.get(Dataset, dataset.id)
+    assert dataset.text_dictionary is not None
+    assert db.session.get(Dataset, sharer.id).text_dictionary == (
+        dataset.text_dictionary
+    )
+    assert event_texts(dataset.id) == texts
+    assert search_events(dataset.id, "consectetur")[1] == n_hits
+    url = url_for("annotate.annotate_ps", dataset_id=sharer.id, page=1)
+    response = test_client.get(url)
+    assert response.status_code == 200
+    assert texts[0].encode() in response.data
+
+    # the texts are only compressed once
+    result = runner.invoke(compress_datasets, [str(dataset.id)])
+    assert result.exit_code == 0, result.output
+    assert "0 bytes" in result.output
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_compress_dataset_chunks(test_client, insert_users, tmp_path, monkeypatch):
+    """
+    GIVEN a psychotherapy dataset uploaded before compression was enabled
+    WHEN its first chunk of texts is compressed, then all of them, 10 texts at a time
+    THEN check that the compressed and plain texts are read alike meanwhile, that the
+    dictionary is only recorded as the dictionary of the dataset at the end, and that
+    each chunk is compressed in its own write job
+    """
+    login(test_client, "admin1")
+    df = read_pickle(test_client.application.config["PS_DATASET_PATH"])
+    df["event_plaintext"] = df["event_plaintext"].where(
+        df["event_speaker"] == "Timestamp", df["event_plaintext"] + " In chunks."
+    )
+    path = tmp_path / "session.pickle"
+    df.to_pickle(path)
+    dataset = upload_dataset(
+        test_client, "/upload/upload_psychotherapy", path, "chunked_dataset"
+    )
+    texts = event_texts(dataset.id)
+    n_hits = search_events(dataset.id, "consectetur")[1]
+
+    id_content, key, columns = write_queue.submit(train_dictionary, dataset.id)
+    assert id_content == dataset.id
+    assert columns == [("ps_dialog_event", "event_plaintext")]
+    assert db.session.get(TextDictionary, key) is not None
+    last_id, size_before, size_after = write_queue.submit(
+        compress_chunk, dataset.id, *columns[0], key, 0, 10
+    )
+    assert size_after < size_before
+    db.session.expire_all()
+    types = stored_types("ps_dialog_event", "event_plaintext", dataset.id)
+    assert types["text"] > 0 and types["blob"] > 0  # mixed
+    assert db.session.get(Dataset, dataset.id).text_dictionary is None
+    assert event_texts(dataset.id) == texts
+    assert search_events(dataset.id, "consectetur")[1] == n_hits
+    db.session.rollback()
+
+    jobs = []
+    submit = write_queue.submit
+
+    def record_submit(func, *args, **kwargs):
+        jobs.append(func.__name__)
+        return submit(func, *args, **kwargs)
+
+    monkeypatch.setattr(write_queue, "submit", record_submit)
+    sizes = compress_dataset(dataset.id, chunk_size=10)
+    monkeypatch.undo()
+    n_texts = len(texts)
+    assert jobs.count("compress_chunk") == (n_texts + 9) // 10 + 1  # + the last one
+    assert jobs[-1] == "set_dictionary"
+    assert sizes[1] < sizes[0]
+    db.session.expire_all()
+    assert set(stored_types("ps_dialog_event", "event_plaintext", dataset.id)) == {
+        "blob"
+    }
+    assert db.session.get(Dataset, dataset.id).text_dictionary == key
+    assert event_texts(dataset.id) == texts
+    assert search_events(dataset.id, "consectetur")[1] == n_hits
+    delete_dataset(dataset.id)
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_upload_compressed_psychotherapy(test_client, insert_users, tmp_path):
+    """
+    GIVEN a Flask application with COMPRESS_TEXT enabled
+    WHEN a psychotherapy dataset is uploaded, then a new version of it, and it is cloned
+    THEN check that the texts of the dialog events are stored compressed, that they are
+    shown and searched like plain texts, and that the dictionary is deleted with the
+    last dataset using it
+    """
+    flask_app = test_client.application
+    flask_app.config["COMPRESS_TEXT"] = True
+    try:
+        login(test_client, "admin1")
+        df = read_pickle(flask_app.config["PS_DATASET_PATH"])
+        df["event_plaintext"] = df["event_plaintext"].where(
+            df["event_speaker"] == "Timestamp", df["event_plaintext"] + " Compressed."
+        )
+        path = tmp_path / "session.pickle"
+        df.to_pickle(path)
+        dataset = upload_dataset(
+            test_client, "/upload/upload_psychotherapy", path, "compressed_dataset"
+        )
+        assert dataset.content_id == dataset.id  # not shared
+        types = stored_types("ps_dialog_event", "event_plaintext", dataset.id)
+        assert types["blob"] > types.get("text", 0)
+        key = dataset.text_dictionary
+        assert db.session.get(TextDictionary, key) is not None
+        texts = event_texts(dataset.id)
+        assert texts == file_texts(df)
+        url = url_for("annotate.annotate_ps", dataset_id=dataset.id, page=1)
+        response = test_client.get(url)
+        assert texts[0].encode() in response.data
+        hits, total = search_events(dataset.id, "compressed")
+        assert total > 0
+        assert "<mark>" in hits[0]["snippet"]
+
+        # a new version, with a changed and a new dialog event
+        df.loc[1, "event_plaintext"] = "Etincidunt ut consectetur adipisci versioned."
+        df = pd.concat(
+            [df, pd.DataFrame([dict(df.iloc[-1], event_plaintext="A new event.")])],
+            ignore_index=True,
+        )
+        new_path = tmp_path / "session_v2.pickle"
+        df.to_pickle(new_path)
+        response = upload(
+            test_client,
+            url_for("upload.upload_psychotherapy_version", dataset_id=dataset.id),
+            new_path,
+        )
+        assert b"dialog events: 1 inserted, 1 updated, 0 deleted" in response.data
+        db.session.expire_all()
+        assert event_texts(dataset.id) == file_texts(df)
+        assert search_events(dataset.id, "versioned")[1] == 1
+        assert search_events(dataset.id, "new event")[1] == 1
+
+        # the compressed texts are copied as they are
+        admin1 = User.query.filter_by(username="admin1").first()
+        id_clone = clone_dataset(
+            dataset.id, "compressed_clone", "", admin1.id, [admin1.id]
+        )
+        db.session.commit()
+        assert db.session.get(Dataset, id_clone).text_dictionary == key
+        assert stored_types("ps_dialog_event", "event_plaintext", id_clone) == (
+            stored_types("ps_dialog_event", "event_plaintext", dataset.id)
+        )
+        assert event_texts(id_clone) == file_texts(df)
+        assert search_events(id_clone, "versioned")[1] == 1
+
+        delete_dataset(dataset.id)
+        db.session.expire_all()
+        assert db.session.get(TextDictionary, key) is not None
+        delete_dataset(id_clone)
+        db.session.expire_all()
+        assert db.session.get(TextDictionary, key) is None
+    finally:
+        flask_app.config["COMPRESS_TEXT"] = False
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_upload_compressed_sm(test_client, insert_users):
+    """
+    GIVEN a Flask application with COMPRESS_TEXT enabled
+    WHEN a social media dataset is uploaded
+    THEN check that the texts of the posts and replies are stored compressed,
+    and that the posts are shown on the annotation page
+    """
+    flask_app = test_client.application
+    flask_app.config["COMPRESS_TEXT"] = True
+    try:
+        login(test_client, "admin1")
+        dataset = upload_dataset(
+            test_client,
+            "/upload/upload_sm",
+            flask_app.config["SM_DATASET_PATH"],
+            "compressed_sm_dataset",
+        )
+        assert stored_types("sm_post", "question", dataset.id)["blob"] > 0
+        assert stored_types("sm_reply", "comment", dataset.id)["blob"] > 0
+        post = SMPost.query.filter_by(id_dataset=dataset.id).order_by(SMPost.id).first()
+        assert isinstance(post.question, str)
+        reply = SMReply.query.filter_by(id_dataset=dataset.id).first()
+        assert isinstance(reply.comment, str) and reply.comment
+        response = test_client.get(
+            url_for("annotate.annotate_sm", dataset_id=dataset.id)
+        )
+        assert response.status_code == 200
+        assert post.question.split()[0].encode() in response.data
+    finally:
+        flask_app.config["COMPRESS_TEXT"] = False
+    test_client.get("/auth/logout", follow_redirects=True)
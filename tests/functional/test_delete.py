@@ -0,0 +1,382 @@
+"""
+Functional tests for the deletion of datasets by the admin (a chunk of rows at a time,
+see app/admin/delete.py), and for their archives (see app/admin/archive.py).
+"""
+import gzip
+import json
+import os
+import re
+from flask import url_for
+from bs4 import BeautifulSoup
+from sqlalchemy import event
+from app import db, write_queue
+from app.models import (
+    Dataset,
+    DatasetStats,
+    EvidenceDyad,
+    PSAnnotationDyad,
+    PSAnnotationProgress,
+    PSDialogEvent,
+    PSDialogTurn,
+    User,
+    dataset_annotator,
+)
+from app.admin.archive import archived_columns, restore_dataset, write_archive
+from app.admin.delete import delete_dataset, mark_deleting
+from app.export.exporters import annotation_chunks, export_watermark
+from app.annotate.utils import get_annotated_dataset
+from app.search.utils import search_events
+from app.upload.routes import save_shared_dataset
+from tests.functional.utils import create_segment_level_annotation_dyad
+import pytest
+
+
+def login(test_client, username: str):
+    """Log in to the app"""
+    response = test_client.post(
+        "/auth/login",
+        data={"username": username, "password": username + "password"},
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+
+
+def upload_and_annotate(test_client, name: str) -> Dataset:
+    """Upload the psychotherapy dataset and annotate its first page (as admin1)"""
+    admin1 = User.query.filter_by(username="admin1").first()
+    path = test_client.application.config["PS_DATASET_PATH"]
+    with open(path, "rb") as handle:
+        response = test_client.post(
+            "/upload/upload_psychotherapy",
+            data={
+                "name": name,
+                "description": "test description",
+                "annotators": admin1.id,
+                "file": (handle, os.path.basename(path)),
+            },
+            follow_redirects=True,
+        )
+    assert b"File uploaded successfully" in response.data
+    dataset = Dataset.query.filter_by(name=name).one()
+    url = url_for("annotate.annotate_ps", dataset_id=dataset.id, page=1)
+    soup = BeautifulSoup(test_client.get(url).data, "html.parser")
+    response = test_client.post(
+        url, data=create_segment_level_annotation_dyad(soup)[0], follow_redirects=True
+    )
+    assert b"Your annotations have been saved" in response.data
+    return dataset
+
+
+def count_rows(id_dataset: int) -> dict:
+    """The number of rows of a dataset in each table"""
+    annotations = db.select(PSAnnotationDyad.id).where(
+        PSAnnotationDyad.id_dataset == id_dataset
+    )
+    return {
+        "dialog_turns": PSDialogTurn.query.filter_by(id_dataset=id_dataset).count(),
+        "dialog_events": PSDialogEvent.query.filter_by(id_dataset=id_dataset).count(),
+        "annotations": PSAnnotationDyad.query.filter_by(id_dataset=id_dataset).count(),
+        "segment_links": PSAnnotationDyad.query.filter(
+            PSAnnotationDyad.id_dataset == id_dataset,
+            PSAnnotationDyad.id_first_dialog_turn.is_not(None),
+        ).count(),
+        "evidence": EvidenceDyad.query.filter(
+            EvidenceDyad.id_ps_annotation_dyad.in_(annotations)
+        ).count(),
+        "progress": PSAnnotationProgress.query.filter_by(id_dataset=id_dataset).count(),
+        "stats": DatasetStats.query.filter_by(id_dataset=id_dataset).count(),
+        "annotators": db.session.scalar(
+            db.select(db.func.count())
+            .select_from(dataset_annotator)
+            .where(dataset_annotator.c.id_dataset == id_dataset)
+        ),
+    }
+
+
+@pytest.mark.order(25)
+def test_archive_and_restore_dataset(test_client, insert_users):
+    """
+    GIVEN a psychotherapy dataset with an annotation of its first page
+    WHEN the admin deletes it with its archive, and the archive is restored with the
+    `flask restore-dataset` command
+    THEN check that all the rows of the dataset are deleted, and that the restored
+    dataset has the same rows, with their references remapped
+    """
+    login(test_client, "admin1")
+    id_dataset = upload_and_annotate(test_client, "archived_dataset").id
+    n_rows = count_rows(id_dataset)
+    timestamp = PSAnnotationDyad.query.filter_by(id_dataset=id_dataset).one().timestamp
+    assert all(n_rows.values())
+    n_hits = search_events(id_dataset, "consectetur")[1]
+    assert n_hits > 0
+    response = test_client.get(url_for("main.index"))
+    assert url_for("admin.delete", dataset_id=id_dataset).encode() in response.data
+
+    response = test_client.post(
+        url_for("admin.delete", dataset_id=id_dataset),
+        data={"archive": "y"},
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+    match = re.search(rb"being archived to (\S+\.jsonl\.gz) and deleted", response.data)
+    assert match is not None
+    path = os.path.join(
+        test_client.application.config["ARCHIVE_FOLDER"], match.group(1).decode()
+    )
+    assert os.path.isfile(path)
+    db.session.expire_all()
+    assert db.session.get(Dataset, id_dataset) is None
+    assert not any(count_rows(id_dataset).values())
+    assert search_events(id_dataset, "consectetur")[1] == 0
+
+    from annotations_interface import restore_dataset
+
+    watermark = export_watermark(0)  # of an incremental export before the restore
+    runner = test_client.application.test_cli_runner(mix_stderr=False)
+    result = runner.invoke(restore_dataset, [path])
+    assert result.exit_code == 0, result.output
+    restored = Dataset.query.filter_by(name="archived_dataset").one()
+    assert count_rows(restored.id) == n_rows
+    annotation = PSAnnotationDyad.query.filter_by(id_dataset=restored.id).one()
+    assert annotation.first_dialog_turn.id_dataset == restored.id
+    # the restored annotations keep their timestamps, and are marked as modified
+    # by the restore, so the next incremental export exports them
+    assert annotation.timestamp == timestamp
+    assert annotation.modified >= watermark
+    exported = [
+        row["id"]
+        for rows in annotation_chunks(restored.id, since=watermark)
+        for row in rows
+    ]
+    assert exported == [annotation.id]
+    assert {item.dialog_event.id_dataset for item in annotation.evidence} == {
+        restored.id
+    }
+    for dialog_event in PSDialogEvent.query.filter_by(id_dataset=restored.id):
+        assert dialog_event.dialog_turn.id_dataset == restored.id
+    assert search_events(restored.id, "consectetur")[1] == n_hits
+    url = url_for("annotate.annotate_ps", dataset_id=restored.id, page=1)
+    assert test_client.get(url).status_code == 200
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def annotation_labels(id_dataset: int) -> list:
+    """The labels and strengths of the dyad annotations of a dataset, with their evidence"""
+    return [
+        (
+            annotation.label_a,
+            annotation.label_b,
+            annotation.strength_a,
+            annotation.strength_b,
+            sorted(
+                (item.dialog_event.event_n, item.label.name)
+                for item in annotation.evidence
+            ),
+        )
+        for annotation in PSAnnotationDyad.query.filter_by(
+            id_dataset=id_dataset
+        ).order_by(PSAnnotationDyad.id)
+    ]
+
+
+def test_archive_round_trip_labels(test_client, insert_users, tmp_path):
+    """
+    GIVEN a psychotherapy dataset with an annotation of its first page, with evidence
+    WHEN it is written to an archive, and the archive is restored
+    THEN check that the archive has the names of the labels, and that the restored
+    annotations and evidence have the same labels and strengths
+    """
+    login(test_client, "admin1")
+    id_dataset = upload_and_annotate(test_client, "round_trip_dataset").id
+    labels = annotation_labels(id_dataset)
+    assert labels and all(evidence for *_, evidence in labels)
+    path = str(tmp_path / "round-trip.jsonl.gz")
+    write_archive(id_dataset, path)
+    db.session.rollback()
+    with gzip.open(path, "rt", encoding="utf-8") as handle:
+        chunks = [json.loads(line) for line in handle][1:]
+    rows = [
+        dict(
+            zip(
+                [
+                    column.name
+                    for column in archived_columns(db.metadata.tables[chunk["table"]])
+                ],
+                values,
+            )
+        )
+        for chunk in chunks
+        if chunk["table"] == PSAnnotationDyad.__tablename__
+        for values in chunk["rows"]
+    ]
+    assert rows[0]["label_a"] == labels[0][0].name
+
+    id_restored = write_queue.submit(restore_dataset, path)
+    db.session.expire_all()
+    assert annotation_labels(id_restored) == labels
+    delete_dataset(id_restored)
+    delete_dataset(id_dataset)
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_dataset_being_deleted(test_client, insert_users):
+    """
+    GIVEN a psychotherapy dataset with an annotation of its first page
+    WHEN it is marked as being deleted (before it is archived and deleted)
+    THEN check that it is no longer listed nor annotated, and that no annotation
+    of the dataset can be written anymore
+    """
+    login(test_client, "admin1")
+    dataset = upload_and_annotate(test_client, "dataset_being_deleted")
+    id_dataset = dataset.id
+    url = url_for("annotate.annotate_ps", dataset_id=id_dataset, page=1)
+    delete_url = url_for("admin.delete", dataset_id=id_dataset)
+    assert delete_url.encode() in test_client.get(url_for("main.index")).data
+
+    write_queue.submit(mark_deleting, id_dataset)
+    db.session.expire_all()
+    assert delete_url.encode() not in test_client.get(url_for("main.index")).data
+    assert test_client.get(url).status_code == 404
+    with pytest.raises(ValueError):
+        get_annotated_dataset(id_dataset)
+
+    delete_dataset(id_dataset)
+    db.session.expire_all()
+    assert db.session.get(Dataset, id_dataset) is None
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_upload_during_delete(test_client, insert_users):
+    """
+    GIVEN psychotherapy datasets uploaded from the same file, being deleted
+    WHEN the '/upload_psychotherapy' page is requested (POST) with an identical file
+    THEN check that the new dataset does not share the contents of the datasets
+    being deleted, but has its own dialog turns and events
+    """
+    login(test_client, "admin1")
+    dataset = upload_and_annotate(test_client, "dataset_deleted_during_upload")
+    file_sha256 = dataset.file_sha256
+    identical = [
+        row.id
+        for row in Dataset.query.filter_by(
+            file_sha256=file_sha256, type=dataset.type, deleting=False
+        )
+    ]
+
+    def set_deleting(deleting: bool):
+        db.session.execute(
+            db.update(Dataset)
+            .where(Dataset.id.in_(identical))
+            .values(deleting=deleting)
+        )
+
+    write_queue.submit(set_deleting, True)
+    try:
+        # the write job checks the mark again, e.g. if it was set since the request
+        admin1 = User.query.filter_by(username="admin1").first()
+        assert (
+            write_queue.submit(
+                save_shared_dataset, None, dataset.id, admin1.id, file_sha256
+            )
+            is None
+        )
+        new_dataset = upload_and_annotate(test_client, "dataset_uploaded_during_delete")
+    finally:
+        write_queue.submit(set_deleting, False)
+    assert new_dataset.id_content is None
+    assert new_dataset.content_id == new_dataset.id
+    assert count_rows(new_dataset.id)["dialog_turns"] > 0
+    assert count_rows(new_dataset.id)["dialog_events"] > 0
+
+    delete_dataset(new_dataset.id)
+    delete_dataset(dataset.id)
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_delete_dataset_chunks(test_client, insert_users):
+    """
+    GIVEN psychotherapy datasets with annotations, uploaded from the same file,
+    which share the dialog turns and events of one of them
+    WHEN that dataset is deleted, 10 rows at a time
+    THEN check that its annotations are deleted, and that its dialog turns and events
+    are kept for the other datasets; and when all the datasets are deleted, check that
+    the dialog turns and events are deleted with several DELETE statements
+    """
+    login(test_client, "admin1")
+    upload_and_annotate(test_client, "deleted_dataset")
+    id_owner = upload_and_annotate(test_client, "shared_dataset").content_id
+    n_rows = count_rows(id_owner)
+    n_events = n_rows["dialog_events"]
+    sharers = [
+        dataset.id
+        for dataset in Dataset.query.filter_by(id_content=id_owner).order_by(Dataset.id)
+    ]
+    assert len(sharers) >= 1
+    n_shared_rows = {id_dataset: count_rows(id_dataset) for id_dataset in sharers}
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        n_deleted = delete_dataset(id_owner, chunk_size=10)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert n_deleted["ps_annotation_dyad"] == n_rows["annotations"]
+    # the dialog turns and events were moved to another dataset, not deleted
+    assert n_deleted["ps_dialog_turn"] == n_deleted["ps_dialog_event"] == 0
+    assert not [
+        statement
+        for statement in statements
+        if re.match(r"DELETE FROM (ps_dialog_turn|ps_dialog_event)\b", statement)
+    ]
+    db.session.expire_all()
+    assert db.session.get(Dataset, id_owner) is None
+    assert not any(count_rows(id_owner).values())
+    id_heir = sharers[0]
+    assert db.session.get(Dataset, id_heir).id_content is None
+    for id_dataset in sharers[1:]:
+        assert db.session.get(Dataset, id_dataset).id_content == id_heir
+        assert count_rows(id_dataset) == n_shared_rows[id_dataset]
+    assert count_rows(id_heir) == dict(
+        n_shared_rows[id_heir],
+        dialog_turns=n_rows["dialog_turns"],
+        dialog_events=n_events,
+    )
+    assert search_events(id_heir, "consectetur")[1] > 0
+
+    # the dialog turns and events are deleted, in chunks, with the last dataset
+    for id_dataset in sharers[:0:-1]:
+        delete_dataset(id_dataset, chunk_size=10)
+    statements.clear()
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        n_deleted = delete_dataset(id_heir, chunk_size=10)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert n_deleted["ps_dialog_turn"] == n_rows["dialog_turns"]
+    assert n_deleted["ps_dialog_event"] == n_events
+    deletes = [
+        statement
+        for statement in statements
+        if re.match(r"DELETE FROM ps_dialog_event\b", statement)
+    ]
+    assert len(deletes) == -(-n_events // 10)
+    db.session.expire_all()
+    assert not any(count_rows(id_heir).values())
+    assert search_events(id_heir, "consectetur")[1] == 0
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_delete_dataset_admin_only(test_client, insert_users):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN annotator1 requests the page to delete a dataset (GET)
+    THEN check that it is forbidden
+    """
+    login(test_client, "annotator1")
+    response = test_client.get(url_for("admin.delete", dataset_id=1))
+    assert response.status_code == 403
+    test_client.get("/auth/logout", follow_redirects=True)
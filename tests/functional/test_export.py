@@ -0,0 +1,332 @@
+"""
+Functional tests for the export (`export`) blueprint and the `flask export-annotations` command.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from app.models import Dataset, User, PSAnnotationClient, EvidenceClient, PSDialogTurn
+from app.utils import SubLabelsCClient, LabelNamesClient, Speaker
+from app.export import exporters
+import pytest
+
+
+@pytest.fixture(scope="function")
+def insert_ps_annotations(
+    db_session,
+    insert_users,
+    insert_datasets,
+    new_evidence_client,
+    new_evidence_therapist,
+    new_evidence_dyad,
+):
+    """Fixture to insert psychotherapy annotations (one per speaker) and their evidence"""
+    db_session.add_all([new_evidence_client, new_evidence_therapist, new_evidence_dyad])
+    db_session.commit()
+
+
+def login(test_client, username: str):
+    """Log in to the app with one of the test users"""
+    response = test_client.post(
+        "/auth/login",
+        data={"username": username, "password": username + "password"},
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.order(17)
+def test_export_login_required(test_client):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the annotations of a dataset are exported without logging in
+    THEN check that the user is redirected to the login page
+    """
+    response = test_client.get("/export/1/annotations.csv")
+    assert response.status_code == 302
+    assert "/auth/login" in response.headers["Location"]
+
+
+def test_export_forbidden(
+    test_client, db_session, insert_ps_annotations, new_ps_dataset
+):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the annotations of a dataset are exported by a user who is not one of its annotators
+    THEN check that access is denied
+    """
+    user = User(username="annotator2", email="annotator2@example.com")
+    user.set_password("annotator2password")
+    db_session.add(user)
+    db_session.commit()
+    login(test_client, "annotator2")
+    response = test_client.get("/export/{}/annotations.csv".format(new_ps_dataset.id))
+    assert response.status_code == 403
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_export_csv(
+    test_client, insert_ps_annotations, new_ps_dataset, new_ps_dialog_turn
+):
+    """
+    GIVEN a Flask application configured for testing, with annotations for each speaker
+    WHEN the annotations of the dataset are exported as CSV by one of its annotators
+    THEN check that there is one row per annotation, with the label names and evidence
+    """
+    login(test_client, "annotator1")
+    response = test_client.get("/export/{}/annotations.csv".format(new_ps_dataset.id))
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    assert "attachment" in response.headers["Content-Disposition"]
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert list(rows[0]) == exporters.EXPORT_COLUMNS
+    assert [row["speaker"] for row in rows] == ["client", "therapist", "dyad"]
+    client = rows[0]
+    assert client["label_a"] == "attachment"
+    assert client["strength_a"] == "moderately_adaptive"
+    assert client["comment_summary"] == "test comment summary"
+    assert client["dialog_turn_ids"] == str(new_ps_dialog_turn.id)
+    assert client["evidence_a"] != ""
+    assert client["evidence_b"] == ""
+    assert rows[1]["evidence_b"] == rows[2]["evidence_a"] == client["evidence_a"]
+
+    # only some of the speakers
+    response = test_client.get(
+        "/export/{}/annotations.csv?speaker=dyad".format(new_ps_dataset.id)
+    )
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [row["speaker"] for row in rows] == ["dyad"]
+    response = test_client.get(
+        "/export/{}/annotations.csv?speaker=nobody".format(new_ps_dataset.id)
+    )
+    assert response.status_code == 400
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_export_jsonl(test_client, insert_ps_annotations, new_ps_dataset):
+    """
+    GIVEN a Flask application configured for testing, with annotations for each speaker
+    WHEN the annotations of the dataset are exported as JSON Lines by an admin
+    THEN check that there is one JSON object per annotation, with lists of ids
+    """
+    login(test_client, "admin1")
+    response = test_client.get("/export/{}/annotations.jsonl".format(new_ps_dataset.id))
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(rows) == 3
+    assert rows[1]["label_b"] == "reframing"
+    assert rows[1]["strength_b"] == "high"
+    assert rows[1]["label_f"] is None
+    assert len(rows[1]["evidence_b"]) == 1
+    assert isinstance(rows[1]["dialog_turn_ids"], list)
+    response = test_client.get("/export/{}/annotations.xml".format(new_ps_dataset.id))
+    assert response.status_code == 404
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_export_parquet(
+    test_client, monkeypatch, insert_ps_annotations, new_ps_dataset
+):
+    """
+    GIVEN a Flask application configured for testing, with annotations for each speaker
+    WHEN the annotations of the dataset are exported as Parquet, one annotation at a time
+    THEN check that the streamed file is valid, with one row group per chunk
+    """
+    pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(exporters, "EXPORT_CHUNK_SIZE", 1)
+    login(test_client, "admin1")
+    response = test_client.get(
+        "/export/{}/annotations.parquet".format(new_ps_dataset.id)
+    )
+    assert response.status_code == 200
+    parquet_file = pq.ParquetFile(io.BytesIO(response.data))
+    assert parquet_file.metadata.num_row_groups == 3
+    table = parquet_file.read()
+    assert table.column_names == exporters.EXPORT_COLUMNS
+    assert table.column("speaker").to_pylist() == ["client", "therapist", "dyad"]
+    assert table.column("label_a").to_pylist()[2] == "bond"
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_export_annotations_command(
+    flask_app, tmp_path, insert_ps_annotations, new_ps_dataset
+):
+    """
+    GIVEN a Flask application configured for testing, with annotations for each speaker
+    WHEN the `flask export-annotations` command is run
+    THEN check that the annotations are written to the output file
+    """
+    from annotations_interface import export_annotations
+
+    runner = flask_app.test_cli_runner()
+    output = tmp_path / "annotations.jsonl"
+    result = runner.invoke(
+        export_annotations,
+        [
+            str(new_ps_dataset.id),
+            "--format",
+            "jsonl",
+            "--speaker",
+            "client",
+            "-o",
+            output,
+        ],
+    )
+    assert result.exit_code == 0
+    rows = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [row["speaker"] for row in rows] == ["client"]
+
+    result = runner.invoke(export_annotations, ["12345"])
+    assert result.exit_code != 0
+    assert "dataset not found" in result.output
+
+
+def test_incremental_export(
+    flask_app,
+    test_client,
+    db_session,
+    monkeypatch,
+    insert_ps_annotations,
+    new_ps_dataset,
+    new_ps_dialog_turn,
+    new_ps_dialog_event,
+    user_annotator1,
+):
+    """
+    GIVEN a Flask application configured for testing, with annotations for each speaker
+    WHEN the annotations are exported since the watermark of the previous export
+    THEN check that only the annotations created after the previous export are exported,
+    with their evidence, and that a new watermark is returned
+    """
+    monkeypatch.setitem(flask_app.config, "EXPORT_WATERMARK_LAG", 0)
+    login(test_client, "admin1")
+    url = "/export/{}/annotations.jsonl".format(new_ps_dataset.id)
+    response = test_client.get(url, query_string={"since": "2000-01-01T00:00:00"})
+    assert len(response.get_data(as_text=True).splitlines()) == 3
+    watermark = response.headers["X-Export-Watermark"]
+
+    # nothing new since the previous export
+    response = test_client.get(url, query_string={"since": watermark})
+    assert response.data == b""
+    assert response.headers["X-Export-Watermark"] > watermark
+
+    # a new annotation (with evidence) after the previous export
+    annotation = PSAnnotationClient(
+        label_c=SubLabelsCClient.fight,
+        comment_c="new annotation",
+        author=user_annotator1,
+        dataset=new_ps_dataset,
+        first_dialog_turn=new_ps_dialog_turn,
+    )
+    evidence = EvidenceClient(
+        dialog_event=new_ps_dialog_event,
+        annotation=annotation,
+        label=LabelNamesClient.label_c,
+    )
+    db_session.add_all([annotation, evidence])
+    db_session.commit()
+    response = test_client.get(url, query_string={"since": watermark})
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [row["id"] for row in rows] == [annotation.id]
+    assert rows[0]["label_c"] == "fight"
+    assert rows[0]["evidence_c"] == [new_ps_dialog_event.id]
+
+    # the annotations of all the datasets, since the same watermark
+    response = test_client.get(
+        "/export/annotations.jsonl", query_string={"since": watermark}
+    )
+    assert response.status_code == 200
+    assert len(response.get_data(as_text=True).splitlines()) == 1
+    response = test_client.get(url, query_string={"since": "yesterday"})
+    assert response.status_code == 400
+    test_client.get("/auth/logout", follow_redirects=True)
+
+    # only admins can export all the datasets
+    login(test_client, "annotator1")
+    response = test_client.get("/export/annotations.jsonl")
+    assert response.status_code == 403
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_incremental_export_command(
+    flask_app, tmp_path, monkeypatch, insert_ps_annotations
+):
+    """
+    GIVEN a Flask application configured for testing, with psychotherapy annotations
+    WHEN the `flask export-annotations` command is run twice with a watermark file
+    THEN check that the second export only contains the annotations created since the first one
+    """
+    from annotations_interface import export_annotations
+
+    monkeypatch.setitem(flask_app.config, "EXPORT_WATERMARK_LAG", 0)
+    runner = flask_app.test_cli_runner()
+    watermark_file = tmp_path / "watermark"
+    output = tmp_path / "annotations.csv"
+    args = ["--watermark-file", watermark_file, "-o", output]
+    result = runner.invoke(export_annotations, args)
+    assert result.exit_code == 0
+    rows = list(csv.DictReader(io.StringIO(output.read_text())))
+    assert len(rows) == PSAnnotationClient.query.count() + 2  # therapist and dyad
+    watermark = watermark_file.read_text()
+    assert "Next watermark: " + watermark in result.output
+
+    result = runner.invoke(export_annotations, args)
+    assert result.exit_code == 0
+    assert list(csv.DictReader(io.StringIO(output.read_text()))) == []
+    assert watermark_file.read_text() > watermark
+
+
+def test_export_all_datasets_segments(
+    db_session,
+    monkeypatch,
+    insert_ps_annotations,
+    new_ps_dataset,
+    new_ps_dialog_turn,
+    user_annotator1,
+):
+    """
+    GIVEN annotations of two datasets, whose ids alternate between the datasets
+    WHEN the annotations of all the datasets are exported
+    THEN check that the segments of each dataset are computed once, one dataset
+    at a time, and that each annotation has the dialog turns of its segment
+    """
+    other_dataset = Dataset(name="Other Psychotherapy Dataset Test")
+    dialog_turn = PSDialogTurn(
+        c_code="cd5678",
+        timestamp=datetime.strptime("00:00:00", "%H:%M:%S").time(),
+        main_speaker="Client",
+        session_n=1,
+        dialog_turn_n=1,
+        dataset=other_dataset,
+    )
+    annotations = [
+        PSAnnotationClient(
+            author=user_annotator1, dataset=dataset, first_dialog_turn=first_turn
+        )
+        for dataset, first_turn in [
+            (other_dataset, dialog_turn),
+            (new_ps_dataset, new_ps_dialog_turn),
+        ]
+    ]
+    db_session.add_all([other_dataset, dialog_turn] + annotations)
+    db_session.commit()
+    calls = []
+    segments_by_dialog_turn = exporters.segments_by_dialog_turn
+
+    def record(id_content, time_interval=300):
+        calls.append(id_content)
+        return segments_by_dialog_turn(id_content, time_interval)
+
+    monkeypatch.setattr(exporters, "segments_by_dialog_turn", record)
+    rows = [
+        row
+        for chunk in exporters.annotation_chunks(speakers=[Speaker.client])
+        for row in chunk
+    ]
+    assert len(calls) == len(set(calls))
+    assert [row["id_dataset"] for row in rows] == sorted(
+        row["id_dataset"] for row in rows
+    )
+    turns = {new_ps_dataset.id: new_ps_dialog_turn.id, other_dataset.id: dialog_turn.id}
+    for row in rows:
+        assert row["dialog_turn_ids"] == [turns[row["id_dataset"]]]
@@ -0,0 +1,98 @@
+"""
+Functional tests for the `flask import-datasets` command (bulk import of dataset files).
+"""
+import shutil
+from app.models import Dataset, DatasetStats, SMTimeline, User
+from app.search.utils import search_events
+from app.upload.parsers import read_pickle
+from app.utils import DatasetType
+import pytest
+
+
+@pytest.mark.order(22)
+def test_import_datasets_command(flask_app, tmp_path, insert_users):
+    """
+    GIVEN a directory with psychotherapy (pickle and Parquet) and social media files,
+    a file which is not a dataset and a corrupted file
+    WHEN the `flask import-datasets` command is run with several worker processes
+    THEN check that each dataset file is imported as a new dataset, with the annotators
+    of the manifest, and that the files which cannot be imported are reported
+    """
+    from annotations_interface import import_datasets
+
+    df = read_pickle(flask_app.config["PS_DATASET_PATH"])
+    shutil.copy(flask_app.config["PS_DATASET_PATH"], tmp_path / "session_1.pickle")
+    df.to_parquet(tmp_path / "session_2.parquet")
+    shutil.copy(flask_app.config["SM_DATASET_PATH"], tmp_path / "timelines.pkl")
+    (tmp_path / "corrupted.pkl").write_bytes(b"not a pickle")
+    shutil.copy(tmp_path / "session_1.pickle", tmp_path / "notes.txt")  # ignored
+    (tmp_path / "manifest.csv").write_text(
+        "file,name,description,annotators\n"
+        "session_2.parquet,Session 2,Second session,annotator1\n"
+    )
+    n_datasets = Dataset.query.count()
+
+    runner = flask_app.test_cli_runner(mix_stderr=False)
+    result = runner.invoke(
+        import_datasets,
+        [
+            str(tmp_path),
+            "--author",
+            "admin1",
+            "--annotator",
+            "admin1",
+            "--manifest",
+            str(tmp_path / "manifest.csv"),
+            "--workers",
+            "2",
+        ],
+    )
+    assert result.exit_code == 1
+    assert "Imported 3 of 4 files" in result.output
+    assert "corrupted.pkl: FAILED" in result.stderr
+    assert Dataset.query.count() == n_datasets + 3
+
+    admin1 = User.query.filter_by(username="admin1").first()
+    annotator1 = User.query.filter_by(username="annotator1").first()
+    n_timestamps = sum(df["event_speaker"] == "Timestamp")
+    for name in ["session_1", "Session 2"]:
+        dataset = Dataset.query.filter_by(name=name).one()
+        assert dataset.type == DatasetType.psychotherapy
+        assert dataset.author == admin1
+        assert dataset.n_segments > 0
+        stats = DatasetStats.query.get(dataset.id)
+        assert stats.n_dialog_turns == n_timestamps
+        assert stats.n_dialog_events == len(df) - n_timestamps
+        assert dataset.dialog_events.count() == stats.n_dialog_events
+        # the dialog events are added to the full-text search index
+        assert search_events(dataset.id, "etincidunt")[1] > 0
+    assert Dataset.query.filter_by(name="session_1").one().annotators.all() == [admin1]
+    dataset = Dataset.query.filter_by(name="Session 2").one()
+    assert dataset.description == "Second session"
+    assert set(dataset.annotators) == {admin1, annotator1}
+
+    dataset = Dataset.query.filter_by(name="timelines").one()
+    assert dataset.type == DatasetType.sm_thread
+    assert (dataset.posts.count(), dataset.replies.count()) == (43, 92)
+    assert SMTimeline.query.filter_by(id_dataset=dataset.id).count() > 0
+    assert "43 posts, 92 replies" in result.output
+
+
+def test_import_datasets_unknown_user(flask_app, tmp_path, insert_users):
+    """
+    GIVEN a directory with a dataset file
+    WHEN the `flask import-datasets` command is run with an unknown annotator
+    THEN check that nothing is imported
+    """
+    from annotations_interface import import_datasets
+
+    shutil.copy(flask_app.config["SM_DATASET_PATH"], tmp_path / "timelines.pickle")
+    n_datasets = Dataset.query.count()
+    runner = flask_app.test_cli_runner()
+    result = runner.invoke(
+        import_datasets,
+        [str(tmp_path), "--author", "admin1", "--annotator", "nobody"],
+    )
+    assert result.exit_code != 0
+    assert "unknown user: nobody" in result.output
+    assert Dataset.query.count() == n_datasets
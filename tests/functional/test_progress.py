@@ -0,0 +1,105 @@
+"""
+Functional tests for the annotation progress of psychotherapy datasets
+(progress on the home page and "resume where I left off" link).
+"""
+from flask import url_for
+from bs4 import BeautifulSoup
+from app import db
+from app.models import User, Dataset, PSAnnotationProgress, PSAnnotatedSegment
+from app.annotate.utils import rebuild_annotation_progress
+from app.utils import Speaker
+from tests.functional.utils import create_segment_level_annotation_dyad
+import pytest
+
+
+def annotate_page(test_client, dataset_id: int, page: int):
+    """Submit an annotation for the dyad on a page of the dataset"""
+    url = url_for("annotate.annotate_ps", dataset_id=dataset_id, page=page)
+    soup = BeautifulSoup(test_client.get(url).data, "html.parser")
+    data = create_segment_level_annotation_dyad(soup)[0]
+    response = test_client.post(url, data=data, follow_redirects=True)
+    assert b"Your annotations have been saved" in response.data
+
+
+def get_progress(dataset_id: int, speaker: Speaker):
+    """Get the annotation progress of annotator1 for the dataset and the speaker"""
+    user = User.query.filter_by(username="annotator1").first()
+    return PSAnnotationProgress.query.filter_by(
+        id_dataset=dataset_id, id_user=user.id, speaker=speaker
+    ).first()
+
+
+@pytest.mark.order(19)
+def test_annotation_progress(test_client, insert_users, insert_ps_dialog_turns):
+    """
+    GIVEN a Flask application configured for testing and a psychotherapy dataset
+    WHEN the segments are annotated out of order, and a segment is annotated twice
+    THEN check that the number of annotated segments and the first segment
+    not annotated yet are updated with each annotation
+    """
+    response = test_client.post(
+        "/auth/login",
+        data={"username": "annotator1", "password": "annotator1password"},
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+    dataset = Dataset.query.filter_by(name="Psychotherapy Dataset Test").first()
+    assert get_progress(dataset.id, Speaker.dyad) is None
+
+    annotate_page(test_client, dataset.id, 2)
+    progress = get_progress(dataset.id, Speaker.dyad)
+    assert progress.n_segments_annotated == 1
+    assert progress.next_page == 1
+
+    annotate_page(test_client, dataset.id, 1)
+    progress = get_progress(dataset.id, Speaker.dyad)
+    assert progress.n_segments_annotated == 2
+    assert progress.next_page == 3
+
+    annotate_page(test_client, dataset.id, 1)  # the same segment again
+    progress = get_progress(dataset.id, Speaker.dyad)
+    assert progress.n_segments_annotated == 2
+    assert progress.next_page == 3
+    assert get_progress(dataset.id, Speaker.client) is None
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_progress_on_home_page(test_client, insert_users, insert_ps_dialog_turns):
+    """
+    GIVEN a psychotherapy dataset with some segments annotated for the dyad
+    WHEN the home page is requested (GET)
+    THEN check that the progress and the "resume" link are shown
+    """
+    dataset = Dataset.query.filter_by(name="Psychotherapy Dataset Test").first()
+    response = test_client.post(
+        "/auth/login",
+        data={"username": "annotator1", "password": "annotator1password"},
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+    assert "Dyad 2 segments" in " ".join(response.get_data(as_text=True).split())
+    soup = BeautifulSoup(response.data, "html.parser")
+    resume_link = soup.find("a", string="Resume where I left off")
+    # the client and the therapist have not been annotated yet
+    assert resume_link["href"].endswith(
+        "/annotate_psychotherapy/{}?page=1".format(dataset.id)
+    )
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_rebuild_annotation_progress(flask_app, insert_ps_dialog_turns):
+    """
+    GIVEN a psychotherapy dataset with some segments annotated
+    WHEN the annotation progress is computed again from the annotations
+    THEN check that it is the same as the progress recorded with each annotation,
+    and that the number of segments of the dataset is set
+    """
+    dataset = Dataset.query.filter_by(name="Psychotherapy Dataset Test").first()
+    time_interval = flask_app.config["PS_MINS_PER_PAGE"] * 60
+    rebuild_annotation_progress(dataset, time_interval)
+    db.session.commit()
+    progress = get_progress(dataset.id, Speaker.dyad)
+    assert progress.n_segments_annotated == 2
+    assert progress.next_page == 3
+    assert PSAnnotatedSegment.query.filter_by(id_dataset=dataset.id).count() == 2
+    assert dataset.n_segments > 3
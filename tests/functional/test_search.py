@@ -0,0 +1,180 @@
+"""
+Functional tests for the full-text search of the psychotherapy transcripts.
+"""
+import re
+from flask import url_for
+from bs4 import BeautifulSoup
+from app import db
+from app.models import Dataset, PSDialogEvent, User
+from app.upload.parsers import read_pickle
+from tests.functional.utils import create_segment_level_annotation_client
+import pytest
+
+
+def login(test_client, username: str):
+    """Log in to the app"""
+    response = test_client.post(
+        "/auth/login",
+        data={"username": username, "password": username + "password"},
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+
+
+def count_events(df, word: str, speaker: str = None) -> int:
+    """Count the dialog events (not timestamps) containing a word in the dataframe"""
+    events = df[df["event_speaker"] != "Timestamp"]
+    if speaker:
+        events = events[events["event_speaker"] == speaker]
+    pattern = re.compile(r"\b{}\b".format(word), re.IGNORECASE)
+    return sum(bool(pattern.search(text)) for text in events["event_plaintext"])
+
+
+@pytest.mark.order(20)
+def test_search_dataset(test_client, insert_users, insert_ps_dialog_turns):
+    """
+    GIVEN a psychotherapy dataset indexed when it was uploaded
+    WHEN the dialog events are searched for a word (GET, JSON results)
+    THEN check that all the events containing the word are found, ranked by relevance,
+    with the word highlighted and the page they are on
+    """
+    login(test_client, "annotator1")
+    dataset = Dataset.query.filter_by(name="Psychotherapy Dataset Test").first()
+    df = read_pickle(test_client.application.config["PS_DATASET_PATH"])
+    url = url_for("search.search_dataset", dataset_id=dataset.id)
+
+    response = test_client.get(url, query_string={"q": "Etincidunt", "format": "json"})
+    assert response.status_code == 200
+    results = response.get_json()
+    assert results["total"] == count_events(df, "etincidunt")
+    hits = results["hits"]
+    assert len(hits) == test_client.application.config["SEARCH_RESULTS_PER_PAGE"]
+    scores = [hit["score"] for hit in hits]
+    assert scores == sorted(scores, reverse=True)
+    for hit in hits:
+        assert re.search("<mark>etincidunt</mark>", hit["snippet"], re.IGNORECASE)
+    # the hits are on the annotation page they link to
+    hit = hits[-1]
+    page = test_client.get(
+        url_for("annotate.annotate_ps", dataset_id=dataset.id, page=hit["page"])
+    )
+    assert 'id="event-{}"'.format(hit["id"]).encode() in page.data
+    event = db.session.get(PSDialogEvent, hit["id"])
+    assert "etincidunt" in event.event_plaintext.lower()
+
+    # next page of results
+    response = test_client.get(
+        url, query_string={"q": "Etincidunt", "format": "json", "page": 2}
+    )
+    assert response.get_json()["total"] == results["total"]
+    ids = {hit["id"] for hit in response.get_json()["hits"]}
+    assert ids and not ids & {hit["id"] for hit in hits}
+
+
+def test_search_speaker_and_page(test_client, insert_users, insert_ps_dialog_turns):
+    """
+    GIVEN a psychotherapy dataset indexed when it was uploaded
+    WHEN the search page is requested (GET) with a speaker, or with no words to search for
+    THEN check that only the events of the speaker are shown, and that invalid
+    searches show no results
+    """
+    login(test_client, "annotator1")
+    dataset = Dataset.query.filter_by(name="Psychotherapy Dataset Test").first()
+    df = read_pickle(test_client.application.config["PS_DATASET_PATH"])
+    url = url_for("search.search_dataset", dataset_id=dataset.id)
+
+    response = test_client.get(url, query_string={"q": "labore", "speaker": "Client"})
+    assert response.status_code == 200
+    text = response.get_data(as_text=True)
+    total = count_events(df, "labore", "Client")
+    assert "{} dialog events found".format(total) in text
+    assert "<strong>Therapist:</strong>" not in text
+    assert "<mark>" in text
+
+    for query in ['"', "*", "(", "NOT"]:
+        response = test_client.get(url, query_string={"q": query, "format": "json"})
+        assert response.status_code == 200
+        assert response.get_json()["total"] == 0
+
+    sm_dataset = Dataset.query.filter_by(name="Social Media Dataset Test").first()
+    response = test_client.get(
+        url_for("search.search_dataset", dataset_id=sm_dataset.id),
+        query_string={"q": "labore"},
+    )
+    assert response.status_code == 404
+
+
+def annotate_client(
+    test_client, dataset_id: int, page: int, label_d: str, comment: str
+):
+    """Submit an annotation for the client on a page of the dataset"""
+    url = url_for("annotate.annotate_ps", dataset_id=dataset_id, page=page)
+    soup = BeautifulSoup(test_client.get(url).data, "html.parser")
+    data = create_segment_level_annotation_client(soup)[0]
+    data.update({"label_d_client": label_d, "comment_a_client": comment})
+    response = test_client.post(url, data=data, follow_redirects=True)
+    assert b"Your annotations have been saved" in response.data
+
+
+def test_search_annotations(
+    test_client, insert_users, insert_ps_dialog_turns, monkeypatch
+):
+    """
+    GIVEN a psychotherapy dataset with client annotations, one of them annotated again
+    WHEN the annotations are searched with filters on the labels, the annotator
+    and the comments, and the results are paged
+    THEN check that only the latest matching annotations are found (unless all the
+    versions are requested), with the page of their segment
+    """
+    login(test_client, "annotator1")
+    dataset = Dataset.query.filter_by(name="Psychotherapy Dataset Test").first()
+    annotate_client(test_client, dataset.id, 1, "positive", "talks about her family")
+    annotate_client(test_client, dataset.id, 2, "hard_negative", "panic at work")
+    annotate_client(test_client, dataset.id, 2, "neutral", "calmer at work")
+    url = url_for("search.search_dataset_annotations", dataset_id=dataset.id)
+
+    def search(**args):
+        response = test_client.get(url, query_string=dict(args, format="json"))
+        assert response.status_code == 200
+        return response.get_json()
+
+    results = search(label_d="hard_negative")
+    assert results["annotations"] == []
+    results = search(label_d="hard_negative", all_versions=1)
+    assert len(results["annotations"]) == 1
+    annotation = results["annotations"][0]
+    assert annotation["page"] == 2
+    assert annotation["comments"]["comment_a"] == "panic at work"
+    assert annotation["annotator"] == "annotator1"
+
+    results = search(q="work")
+    assert [a["comments"]["comment_a"] for a in results["annotations"]] == [
+        "calmer at work"
+    ]
+    assert search(q="family")["annotations"][0]["page"] == 1
+    assert search(q="famil*", label_d="positive")["annotations"][0]["page"] == 1
+    assert search(q="panic")["annotations"] == []
+    annotator1 = User.query.filter_by(username="annotator1").first()
+    admin1 = User.query.filter_by(username="admin1").first()
+    assert len(search(annotator=annotator1.id)["annotations"]) == 2
+    assert search(annotator=admin1.id)["annotations"] == []
+    assert search(speaker="dyad")["annotations"] == []
+
+    # keyset pagination, newest first
+    monkeypatch.setitem(test_client.application.config, "SEARCH_RESULTS_PER_PAGE", 1)
+    pages = [search(all_versions=1)]
+    while pages[-1]["next"]:
+        pages.append(test_client.get(pages[-1]["next"]).get_json())
+    comments = [page["annotations"][0]["comments"]["comment_a"] for page in pages]
+    assert comments == ["calmer at work", "panic at work", "talks about her family"]
+
+    # the search page links to the segments
+    response = test_client.get(url, query_string={"label_d": "neutral"})
+    assert response.status_code == 200
+    assert (
+        url_for("annotate.annotate_ps", dataset_id=dataset.id, page=2).encode()
+        in response.data
+    )
+    # unknown label values and invalid cursors
+    for args in [{"label_d": "unknown"}, {"after": "x"}]:
+        assert test_client.get(url, query_string=args).status_code == 400
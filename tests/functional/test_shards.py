@@ -0,0 +1,226 @@
+"""
+Functional tests for the per-dataset database files (SHARD_DATASETS, see app/shards.py).
+"""
+import os
+import threading
+from flask import url_for
+from app import create_app, db
+from app.models import Dataset, PSDialogEvent, Role, User
+from app.admin.delete import delete_dataset
+from app.database import FORK_ENGINES
+from app.search.utils import search_events
+from app.shards import shard_engine, use_shard
+from config import TestConfig
+import pytest
+
+
+@pytest.fixture(scope="module")
+def flask_app(tmp_path_factory):
+    """Fixture to create a Flask app in sharding mode, backed by a SQLite database file"""
+    directory = tmp_path_factory.mktemp("shards")
+    config = type(
+        "ShardConfig",
+        (TestConfig,),
+        {
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(directory / "app.db"),
+            "SHARD_DATASETS": True,
+            "SHARD_FOLDER": str(directory / "shards"),
+        },
+    )
+    flask_app = create_app(config)
+    with flask_app.app_context():
+        db.create_all()
+        Role.insert_roles()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+def login(test_client, username: str):
+    """Log in to the app"""
+    response = test_client.post(
+        "/auth/login",
+        data={"username": username, "password": username + "password"},
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+
+
+def upload_dataset(test_client, name: str) -> Dataset:
+    """Upload the psychotherapy test file as a dataset (as admin1)"""
+    admin1 = User.query.filter_by(username="admin1").first()
+    path = test_client.application.config["PS_DATASET_PATH"]
+    with open(path, "rb") as handle:
+        response = test_client.post(
+            "/upload/upload_psychotherapy",
+            data={
+                "name": name,
+                "description": "test description",
+                "annotators": admin1.id,
+                "file": (handle, os.path.basename(path)),
+            },
+            follow_redirects=True,
+        )
+    assert b"File uploaded successfully" in response.data
+    use_shard(None)
+    return Dataset.query.filter_by(name=name).one()
+
+
+def count_events(shard: str, id_dataset: int) -> int:
+    """The number of dialog events of a dataset in the database file of a shard"""
+    with shard_engine(shard).connect() as connection:
+        return connection.scalar(
+            db.select(db.func.count())
+            .select_from(PSDialogEvent)
+            .where(PSDialogEvent.id_dataset == id_dataset)
+        )
+
+
+@pytest.mark.order(27)
+def test_upload_to_shard(test_client, insert_users):
+    """
+    GIVEN a Flask application in sharding mode
+    WHEN a psychotherapy dataset is uploaded, then the same file again
+    THEN check that the rows of the dataset are stored in a database file of its own,
+    shared by the second dataset, and that the dataset can be annotated and searched
+    """
+    flask_app = test_client.application
+    login(test_client, "admin1")
+    dataset = upload_dataset(test_client, "sharded_dataset")
+    assert dataset.shard is not None
+    path = os.path.join(flask_app.config["SHARD_FOLDER"], dataset.shard)
+    assert os.path.exists(path)
+    assert count_events(dataset.shard, dataset.id) > 0
+    assert count_events(None, dataset.id) == 0  # not in the main database
+    # its pooled connections are discarded in forked processes (see app/database.py)
+    assert shard_engine(dataset.shard) in FORK_ENGINES
+
+    sharer = upload_dataset(test_client, "sharded_dataset_copy")
+    assert sharer.content_id == dataset.id
+    assert sharer.shard == dataset.shard
+
+    response = test_client.get(
+        url_for("annotate.annotate_ps", dataset_id=sharer.id, page=1)
+    )
+    assert response.status_code == 200
+    response = test_client.get(
+        url_for("search.search_dataset", dataset_id=dataset.id, q="consectetur")
+    )
+    assert response.status_code == 200
+    assert b"<mark>" in response.data
+    response = test_client.get("/index")
+    assert response.status_code == 200
+    assert b"sharded_dataset_copy" in response.data
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_delete_removes_shard(test_client, insert_users):
+    """
+    GIVEN two datasets sharing a shard, and a clone of the first one
+    WHEN they are deleted
+    THEN check that the database file of the shard is deleted with the last of them
+    """
+    flask_app = test_client.application
+    login(test_client, "admin1")
+    dataset = Dataset.query.filter_by(name="sharded_dataset").one()
+    sharer = Dataset.query.filter_by(name="sharded_dataset_copy").one()
+    admin1 = User.query.filter_by(username="admin1").first()
+    response = test_client.post(
+        url_for("admin.clone", dataset_id=dataset.id),
+        data={
+            "name": "sharded_clone",
+            "description": "test description",
+            "annotators": admin1.id,
+        },
+        follow_redirects=True,
+    )
+    assert b"cloned successfully" in response.data
+    use_shard(None)
+    clone = Dataset.query.filter_by(name="sharded_clone").one()
+    assert clone.shard == dataset.shard
+    assert count_events(clone.shard, clone.id) == count_events(
+        dataset.shard, dataset.id
+    )
+    use_shard(clone.shard)
+    assert search_events(clone.id, "consectetur")[1] > 0
+
+    path = os.path.join(flask_app.config["SHARD_FOLDER"], dataset.shard)
+    for id_dataset in [sharer.id, dataset.id]:
+        delete_dataset(id_dataset)
+        assert os.path.exists(path)
+    response = test_client.post(
+        url_for("admin.delete", dataset_id=clone.id), follow_redirects=True
+    )
+    assert b"being deleted" in response.data
+    for thread in threading.enumerate():
+        if thread.name.startswith("background-"):
+            thread.join()  # the deletion runs in the background
+    assert not os.path.exists(path)
+    use_shard(None)
+    assert Dataset.query.count() == 0
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_parallel_writers(test_client, insert_users):
+    """
+    GIVEN a Flask application in sharding and single-writer mode
+    WHEN psychotherapy datasets are uploaded concurrently
+    THEN check that each one is stored in its own shard
+    """
+    flask_app = test_client.application
+    flask_app.config["SINGLE_WRITER"] = True
+    try:
+        names = ["parallel_{}".format(i) for i in range(3)]
+        errors = []
+
+        def upload(name):
+            with flask_app.test_client() as client:
+                try:
+                    login(client, "admin1")
+                    upload_dataset(client, name)
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=upload, args=(name,)) for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        use_shard(None)
+        db.session.expire_all()
+        datasets = Dataset.query.filter(Dataset.name.in_(names)).all()
+        assert len({dataset.shard for dataset in datasets}) == len(names)
+        for dataset in datasets:
+            assert count_events(dataset.shard, dataset.id) > 0
+    finally:
+        flask_app.config["SINGLE_WRITER"] = False
+
+
+def test_vacuum_and_backup_commands(test_client, insert_users, tmp_path):
+    """
+    GIVEN a Flask application in sharding mode, with datasets in their own shards
+    WHEN the `flask vacuum` and `flask backup` commands are run
+    THEN check that the main database file and the shards are vacuumed, and copied
+    """
+    from annotations_interface import backup, vacuum
+
+    dataset = Dataset.query.filter_by(name="parallel_0").one()
+    runner = test_client.application.test_cli_runner(mix_stderr=False)
+    result = runner.invoke(vacuum, [])
+    assert result.exit_code == 0, result.output
+    assert dataset.shard in result.output
+    assert "app.db" in result.output
+
+    result = runner.invoke(backup, [str(tmp_path), str(dataset.id)])
+    assert result.exit_code == 0, result.output
+    assert os.listdir(tmp_path) == [dataset.shard]
+    copy = db.create_engine("sqlite:///" + str(tmp_path / dataset.shard))
+    with copy.connect() as connection:
+        assert connection.scalar(
+            db.select(db.func.count())
+            .select_from(PSDialogEvent)
+            .where(PSDialogEvent.id_dataset == dataset.id)
+        ) == count_events(dataset.shard, dataset.id)
+    copy.dispose()
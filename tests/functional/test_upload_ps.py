@@ -2,8 +2,12 @@
 Functional tests for the upload (`upload`) blueprint.
 Psychotherapy session dataset upload page.
 """
-from app.models import User, Dataset, PSDialogTurn, PSDialogEvent
+from app.models import User, Dataset, DatasetStats, PSDialogTurn, PSDialogEvent
+from app.search.utils import search_events
+from app.upload.parsers import read_pickle
+from app.upload.storage import get_file_path, hash_file
 from bs4 import BeautifulSoup
+from flask import url_for
 import os
 import pytest
 
@@ -103,6 +107,7 @@ def test_upload_psychotherapy_valid_dataset(test_client, insert_users):
     assert dataset.id_author == admin1.id
     assert dataset.annotators.all() == [admin1, annotator1]
     assert dataset.type.value == "Psychotherapy Session"
+    assert dataset.n_segments > 0  # for the annotation progress
 
     dialog_turns = PSDialogTurn.query.filter_by(id_dataset=dataset.id).all()
     assert dialog_turns
@@ -112,6 +117,110 @@ def test_upload_psychotherapy_valid_dataset(test_client, insert_users):
     assert dialog_events[0].id_dataset == dataset.id
 
 
+def upload_psychotherapy(test_client, name: str, path: str, filename: str = None):
+    """Upload a psychotherapy dataset file, logged in as admin1"""
+    with open(path, "rb") as handle:
+        return test_client.post(
+            "/upload/upload_psychotherapy",
+            data={
+                "name": name,
+                "description": "test description",
+                "annotators": User.query.filter_by(username="admin1").first().id,
+                "file": (handle, filename or os.path.basename(path)),
+            },
+            follow_redirects=True,
+        )
+
+
+def test_upload_psychotherapy_duplicate_dataset(test_client, insert_users):
+    """
+    GIVEN a psychotherapy dataset uploaded already
+    WHEN the '/upload_psychotherapy' page is requested (POST) with an identical file
+    THEN check that the file is stored once, under its SHA-256, and that the new
+    dataset shares the dialog turns and events of the first one instead of adding
+    them again, with the same statistics, annotation pages and search results
+    """
+    response = test_client.post(
+        "/auth/login",
+        data={"username": "admin1", "password": "admin1password"},
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+    path = test_client.application.config["PS_DATASET_PATH"]
+    source = Dataset.query.filter_by(name="test_dataset").one()
+    n_dialog_turns = PSDialogTurn.query.count()
+
+    response = upload_psychotherapy(test_client, "test_dataset_copy", path)
+    assert b"File uploaded successfully" in response.data
+    dataset = Dataset.query.filter_by(name="test_dataset_copy").one()
+    assert dataset.file_sha256 == source.file_sha256 == hash_file(path)
+    assert os.path.exists(get_file_path(dataset.file_sha256, path))
+    assert dataset.id_content == source.id
+    assert dataset.content_id == source.id
+    assert PSDialogTurn.query.count() == n_dialog_turns  # nothing added
+    assert PSDialogTurn.query.filter_by(id_dataset=dataset.id).count() == 0
+    assert dataset.n_segments == source.n_segments
+    stats = DatasetStats.query.get(dataset.id)
+    assert stats.n_dialog_events == DatasetStats.query.get(source.id).n_dialog_events
+    assert (
+        stats.n_dialog_events
+        == PSDialogEvent.query.filter_by(id_dataset=source.id).count()
+    )
+    assert search_events(dataset.content_id, "etincidunt")[1] > 0
+
+    # the annotation pages show the shared dialog turns
+    response = test_client.get(
+        url_for("annotate.annotate_ps", dataset_id=dataset.id, page=1)
+    )
+    assert response.status_code == 200
+    assert response.data.count(b"list-group-item") == test_client.get(
+        url_for("annotate.annotate_ps", dataset_id=source.id, page=1)
+    ).data.count(b"list-group-item")
+    response = test_client.get("/auth/logout", follow_redirects=True)
+    assert response.status_code == 200
+
+
+def test_upload_psychotherapy_duplicate_rejected(test_client, insert_users, tmp_path):
+    """
+    GIVEN a Flask application configured to reject the uploads of identical files
+    WHEN the '/upload_psychotherapy' page is requested (POST) with a file identical to
+    the file of a dataset, then with a different file with the same name
+    THEN check that the identical file is rejected, naming the existing dataset,
+    and that the different file is uploaded, without overwriting the first file
+    """
+    response = test_client.post(
+        "/auth/login",
+        data={"username": "admin1", "password": "admin1password"},
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+    app_config = test_client.application.config
+    app_config["DUPLICATE_UPLOADS"] = "reject"
+    path = app_config["PS_DATASET_PATH"]
+    n_datasets = Dataset.query.count()
+    try:
+        response = upload_psychotherapy(test_client, "rejected_dataset", path)
+        assert b"This file was uploaded already" in response.data
+        assert b"test_dataset" in response.data
+        assert Dataset.query.count() == n_datasets
+
+        # a different file with the same name
+        df = read_pickle(path)
+        other_path = tmp_path / os.path.basename(path)
+        df.head(len(df) // 2).to_pickle(other_path)
+        response = upload_psychotherapy(test_client, "half_dataset", other_path)
+        assert b"File uploaded successfully" in response.data
+    finally:
+        app_config["DUPLICATE_UPLOADS"] = "share"
+    dataset = Dataset.query.filter_by(name="half_dataset").one()
+    assert dataset.id_content is None
+    assert PSDialogTurn.query.filter_by(id_dataset=dataset.id).count() > 0
+    assert hash_file(get_file_path(hash_file(path), path)) == hash_file(path)
+    assert hash_file(get_file_path(dataset.file_sha256, path)) == dataset.file_sha256
+    response = test_client.get("/auth/logout", follow_redirects=True)
+    assert response.status_code == 200
+
+
 def test_upload_psychotherapy_invalid_dataset(test_client, insert_users):
     """
     GIVEN a Flask application configured for testing
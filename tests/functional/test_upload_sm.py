@@ -85,6 +85,12 @@ def test_upload_sm_valid_dataset(test_client, insert_users):
     assert response.status_code == 200
     assert b"File uploaded successfully" in response.data
 
+    # check the dataset statistics are shown on the upload page and the index page
+    response = test_client.get("/upload/upload_sm")
+    assert b"43 posts, 92 replies" in response.data
+    response = test_client.get("/index")
+    assert b"43 posts, 92 replies" in response.data
+
     # log out
     response = test_client.get("/auth/logout", follow_redirects=True)
     assert response.status_code == 200
@@ -0,0 +1,335 @@
+"""
+Functional tests for the upload of a new version of a psychotherapy dataset
+(only the dialog turns and events which changed are written).
+"""
+import os
+import re
+import time as clock
+from datetime import time
+import pandas as pd
+from flask import url_for
+from bs4 import BeautifulSoup
+from sqlalchemy import event
+from app import db
+from app.agreement import agreement_report
+from app.export.exporters import annotation_chunks, export_watermark
+from app.models import (
+    Dataset,
+    DatasetStats,
+    EvidenceDyad,
+    PSAnnotationClient,
+    PSAnnotationDyad,
+    PSDialogEvent,
+    PSDialogTurn,
+    User,
+)
+from app.search.utils import search_events
+from app.upload.diff import apply_psychotherapy_diff
+from app.utils import SubLabelsADyad
+from app.upload.parsers import read_pickle
+from tests.functional.utils import create_segment_level_annotation_dyad
+import pytest
+
+
+def login(test_client, username: str):
+    """Log in to the app"""
+    response = test_client.post(
+        "/auth/login",
+        data={"username": username, "password": username + "password"},
+        follow_redirects=True,
+    )
+    assert response.status_code == 200
+
+
+def upload(test_client, url: str, path: str, data: dict = None):
+    """Upload a file to an upload page"""
+    with open(path, "rb") as handle:
+        return test_client.post(
+            url,
+            data=dict(data or {}, file=(handle, os.path.basename(path))),
+            follow_redirects=True,
+        )
+
+
+@pytest.mark.order(23)
+def test_upload_psychotherapy_version(test_client, insert_users, tmp_path):
+    """
+    GIVEN a psychotherapy dataset with an annotation of its first page
+    WHEN a new version of its file is uploaded, with a typo fixed in a dialog event,
+    the timestamp of a dialog turn changed and a new dialog turn at the end
+    THEN check that only these rows are written, that the other rows, the annotation
+    links and the evidence are kept, and that the statistics, the search index
+    and the version of the dataset are updated
+    """
+    login(test_client, "admin1")
+    path = test_client.application.config["PS_DATASET_PATH"]
+    admin1 = User.query.filter_by(username="admin1").first()
+    response = upload(
+        test_client,
+        "/upload/upload_psychotherapy",
+        path,
+        {
+            "name": "versioned_dataset",
+            "description": "test description",
+            "annotators": admin1.id,
+        },
+    )
+    assert b"File uploaded successfully" in response.data
+    dataset = Dataset.query.filter_by(name="versioned_dataset").one()
+    assert dataset.version == 1
+    url = url_for("annotate.annotate_ps", dataset_id=dataset.id, page=1)
+    soup = BeautifulSoup(test_client.get(url).data, "html.parser")
+    response = test_client.post(
+        url, data=create_segment_level_annotation_dyad(soup)[0], follow_redirects=True
+    )
+    assert b"Your annotations have been saved" in response.data
+    n_links = PSAnnotationDyad.query.filter(
+        PSAnnotationDyad.id_first_dialog_turn.is_not(None)
+    ).count()
+    n_evidence = EvidenceDyad.query.count()
+    assert n_links > 0 and n_evidence > 0
+    turn_ids = [
+        turn.id
+        for turn in PSDialogTurn.query.filter_by(id_dataset=dataset.id).order_by(
+            PSDialogTurn.id
+        )
+    ]
+    event_ids = [
+        dialog_event.id
+        for dialog_event in PSDialogEvent.query.filter_by(
+            id_dataset=dataset.id
+        ).order_by(PSDialogEvent.id)
+    ]
+
+    # the new version of the file
+    df = read_pickle(path)
+    df.loc[1, "event_plaintext"] = "Etincidunt ut consectetur adipisci transcribed."
+    df.loc[2, "event_plaintext"] = "0 0 : 0 6 : 5 3"  # timestamp of the 2nd dialog turn
+    last = df.iloc[-1]
+    df = pd.concat(
+        [
+            df,
+            pd.DataFrame(
+                [
+                    dict(
+                        last,
+                        dialog_turn_main_speaker="Timestamp",
+                        event_speaker="Timestamp",
+                        event_plaintext="0 5 : 0 0 : 0 0",
+                    ),
+                    dict(
+                        last,
+                        dialog_turn_main_speaker="Client",
+                        event_speaker="Client",
+                        event_plaintext="A new dialog event.",
+                    ),
+                ]
+            ),
+        ],
+        ignore_index=True,
+    )
+    new_path = tmp_path / "session_v2.pickle"
+    df.to_pickle(new_path)
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        response = upload(
+            test_client,
+            url_for("upload.upload_psychotherapy_version", dataset_id=dataset.id),
+            new_path,
+        )
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    assert (
+        b"dialog turns: 1 inserted, 1 updated, 0 deleted; "
+        b"dialog events: 1 inserted, 1 updated, 0 deleted" in response.data
+    )
+    # the changed rows are written with one statement per table, and nothing else
+    writes = [
+        statement
+        for statement in statements
+        if re.match(
+            r"(INSERT INTO|UPDATE|DELETE FROM) (ps_dialog_turn|ps_dialog_event)\b",
+            statement,
+        )
+    ]
+    assert len(writes) == 4
+
+    db.session.expire_all()
+    dataset = db.session.get(Dataset, dataset.id)
+    assert dataset.version == 2
+    new_turn_ids = [
+        turn.id
+        for turn in PSDialogTurn.query.filter_by(id_dataset=dataset.id).order_by(
+            PSDialogTurn.id
+        )
+    ]
+    assert new_turn_ids[:-1] == turn_ids
+    new_event_ids = [
+        dialog_event.id
+        for dialog_event in PSDialogEvent.query.filter_by(
+            id_dataset=dataset.id
+        ).order_by(PSDialogEvent.id)
+    ]
+    assert new_event_ids[:-1] == event_ids
+    assert db.session.get(PSDialogEvent, event_ids[0]).event_plaintext.endswith(
+        "transcribed."
+    )
+    assert db.session.get(PSDialogTurn, turn_ids[1]).timestamp.second == 53
+    assert (
+        PSAnnotationDyad.query.filter(
+            PSAnnotationDyad.id_first_dialog_turn.is_not(None)
+        ).count()
+        == n_links
+    )
+    assert EvidenceDyad.query.count() == n_evidence
+    stats = db.session.get(DatasetStats, dataset.id)
+    assert stats.n_dialog_turns == len(turn_ids) + 1
+    assert stats.n_dialog_events == len(event_ids) + 1
+    assert search_events(dataset.id, "transcribed")[1] == 1
+    assert search_events(dataset.id, "dialog event")[1] == 1
+
+    # the same file again
+    response = upload(
+        test_client,
+        url_for("upload.upload_psychotherapy_version", dataset_id=dataset.id),
+        new_path,
+    )
+    assert b"identical to the current version" in response.data
+    assert db.session.get(Dataset, dataset.id).version == 2
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_upload_psychotherapy_version_forbidden(test_client, insert_users):
+    """
+    GIVEN a psychotherapy dataset uploaded by admin1
+    WHEN annotator1 requests the page to upload a new version of it (GET)
+    THEN check that it is forbidden
+    """
+    login(test_client, "annotator1")
+    dataset = Dataset.query.filter_by(name="versioned_dataset").one()
+    response = test_client.get(
+        url_for("upload.upload_psychotherapy_version", dataset_id=dataset.id)
+    )
+    assert response.status_code == 403
+    test_client.get("/auth/logout", follow_redirects=True)
+
+
+def test_delete_first_dialog_turn_of_segment(db_session, insert_users):
+    """
+    GIVEN a psychotherapy dataset with two segments (pages), each annotated
+    WHEN a new version deletes the first dialog turn of the first segment, and the
+    only dialog turn of the second segment
+    THEN check that the annotation of the first segment is linked to the new first
+    dialog turn of its segment, and that only the annotation of the second segment,
+    whose segment is gone, loses its link
+    """
+    admin1 = User.query.filter_by(username="admin1").first()
+    dataset = Dataset(name="segment relink test")
+    dialog_turns = [
+        PSDialogTurn(
+            c_code="ab1234",
+            timestamp=timestamp,
+            main_speaker="Client",
+            session_n=1,
+            dialog_turn_n=n,
+            dataset=dataset,
+        )
+        for n, timestamp in enumerate([time(0, 0, 0), time(0, 2, 0), time(0, 6, 0)])
+    ]
+    first_segment = PSAnnotationClient(
+        author=admin1, dataset=dataset, first_dialog_turn=dialog_turns[0]
+    )
+    second_segment = PSAnnotationDyad(
+        author=admin1, dataset=dataset, first_dialog_turn=dialog_turns[2]
+    )
+    db_session.add_all(dialog_turns + [dataset, first_segment, second_segment])
+    db_session.commit()
+    diff = {
+        "turns": ([], [], [dialog_turns[0].id, dialog_turns[2].id]),
+        "events": ([], [], []),
+        "turn_ids": {},
+    }
+    rows = {"dialog_turns": [], "dialog_events": [], "stats": {}}
+    changes = apply_psychotherapy_diff(diff, rows, dataset)
+    db_session.commit()
+    assert changes["links"] == 1
+    db_session.expire_all()
+    assert first_segment.id_first_dialog_turn == dialog_turns[1].id
+    assert second_segment.id_first_dialog_turn is None
+
+
+def test_relinked_annotations_are_changed(db_session, insert_users):
+    """
+    GIVEN a psychotherapy dataset with three segments (pages), each annotated by two
+    annotators, its agreement report and an incremental export
+    WHEN a new version deletes the first dialog turn of the first segment, and the
+    only dialog turn of the second segment
+    THEN check that the agreement report is computed again without the second segment,
+    and that the next incremental export has the annotations of the first two segments
+    again, with their new segments, but not the annotations of the third segment
+    """
+    annotators = [
+        User.query.filter_by(username=username).first()
+        for username in ["admin1", "annotator1"]
+    ]
+    dataset = Dataset(name="segment relink changes test")
+    dialog_turns = [
+        PSDialogTurn(
+            c_code="ab1234",
+            timestamp=timestamp,
+            main_speaker="Client",
+            session_n=1,
+            dialog_turn_n=n,
+            dataset=dataset,
+        )
+        for n, timestamp in enumerate(
+            [time(0, 0, 0), time(0, 2, 0), time(0, 6, 0), time(0, 12, 0)]
+        )
+    ]
+    annotations = [
+        PSAnnotationDyad(
+            author=annotator,
+            dataset=dataset,
+            first_dialog_turn=dialog_turn,
+            label_a=SubLabelsADyad.tasks_goals,
+        )
+        for dialog_turn in [dialog_turns[0], dialog_turns[2], dialog_turns[3]]
+        for annotator in annotators
+    ]
+    db_session.add_all(dialog_turns + [dataset] + annotations)
+    db_session.commit()
+    assert agreement_report(dataset.id)["dyad"]["n_segments"] == 3
+    clock.sleep(0.01)
+    watermark = export_watermark(0)  # of an incremental export before the new version
+    clock.sleep(0.01)
+
+    diff = {
+        "turns": ([], [], [dialog_turns[0].id, dialog_turns[2].id]),
+        "events": ([], [], []),
+        "turn_ids": {},
+    }
+    rows = {"dialog_turns": [], "dialog_events": [], "stats": {}}
+    changes = apply_psychotherapy_diff(diff, rows, dataset)
+    db_session.commit()
+    assert changes["links"] == 2
+    db_session.expire_all()
+    assert agreement_report(dataset.id)["dyad"]["n_segments"] == 2
+    exported = {
+        row["id"]: row
+        for rows in annotation_chunks(
+            dataset.id, since=watermark, until=export_watermark(0)
+        )
+        for row in rows
+    }
+    assert set(exported) == {annotation.id for annotation in annotations[:4]}
+    for annotation in annotations[:2]:
+        assert exported[annotation.id]["dialog_turn_ids"] == [dialog_turns[1].id]
+    for annotation in annotations[2:4]:
+        assert exported[annotation.id]["dialog_turn_ids"] == []
@@ -0,0 +1,101 @@
+"""
+Unit tests for the inter-annotator agreement metrics.
+The expected values are the published results for the example data.
+"""
+import numpy as np
+from app.agreement import (
+    krippendorff_alpha,
+    fleiss_kappa,
+    cohen_kappa,
+    evidence_jaccard,
+    encode,
+)
+import pytest
+
+
+@pytest.mark.order(18)
+def test_krippendorff_alpha():
+    """
+    GIVEN the reliability data of Krippendorff (2011), 4 coders and 12 units with missing values
+    WHEN Krippendorff's alpha is computed
+    THEN check that it is 0.743 for nominal data and 0.815 for ordinal data
+    """
+    data = [
+        [0, 1, 2, 2, 1, 0, 3, 0, 1, -1, -1, -1],
+        [0, 1, 2, 2, 1, 1, 3, 0, 1, 4, -1, 2],
+        [-1, 2, 2, 2, 1, 2, 3, 1, 1, 4, 0, -1],
+        [0, 1, 2, 2, 1, 3, 3, 0, 1, 4, 0, -1],
+    ]
+    ratings = np.array(data).T
+    assert krippendorff_alpha(ratings, 5) == pytest.approx(0.743, abs=1e-3)
+    assert krippendorff_alpha(ratings, 5, "ordinal") == pytest.approx(0.815, abs=1e-3)
+    assert np.isnan(krippendorff_alpha(np.zeros((3, 2), dtype=int), 5))
+
+
+def test_fleiss_kappa():
+    """
+    GIVEN the example of Fleiss (1971) as given on Wikipedia, 14 raters and 10 subjects
+    WHEN Fleiss' kappa is computed
+    THEN check that it is 0.210
+    """
+    counts = [
+        [0, 0, 0, 0, 14],
+        [0, 2, 6, 4, 2],
+        [0, 0, 3, 5, 6],
+        [0, 3, 9, 2, 0],
+        [2, 2, 8, 1, 1],
+        [7, 7, 0, 0, 0],
+        [3, 2, 6, 3, 0],
+        [2, 5, 3, 2, 2],
+        [6, 5, 2, 1, 0],
+        [0, 2, 2, 3, 7],
+    ]
+    ratings = np.array([np.repeat(np.arange(5), row) for row in counts])
+    assert fleiss_kappa(ratings, 5) == pytest.approx(0.210, abs=1e-3)
+
+
+def test_cohen_kappa():
+    """
+    GIVEN two annotators agreeing on 35 out of 50 yes/no ratings
+    WHEN Cohen's kappa is computed
+    THEN check that it is 0.4, and that units rated by one annotator only are ignored
+    """
+    ratings = np.array([[0, 0]] * 20 + [[0, 1]] * 5 + [[1, 0]] * 10 + [[1, 1]] * 15)
+    assert cohen_kappa(ratings, 2) == pytest.approx(0.4)
+    ratings = np.vstack([ratings, [[0, -1]] * 10])
+    assert cohen_kappa(ratings, 2) == pytest.approx(0.4)
+
+
+def test_evidence_jaccard():
+    """
+    GIVEN the evidence marked by two annotators on two segments
+    WHEN the evidence Jaccard index is computed
+    THEN check that it is averaged over the segments where some evidence was marked
+    """
+    evidence = np.array(
+        [
+            [1, 1, 0, 0],  # annotator 1, segment 1
+            [0, 1, 1, 0],  # annotator 2, segment 1
+            [0, 0, 0, 1],  # annotator 1, segment 2
+            [0, 0, 0, 1],  # annotator 2, segment 2
+            [0, 0, 0, 0],  # annotator 1, segment 3
+            [0, 0, 0, 0],  # annotator 2, segment 3
+        ],
+        dtype=bool,
+    )
+    annotations = np.array([[0, 1], [2, 3], [4, 5], [-1, 5]])
+    jaccard, n_pairs = evidence_jaccard(evidence, annotations)
+    assert n_pairs == 2
+    assert jaccard == pytest.approx((1 / 3 + 1) / 2)
+
+
+def test_encode():
+    """
+    GIVEN an array of stored label codes, with missing and unknown codes
+    WHEN they are converted to the positions of their categories
+    THEN check that the positions follow the order of the categories, and are -1 if
+    missing
+    """
+    values = np.array([3, None, 1, 9, 2], dtype=object)
+    codes = encode(values, [1, 3, 2])
+    assert codes.tolist() == [1, -1, 0, -1, 2]
@@ -1,9 +1,36 @@
 """
 Unit tests for the utilities module in the annotate blueprint.
 """
-from datetime import time
-from app.models import PSDialogTurn, PSDialogEvent
-from app.annotate.utils import split_dialog_turns, get_events_from_segments
+import dataclasses
+import pickle
+from datetime import datetime, time
+from types import MappingProxyType
+from sqlalchemy import event
+from app import db
+from app.models import (
+    Dataset,
+    PSAnnotatedSegment,
+    PSAnnotationProgress,
+    PSDialogTurn,
+    PSDialogEvent,
+    User,
+)
+from app.annotate.forms import (
+    ANNOTATION_FORMS,
+    PSAnnotationFormClient,
+    enum_choices,
+)
+from app.annotate.projections import AnnotationValues
+from app.annotate.schema import ANNOTATION_SCHEMA, EVIDENCE_FIELDS
+from app.annotate.utils import (
+    annotation_form_data,
+    assign_dynamic_choices,
+    segments_by_dialog_turn,
+    split_dialog_turns,
+    update_annotation_progress,
+    get_events_from_segments,
+)
+from app.utils import LabelNamesClient, Speaker, SubLabelsAClient
 import pytest
 
 
@@ -88,3 +115,139 @@ def test_get_events_from_segments(insert_ps_dialog_turns):
     # check that that all events in a given segment are instances of the PSDialogEvent class
     for segment in events:
         assert all(isinstance(event, PSDialogEvent) for event in segment)
+
+
+def test_segments_by_dialog_turn(insert_ps_dialog_turns):
+    """
+    GIVEN the dialog turns of a psychotherapy dataset
+    WHEN the dialog turns of the segment of each dialog turn are looked up
+    THEN check that they are the segments of split_dialog_turns, so that an annotation
+    referencing the first dialog turn of a segment gets all its dialog turns
+    """
+    dialog_turns = PSDialogTurn.query.order_by(PSDialogTurn.timestamp).all()
+    segments = segments_by_dialog_turn(dialog_turns[0].id_dataset, time_interval=300)
+    assert len(segments) == len(dialog_turns)
+    for segment in split_dialog_turns(dialog_turns, time_interval=300):
+        ids = tuple(dialog_turn.id for dialog_turn in segment)
+        assert all(segments[id_dialog_turn] == ids for id_dialog_turn in ids)
+    assert segments_by_dialog_turn(12345) == {}
+
+
+def test_update_annotation_progress(db_session, insert_users, insert_datasets):
+    """
+    GIVEN a psychotherapy dataset
+    WHEN a segment is annotated twice in the same transaction (as two concurrent saves
+    would, neither seeing the rows of the other), then the segment before it
+    THEN check that the rows are inserted without conflict (ON CONFLICT DO NOTHING),
+    that the segment is counted once, and that the next page is updated
+    """
+    dataset = Dataset.query.filter_by(name="Psychotherapy Dataset Test").first()
+    user = User.query.filter_by(username="admin1").first()
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        update_annotation_progress(dataset, user, Speaker.therapist, 2)
+        update_annotation_progress(dataset, user, Speaker.therapist, 2)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert sum("ON CONFLICT DO NOTHING" in statement for statement in statements) == 3
+    update_annotation_progress(dataset, user, Speaker.therapist, 1)
+    db_session.commit()
+    progress = PSAnnotationProgress.query.filter_by(
+        id_dataset=dataset.id, id_user=user.id, speaker=Speaker.therapist
+    ).one()
+    assert progress.n_segments_annotated == 2
+    assert progress.next_page == 3
+    assert (
+        PSAnnotatedSegment.query.filter_by(
+            id_dataset=dataset.id, id_user=user.id, speaker=Speaker.therapist
+        ).count()
+        == 2
+    )
+
+
+def test_annotation_values_form_data():
+    """
+    GIVEN the read-only values of a client annotation, with evidence for labels A and F
+    WHEN the data of its form is built
+    THEN check that the values cannot be changed, and that the evidence of label F is
+    given as its first and last events
+    """
+    values = AnnotationValues(
+        id=1,
+        timestamp=datetime(2023, 1, 1),
+        fields=MappingProxyType({"label_a": "identity", "comment_a": "a comment"}),
+        evidence=MappingProxyType({"label_a": (3, 4), "label_f": (5, 6, 7)}),
+    )
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        values.id = 2
+    with pytest.raises(TypeError):
+        values.fields["label_a"] = "security"
+    assert values.form_data() == {
+        "label_a": "identity",
+        "comment_a": "a comment",
+        "relevant_events_a": [3, 4],
+        "start_event_f": 5,
+        "end_event_f": 7,
+    }
+
+
+def test_annotation_forms_from_schema(flask_app):
+    """
+    GIVEN the annotation forms compiled from the annotation schema
+    WHEN a client form is created and the events of a page are assigned to it
+    THEN check the names, labels, choices and defaults of its fields, that the choices
+    of the select fields are built once, and that only the evidence fields
+    get the events of the speaker
+    """
+    assert EVIDENCE_FIELDS[Speaker.client][-2:] == ("start_event_f", "end_event_f")
+    assert EVIDENCE_FIELDS[Speaker.dyad] == ("relevant_events_a", "relevant_events_b")
+    events = [
+        PSDialogEvent(id=1, event_n=1, event_speaker="Client"),
+        PSDialogEvent(id=2, event_n=2, event_speaker="Therapist"),
+    ]
+    with flask_app.test_request_context():
+        for speaker, schema in ANNOTATION_SCHEMA.items():
+            form = ANNOTATION_FORMS[speaker]()
+            assert ("submit" in form._fields) == schema.submit
+            for name, field in form._fields.items():
+                if name == "submit":
+                    continue
+                assert field.name == name + "_" + speaker.name  # HTML name
+        form = assign_dynamic_choices(PSAnnotationFormClient(), events, Speaker.client)
+    assert form.label_a.label.text == LabelNamesClient.label_a.value
+    # the choices of the field classes are built once for each Enum
+    assert PSAnnotationFormClient.label_a.kwargs["choices"] is enum_choices(
+        SubLabelsAClient
+    )
+    assert form.label_a.choices[0] == (
+        SubLabelsAClient.attachment.name,
+        SubLabelsAClient.attachment.value,
+    )
+    assert form.label_f.data == form.strength_f.data == "no_change"
+    assert form.comment_f.validators[0].__class__.__name__ == "Length"
+    for name in EVIDENCE_FIELDS[Speaker.client]:
+        assert form[name].choices == [(1, 1)]
+
+
+def test_annotation_form_data(flask_app):
+    """
+    GIVEN a client annotation form with a label and evidence
+    WHEN its data is read to be passed to the write job saving the annotation
+    THEN check that it has the value of each label, strength, comment and evidence
+    field by name, as plain values which can be pickled, without the submit button
+    """
+    with flask_app.test_request_context():
+        form = PSAnnotationFormClient(
+            data={"label_a": "identity", "relevant_events_a": [3, 4]}
+        )
+        data = annotation_form_data(form)
+    assert set(data) == set(form._fields) - {"submit", "csrf_token"}
+    assert data["label_a"] == "identity"
+    assert data["relevant_events_a"] == [3, 4]
+    assert set(EVIDENCE_FIELDS[Speaker.client]) < set(data)
+    assert pickle.loads(pickle.dumps(data)) == data
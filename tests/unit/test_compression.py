@@ -0,0 +1,86 @@
+"""
+Unit tests for the compression of the texts (see app/compression.py).
+"""
+import sqlite3
+from app.compression import (
+    HEADER_SIZE,
+    build_dictionary,
+    compress_text,
+    decompress_text,
+    dictionary_key,
+    register_sqlite_functions,
+)
+import pytest
+
+TEXTS = [
+    "I have been feeling anxious at work, and I cannot sleep at night.",
+    "When I feel anxious at work I cannot focus on anything.",
+    "How long have you been feeling anxious at work?",
+    "Since my manager asked me to lead the new project, I cannot sleep.",
+    "Okay.",
+]
+
+
+@pytest.mark.order(26)
+def test_compress_text():
+    """
+    GIVEN a dictionary trained on short dialog events
+    WHEN the texts are compressed and decompressed with it
+    THEN check that the long texts are smaller compressed, that the texts too short
+    to compress are kept as they are, and that decompression gives the texts back
+    """
+    dictionary = build_dictionary(TEXTS)
+    assert dictionary and len(dictionary) <= 32 * 1024
+    assert b"anxious at" in dictionary
+    key = dictionary_key(dictionary)
+    compressed = [compress_text(text, dictionary, key) for text in TEXTS]
+    assert isinstance(compressed[0], bytes)
+    assert len(compressed[0]) < len(TEXTS[0].encode())
+    assert compressed[0][1:HEADER_SIZE].hex() == key
+    assert compressed[-1] == "Okay."
+    assert compress_text(None, dictionary) is None
+    texts = [decompress_text(value, {key: dictionary}.get) for value in compressed]
+    assert texts == TEXTS
+
+
+def test_decompress_text_unknown_dictionary():
+    """
+    GIVEN a text compressed with a dictionary the process does not know
+    WHEN it is decompressed
+    THEN check that the dictionary is loaded with load_dictionary, and that an error
+    is raised when it cannot be found
+    """
+    dictionary = b"unknown dictionary: anxious at work, cannot sleep"
+    key = dictionary_key(dictionary)
+    value = compress_text(TEXTS[0], dictionary, key)
+    assert isinstance(value, bytes)
+    with pytest.raises(LookupError):
+        decompress_text(value, lambda key: None)
+    assert decompress_text(value, {key: dictionary}.get) == TEXTS[0]
+    with pytest.raises(ValueError):
+        decompress_text(b"\x00" + value[1:])
+
+
+def test_sqlite_decompress_text():
+    """
+    GIVEN a SQLite connection with the decompress_text function registered
+    WHEN compressed and plain texts are selected through it
+    THEN check that the texts are decompressed, with the dictionary stored in the
+    text_dictionary table
+    """
+    dictionary = build_dictionary(TEXTS[:2]) + b" unique to this test"
+    key = dictionary_key(dictionary)
+    connection = sqlite3.connect(":memory:")
+    register_sqlite_functions(connection)
+    connection.execute("CREATE TABLE text_dictionary (key TEXT PRIMARY KEY, data BLOB)")
+    connection.execute("CREATE TABLE event (text TEXT)")
+    connection.execute("INSERT INTO text_dictionary VALUES (?, ?)", (key, dictionary))
+    connection.executemany(
+        "INSERT INTO event VALUES (?)",
+        [(compress_text(text, dictionary, key),) for text in TEXTS],
+    )
+    texts = [
+        row[0] for row in connection.execute("SELECT decompress_text(text) FROM event")
+    ]
+    assert texts == TEXTS
+    connection.close()
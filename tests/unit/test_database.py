@@ -0,0 +1,221 @@
+"""
+Unit tests for the database engine configuration (SQLite settings and connection pool).
+"""
+import gc
+import os
+import sqlite3
+import threading
+import weakref
+from sqlalchemy import text
+from app import create_app, db
+from app.database import FORK_ENGINES, TimedQueuePool, pool_stats
+from config import TestConfig
+import pytest
+
+
+def create_file_app(tmp_path, pragmas):
+    """Create a Flask app backed by a SQLite database file, with the given SQLite settings"""
+    config = type(
+        "SQLiteFileConfig",
+        (TestConfig,),
+        {
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path / "app.db"),
+            "SQLITE_PRAGMAS": pragmas,
+        },
+    )
+    return create_app(config)
+
+
+def run_load(db_path: str, timeout: float, n_readers: int = 4, n_writes: int = 200):
+    """
+    Load harness: one writer thread commits many small transactions while
+    several reader threads keep read transactions open on the same database file.
+
+    Returns the number of committed writes and the number of "database is locked" errors.
+    """
+    results = {"writes": 0, "errors": 0}
+    done = threading.Event()
+
+    def reader():
+        con = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+        while not done.is_set():
+            try:
+                con.execute("BEGIN")
+                con.execute("SELECT count(*) FROM item").fetchone()
+                con.execute("SELECT max(id) FROM item").fetchone()
+                con.execute("COMMIT")
+            except sqlite3.OperationalError:
+                results["errors"] += 1
+                if con.in_transaction:
+                    con.execute("ROLLBACK")
+        con.close()
+
+    def writer():
+        con = sqlite3.connect(db_path, timeout=timeout)
+        for i in range(n_writes):
+            try:
+                con.execute("INSERT INTO item (name) VALUES (?)", (str(i),))
+                con.commit()
+                results["writes"] += 1
+            except sqlite3.OperationalError:
+                results["errors"] += 1
+                con.rollback()
+        con.close()
+        done.set()
+
+    readers = [threading.Thread(target=reader) for _ in range(n_readers)]
+    for thread in readers:
+        thread.start()
+    writer()
+    for thread in readers:
+        thread.join()
+    return results["writes"], results["errors"]
+
+
+@pytest.mark.order(12)
+def test_sqlite_pragmas_are_applied(tmp_path):
+    """
+    GIVEN a Flask application backed by a SQLite database file
+    WHEN a new connection is opened
+    THEN check that the SQLite settings in SQLITE_PRAGMAS are applied to it
+    """
+    app = create_file_app(tmp_path, TestConfig.SQLITE_PRAGMAS)
+    with app.app_context():
+        with db.engine.connect() as connection:
+
+            def pragma(name):
+                return connection.execute(text(f"PRAGMA {name}")).scalar()
+
+            assert pragma("journal_mode").lower() == "wal"
+            assert pragma("synchronous") == 1  # NORMAL
+            assert pragma("busy_timeout") == TestConfig.SQLITE_PRAGMAS["busy_timeout"]
+            assert pragma("cache_size") == TestConfig.SQLITE_PRAGMAS["cache_size"]
+            assert pragma("temp_store") == 2  # MEMORY
+        db.engine.dispose()
+
+
+def test_sqlite_pragmas_disabled(tmp_path):
+    """
+    GIVEN a Flask application with SQLITE_PRAGMAS set to None
+    WHEN a new connection is opened
+    THEN check that the SQLite defaults are used
+    """
+    app = create_file_app(tmp_path, None)
+    with app.app_context():
+        with db.engine.connect() as connection:
+            journal_mode = connection.execute(text("PRAGMA journal_mode")).scalar()
+            assert journal_mode.lower() == "delete"
+        db.engine.dispose()
+
+
+def test_writer_not_blocked_by_readers(tmp_path):
+    """
+    GIVEN two SQLite database files, one with the default settings and one with SQLITE_PRAGMAS
+    WHEN a writer commits many transactions while several readers query the database
+    THEN check that all the writes succeed with SQLITE_PRAGMAS (WAL mode),
+    while readers and the writer lock each other out with the default settings
+    """
+    timeout = 0.01  # short lock timeout, so that lock contention shows up as errors
+    db_paths = {}
+    for mode, pragmas in [("default", None), ("tuned", TestConfig.SQLITE_PRAGMAS)]:
+        path = tmp_path / mode
+        path.mkdir()
+        app = create_file_app(path, pragmas)
+        with app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(
+                    text("CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT)")
+                )
+            db.engine.dispose()
+        db_paths[mode] = str(path / "app.db")
+
+    writes, errors = run_load(db_paths["tuned"], timeout)
+    assert writes == 200
+    assert errors == 0
+
+    writes_default, errors_default = run_load(db_paths["default"], timeout)
+    assert errors_default > 0
+    assert writes_default <= writes
+
+
+def test_engine_options_preset(tmp_path):
+    """
+    GIVEN a Flask application backed by a SQLite database file
+    WHEN the engine is created
+    THEN check that the SQLite preset of ENGINE_OPTIONS_PRESETS is used,
+    and that SQLALCHEMY_ENGINE_OPTIONS takes precedence
+    """
+    config = type(
+        "PoolConfig",
+        (TestConfig,),
+        {
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path / "app.db"),
+            "SQLALCHEMY_ENGINE_OPTIONS": {"max_overflow": 3},
+        },
+    )
+    app = create_app(config)
+    with app.app_context():
+        pool = db.engine.pool
+        assert isinstance(pool, TimedQueuePool)
+        assert pool.size() == TestConfig.ENGINE_OPTIONS_PRESETS["sqlite"]["pool_size"]
+        assert pool._max_overflow == 3
+        db.engine.dispose()
+
+
+def test_pool_stats(tmp_path):
+    """
+    GIVEN a Flask application backed by a SQLite database file
+    WHEN connections are checked out from the pool
+    THEN check that the pool statistics report them
+    """
+    app = create_file_app(tmp_path, TestConfig.SQLITE_PRAGMAS)
+    with app.app_context():
+        connections = [db.engine.connect() for _ in range(7)]
+        stats = pool_stats(db.engine)
+        assert stats["pool_class"] == "TimedQueuePool"
+        assert stats["checked_out"] == 7
+        assert stats["overflow"] == 2  # pool size is 5
+        assert stats["checkouts"] == 7
+        assert stats["wait_time_max"] >= stats["wait_time_avg"] > 0
+        for connection in connections:
+            connection.close()
+        stats = pool_stats(db.engine)
+        assert stats["checked_out"] == 0
+        db.engine.dispose()
+
+
+def test_engines_disposed_after_fork(tmp_path):
+    """
+    GIVEN a Flask application with open pooled connections
+    WHEN the process is forked
+    THEN check that the child process starts with an empty connection pool
+    """
+    app = create_file_app(tmp_path, TestConfig.SQLITE_PRAGMAS)
+    with app.app_context():
+        db.engine.connect().close()  # leave one connection in the pool
+        assert db.engine.pool.checkedin() == 1
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # child process
+            os.write(write_end, str(db.engine.pool.checkedin()).encode())
+            os._exit(0)
+        os.waitpid(pid, 0)
+        assert os.read(read_end, 16) == b"0"
+        assert db.engine.pool.checkedin() == 1  # the parent keeps its connection
+        db.engine.dispose()
+
+
+def test_fork_hook_does_not_keep_engines(tmp_path):
+    """
+    GIVEN a Flask application whose engine is disposed after a fork
+    WHEN the application is no longer used
+    THEN check that the fork hook does not keep its engine alive
+    """
+    app = create_file_app(tmp_path, TestConfig.SQLITE_PRAGMAS)
+    with app.app_context():
+        engine = weakref.ref(db.engine)
+    assert engine() in FORK_ENGINES
+    del app
+    gc.collect()
+    gc.collect()  # the objects freed by the callbacks of the first collection
+    assert engine() is None
@@ -235,7 +235,7 @@ def test_new_ps_dialog_turn_annotation_client(
     assert annotation.comment_a == "test comment a"
     assert annotation.comment_b == "test comment b"
     assert annotation.comment_summary == "test comment summary"
-    assert annotation.dialog_turns.first() == new_ps_dialog_turn
+    assert annotation.first_dialog_turn == new_ps_dialog_turn
     assert annotation.author == annotator1
     assert annotation.dataset == dataset
 
@@ -263,7 +263,7 @@ def test_new_ps_dialog_turn_annotation_therapist(
     assert annotation.comment_a == "test comment a"
     assert annotation.comment_b == "test comment b"
     assert annotation.comment_summary == "test comment summary"
-    assert annotation.dialog_turns.first() == new_ps_dialog_turn
+    assert annotation.first_dialog_turn == new_ps_dialog_turn
     assert annotation.author == annotator1
     assert annotation.dataset == dataset
 
@@ -290,7 +290,7 @@ def test_new_ps_dialog_turn_annotation_dyad(
     assert annotation.comment_a == "test comment a"
     assert annotation.comment_b == "test comment b"
     assert annotation.comment_summary == "test comment summary"
-    assert annotation.dialog_turns.first() == new_ps_dialog_turn
+    assert annotation.first_dialog_turn == new_ps_dialog_turn
     assert annotation.author == annotator1
     assert annotation.dataset == dataset
 
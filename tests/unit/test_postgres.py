@@ -0,0 +1,192 @@
+"""
+Unit tests for the PostgreSQL profile.
+These tests run against a throwaway PostgreSQL server started by the `postgres_url` fixture,
+and are skipped if PostgreSQL is not available.
+"""
+from sqlalchemy import text
+from app import create_app, db
+from app.models import (
+    Dataset,
+    PSAnnotationDyad,
+    PSAnnotationProgress,
+    SMPost,
+    SMReply,
+    PSDialogTurn,
+    PSDialogEvent,
+    User,
+)
+from app.annotate.utils import update_annotation_progress
+from app.export.exporters import export_watermark
+from app.utils import DatasetType, Speaker
+from app.upload.parsers import (
+    read_pickle,
+    sm_dict_to_sql,
+    psychotherapy_df_to_sql,
+    use_copy_from,
+)
+from config import TestConfig
+import pytest
+
+
+@pytest.fixture(scope="module")
+def pg_app(postgres_url):
+    """Fixture to create a Flask app backed by the PostgreSQL test server"""
+    config = type(
+        "PostgresConfig", (TestConfig,), {"SQLALCHEMY_DATABASE_URI": postgres_url}
+    )
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+@pytest.mark.order(14)
+def test_engine_options(pg_app):
+    """
+    GIVEN a Flask application configured with a PostgreSQL database
+    WHEN the engine is created
+    THEN check that the connection pool settings of the PostgreSQL preset are used
+    """
+    options = pg_app.config["ENGINE_OPTIONS_PRESETS"]["postgresql"]
+    assert db.engine.pool.size() == options["pool_size"]
+    assert db.engine.pool._max_overflow == options["max_overflow"]
+    assert db.engine.pool._pre_ping is True
+    assert pg_app.extensions["migrate"].configure_args["render_as_batch"] is False
+
+
+def test_native_enums(pg_app):
+    """
+    GIVEN a Flask application configured with a PostgreSQL database
+    WHEN the tables are created
+    THEN check that the other enum columns use native ENUM types, and that the label
+    and strength columns store integer codes (see app/vocabulary.py)
+    """
+    typtype = db.session.execute(
+        text("SELECT typtype FROM pg_type WHERE typname = 'datasettype'")
+    ).scalar()
+    assert typtype == "e"  # enum type
+    data_types = db.session.execute(
+        text(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_name = 'ps_annotation_client' "
+            "AND column_name IN ('label_d', 'strength_d')"
+        )
+    ).all()
+    assert dict(data_types) == {"label_d": "smallint", "strength_d": "smallint"}
+
+
+def test_sm_dict_to_sql_copy(pg_app):
+    """
+    GIVEN a social media dataset and a PostgreSQL database
+    WHEN the dataset is parsed with sm_dict_to_sql
+    THEN check that the posts and replies are loaded with COPY and added correctly
+    """
+    assert use_copy_from()
+    sm_data = read_pickle(pg_app.config["SM_DATASET_PATH"])
+    dataset = Dataset(name="SM Postgres", type=DatasetType.sm_thread)
+    db.session.add(dataset)
+    sm_dict_to_sql(sm_data, dataset)
+    db.session.commit()
+
+    assert SMPost.query.filter_by(id_dataset=dataset.id).count() == 43
+    assert SMReply.query.filter_by(id_dataset=dataset.id).count() == 92
+    post = SMPost.query.filter_by(
+        user_id="746731", timeline_id="746731_1", post_id=9602529, id_dataset=dataset.id
+    ).first()
+    assert (post.mood).lower() == "happy"
+    assert post.replies.count() == 2
+    assert post.date.microsecond == 0
+
+    # new rows added with the ORM do not clash with the ids reserved for COPY
+    db.session.add(SMPost(question="new post", dataset=dataset))
+    db.session.commit()
+
+
+def test_psychotherapy_df_to_sql_copy(pg_app):
+    """
+    GIVEN a psychotherapy dataset and a PostgreSQL database
+    WHEN the dataset is parsed with psychotherapy_df_to_sql
+    THEN check that the dialog events are loaded with COPY and added correctly
+    """
+    df = read_pickle(pg_app.config["PS_DATASET_PATH"])
+    dataset = Dataset(name="PS Postgres", type=DatasetType.psychotherapy)
+    db.session.add(dataset)
+    psychotherapy_df_to_sql(df, dataset)
+    db.session.commit()
+
+    n_timestamps = sum(df["event_speaker"] == "Timestamp")
+    assert PSDialogTurn.query.filter_by(id_dataset=dataset.id).count() == n_timestamps
+    assert (
+        PSDialogEvent.query.filter_by(id_dataset=dataset.id).count()
+        == len(df) - n_timestamps
+    )
+    dialog_turn = PSDialogTurn.query.filter_by(
+        id_dataset=dataset.id, dialog_turn_n=3
+    ).first()
+    dialog_events = dialog_turn.dialog_events.order_by("event_n").all()
+    assert len(dialog_events) == 7
+    assert dialog_events[0].event_speaker == "Client"
+    assert dialog_events[0].event_plaintext == df.loc[14, "event_plaintext"]
+    assert dialog_events[0].event_n == int(df.loc[14, "event_n"]) - 4
+
+
+def test_copy_is_rolled_back(pg_app):
+    """
+    GIVEN a PostgreSQL database
+    WHEN the session is rolled back after a dataset is loaded with COPY
+    THEN check that the rows loaded with COPY are discarded too
+    """
+    df = read_pickle(pg_app.config["PS_DATASET_PATH"])
+    n_events = PSDialogEvent.query.count()
+    dataset = Dataset(name="PS Postgres rollback", type=DatasetType.psychotherapy)
+    db.session.add(dataset)
+    psychotherapy_df_to_sql(df, dataset)
+    db.session.rollback()
+    assert PSDialogEvent.query.count() == n_events
+    assert Dataset.query.filter_by(name="PS Postgres rollback").first() is None
+
+
+def test_update_annotation_progress_on_conflict(pg_app):
+    """
+    GIVEN a PostgreSQL database
+    WHEN the same segment is annotated twice in a transaction
+    THEN check that the progress rows are inserted with ON CONFLICT DO NOTHING,
+    and that the segment is counted once
+    """
+    dataset = Dataset(name="PS Postgres progress", type=DatasetType.psychotherapy)
+    user = User(username="pg_annotator", email="pg_annotator@example.com")
+    db.session.add_all([dataset, user])
+    db.session.flush()
+    update_annotation_progress(dataset, user, Speaker.client, 1)
+    update_annotation_progress(dataset, user, Speaker.client, 1)
+    db.session.commit()
+    progress = PSAnnotationProgress.query.filter_by(
+        id_dataset=dataset.id, id_user=user.id
+    ).one()
+    assert progress.n_segments_annotated == 1
+    assert progress.next_page == 2
+
+
+def test_annotation_modified_time(pg_app):
+    """
+    GIVEN a PostgreSQL database
+    WHEN an annotation is written, then changed
+    THEN check that its modified time is set by the database, in UTC, each time
+    """
+    dataset = Dataset(name="PS Postgres modified", type=DatasetType.psychotherapy)
+    annotation = PSAnnotationDyad(dataset=dataset)
+    db.session.add_all([dataset, annotation])
+    db.session.commit()
+    before = export_watermark(0)
+    assert annotation.timestamp <= annotation.modified <= before
+    db.session.execute(
+        db.update(PSAnnotationDyad)
+        .where(PSAnnotationDyad.id == annotation.id)
+        .values(comment_a="changed")
+    )
+    db.session.commit()
+    db.session.refresh(annotation)
+    assert annotation.modified >= before
@@ -0,0 +1,30 @@
+"""
+Unit tests for the utility functions of the search blueprint.
+"""
+from app.search.utils import fts_query, highlight, MARK_START, MARK_END
+import pytest
+
+
+@pytest.mark.order(20)
+def test_fts_query():
+    """
+    GIVEN search queries typed by users
+    WHEN they are converted to FTS5 queries
+    THEN check that every word or phrase is quoted, so that FTS5 syntax errors cannot happen
+    """
+    assert fts_query("anxious work") == '"anxious" "work"'
+    assert fts_query('"panic attack" family') == '"panic attack" "family"'
+    assert fts_query("anx*") == '"anx"*'
+    assert fts_query('NOT "unbalanced') == '"NOT" "unbalanced"'
+    assert fts_query('a"b OR (c') == '"ab" "OR" "(c"'
+    assert fts_query('" * -- ') == ""
+
+
+def test_highlight():
+    """
+    GIVEN a snippet of a dialog event with matching words between the markers
+    WHEN it is highlighted
+    THEN check that the text is escaped and the matching words are in <mark> tags
+    """
+    snippet = f"a <b>{MARK_START}test{MARK_END}</b> & more"
+    assert highlight(snippet) == "a &lt;b&gt;<mark>test</mark>&lt;/b&gt; &amp; more"
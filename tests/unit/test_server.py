@@ -0,0 +1,56 @@
+"""
+Unit tests for the production server settings (fast worker startup).
+"""
+import subprocess
+import sys
+from app import create_app
+from app.jinja import precompile_templates
+from config import TestConfig
+import pytest
+
+
+@pytest.mark.order(16)
+def test_pandas_not_imported_at_startup():
+    """
+    GIVEN the Flask application module
+    WHEN it is imported in a new Python process
+    THEN check that pandas is not imported (it is only needed to read uploaded datasets)
+    """
+    code = "import sys, annotations_interface; print('pandas' in sys.modules)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    assert output.strip() == "False"
+
+
+def test_precompile_templates():
+    """
+    GIVEN a Flask application
+    WHEN the templates are precompiled
+    THEN check that all the HTML templates are loaded in the template cache
+    """
+    app = create_app(TestConfig)
+    n_templates = precompile_templates(app)
+    assert n_templates > 0
+    assert "index.html" in app.jinja_env.list_templates()
+    assert len(app.jinja_env.cache) == n_templates
+
+
+def test_bytecode_cache(tmp_path):
+    """
+    GIVEN a Flask application with JINJA_BYTECODE_CACHE_DIR set
+    WHEN the templates are precompiled
+    THEN check that the compiled templates are written to the cache directory,
+    and that a new application loads them from there
+    """
+    cache_dir = tmp_path / "jinja"
+    config = type(
+        "BytecodeCacheConfig", (TestConfig,), {"JINJA_BYTECODE_CACHE_DIR": cache_dir}
+    )
+    n_templates = precompile_templates(create_app(config))
+    cache_files = list(cache_dir.iterdir())
+    assert len(cache_files) == n_templates
+    mtimes = {path: path.stat().st_mtime_ns for path in cache_files}
+
+    precompile_templates(create_app(config))  # cached files are reused, not rewritten
+    assert {path: path.stat().st_mtime_ns for path in cache_files} == mtimes
@@ -1,8 +1,23 @@
 """
 Unit tests for the parsers module in the upload blueprint.
 """
-from app.upload.parsers import read_pickle, sm_dict_to_sql, psychotherapy_df_to_sql
-from app.models import Dataset, SMPost, SMReply, PSDialogTurn, PSDialogEvent
+from app.upload.parsers import (
+    read_pickle,
+    sm_dict_to_sql,
+    psychotherapy_df_to_rows,
+    psychotherapy_df_to_sql,
+    compute_dataset_stats,
+)
+from app.upload.diff import diff_psychotherapy_rows
+from app import db
+from app.models import (
+    Dataset,
+    SMPost,
+    SMReply,
+    SMTimeline,
+    PSDialogTurn,
+    PSDialogEvent,
+)
 from datetime import datetime
 import pytest
 
@@ -37,6 +52,58 @@ def test_sm_dict_to_sql(flask_app, db_session, insert_datasets):
     replies = SMReply.query.filter_by(id_sm_post=post.id).all()
     assert len(replies) == 2
 
+    # check the dataset statistics computed while parsing
+    stats = dataset.stats
+    assert stats.n_posts == 43
+    assert stats.n_replies == 92
+    assert stats.n_timelines == sum(len(timelines) for timelines in sm_data.values())
+    authors = set(sm_data) | {
+        str(reply["user"])
+        for timelines in sm_data.values()
+        for posts in timelines.values()
+        for post in posts
+        for reply in post["replies"]
+    }
+    assert stats.n_users == len(authors)
+    assert stats.n_dialog_turns is None
+
+    # check the timelines recorded while parsing
+    def timelines():
+        return [
+            (
+                timeline.user_id,
+                timeline.timeline_id,
+                timeline.first_post_date,
+                timeline.last_post_date,
+                timeline.n_posts,
+                timeline.n_replies,
+            )
+            for timeline in dataset.timelines.order_by(
+                SMTimeline.user_id, SMTimeline.timeline_id
+            )
+        ]
+
+    parsed = timelines()
+    assert len(parsed) == stats.n_timelines
+    assert sum(timeline[4] for timeline in parsed) == 43
+    assert sum(timeline[5] for timeline in parsed) == 92
+    timeline = SMTimeline.query.filter_by(
+        user_id="746731", timeline_id="746731_1", id_dataset=dataset.id
+    ).one()
+    posts = SMPost.query.filter_by(
+        user_id="746731", timeline_id="746731_1", id_dataset=dataset.id
+    )
+    assert timeline.n_posts == 10
+    assert timeline.first_post_date == min(post.date for post in posts)
+    assert timeline.last_post_date == max(post.date for post in posts)
+
+    # the same statistics and timelines are computed from the database
+    computed = compute_dataset_stats(dataset)
+    assert (computed.n_posts, computed.n_replies) == (43, 92)
+    assert computed.n_timelines == stats.n_timelines
+    assert computed.n_users == len(authors)
+    assert timelines() == parsed
+
 
 @pytest.mark.dependency()
 def test_psychotherapy_df_to_sql(flask_app, db_session):
@@ -79,3 +146,58 @@ def test_psychotherapy_df_to_sql(flask_app, db_session):
     assert (
         dialog_event.event_n == int(df.loc[14, "event_n"]) - 4
     )  # -4 because the first 4 events are Timestamps
+
+    # check the dataset statistics computed while parsing
+    stats = dataset.stats
+    turns = df[df["event_speaker"] == "Timestamp"]
+    assert stats.n_dialog_turns == len(turns)
+    assert stats.n_dialog_events == len(df) - len(turns)
+    assert stats.n_sessions == len(df[["c_code", "session_n"]].drop_duplicates())
+    assert stats.n_patients == df["c_code"].nunique()
+    assert (
+        stats.n_speakers
+        == df.loc[df["event_speaker"] != "Timestamp", "event_speaker"].nunique()
+    )
+    assert stats.duration > 0
+    assert stats.n_posts is None
+    # the same statistics are computed from the database
+    expected = {
+        column.name: getattr(stats, column.name) for column in stats.__table__.columns
+    }
+    computed = compute_dataset_stats(dataset)
+    assert {
+        column.name: getattr(computed, column.name)
+        for column in computed.__table__.columns
+    } == expected
+
+
+@pytest.mark.dependency(depends=["test_psychotherapy_df_to_sql"])
+def test_diff_psychotherapy_rows(flask_app, db_session):
+    """
+    Test the diff_psychotherapy_rows function, which compares the rows of a new version
+    of a psychotherapy dataset with its stored rows, for a file with one event changed,
+    and for the rows stored before their fingerprints were recorded.
+    """
+    df = read_pickle(flask_app.config["PS_DATASET_PATH"])
+    dataset = Dataset.query.filter_by(name="Psychotherapy Dataset Test").first()
+    rows = psychotherapy_df_to_rows(df)
+    assert diff_psychotherapy_rows(rows, dataset.id)["events"] == ([], [], [])
+
+    df.loc[14, "event_plaintext"] = "A corrected dialog event."
+    rows = psychotherapy_df_to_rows(df)
+    diff = diff_psychotherapy_rows(rows, dataset.id)
+    dialog_event = PSDialogEvent.query.filter_by(
+        id_dataset=dataset.id, event_n=int(df.loc[14, "event_n"]) - 4
+    ).one()
+    assert diff["turns"] == ([], [], [])
+    assert diff["events"] == ([], [(dialog_event.id, dialog_event.event_n)], [])
+
+    # without the fingerprints, they are computed from the stored values
+    for model in [PSDialogTurn, PSDialogEvent]:
+        db_session.execute(
+            db.update(model)
+            .where(model.id_dataset == dataset.id)
+            .values(fingerprint=None)
+        )
+    assert diff_psychotherapy_rows(rows, dataset.id) == diff
+    db_session.rollback()
@@ -0,0 +1,88 @@
+"""
+Unit tests for the integer codes of the labels (see app/vocabulary.py).
+"""
+from app import db
+from app.models import (
+    Dataset,
+    EvidenceClient,
+    LabelVocabulary,
+    PSAnnotationClient,
+    PSAnnotationDyad,
+    PSAnnotationTherapist,
+)
+from app.utils import LabelNamesClient, LabelStrengthBDyad, SubLabelsAClient
+from app.vocabulary import LABEL_CODES, LabelCode, vocabulary_rows
+import pytest
+
+
+@pytest.mark.order(28)
+def test_label_codes():
+    """
+    GIVEN the label, strength and evidence columns of the annotation tables
+    WHEN their codes are looked up
+    THEN check that every Enum member has a code, that the codes of an Enum are
+    distinct, and that the codes do not follow the order of the Enum members
+    """
+    for model in [PSAnnotationClient, PSAnnotationTherapist, PSAnnotationDyad]:
+        for column in model.__table__.columns:
+            if column.name.startswith(("label_", "strength_")):
+                assert isinstance(column.type, LabelCode)
+                assert set(column.type.codes) == set(column.type.enum_class)
+    for enum_class, names in LABEL_CODES.items():
+        assert len(set(names)) == len(names), enum_class
+    label_type = LabelCode(SubLabelsAClient)
+    assert label_type.codes[SubLabelsAClient.attachment] == 1
+    assert label_type.codes[SubLabelsAClient.other] == 5
+    # the codes are the positions in LABEL_CODES, not in the Enum
+    assert LabelCode(LabelStrengthBDyad).codes[LabelStrengthBDyad.high] == 1
+
+
+def test_label_code_type():
+    """
+    GIVEN a LabelCode column type
+    WHEN Enum members, their names and None are stored, and codes are read
+    THEN check that the codes and the members are converted like an Enum column
+    """
+    label_type = LabelCode(SubLabelsAClient)
+    assert label_type.process_bind_param(SubLabelsAClient.identity, None) == 2
+    assert label_type.process_bind_param("identity", None) == 2  # form data
+    assert label_type.process_bind_param(None, None) is None
+    assert label_type.process_result_value(2, None) is SubLabelsAClient.identity
+    assert label_type.process_result_value(None, None) is None
+    assert label_type.python_type is SubLabelsAClient
+    with pytest.raises(KeyError):
+        label_type.process_bind_param("unknown", None)
+
+
+def test_label_vocabulary(db_session, insert_users):
+    """
+    GIVEN a database with the label vocabulary inserted
+    WHEN an annotation with labels and evidence is added
+    THEN check that the labels are stored as integers, which the label_vocabulary
+    table translates back to the names of the labels
+    """
+    assert LabelVocabulary.query.count() == len(vocabulary_rows())
+    dataset = Dataset(name="vocabulary test")
+    annotation = PSAnnotationClient(
+        label_a=SubLabelsAClient.security, strength_a="very_adaptive", dataset=dataset
+    )
+    evidence = EvidenceClient(label=LabelNamesClient.label_a)
+    db_session.add_all([dataset, annotation, evidence])
+    db_session.commit()
+    stored = db_session.execute(
+        db.text(
+            "SELECT typeof(a.label_a), v.name FROM ps_annotation_client a "
+            "JOIN label_vocabulary v ON v.enum = 'SubLabelsAClient' "
+            "AND v.code = a.label_a WHERE a.id = :id"
+        ),
+        {"id": annotation.id},
+    ).one()
+    assert tuple(stored) == ("integer", "security")
+    db_session.expire_all()
+    annotation = db_session.get(PSAnnotationClient, annotation.id)
+    assert annotation.label_a is SubLabelsAClient.security
+    assert annotation.strength_a.name == "very_adaptive"
+    assert db_session.get(EvidenceClient, evidence.id).label is LabelNamesClient.label_a
+    assert PSAnnotationClient.query.filter_by(
+        label_a=SubLabelsAClient.security
+    ).all() == [annotation]
@@ -0,0 +1,149 @@
+"""
+Unit tests for the single-writer mode (write queue).
+"""
+import threading
+import time
+from app import create_app, db, write_queue
+from app.models import Dataset
+from app.writer import run_in_background
+from config import TestConfig
+import pytest
+
+
+@pytest.fixture(scope="module")
+def writer_app(tmp_path_factory):
+    """Fixture to create a Flask app in single-writer mode, backed by a SQLite database file"""
+    db_path = tmp_path_factory.mktemp("writer") / "app.db"
+    config = type(
+        "SingleWriterConfig",
+        (TestConfig,),
+        {"SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(db_path), "SINGLE_WRITER": True},
+    )
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.drop_all()
+        db.engine.dispose()
+
+
+def add_dataset(name: str):
+    """Write job: add a new dataset and return its id"""
+    if name.startswith("fail"):
+        raise ValueError("invalid dataset")
+    dataset = Dataset(name=name)
+    db.session.add(dataset)
+    db.session.flush()
+    return dataset.id
+
+
+def submit_in_threads(app, names: list, results: dict):
+    """Submit one write per dataset name, each from a different thread"""
+
+    def submit(name):
+        with app.app_context():
+            try:
+                results[name] = write_queue.submit(add_dataset, name)
+            except ValueError as e:
+                results[name] = e
+
+    threads = [threading.Thread(target=submit, args=(name,)) for name in names]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+@pytest.mark.order(13)
+def test_writes_are_committed(writer_app):
+    """
+    GIVEN a Flask application in single-writer mode
+    WHEN a write is submitted
+    THEN check that the write is committed and its result is returned to the caller
+    """
+    with writer_app.app_context():
+        id_dataset = write_queue.submit(add_dataset, "writer test")
+        db.session.remove()  # make sure the dataset is read from the database
+        dataset = db.session.get(Dataset, id_dataset)
+        assert dataset.name == "writer test"
+
+
+def test_group_commit(writer_app):
+    """
+    GIVEN a Flask application in single-writer mode
+    WHEN many writes are submitted concurrently while the writer thread is busy
+    THEN check that all the waiting writes are committed together in one transaction
+    """
+    with writer_app.app_context():
+        writer = write_queue.get_writer()
+        names = ["group {}".format(i) for i in range(20)]
+        results = {}
+
+        def slow_write():
+            # keep the writer thread busy until all the other writes are queued
+            threads.extend(submit_in_threads(writer_app, names, results))
+            while writer._queues[0].qsize() < len(names):
+                time.sleep(0.01)
+            return add_dataset("slow")
+
+        threads = []
+        n_commits = writer.n_commits
+        write_queue.submit(slow_write)
+        for thread in threads:
+            thread.join()
+        assert writer.n_commits == n_commits + 2
+        assert sorted(results) == sorted(names)
+        db.session.remove()
+        for name, id_dataset in results.items():
+            assert db.session.get(Dataset, id_dataset).name == name
+
+
+def test_failing_write_is_isolated(writer_app):
+    """
+    GIVEN a Flask application in single-writer mode
+    WHEN a write fails while being committed together with other writes
+    THEN check that the error is raised to its caller only, and the other writes are committed
+    """
+    with writer_app.app_context():
+        writer = write_queue.get_writer()
+        names = ["fail", "isolated 1", "isolated 2", "isolated 3"]
+        results = {}
+
+        def slow_write():
+            threads.extend(submit_in_threads(writer_app, names, results))
+            while writer._queues[0].qsize() < len(names):
+                time.sleep(0.01)
+
+        threads = []
+        write_queue.submit(slow_write)
+        for thread in threads:
+            thread.join()
+        assert isinstance(results["fail"], ValueError)
+        db.session.remove()
+        for name in names[1:]:
+            assert db.session.get(Dataset, results[name]).name == name
+        assert Dataset.query.filter_by(name="fail").first() is None
+
+
+def test_run_in_background(writer_app, caplog):
+    """
+    GIVEN a Flask application backed by a SQLite database file
+    WHEN jobs are run in the background
+    THEN check that they run in another thread, with an application context,
+    that their writes are committed, and that their errors are logged
+    """
+    with writer_app.app_context():
+        threads = {}
+
+        def job(name):
+            threads[name] = threading.current_thread().name
+            write_queue.submit(add_dataset, name)
+
+        run_in_background(job, "background job").join()
+        assert threads["background job"] == "background-job"
+        db.session.remove()
+        assert Dataset.query.filter_by(name="background job").count() == 1
+
+        run_in_background(job, "fail in background").join()
+        assert "background job job failed" in caplog.text
+        assert "invalid dataset" in caplog.text